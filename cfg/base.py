@@ -21,9 +21,64 @@ class Config(object):
     batch_size = 16
     learning_rate_freeze = 1e-3
     learning_rate_unfreeze = 1e-4
+    # 剪枝(components/pruning.py)：None不剪枝；magnitude为tfmot的非结构化剪枝；channel为通道剪枝，
+    # 加载以及导出时删除被剪掉的通道，FLOPs下降。剪枝比例在pruning_begin_epoch到pruning_end_epoch之间
+    # 从0增加到pruning_sparsity，每pruning_frequency个batch更新一次，训练完成后保存logdir/<save_weight>_pruned.h5
+    pruning = None
+    pruning_sparsity = 0.5
+    pruning_begin_epoch = 50
+    pruning_end_epoch = 80
+    pruning_frequency = 100
+    # 知识蒸馏(components/distillation.py)：训练YOLOV4-TINY以及YOLOV7时用大模型(teacher)指导训练，
+    # distill_teacher为teacher的权重(.h5或者SavedModel)，distill_teacher_yolo为teacher的算法(YOLOV4、YOLOV5、YOLOX、YOLOV7...)，
+    # 其配置(类别、phi等)来自cfg中对应的配置，类别需要与student相同；为None时不蒸馏
+    # 蒸馏损失：类别得分(输出蒸馏)以及检测头特征的注意力图(特征蒸馏)，按stride对应，权重分别为distill_output_weight、distill_feature_weight
+    # distill_cache_dir为None时每个batch在线运行teacher，保留数据增强；
+    # 不为空(例如'./model/distill_cache')时teacher的输出缓存到该目录(第一次训练时计算)，训练更快，但训练图像不做随机数据增强
+    distill_teacher = None
+    distill_teacher_yolo = 'YOLOV4'
+    distill_output_weight = 1.0
+    distill_feature_weight = 10.0
+    distill_cache_dir = None
+    # 训练数据的输入管线(components/data_pipeline.py)：generator为原来的Python生成器/keras.utils.Sequence，
+    # tf.data为并行的tf.data.Dataset(分片interleave、并行读取以及数据增强、prefetch)；
+    # data_workers为并行数(None为AUTOTUNE)，data_shards为标注的分片数，data_seed为打乱以及mosaic的随机种子(None时随机)，
+    # data_deterministic为False时不保证batch的组成与顺序(更快)
+    data_pipeline = 'generator'
+    data_workers = None
+    data_shards = 8
+    data_seed = None
+    data_deterministic = True
+    # 稀疏的训练目标(components/sparse_targets.py)：YOLOV4、YOLOV5、YOLOV7的数据加载不再生成每层稠密的y_true，
+    # 只传递每个正样本的(层, 网格, anchor, 目标)记录，yolo_loss中在计算图里还原为稠密的y_true；YOLOV4-TINY与YOLOX不使用
+    sparse_targets = False
+    # 图像缓存(components/image_cache.py)：image_cache_dir不为空时训练集以及验证集的图像只解码一次(最长边缩小到image_cache_max_side)，
+    # 像素保存为内存映射的uint8数组，训练时不再读取JPEG以及解析标注；标注改变时自动重新建立，image_cache_workers为建立时解码的线程数
+    image_cache_dir = None
+    image_cache_max_side = 1024
+    image_cache_workers = 4
     # predict
     score=0.3
     iou=0.5
     max_boxes=100
+    # 非极大值抑制之前最多保留的候选框数量，先筛选再解码坐标，None表示不限制
+    pre_nms_topk=1000
+    # 加载模型时预热：forward的batch大小，以及视频帧forward_frames的(batch_size, H, W)，例如[(1, 720, 1280)]
+    # 预热之后出现新的trace会发出RetraceWarning，为空时不预热
+    warmup_batch_sizes = [1]
+    warmup_frame_shapes = []
+    # 为True时.h5第一次加载后在权重旁边保存推理缓存(SavedModel，voc.h5 -> voc_inference/)，
+    # 之后权重以及配置不变时直接加载缓存中的计算图，不再构建网络以及trace；需要权重所在的目录可写，默认关闭
+    model_cache = False
+    # onnxruntime会话设置：计算图优化级别(disable/basic/extended/all)、执行模式(sequential/parallel)、
+    # 算子内/算子间线程数(None时使用线程预算或者默认值)、内存池，
+    # io_binding为True时输出写入预先分配的缓冲区(轮流使用num_buffers组，之后的推理会覆盖之前返回的输出)
+    onnx_options = dict(graph_optimization='all', execution_mode='sequential', intra_op_threads=None, inter_op_threads=None,
+                        mem_arena=True, io_binding=False, num_buffers=2)
+    # TFLite解释器设置：线程数(None时使用线程预算或者默认值)、是否使用XNNPACK delegate(CPU上的float模型)
+    tflite_options = dict(num_threads=None, xnnpack=True)
+    # .h5以及SavedModel加载后把BN折叠到前一个卷积中、合并YOLOV7的RepConv分支，加载时用随机输入核对输出，
+    # 不一致时保持原模型；通道剪枝(pruning = 'channel')的权重同时删除被剪掉的通道；导出(export.py)同样使用折叠后的模型
+    fuse = True
     letterbox_image=False
     ANCHOR_MASK = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
\ No newline at end of file
@@ -22,6 +22,10 @@ class YOLOV4Config(Config):
     pretrain_weight = './model/yolo4tf2_weight.h5'
     save_weight = 'VOC_yolov4_tf2.h5'
     anchors_path = './yolov4/data/yolo_anchors.txt'
+    # YOLOV4-TINY(yolov4/train_tiny.py)
+    pretrain_weight_tiny = './model/yolov4_tiny_weights_coco.h5'
+    save_weight_tiny = 'VOC_yolov4_tiny_tf2.h5'
+    anchors_tiny_path = './yolov4/data/yolo_anchors_tiny.txt'
     # Inference
     predict_weight = './model/yolo4_voc_weights.h5'
     ISTINY=False
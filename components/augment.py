@@ -0,0 +1,198 @@
+import cv2
+import numpy as np
+
+
+# 数据增强：所有算法共用，全部在RGB的uint8 NumPy数组上完成，不再在PIL与NumPy之间来回转换
+# 缩放以及长宽扭曲为一次cv2.resize，左右翻转以及平移为一次带步长的复制，只把可见的部分直接写入输出的canvas
+# (这里cv2.resize比INTER_CUBIC的warpAffine快5~15倍)；HSV变换为一个3通道的LUT，在canvas(或者其中的一块)上原地完成；
+# Mosaic的4张图像只写入输出canvas中各自的区域，不再分配4张完整的canvas再裁剪
+# 随机数全部来自rng(random.Random或者random模块)，tf.data管线中每个样本的增强由(data_seed, epoch, 序号)完全确定
+GRAY = 128
+
+
+def rand(rng, a=0, b=1):
+    return rng.random() * (b - a) + a
+
+
+def shuffled(box, rng):
+    order = list(range(len(box)))
+    rng.shuffle(order)
+    return box[order]
+
+
+def place(image, canvas, nw, nh, dx, dy, flip=False, region=None):
+    '''
+    image缩放为(nw, nh)之后放到canvas的(dx, dy)处(与PIL的resize以及paste相同)，flip时在放置的区域内左右翻转，
+    只写入canvas中region = (x0, y0, x1, y1)的部分；返回写入的canvas的视图，没有写入时返回None
+    '''
+    h, w = canvas.shape[:2]
+    x0, y0, x1, y1 = region or (0, 0, w, h)
+    x0, y0, x1, y1 = max(x0, dx), max(y0, dy), min(x1, dx + nw), min(y1, dy + nh)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    ih, iw = image.shape[:2]
+    if (iw, ih) != (nw, nh):
+        # 缩小时INTER_AREA(与PIL BICUBIC缩小的抗锯齿相近)，否则INTER_CUBIC
+        image = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_AREA if nw < iw and nh < ih else cv2.INTER_CUBIC)
+    # 翻转以及平移为一次带步长的复制
+    sx = slice(dx + nw - x1, dx + nw - x0) if flip else slice(x0 - dx, x1 - dx)
+    out = canvas[y0:y1, x0:x1]
+    out[:] = image[y0 - dy:y1 - dy, sx][:, ::-1] if flip else image[y0 - dy:y1 - dy, sx]
+    return out
+
+
+def place_boxes(box, iw, ih, nw, nh, dx, dy, w, h, flip=False, rng=None):
+    '''
+    真实框按place相同的缩放、翻转以及平移变换，截断到(w, h)，去掉宽或者高不大于1的框；rng不为None时先打乱顺序
+    '''
+    if len(box) == 0:
+        return box
+    if rng is not None:
+        box = shuffled(box, rng)
+    x = box[:, [0, 2]] * (nw / iw)
+    box[:, [0, 2]] = dx + nw - x[:, ::-1] if flip else x + dx
+    box[:, [1, 3]] = box[:, [1, 3]] * (nh / ih) + dy
+    box[:, 0:2][box[:, 0:2] < 0] = 0
+    box[:, 2][box[:, 2] > w] = w
+    box[:, 3][box[:, 3] > h] = h
+    box_w = box[:, 2] - box[:, 0]
+    box_h = box[:, 3] - box[:, 1]
+    return box[np.logical_and(box_w > 1, box_h > 1)]
+
+
+def pad_boxes(box, max_boxes):
+    box_data = np.zeros((max_boxes, 5))
+    box = box[:max_boxes]
+    box_data[:len(box)] = box
+    return box_data
+
+
+def gain_lut(rng, hue, sat, val):
+    '''
+    YOLOV5/V7/X的色域变换：H、S、V分别乘以(1 - hue, 1 + hue)等范围内的随机增益，H对180取模
+    '''
+    r = np.array([rand(rng, -1, 1) for _ in range(3)]) * [hue, sat, val] + 1
+    x = np.arange(0, 256, dtype=r.dtype)
+    lut = np.stack([(x * r[0]) % 180, np.clip(x * r[1], 0, 255), np.clip(x * r[2], 0, 255)], -1)
+    return lut.astype(np.uint8).reshape(256, 1, 3)
+
+
+def shift_lut(rng, hue, sat, val):
+    '''
+    YOLOV4的色域变换：H平移hue * 360度(超出[0, 360]时截断)，S、V乘以(1, sat)或者其倒数，与原来浮点HSV的变换相同
+    '''
+    hue = rand(rng, -hue, hue)
+    sat = rand(rng, 1, sat) if rand(rng) < .5 else 1 / rand(rng, 1, sat)
+    val = rand(rng, 1, val) if rand(rng) < .5 else 1 / rand(rng, 1, val)
+    x = np.arange(0, 256, dtype=np.float64)
+    # 8位的H为角度的一半，原来的实现在H大于1时减1
+    h = np.clip(x * 2 + hue * 360 - 1, 0, 360) / 2
+    lut = np.stack([np.round(h) % 180, np.clip(x * sat, 0, 255), np.clip(x * val, 0, 255)], -1)
+    return lut.astype(np.uint8).reshape(256, 1, 3)
+
+
+def apply_hsv(image, lut):
+    '''
+    在image(RGB的uint8，可以是canvas的视图)上原地完成HSV的LUT变换
+    '''
+    cv2.cvtColor(image, cv2.COLOR_RGB2HSV, dst=image)
+    cv2.LUT(image, lut, dst=image)
+    cv2.cvtColor(image, cv2.COLOR_HSV2RGB, dst=image)
+    return image
+
+
+def letterbox(image, box, input_shape, max_boxes, rng=None):
+    '''
+    不做随机增强：等比例缩放到input_shape之内，居中放置，其余部分为灰色；返回(canvas, 补齐的真实框(max_boxes, 5))
+    '''
+    h, w = input_shape
+    ih, iw = image.shape[:2]
+    scale = min(w / iw, h / ih)
+    nw, nh = int(iw * scale), int(ih * scale)
+    dx, dy = (w - nw) // 2, (h - nh) // 2
+    canvas = np.full((h, w, 3), GRAY, np.uint8)
+    place(image, canvas, nw, nh, dx, dy)
+    return canvas, pad_boxes(place_boxes(box, iw, ih, nw, nh, dx, dy, w, h, rng=rng), max_boxes)
+
+
+def random_affine(image, box, input_shape, max_boxes, rng, jitter=.3, scale=(.25, 2), keep_aspect=True):
+    '''
+    随机缩放(scale)、长宽扭曲(jitter)、平移以及左右翻转，一次写入灰色的canvas；
+    keep_aspect为False时(YOLOV4)扭曲的长宽比以输入尺寸而不是图像为基准；返回(canvas, 补齐的真实框(max_boxes, 5))
+    '''
+    h, w = input_shape
+    ih, iw = image.shape[:2]
+    new_ar = (iw / ih if keep_aspect else w / h) * rand(rng, 1 - jitter, 1 + jitter) / rand(rng, 1 - jitter, 1 + jitter)
+    s = rand(rng, *scale)
+    if new_ar < 1:
+        nh = int(s * h)
+        nw = int(nh * new_ar)
+    else:
+        nw = int(s * w)
+        nh = int(nw / new_ar)
+    dx = int(rand(rng, 0, w - nw))
+    dy = int(rand(rng, 0, h - nh))
+    flip = rand(rng) < .5
+    if flip:
+        # 翻转整个canvas等价于在镜像的位置放置翻转的图像
+        dx = w - dx - nw
+    canvas = np.full((h, w, 3), GRAY, np.uint8)
+    place(image, canvas, nw, nh, dx, dy, flip)
+    return canvas, pad_boxes(place_boxes(box, iw, ih, nw, nh, dx, dy, w, h, flip, rng), max_boxes)
+
+
+def mosaic(samples, input_shape, cut, placements, rng, luts=None):
+    '''
+    samples：4个(图像, 真实框)，placements：每张图像的(nw, nh, dx, dy, flip)，cut：(cutx, cuty)
+    第k张图像只写入输出canvas中cut划分的第k个区域(左上、左下、右下、右上)，luts不为None时每张图像在自己的区域内做HSV变换
+    返回(canvas, 每张图像变换以及截断之后的真实框)，真实框的合并(merge_bboxes)由各算法完成
+    '''
+    h, w = input_shape
+    cutx, cuty = cut
+    regions = [(0, 0, cutx, cuty), (0, cuty, cutx, h), (cutx, cuty, w, h), (cutx, 0, w, cuty)]
+    canvas = np.full((h, w, 3), GRAY, np.uint8)
+    boxes = []
+    for k, ((image, box), (nw, nh, dx, dy, flip)) in enumerate(zip(samples, placements)):
+        out = place(image, canvas, nw, nh, dx, dy, flip, regions[k])
+        if luts is not None and out is not None:
+            apply_hsv(out, luts[k])
+        boxes.append(place_boxes(box, image.shape[1], image.shape[0], nw, nh, dx, dy, w, h, flip, rng))
+    return canvas, boxes
+
+
+def random_mosaic(samples, input_shape, rng, jitter=.3, scale=(.4, 1)):
+    '''
+    YOLOV5/V7/X的Mosaic：随机的中心点(输入尺寸的0.3~0.7)，4张图像分别随机翻转、扭曲长宽比以及缩放，
+    以中心点为角放在左上、左下、右下、右上；返回(canvas, 每张图像的真实框, (cutx, cuty))
+    '''
+    h, w = input_shape
+    cutx = int(w * rand(rng, 0.3, 0.7))
+    cuty = int(h * rand(rng, 0.3, 0.7))
+    placements = []
+    for k, (image, _) in enumerate(samples):
+        ih, iw = image.shape[:2]
+        flip = rand(rng) < .5
+        new_ar = iw / ih * rand(rng, 1 - jitter, 1 + jitter) / rand(rng, 1 - jitter, 1 + jitter)
+        s = rand(rng, *scale)
+        if new_ar < 1:
+            nh = int(s * h)
+            nw = int(nh * new_ar)
+        else:
+            nw = int(s * w)
+            nh = int(nw / new_ar)
+        dx = cutx - nw if k in (0, 1) else cutx
+        dy = cuty - nh if k in (0, 3) else cuty
+        placements.append((nw, nh, dx, dy, flip))
+    canvas, boxes = mosaic(samples, input_shape, (cutx, cuty), placements, rng)
+    return canvas, boxes, (cutx, cuty)
+
+
+def mixup(image_1, box_1, image_2, box_2, max_boxes):
+    '''
+    两张图像各一半相加(float32)，有效的真实框合并
+    '''
+    new_image = image_1.astype(np.float32)
+    new_image += image_2
+    new_image *= 0.5
+    new_boxes = np.concatenate([box_1[box_1[:, 2] - box_1[:, 0] > 0], box_2[box_2[:, 2] - box_2[:, 0] > 0]], axis=0)
+    return new_image, pad_boxes(new_boxes, max_boxes)
@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import tensorflow as tf
+
+
+# 训练数据的输入管线：generator为原来的Python生成器/keras.utils.Sequence(单线程读取、增强以及分配目标)，
+# tf.data为并行的tf.data.Dataset：标注按行切分为data_shards个连续的分片，每个epoch分片内以及分片之间按(data_seed, epoch)打乱，
+# interleave轮流读取各个分片；每个样本(读取图像、数据增强)在numpy_function中并行map，
+# batch之后再并行分配目标(preprocess_true_boxes)，最后prefetch，训练时读取数据与GPU计算重叠
+# 样本的随机数(mosaic的概率以及拼接的图像)由(data_seed, epoch, 序号)确定，与线程的调度顺序无关
+DATA_PIPELINES = ['generator', 'tf.data']
+
+
+def sample_rng(seed, epoch, index):
+    '''
+    每个样本独立的随机数生成器(random.Random)，由(seed, epoch, index)确定
+    '''
+    return random.Random(int(np.random.SeedSequence([seed, epoch, index]).generate_state(1)[0]))
+
+
+def _epoch_indices(epoch, length, shards, seed, shuffle):
+    '''
+    一个epoch的样本序号：length个样本切分为shards个连续的分片，shuffle时分片的顺序以及每个分片内的顺序按(seed, epoch)打乱，
+    interleave每次从每个分片取一个
+    '''
+    if not shuffle:
+        return tf.data.Dataset.range(length)
+    bounds = np.linspace(0, length, shards + 1).astype(np.int64)
+    starts, sizes = tf.constant(bounds[:-1]), tf.constant(np.diff(bounds))
+    order = tf.argsort(tf.random.stateless_uniform([shards], seed=tf.stack([seed, epoch])))
+
+    def shard(k):
+        k = tf.cast(k, tf.int64)
+        indices = tf.argsort(tf.random.stateless_uniform([sizes[k]], seed=tf.stack([seed + 1 + k, epoch])))
+        return tf.data.Dataset.from_tensor_slices(starts[k] + tf.cast(indices, tf.int64))
+    return tf.data.Dataset.from_tensor_slices(order).interleave(shard, cycle_length=shards, block_length=1)
+
+
+def build_dataset(dataset, batch_size, initial_epoch=0, epochs=1, shuffle=True, seed=None, shards=8, workers=None,
+                  deterministic=True, eager=False):
+    '''
+    dataset需要：annotation_lines、input_shape、get_sample(index, epoch, rng)返回预处理之后的图像(h, w, 3)以及
+    补齐的真实框(max_boxes, 5)，get_targets(box_data)返回一个batch的y_true(列表)
+    从initial_epoch到epochs，每个epoch len(annotation_lines) // batch_size个batch(与steps_per_epoch对应)，不足一个batch的样本丢弃
+    eager为True时每个batch为(image, *y_true)，否则为((image, *y_true), zeros)，用于model.fit
+    workers为None时并行数由AUTOTUNE决定；deterministic为False时map的输出顺序可以改变(更快，但是batch的组成不再确定)
+    '''
+    length = len(dataset.annotation_lines)
+    steps = length // batch_size
+    assert steps > 0, 'the dataset is smaller than one batch'
+    shards = max(1, min(shards, length))
+    seed = np.random.randint(2 ** 31) if seed is None else seed
+    parallel = tf.data.AUTOTUNE if workers is None else workers
+    h, w = dataset.input_shape[:2]
+
+    def load(epoch, index):
+        image, box = dataset.get_sample(int(index), int(epoch), sample_rng(seed, int(epoch), int(index)))
+        return np.asarray(image, np.float32), np.asarray(box, np.float32)
+
+    def sample(epoch, index):
+        image, box = tf.numpy_function(load, [epoch, index], [tf.float32, tf.float32])
+        image.set_shape([h, w, 3])
+        box.set_shape([None, 5])
+        return image, box
+
+    # 用全部为0的真实框得到y_true的数量、类型以及形状
+    probe = [np.asarray(target) for target in dataset.get_targets(np.zeros((batch_size, 1, 5), np.float32))]
+
+    def targets(image, box):
+        y_true = tf.numpy_function(lambda box: [np.asarray(target, probe[i].dtype) for i, target in enumerate(dataset.get_targets(box))],
+                                   [box], [tf.as_dtype(target.dtype) for target in probe])
+        for target, like in zip(y_true, probe):
+            target.set_shape([batch_size, *[None] * (like.ndim - 2), *like.shape[-1:]] if like.ndim > 2 else like.shape)
+        if eager:
+            return (image, *y_true)
+        return (image, *y_true), tf.zeros([batch_size])
+
+    def epoch_dataset(epoch):
+        indices = _epoch_indices(epoch, length, shards, tf.constant(seed, tf.int64), shuffle)
+        return indices.take(steps * batch_size).map(lambda index: (epoch, index))
+
+    data = tf.data.Dataset.range(initial_epoch, epochs).flat_map(epoch_dataset)
+    data = data.map(sample, num_parallel_calls=parallel, deterministic=deterministic)
+    data = data.batch(batch_size, drop_remainder=True)
+    data = data.map(targets, num_parallel_calls=parallel, deterministic=deterministic)
+    return data.prefetch(tf.data.AUTOTUNE)
+
+
+def data_pipeline(dataset, config, epochs, initial_epoch=0, shuffle=True, eager=False):
+    '''
+    按config.data_pipeline选择训练数据的输入：generator时原样返回dataset(YoloDatasets)，tf.data时返回build_dataset的tf.data.Dataset
+    没有get_sample的dataset(例如读取teacher缓存的TeacherCacheSequence)继续使用keras.utils.Sequence
+    '''
+    assert config.data_pipeline in DATA_PIPELINES, 'data_pipeline must be one of {}'.format(DATA_PIPELINES)
+    if config.data_pipeline == 'generator':
+        return dataset
+    if not hasattr(dataset, 'get_sample'):
+        print('{} does not support tf.data, use it as a keras.utils.Sequence.'.format(type(dataset).__name__))
+        return dataset
+    return build_dataset(dataset, dataset.batch_size, initial_epoch, epochs, shuffle, config.data_seed, config.data_shards,
+                         config.data_workers, config.data_deterministic, eager)
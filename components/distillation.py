@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import backend as K
+from tensorflow.keras.layers import Input
+from tensorflow.keras.models import Model
+
+
+# 知识蒸馏：大模型(teacher，任意算法)指导小模型(student，YOLOV4-TINY、YOLOV7)训练
+# 输出蒸馏：每个网格的类别得分sigmoid(obj) * sigmoid(cls)(对anchor取最大值)，不依赖anchor以及框的编码方式，
+#          YOLOV4/V5/V7(每个网格3个anchor)以及YOLOX(每个网格1个预测)可以互相蒸馏
+# 特征蒸馏：检测头特征的注意力图(attention transfer，通道方向平方的均值再归一化)，不依赖通道数
+# teacher与student按下采样倍数(stride)对应，student中没有对应stride的输出不蒸馏
+
+
+def _output_feature(output):
+    '''
+    检测头最后一个卷积的输入；YOLOX的输出为回归、置信度以及分类的Concatenate，取回归分支
+    '''
+    layer, node_index, _ = output._keras_history
+    while type(layer).__name__ == 'Concatenate':
+        output = layer.get_input_at(node_index)[0]
+        layer, node_index, _ = output._keras_history
+    return layer.get_input_at(node_index)
+
+
+def _strides(model, size=64):
+    outputs = tf.nest.flatten(model(tf.zeros([1, size, size, 3]), training=False))
+    return [size // int(output.shape[1]) for output in outputs]
+
+
+def score_map(output, num_classes):
+    '''
+    (b, h, w, anchors * (5 + num_classes)) -> (b, h, w, num_classes)，每个网格每个类别的得分
+    '''
+    shape = tf.shape(output)
+    output = tf.reshape(output, [shape[0], shape[1], shape[2], -1, 5 + num_classes])
+    return tf.reduce_max(tf.sigmoid(output[..., 4:5]) * tf.sigmoid(output[..., 5:]), axis=3)
+
+
+def attention_map(feature):
+    '''
+    (b, h, w, c) -> (b, h, w, 1)，通道方向平方的均值，每张图像归一化为单位L2范数
+    '''
+    attention = tf.reduce_mean(tf.square(feature), axis=-1, keepdims=True)
+    norm = tf.norm(tf.reshape(attention, [tf.shape(attention)[0], -1]), axis=-1)
+    return attention / (norm[:, None, None, None] + 1e-12)
+
+
+class Distiller(object):
+    '''
+    teacher：冻结的teacher网络(keras模型，输出为检测头的原始输出)；student：student网络
+    输入图像为0到1(除以255)，teacher_mean、teacher_std不为None时按teacher的归一化方式(例如YOLOX)转换之后输入teacher
+    teacher：输入图像，输出每个对应stride的蒸馏目标(b, h, w, num_classes + 1)：类别得分以及注意力图
+    student：输入图像，输出student网络的全部输出以及对应stride的检测头特征，用于eager训练
+    '''
+
+    def __init__(self, teacher, student, num_classes, output_weight=1., feature_weight=10., teacher_mean=None, teacher_std=None):
+        self.num_classes = num_classes
+        self.output_weight = output_weight
+        self.feature_weight = feature_weight
+        student_strides, teacher_strides = _strides(student), _strides(teacher)
+        # (student输出的序号, teacher输出的序号)
+        self.levels = [(i, teacher_strides.index(stride)) for i, stride in enumerate(student_strides) if stride in teacher_strides]
+        assert self.levels, 'the teacher has no output with the same stride as the student'
+        self.strides = [student_strides[i] for i, _ in self.levels]
+
+        teacher.trainable = False
+        teacher_outputs = tf.nest.flatten(teacher.outputs)
+        teacher_body = Model(teacher.inputs, [teacher_outputs[j] for _, j in self.levels] +
+                             [_output_feature(teacher_outputs[j]) for _, j in self.levels])
+        images = Input((None, None, 3))
+        x = images
+        if teacher_mean is not None:
+            x = (x - np.array(teacher_mean, np.float32)) / np.array(teacher_std, np.float32)
+        outputs = teacher_body(x, training=False)
+        n = len(self.levels)
+        targets = [tf.concat([score_map(output, num_classes), attention_map(feature)], axis=-1)
+                   for output, feature in zip(outputs[:n], outputs[n:])]
+        self.teacher = Model(images, targets)
+
+        student_outputs = tf.nest.flatten(student.outputs)
+        self.student = Model(student.inputs, student_outputs + [_output_feature(student_outputs[i]) for i, _ in self.levels])
+
+    def teacher_targets(self, images):
+        return tf.nest.flatten(self.teacher(images, training=False))
+
+    def loss(self, outputs, features, targets):
+        '''
+        outputs：student网络的全部输出；features：对应stride的检测头特征；targets：teacher的蒸馏目标
+        输出蒸馏为类别得分的二元交叉熵(对类别求和，对网格以及batch求平均)，特征蒸馏为注意力图的平方误差
+        '''
+        output_loss = feature_loss = 0.
+        for (i, _), feature, target in zip(self.levels, features, targets):
+            target = tf.cast(target, tf.float32)
+            score = score_map(outputs[i], self.num_classes)
+            output_loss += tf.reduce_mean(tf.reduce_sum(K.binary_crossentropy(target[..., :-1], score), axis=-1))
+            feature_loss += tf.reduce_mean(tf.reduce_sum(tf.square(attention_map(feature) - target[..., -1:]), axis=[1, 2, 3]))
+        return self.output_weight * output_loss + self.feature_weight * feature_loss
+
+    def attach(self, model, body, cached=False):
+        '''
+        在训练模型(输入为[图像, *y_true]，输出为yolo_loss)中加入蒸馏损失(add_loss)，compile以及fit的用法不变
+        cached为True时teacher的蒸馏目标作为模型的输入(由TeacherCache读取)，否则在计算图中运行teacher
+        '''
+        outputs = tf.nest.flatten(body.outputs)
+        features = [_output_feature(outputs[i]) for i, _ in self.levels]
+        if cached:
+            targets = [Input((None, None, self.num_classes + 1)) for _ in self.levels]
+            inputs = [*model.inputs, *targets]
+        else:
+            targets = tf.nest.flatten(self.teacher(body.inputs[0], training=False))
+            inputs = model.inputs
+        model = Model(inputs, model.outputs)
+        model.add_loss(self.loss(outputs, features, targets))
+        return model
+
+
+class TeacherCache(object):
+    '''
+    teacher蒸馏目标的磁盘缓存：第一次使用时对每张图像运行一次teacher，每个stride保存为一个float16的.npy，
+    之后按内存映射读取，训练的每个epoch不再运行teacher
+    缓存目录为cache_dir/<key>，key由teacher、输入尺寸以及图像列表计算，其中任意一项改变时重新计算
+    load_image(annotation_line)返回输入student的图像(h, w, 3)；缓存要求图像是确定的，使用缓存时不做随机数据增强
+    '''
+
+    def __init__(self, distiller, lines, load_image, input_shape, cache_dir, key, batch_size=8):
+        lines = {line.split()[0]: line for line in lines if line.strip()}
+        paths = sorted(lines)
+        key = hashlib.sha1(json.dumps([key, list(input_shape), paths]).encode('utf-8')).hexdigest()[:16]
+        self.dir = os.path.join(cache_dir, key)
+        self.index = {path: i for i, path in enumerate(paths)}
+        files = [os.path.join(self.dir, 'stride{}.npy'.format(stride)) for stride in distiller.strides]
+        if not os.path.exists(os.path.join(self.dir, 'done.json')):
+            os.makedirs(self.dir, exist_ok=True)
+            shapes = [(len(paths), input_shape[0] // stride, input_shape[1] // stride, distiller.num_classes + 1)
+                      for stride in distiller.strides]
+            arrays = [np.lib.format.open_memmap(file, mode='w+', dtype=np.float16, shape=shape) for file, shape in zip(files, shapes)]
+            run = tf.function(distiller.teacher_targets)
+            print('Cache teacher outputs of {} images to {}.'.format(len(paths), self.dir))
+            for start in range(0, len(paths), batch_size):
+                images = np.stack([load_image(lines[path]) for path in paths[start:start + batch_size]]).astype(np.float32)
+                for array, target in zip(arrays, run(tf.convert_to_tensor(images))):
+                    array[start:start + len(images)] = target.numpy().astype(np.float16)
+            for array in arrays:
+                array.flush()
+            del arrays
+            with open(os.path.join(self.dir, 'done.json'), 'w') as f:
+                json.dump({'images': len(paths), 'strides': distiller.strides}, f)
+        self.arrays = [np.load(file, mmap_mode='r') for file in files]
+
+    def get(self, lines):
+        rows = [self.index[line.split()[0]] for line in lines]
+        return [np.asarray(array[rows], np.float32) for array in self.arrays]
+
+
+class TeacherCacheSequence(tf.keras.utils.Sequence):
+    '''
+    在YoloDatasets的输入之后加入缓存的蒸馏目标，按dataset.annotation_lines的顺序对应每个batch的图像
+    '''
+
+    def __init__(self, dataset, cache):
+        self.dataset = dataset
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        inputs, y = self.dataset[index]
+        batch_size = self.dataset.batch_size
+        lines = [self.dataset.annotation_lines[i % self.dataset.length] for i in range(index * batch_size, (index + 1) * batch_size)]
+        return [*inputs, *self.cache.get(lines)], y
+
+    def on_epoch_end(self):
+        self.dataset.on_epoch_end()
+
+
+def load_teacher(config):
+    '''
+    按config.distill_teacher_yolo(YOLOV4、YOLOV5、YOLOX、YOLOV7...)加载teacher，配置来自cfg，
+    只支持.h5以及SavedModel(需要keras模型)；返回(keras模型, 归一化的mean, std)
+    '''
+    from cfg.base import Config
+    from inference.models import load_model
+    # teacher需要keras模型，不使用推理缓存
+    model_cache, Config.model_cache = Config.model_cache, False
+    try:
+        yolo = load_model(config.distill_teacher_yolo, config.distill_teacher)
+    finally:
+        Config.model_cache = model_cache
+    assert isinstance(getattr(yolo, 'model', None), tf.keras.Model), 'the teacher must be a .h5 or SavedModel keras model'
+    if config.distill_teacher_yolo.upper() == 'YOLOX':
+        from yolox.lib.preprocess import MEAN, STD
+        return yolo.model, MEAN, STD
+    return yolo.model, None, None
+
+
+def teacher_key(config):
+    stat = os.stat(config.distill_teacher)
+    return [config.distill_teacher_yolo.upper(), os.path.abspath(config.distill_teacher), stat.st_size, stat.st_mtime]
+
+
+def distillation(config, body, num_classes, lines, load_image, input_shape):
+    '''
+    按config创建蒸馏：返回(Distiller, TeacherCache)，config.distill_cache_dir为空时TeacherCache为None(在线运行teacher)，
+    config.distill_teacher为空时返回(None, None)
+    '''
+    if not config.distill_teacher:
+        return None, None
+    teacher, mean, std = load_teacher(config)
+    distiller = Distiller(teacher, body, num_classes, config.distill_output_weight, config.distill_feature_weight, mean, std)
+    print('Distill from {} ({}) at strides {}.'.format(config.distill_teacher, config.distill_teacher_yolo, distiller.strides))
+    if not config.distill_cache_dir:
+        return distiller, None
+    # 缓存的蒸馏目标要求训练图像是确定的，训练不做随机数据增强，小模型的精度可能低于在线蒸馏
+    warnings.warn('distill_cache_dir is set ({}): the teacher outputs are cached and the training images are NOT augmented '
+                  '(no random/mosaic/mixup); set distill_cache_dir = None to run the teacher online and keep augmentation'.format(
+                      config.distill_cache_dir))
+    cache = TeacherCache(distiller, lines, load_image, input_shape, config.distill_cache_dir, teacher_key(config))
+    return distiller, cache
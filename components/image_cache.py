@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+
+import cv2
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+
+# 训练图像的缓存：每张图像只解码一次，最长边缩小到max_side之后RGB像素连续保存在一个uint8数组文件中，
+# index为每一行标注(图像)的(偏移, 高, 宽)，真实框(按相同的比例缩放)保存为并列的数组，box_index为每一行真实框的起止位置
+# 训练时像素按内存映射只读打开，读取一张图像只是取出数组中的一段，不再打开JPEG、解码以及解析标注的字符串
+# 缓存目录为cache_dir/<key>，key由CACHE_VERSION、max_side以及标注的内容(每一行)计算，标注改变时重新建立
+# 解码(imread)或者缩放(cv2.resize的插值方式、_cached_size的取整)改变时需要将CACHE_VERSION加1，否则会读到旧格式的缓存
+CACHE_VERSION = 2
+
+
+def parse_annotation(annotation_line):
+    '''
+    标注的一行"path x1,y1,x2,y2,c ..."，返回(图像路径, 真实框(n, 5)的int32)
+    '''
+    line = annotation_line.split()
+    box = np.array([list(map(int, box.split(','))) for box in line[1:]], np.int32).reshape(-1, 5)
+    return line[0], box
+
+
+def imread(path):
+    '''
+    解码为RGB的uint8数组(h, w, 3)，与PIL相同不按EXIF旋转；np.fromfile支持中文路径
+    '''
+    image = cv2.imdecode(np.fromfile(path, np.uint8), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise IOError('cannot read image {}'.format(path))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _cached_size(size, max_side):
+    iw, ih = size
+    scale = min(1., max_side / max(iw, ih)) if max_side else 1.
+    return max(1, int(round(iw * scale))), max(1, int(round(ih * scale)))
+
+
+class ImageCache(object):
+    '''
+    lines：标注的行(训练集以及验证集)，max_side：缓存图像的最长边(None不缩放)，workers：建立缓存时解码的线程数
+    '''
+
+    def __init__(self, lines, cache_dir, max_side=1024, workers=4):
+        # 按完整的一行(图像路径以及真实框)索引：同一张图像的多行标注真实框不同时分别缓存，不会取到其他行的真实框
+        lines = sorted(set(line.strip() for line in lines if line.strip()))
+        paths = [line.split()[0] for line in lines]
+        key = hashlib.sha1(json.dumps([CACHE_VERSION, max_side, lines]).encode('utf-8')).hexdigest()[:16]
+        self.dir = os.path.join(cache_dir, key)
+        self.position = {line: i for i, line in enumerate(lines)}
+        files = [os.path.join(self.dir, name) for name in ('pixels.npy', 'index.npy', 'boxes.npy', 'box_index.npy')]
+        if not os.path.exists(os.path.join(self.dir, 'done.json')):
+            os.makedirs(self.dir, exist_ok=True)
+            # 只读取图像的头部得到尺寸，预先分配全部像素
+            sizes = []
+            for path in paths:
+                with Image.open(path) as image:
+                    sizes.append(_cached_size(image.size, max_side))
+            sizes = np.array(sizes, np.int64).reshape(-1, 2)
+            lengths = sizes[:, 0] * sizes[:, 1] * 3
+            index = np.stack([np.cumsum(lengths) - lengths, sizes[:, 1], sizes[:, 0]], -1)
+            pixels = np.lib.format.open_memmap(files[0], mode='w+', dtype=np.uint8, shape=(max(int(lengths.sum()), 1),))
+            boxes = [None] * len(paths)
+
+            def decode(i):
+                path, box = parse_annotation(lines[i])
+                offset, h, w = index[i]
+                image = imread(path)
+                if image.shape[:2] != (h, w):
+                    scale = np.array([w / image.shape[1], h / image.shape[0]] * 2)
+                    box[:, 0:4] = np.round(box[:, 0:4] * scale)
+                    image = cv2.resize(image, (int(w), int(h)), interpolation=cv2.INTER_AREA)
+                pixels[offset:offset + h * w * 3] = image.reshape(-1)
+                boxes[i] = box
+
+            print('Cache {} images to {}.'.format(len(paths), self.dir))
+            with ThreadPool(max(1, workers)) as pool:
+                for _ in tqdm(pool.imap_unordered(decode, range(len(paths))), total=len(paths)):
+                    pass
+            pixels.flush()
+            del pixels
+            np.save(files[1], index)
+            np.save(files[2], np.concatenate([np.zeros((0, 5), np.int32)] + boxes))
+            np.save(files[3], np.cumsum([0] + [len(box) for box in boxes]).astype(np.int64))
+            with open(os.path.join(self.dir, 'done.json'), 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'images': len(paths), 'max_side': max_side, 'bytes': int(lengths.sum())}, f)
+        self.pixels = np.load(files[0], mmap_mode='r')
+        self.index, self.boxes, self.box_index = [np.load(file) for file in files[1:]]
+
+    def __contains__(self, annotation_line):
+        return annotation_line.strip() in self.position
+
+    def load(self, annotation_line):
+        '''
+        返回(图像(h, w, 3)的uint8，内存映射的只读视图, 真实框(n, 5)的int32，可以修改的副本)
+        '''
+        i = self.position[annotation_line.strip()]
+        offset, h, w = self.index[i]
+        image = self.pixels[offset:offset + h * w * 3].reshape(h, w, 3)
+        return image, self.boxes[self.box_index[i]:self.box_index[i + 1]].copy()
+
+
+def load_annotation(annotation_line, cache=None):
+    '''
+    数据增强读取一行标注：返回(RGB的uint8图像(h, w, 3), 真实框(n, 5))，cache中有这张图像时为缓存的只读视图(不复制)
+    '''
+    if cache is not None and annotation_line in cache:
+        return cache.load(annotation_line)
+    path, box = parse_annotation(annotation_line)
+    return imread(path), box
+
+
+def image_cache(config, lines):
+    '''
+    config.image_cache_dir不为空时返回lines的ImageCache(不存在时先建立)，否则返回None
+    '''
+    if not config.image_cache_dir:
+        return None
+    return ImageCache(lines, config.image_cache_dir, config.image_cache_max_side, config.image_cache_workers)
@@ -0,0 +1,195 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_model_optimization as tfmot
+
+from inference.prune_graph import prunable_units
+
+
+# magnitude：非结构化剪枝，tfmot按权重绝对值把卷积核置0，模型文件压缩后变小，dense计算的FLOPs不变
+# channel：结构化(通道)剪枝，按BN的|gamma|(network slimming)把整个输出通道置0，
+#          加载以及导出时fuse_model折叠BN之后删除这些通道，FLOPs以及延迟下降
+PRUNING_METHODS = ['magnitude', 'channel']
+PRUNABLE_LAYERS = ['Conv2D', 'DepthwiseConv2D', 'Dense']
+
+
+def polynomial_sparsity(progress, target, initial=0., power=3):
+    '''
+    剪枝比例从initial按多项式增加到target(与tfmot的PolynomialDecay相同)，progress为0到1的进度
+    '''
+    progress = min(max(progress, 0.), 1.)
+    return target + (initial - target) * (1. - progress) ** power
+
+
+def prune_magnitude(model, target_sparsity, begin_step, end_step, frequency=100):
+    '''
+    用tfmot.sparsity.keras.prune_low_magnitude包装卷积、全连接以及实现了PrunableLayer的层(例如Mish)，
+    begin_step到end_step之间剪枝比例按多项式从0增加到target_sparsity，每frequency步更新一次mask
+    输出层(检测头的最后一个卷积)不剪枝；其余层不经过序列化，直接在新模型中重新使用(Lambda、自定义层保持不变)
+    训练时需要pruning_callbacks中的UpdatePruningStep，训练完成后用strip_pruning去掉包装
+    '''
+    schedule = tfmot.sparsity.keras.PolynomialDecay(initial_sparsity=0., final_sparsity=target_sparsity,
+                                                    begin_step=begin_step, end_step=end_step, frequency=frequency)
+
+    def clone_function(layer):
+        if layer.name in model.output_names:
+            return layer
+        if type(layer).__name__ in PRUNABLE_LAYERS or (
+                isinstance(layer, tfmot.sparsity.keras.PrunableLayer) and layer.get_prunable_weights()):
+            return tfmot.sparsity.keras.prune_low_magnitude(layer, pruning_schedule=schedule)
+        return layer
+    return tf.keras.models.clone_model(model, clone_function=clone_function)
+
+
+class ChannelPruning(tf.keras.callbacks.Callback):
+    '''
+    通道剪枝(network slimming)：begin_epoch到end_epoch之间剪枝比例按多项式从0增加到sparsity，
+    每个可以删除通道的卷积(见prune_graph.prunable_units)按BN的|gamma|(没有BN时按卷积核的L2范数)
+    把最不重要的通道置0，每frequency个batch以及每个epoch结束时重新选择通道
+    每个batch之后把卷积核、bias以及BN的gamma、beta中被剪掉的通道置0，这些通道的输出恒为0
+    保留的通道数为round_to的倍数并且不少于min_channels，便于推理时的向量化
+    model为网络本体(不包括loss)，set_model传入的训练模型不使用
+    initial_epoch：第一个epoch的序号，之后每个epoch结束时加1(与fit的initial_epoch无关)
+    '''
+
+    def __init__(self, model, sparsity=0.5, begin_epoch=0, end_epoch=1, steps_per_epoch=None, frequency=100,
+                 initial_epoch=0, round_to=8, min_channels=8):
+        super(ChannelPruning, self).__init__()
+        self.body = model
+        self.sparsity = sparsity
+        self.begin_epoch = begin_epoch
+        self.end_epoch = max(end_epoch, begin_epoch + 1)
+        self.steps_per_epoch = steps_per_epoch
+        self.frequency = frequency
+        self.epoch = initial_epoch
+        self.batch = 0
+        self.round_to = round_to
+        self.min_channels = min_channels
+        self.units = []
+        for conv_name, bn_name in prunable_units(model).items():
+            conv = model.get_layer(conv_name)
+            bn = model.get_layer(bn_name) if bn_name else None
+            variables = [conv.kernel] + ([conv.bias] if conv.use_bias else [])
+            if bn is not None:
+                variables += [var for var in (bn.gamma, bn.beta) if var is not None]
+            mask = tf.Variable(tf.ones([conv.filters]), trainable=False, name=conv_name + '_channel_mask')
+            self.units.append((conv, bn, variables, mask))
+
+    def current_sparsity(self):
+        steps = self.steps_per_epoch or 1
+        progress = (self.epoch + min(self.batch / steps, 1.) - self.begin_epoch) / (self.end_epoch - self.begin_epoch)
+        if progress <= 0:
+            return 0.
+        return polynomial_sparsity(progress, self.sparsity)
+
+    def importance(self, conv, bn):
+        if bn is not None and getattr(bn, 'gamma', None) is not None:
+            return np.abs(bn.gamma.numpy())
+        kernel = conv.kernel.numpy()
+        return np.sqrt((kernel.reshape(-1, kernel.shape[-1]) ** 2).sum(axis=0))
+
+    def update_masks(self):
+        sparsity = self.current_sparsity()
+        for conv, bn, _, mask in self.units:
+            filters = conv.filters
+            keep = int(np.ceil(filters * (1. - sparsity) / self.round_to) * self.round_to)
+            keep = min(max(keep, self.min_channels, 1), filters)
+            new_mask = np.zeros(filters, np.float32)
+            new_mask[np.argsort(-self.importance(conv, bn))[:keep]] = 1
+            mask.assign(new_mask)
+        self.apply_masks()
+
+    @tf.function
+    def _apply(self):
+        for _, _, variables, mask in self.units:
+            for var in variables:
+                var.assign(var * mask)
+
+    def apply_masks(self):
+        if self.units:
+            self._apply()
+
+    def on_train_begin(self, logs=None):
+        if getattr(self, 'params', None) and self.params.get('steps'):
+            self.steps_per_epoch = self.params['steps']
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.batch = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batch += 1
+        if self.current_sparsity() > 0:
+            if self.batch % self.frequency == 0:
+                self.update_masks()
+            else:
+                self.apply_masks()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch += 1
+        self.batch = 0
+        if self.current_sparsity() > 0:
+            self.update_masks()
+
+    def summary(self):
+        pruned = sum(int((mask.numpy() == 0).sum()) for _, _, _, mask in self.units)
+        total = sum(int(mask.shape[0]) for _, _, _, mask in self.units)
+        return 'channel pruning: {}/{} channels of {} convolutions pruned'.format(pruned, total, len(self.units))
+
+
+def pruning_callbacks(model, config, steps_per_epoch=None):
+    '''
+    config.pruning对应的训练callback：magnitude为tfmot的UpdatePruningStep(需要先用prune_magnitude包装模型)，
+    channel为ChannelPruning；model为网络本体，config.pruning为None时返回空列表
+    '''
+    if not config.pruning:
+        return []
+    assert config.pruning in PRUNING_METHODS, 'pruning must be one of {}'.format(PRUNING_METHODS)
+    if config.pruning == 'magnitude':
+        return [tfmot.sparsity.keras.UpdatePruningStep()]
+    return [ChannelPruning(model, config.pruning_sparsity, config.pruning_begin_epoch, config.pruning_end_epoch,
+                           steps_per_epoch, config.pruning_frequency, initial_epoch=config.Init_epoch)]
+
+
+def pruning_steps(config, steps_per_epoch):
+    # magnitude剪枝的开始以及结束step
+    return config.pruning_begin_epoch * steps_per_epoch, max(config.pruning_end_epoch, config.pruning_begin_epoch + 1) * steps_per_epoch
+
+
+def weight_sparsity(model):
+    '''
+    卷积以及全连接的权重中0的数量
+    返回值：(0的数量, 权重总数)
+    '''
+    zeros = total = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            inner_zeros, inner_total = weight_sparsity(layer)
+            zeros, total = zeros + inner_zeros, total + inner_total
+            continue
+        layer = getattr(layer, 'layer', layer)
+        if type(layer).__name__ in PRUNABLE_LAYERS:
+            kernel = layer.get_weights()[0]
+            zeros += int((kernel == 0).sum())
+            total += kernel.size
+    return zeros, total
+
+
+def strip_and_save(model, config, callbacks=()):
+    '''
+    训练完成后去掉tfmot的包装，保存剪枝后的网络权重：logdir/<save_weight>_pruned.h5
+    该权重与原网络结构相同，可以直接用于预测以及导出；通道剪枝的权重在加载(fuse)时删除被剪掉的通道
+    返回值：(去掉包装后的模型, 权重路径)
+    '''
+    if config.pruning == 'magnitude':
+        model = tfmot.sparsity.keras.strip_pruning(model)
+    for callback in callbacks:
+        if isinstance(callback, ChannelPruning):
+            callback.apply_masks()
+            print(callback.summary())
+    zeros, total = weight_sparsity(model)
+    print('weight sparsity: {:.1%}'.format(zeros / max(total, 1)))
+    path = os.path.join(config.logdir, os.path.splitext(config.save_weight)[0] + '_pruned.h5')
+    model.save_weights(path)
+    print('pruned weights saved to {}'.format(path))
+    return model, path
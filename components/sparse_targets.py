@@ -0,0 +1,57 @@
+import numpy as np
+import tensorflow as tf
+
+
+# 稀疏的训练目标：preprocess_true_boxes(sparse=True)不再生成每层(m, H/s, W/s, 3, 5 + num_classes)的稠密y_true，
+# 而是每张图像一组补齐的记录(m, R, C)：(layer, y, x, anchor, 目标的值...)，layer为-1的行是补齐的空记录，
+# R为这个batch中记录最多的图像的记录数；yolo_loss在计算图中按层scatter为稠密的y_true
+# YOLOV4/V5：值为(x, y, w, h, class)，C = 9；YOLOV7：值为真实框的序号t + 1，C = 5
+TARGET_COLUMNS = 9
+INDEX_COLUMNS = 5
+
+
+def pack_records(records, m, columns):
+    '''
+    records：每层的(b, rows)，b为(n,)每条记录的图像序号，rows为(n, columns)的(layer, y, x, anchor, 值...)，
+    返回(m, R, columns)的float32，空记录的layer为-1
+    '''
+    b = np.concatenate([np.zeros(0, np.int64)] + [np.asarray(r[0], np.int64) for r in records])
+    rows = np.concatenate([np.zeros((0, columns), np.float32)] + [np.asarray(r[1], np.float32).reshape(-1, columns) for r in records])
+    order = np.argsort(b, kind='stable')
+    b, rows = b[order], rows[order]
+    counts = np.bincount(b, minlength=m)
+    packed = np.zeros((m, max(int(counts.max()) if m else 0, 1), columns), np.float32)
+    packed[..., 0] = -1
+    position = np.arange(len(b)) - np.repeat(np.cumsum(counts) - counts, counts)
+    packed[b, position] = rows
+    return packed
+
+
+def scatter_records(records, layer, grid_shape, num_anchors, depth, values):
+    '''
+    把records(m, R, C)中第layer层的记录scatter为(m, h, w, num_anchors, depth)，values(记录中的值)返回每条记录的(n, depth)
+    同一个网格的同一个anchor有多条记录时逐个取最大值(YOLOV4的类别one-hot合并)
+    '''
+    mask = tf.equal(records[..., 0], tf.cast(layer, records.dtype))
+    index = tf.cast(tf.where(mask), tf.int32)
+    rows = tf.boolean_mask(records, mask)
+    cells = tf.concat([index[:, :1], tf.cast(rows[:, 1:4], tf.int32)], -1)
+    shape = tf.stack([tf.shape(records)[0], grid_shape[0], grid_shape[1], num_anchors, depth])
+    return tf.tensor_scatter_nd_max(tf.zeros(shape, records.dtype), cells, values(rows[:, 4:]))
+
+
+def dense_targets(records, layer, grid_shape, num_anchors, num_classes):
+    '''
+    YOLOV4/V5：(m, h, w, num_anchors, 5 + num_classes)，与preprocess_true_boxes的稠密y_true相同
+    '''
+    def values(rows):
+        ones = tf.ones_like(rows[:, :1])
+        return tf.concat([rows[:, 0:4], ones, tf.one_hot(tf.cast(rows[:, 4], tf.int32), num_classes, dtype=rows.dtype)], -1)
+    return scatter_records(records, layer, grid_shape, num_anchors, 5 + num_classes, values)
+
+
+def dense_index_targets(records, layer, grid_shape, num_anchors):
+    '''
+    YOLOV7：(m, h, w, num_anchors, 2)，为(是否为正样本, 真实框的序号 + 1)
+    '''
+    return scatter_records(records, layer, grid_shape, num_anchors, 2, lambda rows: tf.concat([tf.ones_like(rows[:, :1]), rows[:, 0:1]], -1))
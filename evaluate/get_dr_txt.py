@@ -7,6 +7,10 @@ from cfg import *
 from PIL import Image
 from tqdm import tqdm
 import argparse
+import numpy as np
+from inference import batched, Throughput
+from inference.models import load_model
+from inference.workers import WorkerPool
 
 
 '''
@@ -44,11 +48,61 @@ def parse_args():
         help='image path',
         required=True
     )
+    parser.add_argument(
+        '--batch_size',
+        help='number of images per forward pass',
+        default=8,
+        type=int
+    )
+    parser.add_argument(
+        '--workers',
+        help='number of inference processes, each with its own model and cores // workers threads',
+        default=1,
+        type=int
+    )
     args = parser.parse_args()
     return args
 
+def write_dr_txt(dr_txt_path, image_size, detections, class_names):
+    with open(dr_txt_path, 'w') as f:
+        if len(detections) == 0:
+            f.write(" ")
+        for (left, top, right, bottom), score, c in detections:
+            predicted_class = class_names[int(c)]
+            top = top - 5
+            left = left - 5
+            bottom = bottom + 5
+            right = right + 5
+            top = max(0, np.floor(top + 0.5).astype('int32'))
+            left = max(0, np.floor(left + 0.5).astype('int32'))
+            bottom = min(image_size[1], np.floor(bottom + 0.5).astype('int32'))
+            right = min(image_size[0], np.floor(right + 0.5).astype('int32'))
+            f.write("%s %s %s %s %s %s\n" % (predicted_class, str(score), str(int(left)), str(int(top)), str(int(right)),str(int(bottom))))
+
+def get_dr_txt_workers(image_ids, args):
+    '''
+    多进程生成检测结果：每个进程加载一份模型，结果按image_ids的顺序写出
+    '''
+    paths = [os.path.join(args.image_path, image_id+".jpg") for image_id in image_ids]
+    throughput = Throughput()
+    with WorkerPool(load_model, (args.model, args.model_path), args.workers, batch_size=args.batch_size) as pool:
+        throughput.start()
+        with tqdm(total=len(image_ids)) as pbar:
+            for image_id, (_, image_size, detections) in zip(image_ids, pool.imap(paths)):
+                write_dr_txt(os.path.join(args.pr_folder, image_id+'.txt'), image_size, detections, pool.class_names)
+                pbar.update(1)
+        throughput.stop(len(image_ids))
+    print(throughput)
+
 if __name__ == '__main__':
     args = parse_args()
+    if args.workers > 1:
+        image_ids = open(args.testset).read().strip().split()
+        if not os.path.exists(args.pr_folder):
+            os.makedirs(args.pr_folder)
+        get_dr_txt_workers(image_ids, args)
+        print("Conversion completed!")
+        sys.exit(0)
     if args.model.upper() == 'YOLOX':
         from yolox import Inference_YOLOXModel
         yolo = Inference_YOLOXModel(YOLOXConfig, args.model_path)
@@ -76,9 +130,16 @@ if __name__ == '__main__':
     if not os.path.exists(pr_folder_name):
         os.makedirs(pr_folder_name)
 
-    for image_id in tqdm(image_ids):
-        image_name = os.path.join(image_path, image_id+".jpg")
-        image = Image.open(image_name)
-        yolo.getdrtxt(image, pr_folder_name, image_id)
+    throughput = Throughput()
+    with tqdm(total=len(image_ids)) as pbar:
+        for batch_ids in batched(image_ids, args.batch_size):
+            images = [Image.open(os.path.join(image_path, image_id+".jpg")) for image_id in batch_ids]
+            throughput.start()
+            results = yolo.detect_batch(images, batch_size=args.batch_size)
+            throughput.stop(len(images))
+            for image_id, image, detections in zip(batch_ids, images, results):
+                write_dr_txt(os.path.join(pr_folder_name, image_id+'.txt'), image.size, detections, yolo.class_names)
+            pbar.update(len(batch_ids))
     
+    print(throughput)
     print("Conversion completed!")
@@ -4,6 +4,11 @@ ONNX模型命名规则：数据集功能_算法模型_OP_输入维度_版本.onn
 
 Usage:
     python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' 
+    python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' --preprocess --bgr
+    python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' --end2end
+    python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' --save_onnx_int8 'voc_yolox_l_13_640_v1_int8.onnx' --calib_txt ./VOC2007/train.txt
+    python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' --save_tflite 'voc_yolox_l_640_v1_int8.tflite' --quantize int8 --calib_txt ./VOC2007/train.txt
+    python ./export.py --model ./model/VOC.h5 --yolo yolox --save_onnx 'voc_yolox_l_13_640_v1.onnx' --save_tflite 'voc_yolox_l_640_v1_e2e.tflite' --end2end
 
 '''
 
@@ -20,6 +25,16 @@ def parse_arg():
     parser.add_argument('--yolo', type=str, help='YOLO algorithm.', choices=['yolov4', 'yolov4_tiny', 'yolov5', 'yolov5-v61', 'yolox', 'yolov7'], required=True)
     parser.add_argument('--save_onnx', type=str, help='save onnx model name', required=True, default='')
     parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
+    parser.add_argument('--preprocess', action='store_true', help='ONNX: take uint8 HWC images as input, letterbox and normalize inside the model')
+    parser.add_argument('--bgr', action='store_true', help='ONNX: with --preprocess, the input images are BGR (cv2)')
+    parser.add_argument('--end2end', action='store_true', help='ONNX/TFLite: append decode and batched NMS, outputs num_dets, boxes, scores, classes')
+    parser.add_argument('--max_total_size', type=int, default=None, help='end2end: detections kept per image, default max_boxes * num_classes as in the non-end2end path')
+    parser.add_argument('--save_tflite', type=str, default=None, help='also save the network (without pre/post-processing) as TFLite')
+    parser.add_argument('--quantize', type=str, default=None, choices=['dynamic', 'int8', 'fp16'], help='TFLite: dynamic-range, full-integer or float16 quantization')
+    parser.add_argument('--save_onnx_int8', type=str, default=None, help='also save a static int8 (QDQ) quantized copy of the ONNX model, per-channel with --opset 13 or higher')
+    parser.add_argument('--calib_txt', type=str, default=None, help='int8: annotation file (train.txt) to sample calibration images from')
+    parser.add_argument('--calib_num', type=int, default=100, help='int8: number of calibration images')
+    parser.add_argument('--no_fuse', action='store_true', help='keep BatchNormalization layers and RepConv branches unfused')
     return parser
 
 def main(args):
@@ -31,35 +46,43 @@ def main(args):
     yolo_type = args.yolo
     model = args.model
     assert len(model) > 0, 'weights cannot be none or empty.'
+    quantize_args = dict(tflite_save_path=args.save_tflite, quantize=args.quantize, onnx_int8_path=args.save_onnx_int8,
+                         calib_txt=args.calib_txt, calib_num=args.calib_num, fuse=not args.no_fuse,
+                         max_total_size=args.max_total_size)
     if yolo_type == 'yolov4' or yolo_type == 'yolov4_tiny':
         from yolov4 import export_yolov4
         save_pb = args.saved_pb
         save_name = args.saved_pb_dir
-        export_yolov4(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path)
+        export_yolov4(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path, preprocess=args.preprocess, bgr=args.bgr, end2end=args.end2end,
+                      **quantize_args)
         print('success export YOLOV4.')
     elif yolo_type == 'yolox':
         from yolox import export_yolox
         save_pb = args.saved_pb
         save_name = args.saved_pb_dir
-        export_yolox(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path)
+        export_yolox(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path, preprocess=args.preprocess, bgr=args.bgr, end2end=args.end2end,
+                     **quantize_args)
         print('success export YOLOX.')
     elif yolo_type == 'yolov5':
         from yolov5 import export_yolov5
         save_pb = args.saved_pb
         save_name = args.saved_pb_dir
-        export_yolov5(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path)
+        export_yolov5(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path, preprocess=args.preprocess, bgr=args.bgr, end2end=args.end2end,
+                      **quantize_args)
         print('success export yolov5.')
     elif yolo_type == 'yolov5-v61':
         from yolov5v61 import export_yolov5v61
         save_pb = args.saved_pb
         save_name = args.saved_pb_dir
-        export_yolov5v61(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path)
+        export_yolov5v61(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path, preprocess=args.preprocess, bgr=args.bgr, end2end=args.end2end,
+                         **quantize_args)
         print('success export yolov5-v61.')
     elif yolo_type == 'yolov7':
         from yolov7 import export_yolov7
         save_pb = args.saved_pb
         save_name = args.saved_pb_dir
-        export_yolov7(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path)
+        export_yolov7(model, save_pb, save_name, opset=opset, onnx_save_path=onnx_save_path, preprocess=args.preprocess, bgr=args.bgr, end2end=args.end2end,
+                      **quantize_args)
         print('success export yolov7.')
 if __name__ == '__main__':
     parser = parse_arg()
@@ -0,0 +1,6 @@
+from .batch import batched, Throughput
+from .detections import Detections
+from .render import draw_detections, draw_detections_cv2, get_colors, get_font
+from .nms import nms, multiclass_nms, select_candidates
+from .pipeline import VideoPipeline, PipelineStats, put_with_policy
+from .streams import MultiStreamRunner, MultiStreamStats, LiveFileCapture
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from .end2end import END2END_OUTPUTS, is_end2end
+from .preprocess import read_onnx_preprocess
+from .threads import _thread_budget
+from .utils import check_suffix
+
+
+# 权重后缀对应的后端，SavedModel(包括推理缓存)为目录，没有后缀
+BACKEND_SUFFIXES = OrderedDict([('.h5', 'h5'), ('.onnx', 'onnx'), ('.tflite', 'tflite'), ('', 'saved_model')])
+# onnxruntime的计算图优化级别以及执行模式
+ONNX_GRAPH_OPTIMIZATION = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+ONNX_EXECUTION_MODE = {
+    'sequential': 'ORT_SEQUENTIAL',
+    'parallel': 'ORT_PARALLEL',
+}
+# onnx输入类型对应的numpy类型
+ONNX_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(uint8)': np.uint8,
+    'tensor(int8)': np.int8,
+}
+
+
+def backend_type(weights):
+    '''
+    按权重的后缀判断后端：h5、onnx、tflite或者saved_model
+    '''
+    weights = str(weights[0] if isinstance(weights, list) else weights)
+    check_suffix(weights, list(BACKEND_SUFFIXES))
+    return BACKEND_SUFFIXES[Path(weights).suffix.lower()]
+
+
+class Backend(object):
+    '''
+    推理后端的统一接口：run(batch)输入(batch_size, h, w, 3)的网络输入，返回网络输出的列表
+    tensorflow：输出为tf.Tensor，使用tensorflow解码；否则输出为numpy数组，使用NumPy解码
+    preprocess：onnx模型内含预处理时的信息(见read_onnx_preprocess)，否则为None
+    end2end：模型内含解码以及非极大值抑制，run返回boxes、scores、classes以及num_dets
+    '''
+    name = None
+    tensorflow = False
+    preprocess = None
+    end2end = False
+
+    def run(self, batch, input_image_shapes=None):
+        raise NotImplementedError
+
+    def run_frames(self, frames, bgr=True):
+        '''
+        在计算图中完成缩放、填充以及归一化，只有tensorflow后端支持
+        '''
+        raise NotImplementedError
+
+
+class GraphBackend(Backend):
+    '''
+    .h5、SavedModel以及推理缓存：get_pred、get_pred_frames为带input_signature的tf.function
+    '''
+    tensorflow = True
+
+    def __init__(self, name, model, get_pred, get_pred_frames):
+        self.name = name
+        self.model = model
+        self.get_pred = get_pred
+        self.get_pred_frames = get_pred_frames
+
+    def run(self, batch, input_image_shapes=None):
+        return self.get_pred(batch)
+
+    def run_frames(self, frames, bgr=True):
+        return self.get_pred_frames(frames, bgr)
+
+
+def onnx_session_options(graph_optimization='all', execution_mode='sequential', intra_op_threads=None,
+                         inter_op_threads=None, mem_arena=True, mem_pattern=True):
+    '''
+    创建onnxruntime.SessionOptions
+    graph_optimization：计算图优化级别，disable、basic、extended或者all
+    execution_mode：sequential按顺序执行算子；parallel并行执行没有依赖关系的算子(使用inter_op线程)
+    intra_op_threads、inter_op_threads：为None时使用set_thread_budget设置的线程预算，没有设置预算时使用默认值
+    mem_arena、mem_pattern：内存池以及按第一次运行的内存分配模式预分配，输入尺寸固定时减少分配
+    '''
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel, ONNX_GRAPH_OPTIMIZATION[graph_optimization])
+    options.execution_mode = getattr(onnxruntime.ExecutionMode, ONNX_EXECUTION_MODE[execution_mode])
+    intra_op_threads = intra_op_threads or _thread_budget['intra_op']
+    inter_op_threads = inter_op_threads or _thread_budget['inter_op']
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+    options.enable_cpu_mem_arena = mem_arena
+    options.enable_mem_pattern = mem_pattern
+    return options
+
+
+class OnnxBackend(Backend):
+    '''
+    onnxruntime后端，会话的输入、输出名称以及类型在加载时读取一次
+    io_binding：预先绑定输入以及输出，输出写入预先分配的缓冲区，不再每次分配输出数组
+                每种输入尺寸分配num_buffers组缓冲区轮流使用，run返回的数组在之后第num_buffers次run时被覆盖，
+                流水线中推理与后处理不在同一线程、并且积压超过num_buffers批时需要复制或者关闭io_binding
+    其余参数见onnx_session_options
+    '''
+    name = 'onnx'
+
+    def __init__(self, weights, graph_optimization='all', execution_mode='sequential', intra_op_threads=None,
+                 inter_op_threads=None, mem_arena=True, mem_pattern=True, io_binding=False, num_buffers=2, providers=None):
+        import onnxruntime
+        options = onnx_session_options(graph_optimization, execution_mode, intra_op_threads, inter_op_threads, mem_arena, mem_pattern)
+        self.session = onnxruntime.InferenceSession(str(weights), options, providers=providers)
+        inputs = self.session.get_inputs()
+        self.input_names = [x.name for x in inputs]
+        self.input_dtype = ONNX_DTYPES.get(inputs[0].type, np.float32)
+        self.preprocess = read_onnx_preprocess(self.session)
+        self.end2end = is_end2end(self.session)
+        # end2end模型按num_dets、boxes、scores、classes的顺序取出
+        self.output_names = END2END_OUTPUTS if self.end2end else [x.name for x in self.session.get_outputs()]
+        self.io_binding = io_binding
+        self.num_buffers = num_buffers
+        self._binding = self.session.io_binding() if io_binding else None
+        # 输入尺寸 -> [输出缓冲区, ...]以及下一次使用的序号
+        self._buffers = OrderedDict()
+
+    def feed(self, batch, input_image_shapes=None):
+        feed = {self.input_names[0]: np.ascontiguousarray(batch, dtype=self.input_dtype)}
+        if self.end2end:
+            feed[self.input_names[1]] = np.asarray(input_image_shapes, dtype=np.float32).reshape(-1, 2)
+        return feed
+
+    def run(self, batch, input_image_shapes=None):
+        feed = self.feed(batch, input_image_shapes)
+        if self.io_binding:
+            outputs = self._run_with_binding(feed)
+        else:
+            outputs = self.session.run(self.output_names, feed)
+        if self.end2end:
+            num_dets, boxes, scores, classes = outputs
+            return boxes, scores, classes, num_dets
+        return outputs
+
+    def _run_with_binding(self, feed):
+        key = tuple(value.shape for value in feed.values())
+        if key not in self._buffers:
+            # 第一次遇到该输入尺寸时正常运行一次，按输出的尺寸以及类型分配缓冲区
+            outputs = self.session.run(self.output_names, feed)
+            self._buffers[key] = [[np.empty_like(output) for output in outputs] for _ in range(self.num_buffers)], 0
+            if len(self._buffers) > 8:
+                # 输入尺寸很多时只保留最近使用的缓冲区
+                self._buffers.popitem(last=False)
+            return outputs
+        buffers, index = self._buffers[key]
+        self._buffers[key] = buffers, (index + 1) % self.num_buffers
+        self._buffers.move_to_end(key)
+        outputs = buffers[index]
+        binding = self._binding
+        for name, value in feed.items():
+            binding.bind_cpu_input(name, value)
+        for name, output in zip(self.output_names, outputs):
+            binding.bind_output(name, 'cpu', 0, output.dtype, output.shape, output.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return outputs
+
+
+class TFLiteBackend(Backend):
+    '''
+    TFLite后端，优先使用tflite_runtime，没有安装时使用tf.lite
+    num_threads：解释器(以及XNNPACK)的线程数，为None时使用set_thread_budget设置的线程预算
+    xnnpack：使用默认的XNNPACK delegate(float模型的卷积等算子在CPU上使用XNNPACK)，False时只使用内置算子
+    batch大小变化时调整输入尺寸并重新分配张量
+    量化模型(export.py --quantize)：输入输出为整数时按模型中的scale、zero_point量化输入以及反量化输出
+    end2end模型(export.py --end2end --save_tflite)：batch固定为1，逐张图像运行之后拼接输出
+    '''
+    name = 'tflite'
+
+    def __init__(self, weights, num_threads=None, xnnpack=True):
+        try:
+            from tflite_runtime.interpreter import Interpreter, OpResolverType
+        except ImportError:
+            import tensorflow as tf
+            Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+        op_resolver_type = OpResolverType.AUTO if xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = Interpreter(model_path=str(weights), num_threads=num_threads or _thread_budget['intra_op'],
+                                       experimental_op_resolver_type=op_resolver_type)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        # get_output_details的顺序不一定是模型的输出顺序，按signature排列：
+        # export_tflite导出时输出依次命名为output_0、output_1...，与keras模型的输出顺序相同
+        signatures = self.interpreter.get_signature_list()
+        if signatures:
+            # SignatureRunner引用解释器的内部数据，取出输入输出之后释放，否则invoke报错
+            runner = self.interpreter.get_signature_runner(next(iter(signatures)))
+            inputs, details = runner.get_input_details(), runner.get_output_details()
+            del runner
+            self.end2end = sorted(details) == sorted(END2END_OUTPUTS)
+            names = END2END_OUTPUTS if self.end2end else sorted(details, key=lambda name: (len(name), name))
+            output_details = {output['index']: output for output in self.output_details}
+            self.output_details = [output_details[details[name]['index']] for name in names]
+            if self.end2end:
+                # 输入按images、image_shape排列
+                input_details = {detail['index']: detail for detail in self.input_details}
+                self.input_details = [input_details[inputs[name]['index']] for name in ('images', 'image_shape')]
+        self.input_dtype = self.input_details[0]['dtype']
+        self._input_shape = tuple(self.input_details[0]['shape'])
+
+    def run(self, batch, input_image_shapes=None):
+        if self.end2end:
+            input_image_shapes = np.asarray(input_image_shapes, dtype=np.float32).reshape(-1, 2)
+            outputs = [self._invoke(batch[i:i + 1], input_image_shapes[i:i + 1]) for i in range(len(batch))]
+            num_dets, boxes, scores, classes = [np.concatenate(output, axis=0) for output in zip(*outputs)]
+            return boxes, scores, classes, num_dets
+        return self._invoke(batch)
+
+    def _invoke(self, batch, input_image_shapes=None):
+        batch = quantize(batch, self.input_details[0])
+        index = self.input_details[0]['index']
+        if batch.shape != self._input_shape:
+            self.interpreter.resize_tensor_input(index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self._input_shape = batch.shape
+        self.interpreter.set_tensor(index, batch)
+        if input_image_shapes is not None:
+            self.interpreter.set_tensor(self.input_details[1]['index'], input_image_shapes)
+        self.interpreter.invoke()
+        return [dequantize(self.interpreter.get_tensor(output['index']), output) for output in self.output_details]
+
+
+def quantize(x, details):
+    '''
+    按TFLite张量的量化参数把float输入转换为整数，没有量化参数时只转换类型
+    '''
+    dtype = details['dtype']
+    scale, zero_point = details['quantization']
+    if np.issubdtype(dtype, np.integer) and scale > 0 and not np.issubdtype(np.asarray(x).dtype, np.integer):
+        info = np.iinfo(dtype)
+        x = np.clip(np.round(np.asarray(x, np.float32) / scale + zero_point), info.min, info.max)
+    return np.ascontiguousarray(x, dtype=dtype)
+
+
+def dequantize(x, details):
+    scale, zero_point = details['quantization']
+    if np.issubdtype(x.dtype, np.integer) and scale > 0:
+        return (x.astype(np.float32) - zero_point) * scale
+    return x
+
+
+def load_backend(weights, onnx_options=None, tflite_options=None):
+    '''
+    加载onnx或者tflite后端；.h5以及SavedModel需要各算法的网络结构以及推理函数，由预测类创建GraphBackend
+    onnx_options：OnnxBackend的参数，例如{'graph_optimization': 'all', 'io_binding': True}
+    tflite_options：TFLiteBackend的参数，例如{'num_threads': 4, 'xnnpack': True}
+    '''
+    backend = backend_type(weights)
+    if backend == 'onnx':
+        return OnnxBackend(weights, **(onnx_options or {}))
+    if backend == 'tflite':
+        return TFLiteBackend(weights, **(tflite_options or {}))
+    raise ValueError('{} backend is created by the predictor'.format(backend))
@@ -0,0 +1,44 @@
+import time
+
+
+def batched(items, batch_size):
+    '''
+    将可迭代对象按batch_size切分，最后一个batch可能不足batch_size
+    '''
+    assert batch_size >= 1, 'batch_size must be greater than or equal to 1.'
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class Throughput(object):
+    '''
+    统计推理的图像数量以及耗时，用于输出images/sec
+    '''
+    def __init__(self):
+        self.images = 0
+        self.seconds = 0.
+        self._start = None
+
+    def start(self):
+        self._start = time.time()
+
+    def stop(self, num_images):
+        assert self._start is not None, 'call start() before stop().'
+        self.seconds += time.time() - self._start
+        self.images += num_images
+        self._start = None
+
+    @property
+    def images_per_sec(self):
+        if self.seconds <= 0:
+            return 0.
+        return self.images / self.seconds
+
+    def __str__(self):
+        return '{} images in {:.2f}s, {:.2f} images/sec'.format(self.images, self.seconds, self.images_per_sec)
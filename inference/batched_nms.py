@@ -0,0 +1,125 @@
+import contextlib
+
+import tensorflow as tf
+
+
+# 导出TFLite(export_end2end_tflite)时batched_nms改为只使用TFLite内置算子的实现，
+# combined_non_max_suppression不是TFLite的内置算子，需要tflite_runtime不支持的Flex算子
+_tflite_nms = {'enabled': False}
+# TFLite实现中参与非极大值抑制的(检测框, 类别)候选数量上限
+TFLITE_NMS_CANDIDATES = 4096
+
+
+@contextlib.contextmanager
+def tflite_nms():
+    '''
+    在with内构建(trace)的计算图中batched_nms使用batched_nms_tflite
+    '''
+    enabled, _tflite_nms['enabled'] = _tflite_nms['enabled'], True
+    try:
+        yield
+    finally:
+        _tflite_nms['enabled'] = enabled
+
+
+def batched_nms(boxes, box_scores, max_boxes, score_threshold, iou_threshold, max_total_size=None):
+    '''
+    类别相关的批量非极大值抑制：所有类别、所有图像在一个算子内完成，可直接导出到计算图中，
+    结果与逐类别调用tf.image.non_max_suppression一致
+    boxes：(batch_size, num_boxes, 4)
+    box_scores：(batch_size, num_boxes, num_classes)
+    max_boxes：每个类别最多保留的检测框数量
+    max_total_size：每张图像最多保留的检测框数量，默认max_boxes * num_classes
+    返回值：
+    nmsed_boxes：(batch_size, max_total_size, 4)，按置信度从高到低排列，不足的部分补0
+    nmsed_scores：(batch_size, max_total_size)
+    nmsed_classes：(batch_size, max_total_size)，int32
+    valid_detections：(batch_size,)，每张图像的有效检测框数量
+    '''
+    num_classes = box_scores.shape[-1]
+    if max_total_size is None:
+        max_total_size = max_boxes * num_classes
+    if _tflite_nms['enabled']:
+        return batched_nms_tflite(boxes, box_scores, max_boxes, score_threshold, iou_threshold, max_total_size)
+    nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections = tf.image.combined_non_max_suppression(
+        tf.expand_dims(boxes, 2),
+        box_scores,
+        max_output_size_per_class=max_boxes,
+        max_total_size=max_total_size,
+        iou_threshold=iou_threshold,
+        score_threshold=score_threshold,
+        pad_per_class=False,
+        clip_boxes=False)
+    return nmsed_boxes, nmsed_scores, tf.cast(nmsed_classes, tf.int32), valid_detections
+
+
+def batched_nms_tflite(boxes, box_scores, max_boxes, score_threshold, iou_threshold, max_total_size, candidates=TFLITE_NMS_CANDIDATES):
+    '''
+    只使用TFLite内置算子(TOPK_V2、NON_MAX_SUPPRESSION_V5、ONE_HOT、CUMSUM、GATHER)的batched_nms，输出格式相同
+    每张图像按置信度取前candidates个(检测框, 类别)，不同类别的检测框平移到互不重叠的位置之后一次完成非极大值抑制，
+    每个类别按置信度保留前max_boxes个，再保留前max_total_size个
+    高于score_threshold的(检测框, 类别)不超过candidates个时与combined_non_max_suppression(batched_nms)的结果一致，
+    超过时只在置信度最高的candidates个之中进行非极大值抑制
+    batch_size需要是静态的(导出时固定)，逐张图像展开
+    '''
+    batch_size, num_boxes, num_classes = box_scores.shape
+    assert batch_size is not None and num_boxes is not None, 'batched_nms_tflite needs static shapes'
+    k = min(candidates, num_boxes * num_classes)
+    # 候选少于max_total_size时在最后补0，输出形状与batched_nms相同
+    size, pad = min(max_total_size, k), max(max_total_size - k, 0)
+    outputs = []
+    for b in range(batch_size):
+        scores, index = tf.math.top_k(tf.reshape(box_scores[b], [-1]), k=k)
+        classes = index % num_classes
+        candidate_boxes = tf.gather(boxes[b], index // num_classes)
+        span = tf.reduce_max(candidate_boxes) - tf.reduce_min(candidate_boxes) + 1.
+        offset_boxes = candidate_boxes + tf.cast(classes, boxes.dtype)[:, None] * span
+        # 不限制输出数量：与逐类别的非极大值抑制相同，每个类别的前max_boxes个即逐类别限制max_output_size的结果
+        selected, nmsed_scores, valid = tf.raw_ops.NonMaxSuppressionV5(
+            boxes=offset_boxes, scores=scores, max_output_size=k, iou_threshold=iou_threshold,
+            score_threshold=score_threshold, soft_nms_sigma=0., pad_to_max_output_size=True)
+        selected_classes = tf.gather(classes, selected)
+        # 每个检测框在本类别中的名次(按置信度从高到低)
+        one_hot = tf.one_hot(selected_classes, num_classes) * tf.cast(tf.range(k) < valid, tf.float32)[:, None]
+        rank = tf.reduce_sum(tf.cumsum(one_hot, axis=0, exclusive=True) * one_hot, axis=-1)
+        keep = tf.logical_and(tf.range(k) < valid, rank < max_boxes)
+        # 保留的检测框仍按置信度从高到低排列，取前max_total_size个
+        order = tf.math.top_k(tf.where(keep, nmsed_scores, -1.), k=size).indices
+        num_valid = tf.minimum(tf.reduce_sum(tf.cast(keep, tf.int32)), size)
+        mask = tf.range(size) < num_valid
+        outputs.append((tf.pad(tf.gather(candidate_boxes, tf.gather(selected, order)) * tf.cast(mask, boxes.dtype)[:, None], [[0, pad], [0, 0]]),
+                        tf.pad(tf.gather(nmsed_scores, order) * tf.cast(mask, nmsed_scores.dtype), [[0, pad]]),
+                        tf.pad(tf.gather(selected_classes, order) * tf.cast(mask, tf.int32), [[0, pad]]), num_valid))
+    return [tf.stack(output, axis=0) for output in zip(*outputs)]
+
+
+def unpad_detections(nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections, index=0):
+    '''
+    取出batch中第index张图像的有效检测结果
+    '''
+    num = valid_detections[index]
+    return nmsed_boxes[index, :num], nmsed_scores[index, :num], nmsed_classes[index, :num]
+
+
+def select_topk(box_scores, score_threshold, pre_nms_topk=None):
+    '''
+    非极大值抑制之前的候选框筛选(与NumPy实现的select_candidates相同)：最大类别置信度低于score_threshold的检测框置0，
+    按最大类别置信度保留前k个候选框，k为batch中高于score_threshold的检测框数量的最大值，不超过pre_nms_topk
+    导出TFLite(tflite_nms)时形状需要是静态的，k固定为pre_nms_topk(为None时为全部检测框)，低于score_threshold的只置0
+    box_scores：(batch_size, num_boxes, num_classes)
+    返回值：候选框下标(batch_size, k)以及对应的box_scores(batch_size, k, num_classes)
+    '''
+    max_scores = tf.reduce_max(box_scores, axis=-1)
+    above = max_scores >= score_threshold
+    box_scores = box_scores * tf.cast(above, box_scores.dtype)[..., None]
+    num_boxes = box_scores.shape[1]
+    if _tflite_nms['enabled'] and num_boxes is not None:
+        k = num_boxes if pre_nms_topk is None else min(pre_nms_topk, num_boxes)
+    else:
+        # 至少保留1个，没有候选框时非极大值抑制的输入不为空
+        k = tf.maximum(tf.reduce_max(tf.reduce_sum(tf.cast(above, tf.int32), axis=-1)), 1)
+        if pre_nms_topk is not None:
+            k = tf.minimum(k, pre_nms_topk)
+        k = tf.minimum(k, tf.shape(box_scores)[1])
+    _, index = tf.math.top_k(tf.where(above, max_scores, -1.), k=k, sorted=False)
+    return index, tf.gather(box_scores, index, batch_dims=1)
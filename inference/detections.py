@@ -0,0 +1,66 @@
+import numpy as np
+
+
+class Detections(object):
+    '''
+    单张图像的检测结果，均为numpy数组：
+    boxes：(N, 4) float32，格式为(x1, y1, x2, y2)，原图坐标
+    scores：(N,) float32
+    classes：(N,) int32，类别id
+    '''
+    __slots__ = ('boxes', 'scores', 'classes')
+
+    def __init__(self, boxes, scores, classes):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.classes = np.asarray(classes, dtype=np.int32).reshape(-1)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), np.float32), np.zeros((0,), np.float32), np.zeros((0,), np.int32))
+
+    @classmethod
+    def from_tlbr(cls, out_boxes, out_scores, out_classes, image_size=None):
+        '''
+        将解码得到的(top, left, bottom, right)格式转换为(x1, y1, x2, y2)
+        image_size：原图尺寸(w, h)，不为空时将检测框裁剪到图像范围内
+        '''
+        out_boxes = np.asarray(out_boxes, dtype=np.float32).reshape(-1, 4)
+        boxes = out_boxes[:, [1, 0, 3, 2]]
+        if image_size is not None:
+            w, h = image_size
+            np.clip(boxes[:, 0::2], 0, w, out=boxes[:, 0::2])
+            np.clip(boxes[:, 1::2], 0, h, out=boxes[:, 1::2])
+        return cls(boxes, out_scores, out_classes)
+
+    def to_tlbr(self):
+        return self.boxes[:, [1, 0, 3, 2]]
+
+    def to_xywh(self):
+        '''
+        (x1, y1, x2, y2) -> (left, top, width, height)，用于目标跟踪
+        '''
+        xywh = self.boxes.copy()
+        xywh[:, 2:] -= xywh[:, :2]
+        return xywh
+
+    def to_list(self, class_names=None):
+        '''
+        转换为可以json序列化的列表，每个检测框为{'box': [x1, y1, x2, y2], 'score', 'class_id'(, 'class_name')}
+        '''
+        results = []
+        for box, score, class_id in self:
+            result = {'box': [round(float(v), 2) for v in box], 'score': round(float(score), 4), 'class_id': int(class_id)}
+            if class_names is not None:
+                result['class_name'] = class_names[int(class_id)]
+            results.append(result)
+        return results
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __iter__(self):
+        return iter(zip(self.boxes, self.scores, self.classes))
+
+    def __repr__(self):
+        return 'Detections(num={})'.format(len(self))
@@ -0,0 +1,43 @@
+# 导出时写入onnx模型metadata_props的键，标识模型内含解码以及非极大值抑制
+END2END_KEY = 'end2end'
+# end2end模型的输入以及输出名称
+END2END_INPUTS = ['images', 'image_shape']
+END2END_OUTPUTS = ['num_dets', 'boxes', 'scores', 'classes']
+
+
+def end2end_metadata(confidence, nms_iou, max_boxes, max_total_size):
+    '''
+    end2end onnx模型的metadata_props，记录导出时固定在模型中的阈值
+    max_boxes：每个类别最多保留的检测框数量，max_total_size：每张图像最多输出的检测框数量
+    '''
+    return {
+        END2END_KEY: '1',
+        'confidence': str(confidence),
+        'nms_iou': str(nms_iou),
+        'max_boxes': str(max_boxes),
+        'max_total_size': str(max_total_size),
+    }
+
+
+def end2end_max_total_size(max_boxes, num_classes, max_total_size=None):
+    '''
+    end2end模型每张图像最多输出的检测框数量，默认与非end2end的batched_nms相同(max_boxes * num_classes)
+    '''
+    return max_total_size or max_boxes * num_classes
+
+
+def is_end2end(session):
+    '''
+    onnxruntime.InferenceSession是否为end2end模型(输出num_dets、boxes、scores、classes)
+    '''
+    metadata = session.get_modelmeta().custom_metadata_map
+    output_names = [output.name for output in session.get_outputs()]
+    return metadata.get(END2END_KEY) == '1' or output_names == END2END_OUTPUTS
+
+
+def unpad_end2end(boxes, scores, classes, num_dets, index=0):
+    '''
+    取出batch中第index张图像的有效检测结果，boxes为(top, left, bottom, right)
+    '''
+    num = int(num_dets[index])
+    return boxes[index, :num], scores[index, :num], classes[index, :num]
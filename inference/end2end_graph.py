@@ -0,0 +1,38 @@
+import tensorflow as tf
+
+from .preprocess_graph import letterbox_graph
+
+
+def build_end2end_model(model, decode_batch, input_shape, preprocess=False, letterbox_image=True, bgr=False, mean=None, std=None,
+                        batch_size=None):
+    '''
+    在模型之后加入解码以及批量非极大值抑制，导出后不再需要python后处理
+    decode_batch：decode_batch(outputs, image_shape)，返回batched_nms的(boxes, scores, classes, valid_detections)，
+                  阈值以及max_total_size在其中固定
+    input_shape：网络输入(h, w)
+    preprocess：为True时输入为uint8的(batch_size, H, W, 3)原图，缩放、填充以及归一化在模型中完成，
+                否则输入为预处理后的(batch_size, h, w, 3)
+    batch_size：固定的batch大小，None为任意大小
+    输入：images、image_shape(batch_size, 2)，每张原图的(h, w)
+    输出：num_dets(batch_size,)、boxes(batch_size, max_total_size, 4)为原图上的(top, left, bottom, right)、
+          scores(batch_size, max_total_size)、classes(batch_size, max_total_size)，不足的部分补0
+    '''
+    h, w = input_shape
+    image_shape = tf.keras.layers.Input([2], batch_size=batch_size, name='image_shape')
+    if preprocess:
+        images = tf.keras.layers.Input([None, None, 3], batch_size=batch_size, dtype='uint8', name='images')
+        image_data = tf.keras.layers.Lambda(
+            lambda x: letterbox_graph(x, input_shape, letterbox_image, bgr=bgr, mean=mean, std=std),
+            name='preprocess')(images)
+    else:
+        # 输入尺寸固定，解码时可以使用缓存的先验信息
+        images = tf.keras.layers.Input([h, w, 3], batch_size=batch_size, name='images')
+        image_data = images
+    outputs = model(image_data)
+    nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections = tf.keras.layers.Lambda(
+        lambda x: decode_batch(x[:-1], x[-1]), name='decode')([*outputs, image_shape])
+    num_dets = tf.keras.layers.Lambda(tf.identity, name='num_dets')(valid_detections)
+    boxes = tf.keras.layers.Lambda(tf.identity, name='boxes')(nmsed_boxes)
+    scores = tf.keras.layers.Lambda(tf.identity, name='scores')(nmsed_scores)
+    classes = tf.keras.layers.Lambda(tf.identity, name='classes')(nmsed_classes)
+    return tf.keras.models.Model([images, image_shape], [num_dets, boxes, scores, classes])
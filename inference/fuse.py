@@ -0,0 +1,52 @@
+import numpy as np
+
+
+# 可以折叠到前一个卷积中的归一化层以及可以合并的卷积层(keras类名)
+FOLDABLE_NORMS = ['BatchNormalization', 'BatchRenormalization']
+FUSABLE_CONVS = ['Conv2D', 'DepthwiseConv2D']
+
+
+def fold_bn(kernel, bias, gamma, beta, mean, var, epsilon, depthwise=False):
+    '''
+    把推理时的BN折叠到前一个卷积中：BN(conv(x)) = conv'(x)
+    kernel：Conv2D为(kh, kw, in/groups, out)，DepthwiseConv2D为(kh, kw, in, multiplier)
+    bias为None表示卷积没有偏置；gamma、beta为None表示BN不使用scale、center
+    返回值：折叠后的(kernel, bias)
+    '''
+    channels = kernel.shape[2] * kernel.shape[3] if depthwise else kernel.shape[3]
+    gamma = np.ones(channels, np.float32) if gamma is None else gamma
+    beta = np.zeros(channels, np.float32) if beta is None else beta
+    bias = np.zeros(channels, np.float32) if bias is None else bias
+    scale = gamma / np.sqrt(var + epsilon)
+    if depthwise:
+        # 输出通道的顺序为in_channel * multiplier + m
+        kernel = kernel * scale.reshape(kernel.shape[2], kernel.shape[3])
+    else:
+        kernel = kernel * scale
+    bias = (bias - mean) * scale + beta
+    return kernel.astype(np.float32), bias.astype(np.float32)
+
+
+def merge_kernels(kernels, biases):
+    '''
+    RepConv：输入相同、stride为1、padding为same的多个并联卷积相加，等价于一个卷积
+    较小的卷积核补零到最大的卷积核尺寸(居中)后相加
+    '''
+    kh = max(kernel.shape[0] for kernel in kernels)
+    kw = max(kernel.shape[1] for kernel in kernels)
+    merged = np.zeros((kh, kw) + kernels[0].shape[2:], np.float32)
+    for kernel in kernels:
+        top, left = (kh - kernel.shape[0]) // 2, (kw - kernel.shape[1]) // 2
+        merged[top:top + kernel.shape[0], left:left + kernel.shape[1]] += kernel
+    return merged, np.sum(biases, axis=0).astype(np.float32)
+
+
+def relative_error(outputs, fused_outputs):
+    '''
+    每个输出的最大绝对误差除以原输出的最大绝对值
+    '''
+    errors = []
+    for output, fused_output in zip(outputs, fused_outputs):
+        output, fused_output = np.asarray(output), np.asarray(fused_output)
+        errors.append(float(np.abs(output - fused_output).max() / max(np.abs(output).max(), 1e-12)))
+    return errors
@@ -0,0 +1,193 @@
+import warnings
+
+import numpy as np
+import tensorflow as tf
+
+from .fuse import FOLDABLE_NORMS, FUSABLE_CONVS, fold_bn, merge_kernels, relative_error
+
+
+def _references(config):
+    # 每一层的输出 -> 引用它的位置(inbound_nodes以及output_layers中的ref，原地修改即改写连接关系)，
+    # 列表的长度即被引用的次数(包括作为模型输出)；只建立一次，删除以及改名时同步更新
+    refs = {}
+    for ref in [ref for layer in config['layers'] for node in layer['inbound_nodes'] for ref in node] + config['output_layers']:
+        refs.setdefault(ref[0], []).append(ref)
+    return refs
+
+
+def _rename(refs, old, new):
+    # 把对old层输出的引用改为new层的输出
+    for ref in refs.pop(old, []):
+        ref[0], ref[1], ref[2] = new, 0, 0
+        refs.setdefault(new, []).append(ref)
+
+
+def _remove(refs, removed, layer):
+    # 删除layer：layer对其输入的引用不再计数
+    removed.add(layer['name'])
+    for node in layer['inbound_nodes']:
+        for ref in node:
+            refs[ref[0]] = [other for other in refs[ref[0]] if other is not ref]
+
+
+def _single_input(layer):
+    # 只调用过一次并且只有一个输入时返回该输入的引用(层名, node_index, tensor_index)
+    if len(layer['inbound_nodes']) != 1 or len(layer['inbound_nodes'][0]) != 1:
+        return None
+    return tuple(layer['inbound_nodes'][0][0][:3])
+
+
+def _bn_params(layer):
+    '''
+    推理时BN的参数(gamma, beta, mean, var, epsilon)，只支持对最后一维(通道)归一化的BN
+    BatchRenormalization推理时与BatchNormalization相同，使用running_mean以及running_variance
+    '''
+    axis = layer.axis if isinstance(layer.axis, (list, tuple)) else [layer.axis]
+    if len(axis) != 1 or axis[0] not in (-1, 3):
+        return None
+    if type(layer).__name__ == 'BatchRenormalization':
+        mean, var = layer.running_mean, layer.running_variance
+    else:
+        mean, var = layer.moving_mean, layer.moving_variance
+    gamma = None if layer.gamma is None else layer.gamma.numpy()
+    beta = None if layer.beta is None else layer.beta.numpy()
+    return gamma, beta, mean.numpy(), var.numpy(), layer.epsilon
+
+
+def _is_linear_conv(layer):
+    return layer['class_name'] in FUSABLE_CONVS and layer['config'].get('activation', 'linear') == 'linear'
+
+
+def rebuild_model(model, config, new_layers=None):
+    '''
+    按config(改写后的model.get_config())的连接关系重新调用原模型的层，返回新的keras模型
+    new_layers：层名 -> (新建的层, 权重)，其余层直接使用原模型中的层(与原模型共享权重)；
+    不经过序列化，自定义层以及Lambda保持不变
+    '''
+    new_layers = new_layers or {}
+    tensors = {(name, 0, 0): model.get_layer(name).output for name, _, _ in config['input_layers']}
+    pending = [layer for layer in config['layers'] if layer['inbound_nodes']]
+    while pending:
+        remaining = []
+        for layer_config in pending:
+            name = layer_config['name']
+            refs = [ref for node in layer_config['inbound_nodes'] for ref in node]
+            if not all(tuple(ref[:3]) in tensors for ref in refs):
+                remaining.append(layer_config)
+                continue
+            layer = new_layers[name][0] if name in new_layers else model.get_layer(name)
+            for node_index, node in enumerate(layer_config['inbound_nodes']):
+                inputs = [tensors[tuple(ref[:3])] for ref in node]
+                outputs = layer(inputs[0] if len(inputs) == 1 else inputs, **(node[0][3] if len(node[0]) > 3 else {}))
+                for tensor_index, output in enumerate(tf.nest.flatten(outputs)):
+                    tensors[(name, node_index, tensor_index)] = output
+            if name in new_layers:
+                layer.set_weights(new_layers[name][1])
+        assert len(remaining) < len(pending), 'cannot rebuild the model'
+        pending = remaining
+    return tf.keras.Model(model.inputs, [tensors[tuple(ref)] for ref in config['output_layers']], name=model.name)
+
+
+def fuse_model(model, verify_shape=None, rtol=1e-4):
+    '''
+    推理用的计算图重写，返回新的keras模型，权重与原模型等价：
+    1. Conv2D/DepthwiseConv2D之后的BatchNormalization、BatchRenormalization折叠到卷积的kernel以及bias中
+    2. RepConv：输入相同、stride为1、padding为same的并联卷积(折叠BN之后)相加，合并为一个卷积
+    3. 删除通道剪枝(components.pruning)之后输出恒为0的通道，见prune_graph.remove_channels
+    只改写卷积的输出只被BN(或者Add)使用的情况，其余层(包括自定义层以及嵌套模型)保持不变，并且与原模型共享权重
+    verify_shape：(h, w)，对随机输入比较改写前后的输出，最大相对误差超过rtol时发出警告并返回原模型
+    模型不支持get_config时同样返回原模型
+    '''
+    try:
+        config = model.get_config()
+    except NotImplementedError as e:
+        warnings.warn('model cannot be fused: {!r}'.format(e))
+        return model
+    layers = {layer['name']: layer for layer in config['layers']}
+    refs = _references(config)
+    removed = set()
+    # 卷积层名 -> 折叠进来的BN层
+    folded = {}
+    for layer in list(config['layers']):
+        source = _single_input(layer)
+        if layer['class_name'] not in FOLDABLE_NORMS or source is None:
+            continue
+        conv = layers[source[0]]
+        if not _is_linear_conv(conv) or _single_input(conv) is None or len(refs.get(conv['name'], [])) != 1:
+            continue
+        bn = model.get_layer(layer['name'])
+        if _bn_params(bn) is None:
+            continue
+        folded[conv['name']] = bn
+        conv['config']['use_bias'] = True
+        _remove(refs, removed, layer)
+        _rename(refs, layer['name'], conv['name'])
+    config['layers'] = [layer for layer in config['layers'] if layer['name'] not in removed]
+
+    # 合并后的卷积层名 -> 并联的卷积层名(包括自身)
+    merged = {}
+    for layer in list(config['layers']):
+        if layer['class_name'] != 'Add' or len(layer['inbound_nodes']) != 1:
+            continue
+        names = [ref[0] for ref in layer['inbound_nodes'][0]]
+        branches = [layers[name] for name in names]
+        if len(set(names)) != len(names) or not all(
+                branch['class_name'] == 'Conv2D' and _is_linear_conv(branch) and len(refs.get(branch['name'], [])) == 1 for branch in branches):
+            continue
+        if len(set(_single_input(branch) for branch in branches)) != 1 or None in [_single_input(branch) for branch in branches]:
+            continue
+        conv_configs = [branch['config'] for branch in branches]
+        if not all(tuple(c['strides']) == (1, 1) and tuple(c['dilation_rate']) == (1, 1) and c['padding'] == 'same'
+                   and c.get('groups', 1) == 1 and c['filters'] == conv_configs[0]['filters']
+                   and all(k % 2 == 1 for k in c['kernel_size']) for c in conv_configs):
+            continue
+        main = max(branches, key=lambda branch: np.prod(branch['config']['kernel_size']))
+        main['config']['kernel_size'] = (max(c['kernel_size'][0] for c in conv_configs), max(c['kernel_size'][1] for c in conv_configs))
+        main['config']['use_bias'] = True
+        merged[main['name']] = names
+        for branch in branches:
+            if branch is not main:
+                _remove(refs, removed, branch)
+        _remove(refs, removed, layer)
+        _rename(refs, layer['name'], main['name'])
+    config['layers'] = [layer for layer in config['layers'] if layer['name'] not in removed]
+
+    if not folded and not merged:
+        return model
+
+    def conv_weights(name):
+        layer = model.get_layer(name)
+        weights = layer.get_weights()
+        kernel, bias = weights[0], weights[1] if len(weights) > 1 else None
+        if name in folded:
+            kernel, bias = fold_bn(kernel, bias, *_bn_params(folded[name]), depthwise=type(layer).__name__ == 'DepthwiseConv2D')
+        elif bias is None:
+            bias = np.zeros(kernel.shape[-1], np.float32)
+        return kernel, bias
+
+    new_layers = {}
+    for name in list(folded) + list(merged):
+        if name in merged:
+            kernels, biases = zip(*[conv_weights(branch) for branch in merged[name]])
+            weights = merge_kernels(kernels, biases)
+        else:
+            weights = conv_weights(name)
+        # 权重随后由set_weights写入，不需要随机初始化(随机初始化占了改写的大部分时间)
+        layer_config = {key: 'zeros' if key.endswith('_initializer') else value for key, value in layers[name]['config'].items()}
+        new_layers[name] = type(model.get_layer(name)).from_config(layer_config), list(weights)
+    fused = rebuild_model(model, config, new_layers)
+    from .prune_graph import remove_channels
+    fused, removed = remove_channels(fused)
+    message = 'fused {} BatchNormalization layers and {} RepConv blocks'.format(len(folded), len(merged))
+    if removed:
+        message += ', removed {} pruned channels'.format(removed)
+    if verify_shape is not None:
+        h, w = verify_shape
+        image_data = tf.random.stateless_uniform([1, h, w, 3], seed=[0, 0])
+        errors = relative_error(tf.nest.flatten(model(image_data, training=False)), tf.nest.flatten(fused(image_data, training=False)))
+        if max(errors) > rtol:
+            warnings.warn('fused model differs from the original (relative error {:.2e}), using the original model'.format(max(errors)))
+            return model
+        message += ', max relative error {:.2e}'.format(max(errors))
+    print(message)
+    return fused
@@ -0,0 +1,32 @@
+import importlib
+import sys
+
+
+def lazy_exports(package, names=None, submodules=None):
+    '''
+    包的__init__按需导入(PEP 562)：导入包或者其中的推理模块时不再连带导入网络结构、训练代码以及tensorflow，
+    第一次访问某个名称时才导入对应的子模块
+    package：包名，即__init__中的__name__
+    names：{名称: (子模块, 属性)}，对应原来的`from .x import a as b`
+    submodules：{子模块: [名称, ...]}，对应原来的`from .x import *`，同名时后面的子模块优先(与依次import *相同)
+    没有登记的名称直接AttributeError，不导入任何子模块(hasattr以及`from 包 import 子模块`不会导入tensorflow)
+    返回值：模块级的__getattr__以及__dir__
+    '''
+    exports = {}
+    for module, attrs in (submodules or {}).items():
+        exports.update((attr, (module, attr)) for attr in attrs)
+    exports.update(names or {})
+
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(package, name))
+        module, attr = exports[name]
+        value = getattr(importlib.import_module(module, package), attr)
+        # 之后的访问不再经过__getattr__
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__
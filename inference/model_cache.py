@@ -0,0 +1,51 @@
+import json
+import os
+
+# 缓存格式变化时加1，旧的缓存不再使用
+CACHE_VERSION = 1
+CACHE_META = 'inference_cache.json'
+
+
+def cache_path(weights):
+    '''
+    .h5权重对应的推理缓存目录(SavedModel)：voc.h5 -> voc_inference/
+    '''
+    return os.path.splitext(os.path.abspath(os.path.expanduser(weights)))[0] + '_inference'
+
+
+def cache_key(weights, **config):
+    '''
+    缓存的有效条件：权重文件(路径、大小、修改时间)以及影响计算图的配置(输入尺寸、类别数、phi、letterbox_image等)
+    '''
+    weights = os.path.abspath(os.path.expanduser(weights))
+    stat = os.stat(weights)
+    key = dict(config, weights=weights, size=stat.st_size, mtime=stat.st_mtime, version=CACHE_VERSION)
+    # 与写入json之后再读出的结果一致(tuple变为list等)
+    return json.loads(json.dumps(key))
+
+
+def read_cache_key(path):
+    try:
+        with open(os.path.join(path, CACHE_META), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(path, key):
+    '''
+    缓存存在并且与当前的权重以及配置一致
+    '''
+    return read_cache_key(path) == key
+
+
+def is_cache(path):
+    '''
+    path是否为推理缓存目录，可以直接作为--model加载
+    '''
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, CACHE_META))
+
+
+def write_cache_key(path, key):
+    with open(os.path.join(path, CACHE_META), 'w', encoding='utf-8') as f:
+        json.dump(key, f, indent=2)
@@ -0,0 +1,44 @@
+import os
+import shutil
+import warnings
+
+import tensorflow as tf
+
+from .model_cache import write_cache_key
+from .tracing_graph import PredFrames
+
+
+def save_pred_functions(path, model, get_pred, get_pred_frames, key):
+    '''
+    把预测类的推理函数(带input_signature的tf.function)以及权重保存为SavedModel，
+    下次启动时直接加载计算图，不再构建网络、加载.h5以及trace
+    只保存权重以及推理函数，不保存keras模型本身(恢复keras对象比重新构建网络更慢)
+    get_pred_frames：build_pred_functions返回的PredFrames
+    保存失败(例如权重所在的目录只读)时只发出警告
+    '''
+    module = tf.Module()
+    module.weights = list(model.weights)
+    module.get_pred = get_pred
+    module.get_pred_frames_bgr = get_pred_frames.bgr
+    module.get_pred_frames_rgb = get_pred_frames.rgb
+    # 先写到临时目录，多个进程同时保存时不会读到不完整的缓存
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        tf.saved_model.save(module, tmp_path)
+        write_cache_key(tmp_path, key)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    except Exception as e:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        warnings.warn('failed to save the inference cache to {}: {!r}'.format(path, e))
+        return False
+    return True
+
+
+def load_pred_functions(path):
+    '''
+    加载save_pred_functions保存的缓存
+    返回值：(SavedModel对象, get_pred, get_pred_frames(frames, bgr))
+    '''
+    loaded = tf.saved_model.load(path)
+    return loaded, loaded.get_pred, PredFrames(loaded.get_pred_frames_bgr, loaded.get_pred_frames_rgb)
@@ -0,0 +1,28 @@
+def load_model(yolo_type, model_path):
+    '''
+    按算法名称通过各算法的Inference_*Model加载预测类，配置来自cfg
+    yolo_type：YOLOV4、YOLOV4-TINY、YOLOV5、YOLOV5-V61、YOLOX、YOLOV7或者YOLOV7-TINY
+    模块级函数，可以被pickle，用于多进程推理时在子进程中加载模型
+    '''
+    yolo_type = yolo_type.upper()
+    if yolo_type == 'YOLOX':
+        from cfg import YOLOXConfig
+        from yolox import Inference_YOLOXModel
+        return Inference_YOLOXModel(YOLOXConfig, model_path)
+    elif yolo_type in ('YOLOV4', 'YOLOV4-TINY'):
+        from cfg import YOLOV4Config
+        from yolov4 import Inference_YOLOV4Model
+        return Inference_YOLOV4Model(YOLOV4Config, model_path)
+    elif yolo_type == 'YOLOV5':
+        from cfg import YOLOV5Config
+        from yolov5 import Inference_YOLOV5Model
+        return Inference_YOLOV5Model(YOLOV5Config, model_path)
+    elif yolo_type == 'YOLOV5-V61':
+        from cfg import YOLOV5Config
+        from yolov5v61 import Inference_YOLOV5Model
+        return Inference_YOLOV5Model(YOLOV5Config, model_path)
+    elif yolo_type in ('YOLOV7', 'YOLOV7-TINY'):
+        from cfg import YOLOV7Config
+        from yolov7 import Inference_YOLOV7Model
+        return Inference_YOLOV7Model(YOLOV7Config, model_path)
+    raise ValueError('unsupported yolo: {}'.format(yolo_type))
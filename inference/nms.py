@@ -0,0 +1,164 @@
+import numpy as np
+
+
+def box_iou(boxes1, boxes2):
+    '''
+    boxes1：(N, 4)，boxes2：(M, 4)，格式为(top, left, bottom, right)
+    返回值：(N, M)的IoU矩阵
+    '''
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    # 逐个坐标计算(N, M)矩阵，避免生成(N, M, 2)的中间结果
+    inter_h = np.minimum(boxes1[:, 2:3], boxes2[:, 2]) - np.maximum(boxes1[:, 0:1], boxes2[:, 0])
+    inter_w = np.minimum(boxes1[:, 3:4], boxes2[:, 3]) - np.maximum(boxes1[:, 1:2], boxes2[:, 1])
+    np.maximum(inter_h, 0, out=inter_h)
+    np.maximum(inter_w, 0, out=inter_w)
+    inter = np.multiply(inter_h, inter_w, out=inter_h)
+    union = area1[:, None] + area2[None, :] - inter
+    return inter / np.maximum(union, 1e-9, out=union)
+
+
+def box_diou(boxes1, boxes2):
+    '''
+    DIoU = IoU - 中心点距离的平方 / 最小外接矩形对角线长度的平方
+    '''
+    iou = box_iou(boxes1, boxes2)
+    center_y = (boxes1[:, 0:1] + boxes1[:, 2:3]) / 2. - (boxes2[:, 0] + boxes2[:, 2]) / 2.
+    center_x = (boxes1[:, 1:2] + boxes1[:, 3:4]) / 2. - (boxes2[:, 1] + boxes2[:, 3]) / 2.
+    enclose_h = np.maximum(boxes1[:, 2:3], boxes2[:, 2]) - np.minimum(boxes1[:, 0:1], boxes2[:, 0])
+    enclose_w = np.maximum(boxes1[:, 3:4], boxes2[:, 3]) - np.minimum(boxes1[:, 1:2], boxes2[:, 1])
+    center_distance = np.square(center_y) + np.square(center_x)
+    enclose_diagonal = np.square(enclose_h) + np.square(enclose_w)
+    return iou - center_distance / np.maximum(enclose_diagonal, 1e-9)
+
+
+def _greedy_nms(boxes, scores, iou_threshold, max_boxes, overlap, block_size):
+    '''
+    分块的贪心非极大值抑制：按置信度排序后每次处理block_size个检测框，
+    先与已保留的检测框整体比较，再在块内通过一次计算好的重叠矩阵逐个抑制，
+    保留的数量达到max_boxes后提前结束
+    '''
+    order = np.argsort(-scores, kind='stable')
+    sorted_boxes = boxes[order]
+    keep = np.empty(min(len(order), max_boxes), dtype=np.int64)
+    num_keep = 0
+    for start in range(0, len(order), block_size):
+        block = sorted_boxes[start:start + block_size]
+        candidates = np.arange(len(block))
+        if num_keep > 0:
+            suppressed = np.any(overlap(block, sorted_boxes[keep[:num_keep]]) > iou_threshold, axis=1)
+            candidates = candidates[~suppressed]
+        if len(candidates) == 0:
+            continue
+        suppress = overlap(block[candidates], block[candidates]) > iou_threshold
+        alive = np.ones(len(candidates), dtype=bool)
+        for i in range(len(candidates)):
+            if not alive[i]:
+                continue
+            keep[num_keep] = start + candidates[i]
+            num_keep += 1
+            if num_keep == len(keep):
+                return order[keep]
+            alive[i + 1:] &= ~suppress[i, i + 1:]
+    return order[keep[:num_keep]]
+
+
+def _soft_nms(boxes, scores, max_boxes, sigma, score_threshold):
+    '''
+    高斯soft-nms：每次取置信度最高的检测框，其余检测框的置信度乘以exp(-iou^2 / sigma)，
+    置信度低于score_threshold的检测框被移除
+    '''
+    index = np.arange(len(scores))
+    scores = np.array(scores, dtype=np.float32)
+    keep = []
+    keep_scores = []
+    while len(keep) < max_boxes and len(scores) > 0:
+        best = np.argmax(scores)
+        if scores[best] < score_threshold:
+            break
+        keep.append(index[best])
+        keep_scores.append(scores[best])
+        iou = box_iou(boxes[best:best + 1], boxes)[0]
+        scores = scores * np.exp(-np.square(iou) / sigma)
+        scores[best] = -1.
+        alive = scores >= score_threshold
+        boxes, scores, index = boxes[alive], scores[alive], index[alive]
+    return np.array(keep, dtype=np.int64), np.array(keep_scores, dtype=np.float32)
+
+
+def nms(boxes, scores, iou_threshold=0.5, max_boxes=None, method='nms', sigma=0.5, score_threshold=0., block_size=512):
+    '''
+    单类别非极大值抑制
+    boxes：(N, 4)，scores：(N,)
+    method：'nms'为IoU大于iou_threshold即抑制，与tf.image.non_max_suppression一致；
+            'diou'使用DIoU代替IoU；'soft'为高斯soft-nms，使用sigma以及score_threshold
+    返回值：保留的检测框下标以及对应的置信度，按置信度从高到低排列
+    '''
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if max_boxes is None:
+        max_boxes = len(scores)
+    if len(scores) == 0 or max_boxes <= 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.float32)
+    if method == 'soft':
+        return _soft_nms(boxes, scores, max_boxes, sigma, score_threshold)
+    if method == 'nms':
+        keep = _greedy_nms(boxes, scores, iou_threshold, max_boxes, box_iou, block_size)
+    elif method == 'diou':
+        keep = _greedy_nms(boxes, scores, iou_threshold, max_boxes, box_diou, block_size)
+    else:
+        raise ValueError('Unsupported nms method: {}'.format(method))
+    return keep, scores[keep]
+
+
+def select_candidates(box_scores, score_threshold, pre_nms_topk=None):
+    '''
+    非极大值抑制之前的候选框筛选：保留最大类别置信度不低于score_threshold的检测框，
+    数量超过pre_nms_topk时只保留置信度最高的pre_nms_topk个
+    box_scores：(N, num_classes)
+    返回值：候选框下标
+    '''
+    max_scores = np.max(box_scores, axis=-1)
+    index = np.flatnonzero(max_scores >= score_threshold)
+    if pre_nms_topk is not None and len(index) > pre_nms_topk:
+        index = index[np.argpartition(-max_scores[index], pre_nms_topk - 1)[:pre_nms_topk]]
+    return index
+
+
+def multiclass_nms(boxes, box_scores, score_threshold, iou_threshold, max_boxes=100, method='nms', sigma=0.5):
+    '''
+    类别相关的非极大值抑制，NumPy实现，用于onnx等不依赖tensorflow的解码
+    boxes：(N, 4)，box_scores：(N, num_classes)
+    max_boxes：每个类别最多保留的检测框数量
+    返回值：boxes、scores、classes，按置信度从高到低排列
+    '''
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    box_scores = np.asarray(box_scores, dtype=np.float32)
+    # 没有候选框时box_scores为(0, num_classes)，reshape(0, -1)无法推断类别数
+    box_scores = box_scores.reshape(len(boxes), -1) if len(boxes) else box_scores.reshape(0, box_scores.shape[-1] if box_scores.ndim > 1 else 1)
+    box_index, class_index = np.nonzero(box_scores >= score_threshold)
+    candidate_scores = box_scores[box_index, class_index]
+
+    # 按类别分组，避免每个类别都对全部检测框做一次mask
+    order = np.argsort(class_index, kind='stable')
+    box_index, class_index, candidate_scores = box_index[order], class_index[order], candidate_scores[order]
+    classes, starts = np.unique(class_index, return_index=True)
+    ends = np.append(starts[1:], len(class_index))
+
+    # 预先分配输出，每个类别最多max_boxes个
+    capacity = min(len(box_index), len(classes) * max_boxes)
+    boxes_out = np.empty((capacity, 4), dtype=np.float32)
+    scores_out = np.empty((capacity,), dtype=np.float32)
+    classes_out = np.empty((capacity,), dtype=np.int32)
+    num = 0
+    for c, start, end in zip(classes, starts, ends):
+        class_boxes = boxes[box_index[start:end]]
+        keep, keep_scores = nms(class_boxes, candidate_scores[start:end], iou_threshold, max_boxes,
+                                method=method, sigma=sigma, score_threshold=score_threshold)
+        boxes_out[num:num + len(keep)] = class_boxes[keep]
+        scores_out[num:num + len(keep)] = keep_scores
+        classes_out[num:num + len(keep)] = c
+        num += len(keep)
+
+    order = np.argsort(-scores_out[:num], kind='stable')
+    return boxes_out[:num][order], scores_out[:num][order], classes_out[:num][order]
@@ -0,0 +1,285 @@
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .detections import Detections
+
+
+# 队列已满时的处理方式：
+# block：阻塞等待(背压)，用于视频文件，不丢帧
+# drop_oldest：丢弃队列中最旧的帧，用于rtsp等实时流，始终处理最新的画面
+# drop_newest：丢弃当前帧
+DROP_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+# 结束标记，沿着各个阶段依次传递
+_END = object()
+
+
+def is_live_source(source):
+    '''
+    摄像头编号以及rtsp/rtmp等实时流，画面不会等待推理，队列已满时通常丢弃最旧的帧
+    '''
+    return str(source).isnumeric() or str(source).lower().startswith(('rtsp://', 'rtmp://'))
+
+
+def put_with_policy(q, item, policy='block', stop_event=None):
+    '''
+    按policy放入有界队列，返回被丢弃的元素数量
+    '''
+    assert policy in DROP_POLICIES, 'drop policy must be one of {}'.format(DROP_POLICIES)
+    if policy == 'block':
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return 0
+            except queue.Full:
+                if stop_event is not None and stop_event.is_set():
+                    return 1
+    if policy == 'drop_newest':
+        try:
+            q.put_nowait(item)
+            return 0
+        except queue.Full:
+            return 1
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class StageStats(object):
+    '''
+    单个阶段的统计：处理的帧数、忙碌时间(不含等待队列的时间)以及丢弃的帧数
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, num_items, seconds):
+        with self._lock:
+            self.items += num_items
+            self.busy += seconds
+
+    def drop(self, num_items=1):
+        with self._lock:
+            self.dropped += num_items
+
+    def __str__(self):
+        ms = self.busy / self.items * 1000 if self.items > 0 else 0.
+        fps = self.items / self.busy if self.busy > 0 else 0.
+        text = '{:<12s} {:6d} frames, {:8.2f} ms/frame, {:8.2f} frames/sec busy'.format(self.name, self.items, ms, fps)
+        if self.dropped > 0:
+            text += ', {} dropped'.format(self.dropped)
+        return text
+
+
+class PipelineStats(object):
+    '''
+    流水线的统计：各阶段的耗时、端到端延迟(从读取到写出)以及整体吞吐
+    '''
+    def __init__(self, stage_names):
+        self.stages = {name: StageStats(name) for name in stage_names}
+        self.latencies = []
+        self.start_time = None
+        self.end_time = None
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    @property
+    def frames(self):
+        return len(self.latencies)
+
+    @property
+    def fps(self):
+        if self.start_time is None or self.end_time is None or self.end_time <= self.start_time:
+            return 0.
+        return self.frames / (self.end_time - self.start_time)
+
+    def __str__(self):
+        lines = [str(stage) for stage in self.stages.values()]
+        if self.frames > 0:
+            latencies = np.array(self.latencies) * 1000
+            lines.append('end-to-end   {:6d} frames, {:.2f} fps, latency mean {:.2f} ms, p50 {:.2f} ms, p95 {:.2f} ms'.format(
+                self.frames, self.fps, latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95)))
+        return '\n'.join(lines)
+
+
+class VideoPipeline(object):
+    '''
+    流水线视频推理：读取、推理、后处理以及写出分别在各自的线程中运行，阶段之间使用有界队列连接，
+    读取视频时不再等待推理，推理时也不再等待解码以及写出
+    model：预测类，需要提供forward_frames、decode_batch以及draw_frame
+    batch_size：推理阶段每次最多合并的帧数，只合并队列中已有的帧，不额外等待
+    queue_size：各个队列的容量
+    drop_policy：读取队列已满时的处理方式，详见DROP_POLICIES；其余队列始终阻塞，形成背压
+    on_frame：写出阶段对每一帧的回调on_frame(index, frame, detections)，返回False时停止
+    '''
+    STAGES = ('capture', 'infer', 'postprocess', 'write')
+
+    def __init__(self, model, batch_size=1, queue_size=8, drop_policy='block', draw=True, on_frame=None):
+        assert batch_size >= 1, 'batch_size must be greater than or equal to 1.'
+        assert drop_policy in DROP_POLICIES, 'drop policy must be one of {}'.format(DROP_POLICIES)
+        self.model = model
+        self.batch_size = batch_size
+        self.drop_policy = drop_policy
+        self.draw = draw
+        self.on_frame = on_frame
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.output_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.stats = PipelineStats(self.STAGES)
+        self._errors = []
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self.stop_event.set()
+
+    def _put(self, q, item):
+        put_with_policy(q, item, 'block', self.stop_event)
+
+    def _get(self, q):
+        while True:
+            if self.stop_event.is_set():
+                return _END
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _capture(self, capture):
+        stats = self.stats['capture']
+        index = 0
+        while not self.stop_event.is_set():
+            t1 = time.time()
+            ref, frame = capture.read()
+            if not ref or frame is None:
+                break
+            stats.add(1, time.time() - t1)
+            dropped = put_with_policy(self.frame_queue, (index, frame, t1), self.drop_policy, self.stop_event)
+            if dropped > 0:
+                stats.drop(dropped)
+            index += 1
+        self._put(self.frame_queue, _END)
+
+    def _infer(self):
+        stats = self.stats['infer']
+        while True:
+            item = self._get(self.frame_queue)
+            if item is _END:
+                break
+            batch = [item]
+            end = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _END:
+                    end = True
+                    break
+                if item[1].shape != batch[0][1].shape:
+                    # 尺寸不同的帧不能合并为一个batch
+                    self._put(self.output_queue, self._forward(batch, stats))
+                    batch = []
+                batch.append(item)
+            self._put(self.output_queue, self._forward(batch, stats))
+            if end:
+                break
+        self._put(self.output_queue, _END)
+
+    def _forward(self, batch, stats):
+        t1 = time.time()
+        outputs = self.model.forward_frames(np.stack([frame for _, frame, _ in batch], axis=0), bgr=True)
+        stats.add(len(batch), time.time() - t1)
+        return batch, outputs
+
+    def _postprocess(self):
+        stats = self.stats['postprocess']
+        while True:
+            item = self._get(self.output_queue)
+            if item is _END:
+                break
+            batch, outputs = item
+            t1 = time.time()
+            h, w = batch[0][1].shape[:2]
+            input_image_shapes = np.tile(np.array([[h, w]], dtype='float32'), [len(batch), 1])
+            decoded = self.model.decode_batch(outputs, input_image_shapes)
+            results = []
+            for (index, frame, t_capture), (out_boxes, out_scores, out_classes) in zip(batch, decoded):
+                detections = Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                if self.draw:
+                    frame = self.model.draw_frame(frame, detections, bgr=True)
+                results.append((index, frame, detections, t_capture))
+            stats.add(len(batch), time.time() - t1)
+            for result in results:
+                self._put(self.result_queue, result)
+        self._put(self.result_queue, _END)
+
+    def run(self, capture, writer=None, show=False, window_name='video'):
+        '''
+        capture：cv2.VideoCapture或者提供read()的对象
+        writer：cv2.VideoWriter，为空时不保存
+        show：是否使用cv2.imshow显示，按q结束；写出阶段在调用线程中运行，因此imshow在主线程中
+        返回值：PipelineStats
+        '''
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._capture, capture), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._infer,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._postprocess,), daemon=True),
+        ]
+        self.stats.start_time = time.time()
+        for thread in threads:
+            thread.start()
+        stats = self.stats['write']
+        fps = 0.
+        last = None
+        while True:
+            item = self._get(self.result_queue)
+            if item is _END:
+                break
+            index, frame, detections, t_capture = item
+            t1 = time.time()
+            if last is not None:
+                fps = (fps + 1. / max(t1 - last, 1e-6)) / 2
+            last = t1
+            if self.draw:
+                frame = cv2.putText(frame, "fps= %.2f" % fps, (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            if writer is not None:
+                writer.write(frame)
+            keep_going = True
+            if self.on_frame is not None:
+                keep_going = self.on_frame(index, frame, detections) is not False
+            if show:
+                cv2.imshow(window_name, frame)
+                if cv2.waitKey(1) == ord('q'):
+                    keep_going = False
+            t2 = time.time()
+            stats.add(1, t2 - t1)
+            self.stats.latencies.append(t2 - t_capture)
+            if not keep_going:
+                break
+        self.stats.end_time = time.time()
+        self.stop_event.set()
+        for thread in threads:
+            thread.join()
+        if len(self._errors) > 0:
+            raise self._errors[0]
+        return self.stats
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+
+# 导出时写入onnx模型metadata_props的键，标识模型内含预处理
+PREPROCESS_KEY = 'preprocess'
+CHANNEL_ORDER_KEY = 'channel_order'
+
+
+def letterbox_params(image_hw, input_shape, letterbox_image=True):
+    '''
+    与PIL的letterbox_image一致的缩放尺寸以及填充位置
+    image_hw：原图(h, w)，input_shape：网络输入(h, w)
+    返回值：(nh, nw, top, left)
+    '''
+    ih, iw = image_hw
+    h, w = input_shape
+    if not letterbox_image:
+        return h, w, 0, 0
+    scale = min(w / iw, h / ih)
+    nw = int(iw * scale)
+    nh = int(ih * scale)
+    return nh, nw, (h - nh) // 2, (w - nw) // 2
+
+
+def letterbox_uint8(frame, input_shape, letterbox_image=True):
+    '''
+    uint8的HWC图像 -> 缩放以及填充到网络输入尺寸的uint8图像(h, w, 3)，不改变通道顺序，不归一化
+    '''
+    h, w = input_shape
+    nh, nw, top, left = letterbox_params(frame.shape[:2], input_shape, letterbox_image)
+    image = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    if letterbox_image:
+        image = cv2.copyMakeBorder(image, top, h - nh - top, left, w - nw - left, cv2.BORDER_CONSTANT, value=(128, 128, 128))
+    return image
+
+
+def letterbox_numpy(frame, input_shape, letterbox_image=True, bgr=False, mean=None, std=None):
+    '''
+    uint8的HWC图像 -> 归一化后的网络输入(h, w, 3) float32，使用cv2在原图上直接缩放以及填充，
+    不经过PIL，用于不含预处理的onnx模型
+    bgr：输入为cv2读取的BGR图像时为True
+    mean、std：不为空时在除以255之后进行标准化(yolox)
+    '''
+    image = letterbox_uint8(frame, input_shape, letterbox_image)
+    if bgr:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    image_data = image.astype(np.float32)
+    image_data /= 255.
+    if mean is not None:
+        image_data -= np.array(mean, np.float32)
+        image_data /= np.array(std, np.float32)
+    return image_data
+
+
+def stack_frames(frames, input_shape, letterbox_image=True):
+    '''
+    将多帧uint8图像合并为一个batch
+    frames：(batch_size, H, W, 3)，或者尺寸不同的HWC图像列表(例如来自多路摄像头)
+    尺寸相同时直接合并；尺寸不同时先使用cv2缩放以及填充到网络输入尺寸，模型中的缩放不再改变图像，
+    解码时仍然使用原图尺寸
+    返回值：uint8的(batch_size, H, W, 3)以及每帧原图的(h, w)，(batch_size, 2)
+    '''
+    if isinstance(frames, (list, tuple)) and len(set(frame.shape for frame in frames)) > 1:
+        input_image_shapes = np.array([frame.shape[:2] for frame in frames], dtype='float32')
+        frames = np.stack([letterbox_uint8(np.asarray(frame, dtype=np.uint8), input_shape, letterbox_image)
+                           for frame in frames], axis=0)
+        return frames, input_image_shapes
+    frames = np.asarray(frames, dtype=np.uint8)
+    input_image_shapes = np.tile(np.array([frames.shape[1:3]], dtype='float32'), [len(frames), 1])
+    return frames, input_image_shapes
+
+
+def preprocess_metadata(letterbox_image=True, bgr=False):
+    '''
+    内含预处理的onnx模型的metadata_props
+    '''
+    return {
+        PREPROCESS_KEY: 'letterbox' if letterbox_image else 'resize',
+        CHANNEL_ORDER_KEY: 'bgr' if bgr else 'rgb',
+    }
+
+
+def read_onnx_preprocess(session):
+    '''
+    读取onnxruntime.InferenceSession的预处理信息，输入为uint8且带有metadata时返回
+    {'letterbox_image': bool, 'bgr': bool}，否则返回None(需要在外部预处理)
+    '''
+    if session.get_inputs()[0].type != 'tensor(uint8)':
+        return None
+    metadata = session.get_modelmeta().custom_metadata_map
+    return {
+        'letterbox_image': metadata.get(PREPROCESS_KEY, 'letterbox') == 'letterbox',
+        'bgr': metadata.get(CHANNEL_ORDER_KEY, 'rgb') == 'bgr',
+    }
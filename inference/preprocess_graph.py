@@ -0,0 +1,48 @@
+import tensorflow as tf
+
+
+def letterbox_graph(images, input_shape, letterbox_image=True, bgr=False, mean=None, std=None):
+    '''
+    计算图中的预处理：uint8的(batch_size, H, W, 3)图像 -> 归一化后的网络输入(batch_size, h, w, 3)
+    缩放尺寸以及填充位置与PIL的letterbox_image一致，同一batch内的图像尺寸需要相同
+    input_shape：网络输入(h, w)
+    bgr：输入为cv2读取的BGR图像时为True，通道翻转在计算图中完成
+    mean、std：不为空时在除以255之后进行标准化(yolox)
+    使用双线性插值，tf2onnx可以转换为onnx的Resize，与PIL的BICUBIC存在细微差异
+    '''
+    h, w = input_shape
+    images = tf.convert_to_tensor(images)
+    if bgr:
+        images = tf.reverse(images, axis=[-1])
+    images = tf.cast(images, tf.float32)
+    if letterbox_image:
+        # 使用float64计算缩放比例，与python中int(iw * scale)的取整一致
+        shape = tf.cast(tf.shape(images), tf.float64)
+        ih, iw = shape[1], shape[2]
+        scale = tf.minimum(w / iw, h / ih)
+        nw = tf.cast(tf.floor(iw * scale), tf.int32)
+        nh = tf.cast(tf.floor(ih * scale), tf.int32)
+        top = (h - nh) // 2
+        left = (w - nw) // 2
+        images = tf.image.resize(images, tf.stack([nh, nw]), method='bilinear')
+        images = tf.pad(images, [[0, 0], [top, h - nh - top], [left, w - nw - left], [0, 0]], constant_values=128.)
+    else:
+        images = tf.image.resize(images, [h, w], method='bilinear')
+    images = images / 255.
+    if mean is not None:
+        images = (images - tf.constant(mean, tf.float32)) / tf.constant(std, tf.float32)
+    images.set_shape([None, h, w, 3])
+    return images
+
+
+def build_preprocess_model(model, input_shape, letterbox_image=True, bgr=False, mean=None, std=None):
+    '''
+    在模型之前加入预处理，输入为uint8的(batch_size, H, W, 3)图像，用于导出onnx或SavedModel，
+    推理时只需要传输uint8图像
+    '''
+    inputs = tf.keras.layers.Input([None, None, 3], dtype='uint8', name='images')
+    image_data = tf.keras.layers.Lambda(
+        lambda x: letterbox_graph(x, input_shape, letterbox_image, bgr=bgr, mean=mean, std=std),
+        name='preprocess')(inputs)
+    outputs = model(image_data)
+    return tf.keras.models.Model(inputs, outputs)
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PriorCache(object):
+    '''
+    解码所需先验信息的LRU缓存，视频或文件夹推理时输入尺寸不变，只在第一帧构建网格
+    maxsize：最多缓存的输入尺寸数量，多分辨率推理时淘汰最久未使用的
+    '''
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        self.misses += 1
+        value = build()
+        self._cache[key] = value
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+
+_prior_cache = PriorCache()
+
+
+def static_grid_shapes(outputs):
+    '''
+    各特征层的(h, w)，存在未知维度(如计算图中的动态输入)时返回None
+    '''
+    grid_shapes = tuple(tuple(output.shape[1:3]) for output in outputs)
+    for grid_shape in grid_shapes:
+        if None in grid_shape:
+            return None
+    return grid_shapes
+
+
+def _build_anchor_priors(grid_shapes, anchors, anchor_mask):
+    priors = []
+    for grid_shape, mask in zip(grid_shapes, anchor_mask):
+        num_anchors = len(mask)
+        grid_x = np.tile(np.reshape(np.arange(0, stop=grid_shape[1]), [1, -1, 1, 1]), [grid_shape[0], 1, num_anchors, 1])
+        grid_y = np.tile(np.reshape(np.arange(0, stop=grid_shape[0]), [-1, 1, 1, 1]), [1, grid_shape[1], num_anchors, 1])
+        grid = np.reshape(np.concatenate([grid_x, grid_y], axis=-1), [-1, 2])
+        anchors_tensor = np.reshape(anchors[list(mask)], [1, 1, num_anchors, 2])
+        anchors_tensor = np.reshape(np.tile(anchors_tensor, [grid_shape[0], grid_shape[1], 1, 1]), [-1, 2])
+        grid_size = np.ones_like(grid) * np.array(grid_shape[::-1])
+        priors.append(np.concatenate([grid, grid_size, anchors_tensor], axis=-1))
+    priors = np.concatenate(priors, axis=0).astype(np.float32)
+    priors.setflags(write=False)
+    return priors
+
+
+def get_anchor_priors(grid_shapes, anchors, anchor_mask):
+    '''
+    基于先验框的解码(yolov4、yolov5、yolov7)所需的先验信息(num_boxes, 6)：网格坐标、网格尺寸以及先验框宽高，
+    顺序与各特征层reshape为(h * w * num_anchors, 5 + num_classes)后拼接的顺序一致
+    grid_shapes：各特征层的(h, w)
+    按(grid_shapes, anchors, anchor_mask)缓存，返回值只读
+    '''
+    anchors = np.array(anchors, np.float32).reshape(-1, 2)
+    grid_shapes = tuple(tuple(int(x) for x in grid_shape) for grid_shape in grid_shapes)
+    anchor_mask = tuple(tuple(int(x) for x in mask) for mask in anchor_mask)
+    key = ('anchor', grid_shapes, anchors.tobytes(), anchor_mask)
+    return _prior_cache.get(key, lambda: _build_anchor_priors(grid_shapes, anchors, anchor_mask))
+
+
+def _build_stride_priors(grid_shapes, input_shape):
+    priors = []
+    for grid_shape in grid_shapes:
+        grid_x, grid_y = np.meshgrid(np.arange(grid_shape[1]), np.arange(grid_shape[0]))
+        grid = np.reshape(np.stack((grid_x, grid_y), 2), (-1, 2))
+        stride = np.ones_like(grid[:, :1]) * input_shape[0] / grid_shape[0]
+        priors.append(np.concatenate([grid, stride], axis=-1))
+    priors = np.concatenate(priors, axis=0).astype(np.float32)
+    priors.setflags(write=False)
+    return priors
+
+
+def get_stride_priors(grid_shapes, input_shape):
+    '''
+    anchor free解码(yolox)所需的先验信息(num_boxes, 3)：网格坐标以及步长
+    按(grid_shapes, input_shape)缓存，返回值只读
+    '''
+    grid_shapes = tuple(tuple(int(x) for x in grid_shape) for grid_shape in grid_shapes)
+    input_shape = tuple(int(x) for x in input_shape)
+    key = ('stride', grid_shapes, input_shape)
+    return _prior_cache.get(key, lambda: _build_stride_priors(grid_shapes, input_shape))
+
+
+def prior_cache_info():
+    '''
+    返回(命中次数, 未命中次数, 当前缓存数量)
+    '''
+    return _prior_cache.hits, _prior_cache.misses, len(_prior_cache)
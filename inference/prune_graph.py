@@ -0,0 +1,155 @@
+import numpy as np
+
+from .fuse import FOLDABLE_NORMS
+
+
+# 输入为0时输出仍为0的逐元素激活，以及不改变通道的层：被剪掉的通道经过这些层之后仍然恒为0
+ZERO_ACTIVATIONS = ['SiLU', 'Mish', 'LeakyReLU', 'ReLU']
+ZERO_ACTIVATION_FUNCTIONS = ['linear', 'relu', 'swish', 'silu', 'elu', 'gelu', 'tanh']
+CHANNEL_PASS = ['ZeroPadding2D', 'UpSampling2D', 'MaxPooling2D']
+
+
+def _passes_zero(layer):
+    if layer['class_name'] in ZERO_ACTIVATIONS or layer['class_name'] in CHANNEL_PASS:
+        return True
+    return layer['class_name'] == 'Activation' and layer['config'].get('activation') in ZERO_ACTIVATION_FUNCTIONS
+
+
+def _is_slimmable_conv(layer):
+    # 可以按输入通道以及输出通道切片的卷积
+    config = layer['config']
+    return (layer['class_name'] == 'Conv2D' and config.get('groups', 1) == 1 and config.get('activation', 'linear') == 'linear'
+            and len(layer['inbound_nodes']) == 1 and len(layer['inbound_nodes'][0]) == 1)
+
+
+def _channels(model, ref):
+    shape = model.get_layer(ref[0]).get_output_shape_at(ref[1])
+    return (shape[ref[2]] if isinstance(shape, list) else shape)[-1]
+
+
+def _propagate(model, config, units):
+    '''
+    按计算图传播每个张量中恒为0的通道
+    units：输出层名 -> (卷积层名, keep)，keep为bool数组，False表示该卷积(以及其后的BN)输出恒为0的通道
+    返回值：(张量引用 -> (keep或者None, 来源卷积的集合), 需要保留全部通道的卷积)
+    恒为0的通道进入Add、Lambda、注意力模块、BN(不在卷积之后)或者作为模型输出时不能删除，其来源卷积保留全部通道
+    '''
+    masks = {}
+    blocked = set()
+
+    def entry(ref):
+        return masks.get(tuple(ref[:3]), (None, frozenset()))
+
+    for layer in config['layers']:
+        name = layer['name']
+        for node_index, node in enumerate(layer['inbound_nodes']):
+            entries = [entry(ref) for ref in node]
+            output = (None, frozenset())
+            if name in units:
+                conv_name, keep = units[name]
+                output = (keep, frozenset([conv_name]))
+            elif _is_slimmable_conv(layer):
+                # 卷积删除对应的输入通道
+                pass
+            elif _passes_zero(layer) and len(entries) == 1:
+                output = entries[0]
+            elif layer['class_name'] == 'Concatenate' and layer['config'].get('axis') in (-1, 3):
+                if any(keep is not None for keep, _ in entries):
+                    keep = np.concatenate([keep if keep is not None else np.ones(_channels(model, ref), bool)
+                                           for (keep, _), ref in zip(entries, node)])
+                    output = (keep, frozenset().union(*[sources for _, sources in entries]))
+            else:
+                for keep, sources in entries:
+                    if keep is not None and not keep.all():
+                        blocked |= sources
+            masks[(name, node_index, 0)] = output
+    for ref in config['output_layers']:
+        keep, sources = entry(ref)
+        if keep is not None and not keep.all():
+            blocked |= sources
+    return masks, blocked
+
+
+def _solve(model, config, units):
+    # 不断去掉不能删除通道的卷积，直到剩下的卷积都可以删除
+    blocked = set()
+    while True:
+        active = {name: unit for name, unit in units.items() if unit[0] not in blocked}
+        masks, violations = _propagate(model, config, active)
+        if not violations:
+            return masks, active
+        blocked |= violations
+
+
+def prunable_units(model):
+    '''
+    可以做通道剪枝的卷积：卷积层名 -> 其后的BN层名(没有BN时为None)
+    这些卷积的输出通道置0(卷积核以及BN的gamma、beta)之后，remove_channels可以在折叠BN之后把这些通道连同
+    下游卷积对应的输入通道一起删除
+    '''
+    config = model.get_config()
+    layers = {layer['name']: layer for layer in config['layers']}
+    consumers = {}
+    for layer in config['layers']:
+        for node in layer['inbound_nodes']:
+            for ref in node:
+                consumers.setdefault(ref[0], []).append(layer['name'])
+    units = {}
+    for layer in config['layers']:
+        if not _is_slimmable_conv(layer) or layer['config']['filters'] < 2:
+            continue
+        output = layer['name']
+        users = consumers.get(output, [])
+        if len(users) == 1 and layers[users[0]]['class_name'] in FOLDABLE_NORMS:
+            output = users[0]
+        keep = np.ones(layer['config']['filters'], bool)
+        keep[0] = False
+        units[output] = (layer['name'], keep)
+    _, active = _solve(model, config, units)
+    return {conv_name: (output if output != conv_name else None) for output, (conv_name, _) in active.items()}
+
+
+def remove_channels(model):
+    '''
+    删除卷积中输出恒为0的通道(卷积核以及bias都为0，通道剪枝之后折叠BN得到)，以及下游卷积对应的输入通道，
+    激活、padding、池化、上采样以及Concatenate不改变这些通道为0，原模型的输出不变，FLOPs以及参数量下降
+    用于fuse_model折叠BN之后；没有可以删除的通道时直接返回原模型
+    返回值：(模型, 删除的通道数)
+    '''
+    from .fuse_graph import rebuild_model
+    config = model.get_config()
+    units = {}
+    for layer in config['layers']:
+        if not _is_slimmable_conv(layer):
+            continue
+        weights = model.get_layer(layer['name']).get_weights()
+        dead = np.abs(weights[0]).max(axis=(0, 1, 2)) == 0
+        if len(weights) > 1:
+            dead &= weights[1] == 0
+        if dead.any():
+            keep = ~dead
+            # 至少保留一个通道
+            keep[np.argmin(dead)] = True
+            units[layer['name']] = (layer['name'], keep)
+    if not units:
+        return model, 0
+    masks, active = _solve(model, config, units)
+    if not active:
+        return model, 0
+    new_layers = {}
+    for layer in config['layers']:
+        if not _is_slimmable_conv(layer):
+            continue
+        name = layer['name']
+        in_keep = masks.get(tuple(layer['inbound_nodes'][0][0][:3]), (None,))[0]
+        out_keep = active[name][1] if name in active else None
+        if (in_keep is None or in_keep.all()) and out_keep is None:
+            continue
+        weights = model.get_layer(name).get_weights()
+        in_keep = np.ones(weights[0].shape[2], bool) if in_keep is None else in_keep
+        out_keep = np.ones(weights[0].shape[3], bool) if out_keep is None else out_keep
+        weights = [weights[0][:, :, in_keep][..., out_keep]] + [bias[out_keep] for bias in weights[1:]]
+        layer['config']['filters'] = int(out_keep.sum())
+        new_layers[name] = type(model.get_layer(name)).from_config(layer['config']), weights
+    removed = int(sum((~keep).sum() for _, keep in active.values()))
+    return rebuild_model(model, config, new_layers), removed
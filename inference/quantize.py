@@ -0,0 +1,108 @@
+import random
+import shutil
+import tempfile
+import warnings
+
+import numpy as np
+from PIL import Image
+
+from .utils import cvtColor
+
+
+# TFLite的量化方式：dynamic为权重int8、激活float；int8为全整数(需要校准数据)；fp16为权重float16
+TFLITE_QUANTIZE = ['dynamic', 'int8', 'fp16']
+# onnx按通道量化需要的最低opset(DequantizeLinear的axis属性)
+PER_CHANNEL_OPSET = 13
+
+
+def calibration_images(annotation_path, num_samples=100, seed=0):
+    '''
+    从训练使用的标注文件(train.txt，每行为`图像路径 x1,y1,x2,y2,c ...`)中随机抽取num_samples张图像，用于量化校准
+    返回值：PIL.Image的列表(RGB)
+    '''
+    with open(annotation_path, encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    lines = random.Random(seed).sample(lines, min(num_samples, len(lines)))
+    return [cvtColor(Image.open(line.split()[0])) for line in lines]
+
+
+def calibration_feeds(session, images, preprocess):
+    '''
+    按onnx模型的输入生成校准数据，每张图像一个batch
+    session：fp32模型的onnxruntime.InferenceSession
+    preprocess：预测类的preprocess，返回(image, image_data, input_image_shape)
+    输入为uint8(导出时使用--preprocess)时直接传入原图，end2end模型另外传入原图尺寸
+    '''
+    from .preprocess import read_onnx_preprocess
+    inputs = session.get_inputs()
+    onnx_preprocess = read_onnx_preprocess(session)
+    feeds = []
+    for image in images:
+        image, image_data, input_image_shape = preprocess(image)
+        if onnx_preprocess is not None:
+            image_data = np.array(image, dtype=np.uint8)
+            if onnx_preprocess['bgr']:
+                image_data = np.ascontiguousarray(image_data[..., ::-1])
+        feed = {inputs[0].name: image_data[None]}
+        if len(inputs) > 1:
+            feed[inputs[1].name] = input_image_shape[None].astype(np.float32)
+        feeds.append(feed)
+    return feeds
+
+
+def quantize_onnx(onnx_path, save_path, images, preprocess, per_channel=True):
+    '''
+    onnx静态量化(QDQ格式)：权重以及激活为int8，按校准数据统计激活的范围
+    images：校准图像(见calibration_images)，preprocess：预测类的preprocess
+    per_channel：权重按输出通道量化，DequantizeLinear的axis属性需要opset >= 13，更低的opset按整个张量量化
+    保留原模型的metadata_props(预处理、end2end等)，预测类可以直接加载量化后的模型
+    '''
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self, feeds):
+            self.feeds = iter(feeds)
+
+        def get_next(self):
+            return next(self.feeds, None)
+
+    opset = onnx_opset(onnx_path)
+    if per_channel and opset < PER_CHANNEL_OPSET:
+        warnings.warn('per-channel int8 needs opset >= {} (model has opset {}), quantizing per tensor; export with --opset {} '
+                      'for per-channel weights'.format(PER_CHANNEL_OPSET, opset, PER_CHANNEL_OPSET))
+        per_channel = False
+    session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    feeds = calibration_feeds(session, images, preprocess)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        # 量化之前进行形状推断以及计算图优化，失败时直接量化原模型
+        model_input = onnx_path
+        try:
+            quant_pre_process(onnx_path, tmp_dir + '/pre.onnx', skip_symbolic_shape=True)
+            model_input = tmp_dir + '/pre.onnx'
+        except Exception as e:
+            warnings.warn('quantization pre-processing failed, quantizing the original model: {!r}'.format(e))
+        quantize_static(model_input, save_path, Reader(feeds), quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                        activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    metadata = {prop.key: prop.value for prop in onnx.load(onnx_path, load_external_data=False).metadata_props}
+    if len(metadata) > 0:
+        model_proto = onnx.load(save_path)
+        onnx.helper.set_model_props(model_proto, metadata)
+        onnx.save(model_proto, save_path)
+    # 量化后的模型必须能被onnxruntime加载
+    onnxruntime.InferenceSession(save_path, providers=['CPUExecutionProvider'])
+    print('int8 onnx model saved to {} (opset {}, {})'.format(save_path, opset, 'per-channel' if per_channel else 'per-tensor'))
+
+
+def onnx_opset(onnx_path):
+    '''
+    onnx模型默认域(ai.onnx)的opset
+    '''
+    import onnx
+    model_proto = onnx.load(onnx_path, load_external_data=False)
+    return max([opset.version for opset in model_proto.opset_import if opset.domain in ('', 'ai.onnx')] or [0])
@@ -0,0 +1,86 @@
+import numpy as np
+import tensorflow as tf
+
+from .quantize import TFLITE_QUANTIZE
+
+
+def _tflite_converter(func, model, quantize=None, images=None, preprocess=None):
+    assert quantize is None or quantize in TFLITE_QUANTIZE, 'unsupported quantization: {}'.format(quantize)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([func.get_concrete_function()], model)
+    if quantize is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    if quantize == 'int8':
+        assert images, 'int8 quantization needs calibration images'
+
+        def representative_dataset():
+            for image in images:
+                _, image_data, _ = preprocess(image)
+                yield [np.asarray(image_data, np.float32)[None]]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter
+
+
+def export_tflite(model, input_shape, save_path, quantize=None, images=None, preprocess=None):
+    '''
+    导出TFLite模型，输入固定为网络输入尺寸(batch_size, h, w, 3)，输出与keras模型相同
+    quantize：None为float32；dynamic、int8或者fp16，见TFLITE_QUANTIZE
+    int8为全整数量化，images为校准图像(见calibration_images)，preprocess为预测类的preprocess；
+    输入输出保持float32，预测类加载时不需要区分是否量化
+    '''
+    h, w = input_shape
+    func = tf.function(lambda x: model(x, training=False), input_signature=[tf.TensorSpec([None, h, w, 3], tf.float32)])
+    converter = _tflite_converter(func, model, quantize, images, preprocess)
+    with open(save_path, 'wb') as f:
+        f.write(converter.convert())
+    print('{} tflite model saved to {}'.format(quantize or 'float32', save_path))
+
+
+def export_end2end_tflite(model, decode_batch, input_shape, save_path, quantize=None):
+    '''
+    导出内含解码以及非极大值抑制的TFLite模型(export.py --end2end --save_tflite)，只使用TFLite内置算子，
+    可以用tflite_runtime(XNNPACK)运行；非极大值抑制见batched_nms_tflite
+    输入：images(1, h, w, 3)为预处理后的图像、image_shape(1, 2)为原图的(h, w)，batch固定为1，
+    TFLiteBackend逐张图像运行；输出：num_dets、boxes、scores、classes，见build_end2end_model
+    quantize：None、dynamic或者fp16，非极大值抑制不能全整数量化
+    '''
+    from .batched_nms import tflite_nms
+    from .end2end import END2END_OUTPUTS
+    from .end2end_graph import build_end2end_model
+    assert quantize != 'int8', 'end2end tflite models do not support int8 quantization'
+    h, w = input_shape
+    with tflite_nms():
+        end2end_model = build_end2end_model(model, decode_batch, input_shape, batch_size=1)
+
+        def end2end(images, image_shape):
+            return dict(zip(END2END_OUTPUTS, end2end_model([images, image_shape], training=False)))
+        func = tf.function(end2end, input_signature=[tf.TensorSpec([1, h, w, 3], tf.float32), tf.TensorSpec([1, 2], tf.float32)])
+        converter = _tflite_converter(func, end2end_model, quantize)
+        tflite_model = converter.convert()
+    with open(save_path, 'wb') as f:
+        f.write(tflite_model)
+    print('{} end2end tflite model saved to {}'.format(quantize or 'float32', save_path))
+
+
+def export_quantized(yolo, model, input_shape, onnx_save_path, tflite_save_path=None, quantize=None, onnx_int8_path=None,
+                     calib_txt=None, calib_num=100, decode_batch=None):
+    '''
+    各算法export_model共用：在导出fp32 onnx之后导出(量化的)TFLite以及int8 onnx
+    yolo：预测类，使用其preprocess生成校准数据；model：不含预处理以及后处理的keras模型
+    calib_txt：训练使用的标注文件，int8量化时从中抽取calib_num张图像校准
+    decode_batch：不为None时(--end2end)TFLite同样内含解码以及非极大值抑制，见export_end2end_tflite
+    '''
+    images = None
+    if quantize == 'int8' or onnx_int8_path:
+        from .quantize import calibration_images
+        assert calib_txt, 'int8 quantization needs --calib_txt (e.g. ./VOC2007/train.txt)'
+        images = calibration_images(calib_txt, calib_num)
+    if tflite_save_path and decode_batch is not None:
+        export_end2end_tflite(model, decode_batch, input_shape, tflite_save_path, quantize)
+    elif tflite_save_path:
+        export_tflite(model, input_shape, tflite_save_path, quantize, images, yolo.preprocess)
+    if onnx_int8_path:
+        from .quantize import quantize_onnx
+        quantize_onnx(onnx_save_path, onnx_int8_path, images, yolo.preprocess)
@@ -0,0 +1,84 @@
+import colorsys
+import os
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import ImageDraw, ImageFont
+
+
+def get_colors(num_classes):
+    '''
+    每个类别一种颜色
+    '''
+    hsv_tuples = [(x / num_classes, 1., 1.) for x in range(num_classes)]
+    colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
+    colors = list(map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)), colors))
+    return colors
+
+
+@lru_cache(maxsize=32)
+def get_font(font_path, size):
+    '''
+    按(字体, 字号)缓存字体，避免每张图像都重新加载ttf
+    '''
+    if font_path is not None and os.path.exists(font_path):
+        return ImageFont.truetype(font=font_path, size=int(size))
+    return ImageFont.load_default()
+
+
+def draw_detections(image, detections, class_names, colors, font_path='model_data/simhei.ttf', font_scale=3e-2, thickness=None, padding=0):
+    '''
+    在PIL图像上绘制Detections，返回绘制后的图像(原地修改)
+    font_scale：字号与图像高度的比例
+    padding：检测框向外扩展的像素
+    '''
+    w, h = image.size
+    font = get_font(font_path, max(int(np.floor(font_scale * h + 0.5)), 1))
+    if thickness is None:
+        thickness = max((w + h) // 300, 1)
+    draw = ImageDraw.Draw(image)
+    for box, score, c in detections:
+        left, top, right, bottom = box
+        top = max(0, int(np.floor(top - padding + 0.5)))
+        left = max(0, int(np.floor(left - padding + 0.5)))
+        bottom = min(h, int(np.floor(bottom + padding + 0.5)))
+        right = min(w, int(np.floor(right + padding + 0.5)))
+
+        label = '{} {:.2f}'.format(class_names[c], score)
+        x1, y1, x2, y2 = draw.textbbox((0, 0), label, font=font)
+        label_size = np.array([x2 - x1, y2 - y1])
+        if top - label_size[1] >= 0:
+            text_origin = np.array([left, top - label_size[1]])
+        else:
+            text_origin = np.array([left, top + 1])
+
+        for i in range(thickness):
+            if left + i > right - i or top + i > bottom - i:
+                break
+            draw.rectangle([left + i, top + i, right - i, bottom - i], outline=colors[c])
+        draw.rectangle([tuple(text_origin), tuple(text_origin + label_size)], fill=colors[c])
+        draw.text(tuple(text_origin), label, fill=(0, 0, 0), font=font)
+    del draw
+    return image
+
+
+def draw_detections_cv2(frame, detections, class_names, colors, thickness=None, bgr=True):
+    '''
+    使用cv2在uint8的HWC图像上绘制Detections(原地修改)，用于视频流，不经过PIL
+    bgr：frame为BGR图像时为True，colors为RGB时需要翻转
+    '''
+    h, w = frame.shape[:2]
+    if thickness is None:
+        thickness = max((w + h) // 600, 1)
+    font_scale = max(h / 1000., 0.4)
+    for box, score, c in detections:
+        left, top, right, bottom = [int(np.floor(x + 0.5)) for x in box]
+        color = tuple(colors[c][::-1]) if bgr else tuple(colors[c])
+        label = '{} {:.2f}'.format(class_names[c], score)
+        (label_w, label_h), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+        label_top = top - label_h - baseline if top - label_h - baseline >= 0 else top + 1
+        cv2.rectangle(frame, (left, top), (right, bottom), color, thickness)
+        cv2.rectangle(frame, (left, label_top), (left + label_w, label_top + label_h + baseline), color, -1)
+        cv2.putText(frame, label, (left, label_top + label_h), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 1, cv2.LINE_AA)
+    return frame
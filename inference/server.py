@@ -0,0 +1,254 @@
+import collections
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from .detections import Detections
+
+
+# gRPC接口：请求为编码后的图像(jpg、png等)，返回值为json，与HTTP的/predict相同，不需要编译proto
+GRPC_SERVICE = 'yolo.Detector'
+GRPC_PREDICT = '/{}/Predict'.format(GRPC_SERVICE)
+
+
+class ServingStats(object):
+    '''
+    服务端的统计：请求数、batch数以及平均大小，最近window个请求的延迟(从提交到得到结果)以及吞吐
+    '''
+    def __init__(self, window=10000):
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_items = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.done_times = collections.deque(maxlen=window)
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def add_batch(self, latencies, t_done, error=False):
+        with self._lock:
+            self.batches += 1
+            self.batch_items += len(latencies)
+            self.requests += len(latencies)
+            if error:
+                self.errors += len(latencies)
+            self.latencies.extend(latencies)
+            self.done_times.extend([t_done] * len(latencies))
+
+    def as_dict(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            done_times = list(self.done_times)
+            result = {
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch_size': self.batch_items / self.batches if self.batches > 0 else 0.,
+                'uptime': time.time() - self.start_time,
+            }
+        throughput = 0.
+        if len(done_times) > 1 and done_times[-1] > done_times[0]:
+            throughput = (len(done_times) - 1) / (done_times[-1] - done_times[0])
+        result['images_per_sec'] = throughput
+        for p in (50, 95, 99):
+            result['latency_p{}_ms'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) > 0 else 0.
+        return result
+
+
+class MicroBatcher(object):
+    '''
+    将并发的推理请求合并为micro-batch：第一个请求到达后最多等待max_latency秒，
+    期间到达的请求与其合并为一个batch(最多max_batch_size张)，一次前向推理后按请求分别解码
+    只有batch线程调用模型，HTTP以及gRPC的处理线程不会并发访问模型
+    model：预测类，需要提供forward_frames以及decode_batch
+    queue_size：等待中的请求数量上限，超过时submit抛出queue.Full，服务返回503
+    '''
+    def __init__(self, model, max_batch_size=8, max_latency=0.01, queue_size=256):
+        assert max_batch_size >= 1, 'max_batch_size must be greater than or equal to 1.'
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.stats = ServingStats()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        '''
+        frame：uint8的BGR图像(cv2.imdecode的结果)，返回concurrent.futures.Future，结果为Detections
+        '''
+        future = Future()
+        self.requests.put_nowait((frame, future, time.time()))
+        return future
+
+    def predict(self, frame, timeout=None):
+        return self.submit(frame).result(timeout)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def _collect(self):
+        try:
+            first = self.requests.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first[2] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            batch = self._collect()
+            if len(batch) > 0:
+                self._run(batch)
+
+    def _run(self, batch):
+        frames = [frame for frame, _, _ in batch]
+        image_hws = [frame.shape[:2] for frame in frames]
+        try:
+            outputs = self.model.forward_frames(frames, bgr=True)
+            decoded = self.model.decode_batch(outputs, np.array(image_hws, dtype='float32'))
+            results = [Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                       for (h, w), (out_boxes, out_scores, out_classes) in zip(image_hws, decoded)]
+        except Exception as e:
+            t_done = time.time()
+            for _, future, _ in batch:
+                future.set_exception(e)
+            self.stats.add_batch([t_done - t for _, _, t in batch], t_done, error=True)
+            return
+        t_done = time.time()
+        for (_, future, _), detections in zip(batch, results):
+            future.set_result(detections)
+        self.stats.add_batch([t_done - t for _, _, t in batch], t_done)
+
+
+def decode_image(data):
+    '''
+    编码后的图像字节 -> uint8的BGR图像，无法解码时返回None
+    '''
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def predict_bytes(batcher, data, class_names=None, timeout=None):
+    '''
+    对一张编码后的图像推理，返回(状态码, 可以json序列化的结果)
+    '''
+    frame = decode_image(data)
+    if frame is None:
+        return 400, {'error': 'cannot decode image'}
+    t1 = time.time()
+    try:
+        detections = batcher.predict(frame, timeout)
+    except queue.Full:
+        return 503, {'error': 'server busy'}
+    return 200, {
+        'image_size': [frame.shape[1], frame.shape[0]],
+        'detections': detections.to_list(class_names),
+        'latency_ms': (time.time() - t1) * 1000,
+    }
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    '''
+    POST /predict：请求体为编码后的图像，返回json检测结果
+    GET /stats：延迟分位数、吞吐以及batch大小
+    GET /health
+    '''
+    protocol_version = 'HTTP/1.1'
+    batcher = None
+    class_names = None
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._send_json(200, self.batcher.stats.as_dict())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            status, body = predict_bytes(self.batcher, data, self.class_names)
+        except Exception as e:
+            status, body = 500, {'error': str(e)}
+        self._send_json(status, body)
+
+    def log_message(self, format, *args):
+        # 不逐条打印请求，unix socket的client_address为空
+        pass
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+def make_http_server(batcher, host='0.0.0.0', port=8000, unix_socket=None, class_names=None):
+    '''
+    创建HTTP服务，每个连接一个线程；unix_socket不为空时监听本地unix socket，不经过TCP
+    调用serve_forever()开始服务
+    '''
+    handler = type('Handler', (PredictHandler,), {'batcher': batcher, 'class_names': class_names})
+    if unix_socket is not None:
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def make_grpc_server(batcher, address='0.0.0.0:50051', class_names=None, max_workers=16):
+    '''
+    创建gRPC服务(需要安装grpcio)，方法GRPC_PREDICT的请求与返回均为原始字节，不依赖proto文件：
+    请求为编码后的图像，返回值为json；调用start()开始服务
+    '''
+    try:
+        import grpc
+    except ImportError:
+        raise ImportError('"grpcio" not found, please install it to serve over gRPC.')
+    from concurrent.futures import ThreadPoolExecutor
+
+    def predict(request, context):
+        status, body = predict_bytes(batcher, request, class_names)
+        if status != 200:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED if status == 503 else grpc.StatusCode.INVALID_ARGUMENT, body['error'])
+        return json.dumps(body).encode('utf-8')
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+    handler = grpc.method_handlers_generic_handler(GRPC_SERVICE, {
+        'Predict': grpc.unary_unary_rpc_method_handler(predict),
+    })
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(address)
+    return server
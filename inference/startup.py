@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+
+
+class StartupReport(object):
+    '''
+    启动耗时按阶段统计，例如导入、构建网络、加载权重、加载缓存、保存缓存以及预热
+    '''
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        t1 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t1)
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def extend(self, other):
+        self.phases.extend(other.phases)
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.phases)
+
+    def as_dict(self):
+        return dict(self.phases, total=self.total)
+
+    def __str__(self):
+        lines = ['startup {:.2f}s'.format(self.total)]
+        for name, seconds in self.phases:
+            lines.append('  {:<14s} {:7.2f}s'.format(name, seconds))
+        return '\n'.join(lines)
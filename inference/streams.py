@@ -0,0 +1,381 @@
+import collections
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .detections import Detections
+from .pipeline import DROP_POLICIES, StageStats, is_live_source, put_with_policy, _END
+
+
+def open_source(source):
+    '''
+    打开视频源：摄像头编号、视频文件或者rtsp/rtmp地址，提供read()的对象直接返回
+    '''
+    if not isinstance(source, str):
+        return source
+    return cv2.VideoCapture(int(source) if source.isnumeric() else source)
+
+
+class LiveFileCapture(object):
+    '''
+    以实时流的方式读取视频文件，用于在没有摄像头或者rtsp服务时测试多路推理
+    画面按fps的节奏产生，不会等待读取方：读取不及时的帧被跳过，与rtsp相同；loop为True时循环播放
+    '''
+    def __init__(self, path, fps=None, loop=True):
+        self.path = path
+        self.loop = loop
+        self.capture = cv2.VideoCapture(path)
+        self.fps = fps or self.capture.get(cv2.CAP_PROP_FPS) or 25.
+        self.start = None
+        # 已经产生并读取(或跳过)的帧数
+        self.position = 0
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def _grab(self):
+        if self.capture.grab():
+            return True
+        if not self.loop:
+            return False
+        self.capture.release()
+        self.capture = cv2.VideoCapture(self.path)
+        return self.capture.grab()
+
+    def read(self):
+        now = time.time()
+        if self.start is None:
+            self.start = now
+        # 当前时刻最新的一帧
+        latest = int((now - self.start) * self.fps)
+        if latest < self.position:
+            # 下一帧还没有产生
+            time.sleep(self.start + self.position / self.fps - now)
+            latest = self.position
+        while self.position < latest:
+            if not self._grab():
+                return False, None
+            self.position += 1
+        if not self._grab():
+            return False, None
+        self.position += 1
+        return self.capture.retrieve()
+
+    def release(self):
+        self.capture.release()
+
+    def __str__(self):
+        return self.path
+
+
+class StreamStats(object):
+    '''
+    单路视频流的统计：读取、处理以及丢弃的帧数，当前队列深度，最近的处理帧率以及读取到输出的延迟
+    只保留最近window帧的时间，长时间运行时内存不会增长
+    '''
+    def __init__(self, stream_id, source, frame_queue, window=300):
+        self.stream_id = stream_id
+        self.source = source
+        self.frame_queue = frame_queue
+        self.captured = 0
+        self.processed = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.max_queue_depth = 0
+        self.ended = False
+        self.done_times = collections.deque(maxlen=window)
+        self.latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return self.frame_queue.qsize()
+
+    @property
+    def fps(self):
+        with self._lock:
+            if len(self.done_times) < 2 or self.done_times[-1] <= self.done_times[0]:
+                return 0.
+            return (len(self.done_times) - 1) / (self.done_times[-1] - self.done_times[0])
+
+    def capture(self, dropped):
+        with self._lock:
+            self.captured += 1
+            self.dropped += dropped
+            self.max_queue_depth = max(self.max_queue_depth, self.frame_queue.qsize())
+
+    def done(self, t_capture, t_done):
+        with self._lock:
+            self.processed += 1
+            self.done_times.append(t_done)
+            self.latencies.append(t_done - t_capture)
+
+    def as_dict(self):
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+        return {
+            'stream': self.stream_id,
+            'source': str(self.source),
+            'captured': self.captured,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'reconnects': self.reconnects,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'fps': self.fps,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.,
+            'latency_p95_ms': float(np.percentile(latencies, 95)) if len(latencies) > 0 else 0.,
+        }
+
+    def __str__(self):
+        s = self.as_dict()
+        return '{:<6d} {:<28s} {:8d} {:9d} {:7d} {:5d}/{:<5d} {:8.2f} {:9.2f} {:9.2f}'.format(
+            s['stream'], s['source'][-28:], s['captured'], s['processed'], s['dropped'],
+            s['queue_depth'], s['max_queue_depth'], s['fps'], s['latency_p50_ms'], s['latency_p95_ms'])
+
+
+class MultiStreamStats(object):
+    '''
+    多路推理的统计：每一路的StreamStats，推理以及后处理阶段的耗时，batch的数量以及平均大小
+    '''
+    def __init__(self, streams):
+        self.streams = streams
+        self.infer = StageStats('infer')
+        self.postprocess = StageStats('postprocess')
+        self.batches = 0
+        self.start_time = None
+
+    @property
+    def mean_batch_size(self):
+        return self.infer.items / self.batches if self.batches > 0 else 0.
+
+    def as_dict(self):
+        return {
+            'elapsed': time.time() - self.start_time if self.start_time is not None else 0.,
+            'batches': self.batches,
+            'mean_batch_size': self.mean_batch_size,
+            'streams': [stream.as_dict() for stream in self.streams],
+        }
+
+    def __str__(self):
+        lines = ['{:<6s} {:<28s} {:>8s} {:>9s} {:>7s} {:>11s} {:>8s} {:>9s} {:>9s}'.format(
+            'stream', 'source', 'captured', 'processed', 'dropped', 'queue/max', 'fps', 'p50 ms', 'p95 ms')]
+        lines += [str(stream) for stream in self.streams]
+        lines.append(str(self.infer))
+        lines.append(str(self.postprocess))
+        lines.append('{} batches, {:.2f} frames/batch'.format(self.batches, self.mean_batch_size))
+        return '\n'.join(lines)
+
+
+class MultiStreamRunner(object):
+    '''
+    多路视频流推理：每一路在各自的线程中读取，所有路共享一个模型
+    推理线程轮流从各路的队列中取帧组成动态batch，batch已满或者batch中最早的一帧等待超过max_latency时立即推理，
+    不同尺寸的帧在forward_frames中缩放到网络输入尺寸后合并；后处理之后结果按路分发
+    model：预测类，需要提供forward_frames、decode_batch以及draw_frame
+    sources：视频源列表，可以是摄像头编号、视频文件、rtsp/rtmp地址或者提供read()的对象
+    max_batch_size：每个batch最多的帧数
+    max_latency：组batch时最多等待的时间(秒)，从batch中最早一帧的读取时间开始计算
+    queue_size：每一路读取队列的容量
+    drop_policy：读取队列已满时的处理方式，详见DROP_POLICIES；auto对实时流使用drop_oldest，对视频文件使用block
+    reconnect：实时流读取失败后重新连接的间隔(秒)，为None时该路结束
+    on_result：on_result(stream_id, index, frame, detections)，在调用run的线程中执行，返回False时停止
+    '''
+    def __init__(self, model, sources, max_batch_size=8, max_latency=0.05, queue_size=4, drop_policy='auto',
+                 reconnect=None, draw=True, on_result=None):
+        assert max_batch_size >= 1, 'max_batch_size must be greater than or equal to 1.'
+        assert drop_policy == 'auto' or drop_policy in DROP_POLICIES, 'drop policy must be auto or one of {}'.format(DROP_POLICIES)
+        self.model = model
+        self.sources = list(sources)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.reconnect = reconnect
+        self.draw = draw
+        self.on_result = on_result
+        self.drop_policies = [
+            ('drop_oldest' if is_live_source(source) or isinstance(source, LiveFileCapture) else 'block') if drop_policy == 'auto' else drop_policy
+            for source in self.sources]
+        self.frame_queues = [queue.Queue(maxsize=queue_size) for _ in self.sources]
+        self.output_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size * len(self.sources))
+        self.stop_event = threading.Event()
+        # 任意一路放入新帧时置位，组batch时用于等待
+        self.frame_ready = threading.Event()
+        self.stats = MultiStreamStats([StreamStats(i, source, q) for i, (source, q) in enumerate(zip(self.sources, self.frame_queues))])
+        self._next_stream = 0
+        self._errors = []
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self.stop_event.set()
+
+    def _put(self, q, item):
+        put_with_policy(q, item, 'block', self.stop_event)
+
+    def _get(self, q):
+        while True:
+            if self.stop_event.is_set():
+                return _END
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def _capture(self, stream_id, capture):
+        stats = self.stats.streams[stream_id]
+        source = self.sources[stream_id]
+        frame_queue = self.frame_queues[stream_id]
+        index = 0
+        try:
+            while not self.stop_event.is_set():
+                t1 = time.time()
+                ref, frame = capture.read()
+                if not ref or frame is None:
+                    if self.reconnect is None or not is_live_source(source):
+                        break
+                    # 实时流断开后等待reconnect秒重新连接
+                    capture.release()
+                    if self.stop_event.wait(self.reconnect):
+                        break
+                    capture = open_source(source)
+                    stats.reconnects += 1
+                    continue
+                dropped = put_with_policy(frame_queue, (stream_id, index, frame, t1), self.drop_policies[stream_id], self.stop_event)
+                stats.capture(dropped)
+                self.frame_ready.set()
+                index += 1
+        finally:
+            if isinstance(source, str):
+                capture.release()
+        self._put(frame_queue, _END)
+        self.frame_ready.set()
+
+    def _collect(self):
+        '''
+        从各路队列中轮流取帧，每一轮每路最多一帧，避免某一路占满batch；
+        batch已满、最早的一帧等待超过max_latency或者所有路都已结束时返回
+        '''
+        streams = self.stats.streams[self._next_stream:] + self.stats.streams[:self._next_stream]
+        self._next_stream = (self._next_stream + 1) % len(streams)
+        batch = []
+        deadline = None
+        while not self.stop_event.is_set():
+            self.frame_ready.clear()
+            taken = False
+            for stream in streams:
+                if len(batch) >= self.max_batch_size:
+                    break
+                if stream.ended:
+                    continue
+                try:
+                    item = stream.frame_queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    stream.ended = True
+                    continue
+                batch.append(item)
+                taken = True
+                if deadline is None or item[3] + self.max_latency < deadline:
+                    deadline = item[3] + self.max_latency
+            if len(batch) >= self.max_batch_size or all(stream.ended for stream in streams):
+                break
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if not taken:
+                self.frame_ready.wait(0.1 if deadline is None else deadline - now)
+        return batch
+
+    def _infer(self):
+        while not self.stop_event.is_set():
+            batch = self._collect()
+            if len(batch) > 0 and not self.stop_event.is_set():
+                t1 = time.time()
+                outputs = self.model.forward_frames([frame for _, _, frame, _ in batch], bgr=True)
+                self.stats.infer.add(len(batch), time.time() - t1)
+                self.stats.batches += 1
+                self._put(self.output_queue, (batch, outputs))
+            if all(stream.ended for stream in self.stats.streams):
+                break
+        self._put(self.output_queue, _END)
+
+    def _postprocess(self):
+        while True:
+            item = self._get(self.output_queue)
+            if item is _END:
+                break
+            batch, outputs = item
+            t1 = time.time()
+            image_hws = [frame.shape[:2] for _, _, frame, _ in batch]
+            decoded = self.model.decode_batch(outputs, np.array(image_hws, dtype='float32'))
+            results = []
+            for (stream_id, index, frame, t_capture), (h, w), (out_boxes, out_scores, out_classes) in zip(batch, image_hws, decoded):
+                detections = Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                if self.draw:
+                    frame = self.model.draw_frame(frame, detections, bgr=True)
+                results.append((stream_id, index, frame, detections, t_capture))
+            self.stats.postprocess.add(len(batch), time.time() - t1)
+            for result in results:
+                self._put(self.result_queue, result)
+        self._put(self.result_queue, _END)
+
+    def run(self, show=False, duration=None, report_interval=None, report=print):
+        '''
+        运行直到所有视频源结束、on_result返回False、调用stop()、超过duration秒或者按下Ctrl+C
+        show：每一路使用单独的cv2.imshow窗口显示，按q结束
+        report_interval：每隔report_interval秒调用report(stats)输出各路的帧率、队列深度以及丢帧数
+        返回值：MultiStreamStats
+        '''
+        captures = [open_source(source) for source in self.sources]
+        threads = [threading.Thread(target=self._run_stage, args=(self._capture, i, capture), daemon=True)
+                   for i, capture in enumerate(captures)]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(self._infer,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._postprocess,), daemon=True),
+        ]
+        self.stats.start_time = time.time()
+        last_report = self.stats.start_time
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self.result_queue)
+                if item is _END:
+                    break
+                stream_id, index, frame, detections, t_capture = item
+                self.stats.streams[stream_id].done(t_capture, time.time())
+                keep_going = True
+                if self.on_result is not None:
+                    keep_going = self.on_result(stream_id, index, frame, detections) is not False
+                if show:
+                    cv2.imshow('stream {}'.format(stream_id), frame)
+                    if cv2.waitKey(1) == ord('q'):
+                        keep_going = False
+                now = time.time()
+                if report_interval is not None and now - last_report >= report_interval:
+                    report(self.stats)
+                    last_report = now
+                if not keep_going or (duration is not None and now - self.stats.start_time >= duration):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        if len(self._errors) > 0:
+            raise self._errors[0]
+        return self.stats
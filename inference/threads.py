@@ -0,0 +1,38 @@
+import os
+import sys
+
+
+# 进程内的线程预算，为None时使用各框架的默认值(通常为核数)
+_thread_budget = {'intra_op': None, 'inter_op': None}
+
+
+def cpu_count():
+    '''
+    当前进程可以使用的核数，考虑taskset以及容器的cpu亲和性
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_thread_budget(intra_op, inter_op=1):
+    '''
+    限制本进程的算子内(intra_op)以及算子间(inter_op)线程数，多进程推理时每个进程一份预算，总和等于核数
+    需要在加载模型之前调用：tensorflow通过环境变量以及tf.config设置，onnxruntime通过inference.backends.onnx_session_options设置
+    '''
+    _thread_budget['intra_op'] = intra_op
+    _thread_budget['inter_op'] = inter_op
+    os.environ['OMP_NUM_THREADS'] = str(intra_op)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op)
+    import cv2
+    cv2.setNumThreads(intra_op)
+    if 'tensorflow' in sys.modules:
+        # 已经导入tensorflow时环境变量不再生效，运行时初始化之后设置会抛出RuntimeError
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+        except RuntimeError:
+            pass
+
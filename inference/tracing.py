@@ -0,0 +1,84 @@
+import time
+import warnings
+
+import numpy as np
+
+
+class RetraceWarning(UserWarning):
+    '''
+    预热结束之后tf.function再次trace，热路径上的这一帧需要重新构建计算图
+    '''
+    pass
+
+
+class TraceCounter(object):
+    '''
+    统计tf.function的trace次数以及每次trace的输入形状
+    seal()之后(预热结束)再次trace说明热路径上出现了新的输入形状或类型，发出RetraceWarning
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.traces = []
+        self.sealed = False
+
+    @property
+    def count(self):
+        return len(self.traces)
+
+    def record(self, args):
+        signature = tuple(describe_arg(arg) for arg in args)
+        self.traces.append(signature)
+        if self.sealed:
+            warnings.warn('{} traced after warm-up (trace #{}) for {}, the graph is rebuilt on the hot path'.format(
+                self.name, self.count, signature), RetraceWarning, stacklevel=3)
+
+    def seal(self):
+        self.sealed = True
+
+    def __str__(self):
+        return '{}: {} traces {}'.format(self.name, self.count, list(self.traces))
+
+
+def describe_arg(arg):
+    if hasattr(arg, 'shape') and hasattr(arg, 'dtype'):
+        return '{}{}'.format(getattr(arg.dtype, 'name', arg.dtype), list(arg.shape))
+    return repr(arg)
+
+
+def warmup(model, batch_sizes=(1,), frame_shapes=(), seal=True):
+    '''
+    加载模型后使用全零输入预热：tf.function的trace以及首次运行的内存分配、算子选择不再落在第一帧上
+    batch_sizes：forward的batch大小，输入为网络输入尺寸(detect、detect_batch以及服务使用)
+    frame_shapes：forward_frames的(batch_size, H, W)，视频或者摄像头的原图尺寸
+    seal：预热之后再次trace时发出RetraceWarning，只针对预热中trace过的函数(没有预热的函数第一次trace不是重新trace)
+    返回值：[(说明, 秒)]，依次为每个形状的预热耗时
+    '''
+    h, w = model_input_shape(model)
+    timings = []
+    for batch_size in batch_sizes:
+        dtype = np.uint8 if getattr(model, 'onnx_preprocess', None) is not None else np.float32
+        image_data = np.zeros([batch_size, h, w, 3], dtype)
+        input_image_shapes = np.tile(np.array([[h, w]], dtype='float32'), [batch_size, 1])
+        t1 = time.time()
+        model.decode_batch(model.forward(image_data, input_image_shapes), input_image_shapes)
+        timings.append(('forward {}x{}x{}'.format(batch_size, h, w), time.time() - t1))
+    for batch_size, frame_h, frame_w in frame_shapes:
+        frames = np.zeros([batch_size, frame_h, frame_w, 3], np.uint8)
+        input_image_shapes = np.tile(np.array([[frame_h, frame_w]], dtype='float32'), [batch_size, 1])
+        t1 = time.time()
+        model.decode_batch(model.forward_frames(frames, bgr=True), input_image_shapes)
+        timings.append(('forward_frames {}x{}x{}'.format(batch_size, frame_h, frame_w), time.time() - t1))
+    if seal:
+        for counter in getattr(model, 'trace_counters', []):
+            if counter.count > 0:
+                counter.seal()
+    return timings
+
+
+def model_input_shape(model):
+    '''
+    预测类的网络输入(h, w)，yolov4使用input_size(w, h)
+    '''
+    if hasattr(model, 'input_shape'):
+        return tuple(model.input_shape)
+    return model.input_size[1], model.input_size[0]
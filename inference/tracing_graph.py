@@ -0,0 +1,53 @@
+import functools
+
+import tensorflow as tf
+
+from .tracing import TraceCounter
+
+
+def counted_function(python_function, input_signature=None, name=None):
+    '''
+    tf.function，并统计trace次数：python_function中的python代码只在trace时执行
+    返回值：(tf.function, TraceCounter)
+    '''
+    counter = TraceCounter(name or python_function.__name__)
+
+    def traced(*args):
+        counter.record(args)
+        return python_function(*args)
+    traced.__name__ = counter.name
+    return tf.function(traced, input_signature=input_signature), counter
+
+
+def build_pred_functions(get_pred, get_pred_frames, input_shape):
+    '''
+    为预测类创建带input_signature的推理函数，batch大小以及原图尺寸变化时不再重新trace
+    get_pred(image_data)：归一化后的网络输入，形状固定为(None, h, w, 3)
+    get_pred_frames(frames, bgr)：uint8原图，形状为(None, None, None, 3)，缩放在计算图中完成；
+                                  bgr为python bool，True/False各对应一个函数
+    返回值：get_pred、get_pred_frames(frames, bgr)以及[TraceCounter]
+    '''
+    h, w = input_shape
+    pred, pred_counter = counted_function(
+        get_pred, [tf.TensorSpec([None, h, w, 3], tf.float32, name='image_data')], name='get_pred')
+    frame_functions = []
+    counters = [pred_counter]
+    for bgr in (True, False):
+        frame_function, counter = counted_function(
+            functools.partial(get_pred_frames, bgr=bgr), [tf.TensorSpec([None, None, None, 3], tf.uint8, name='frames')],
+            name='get_pred_frames_{}'.format('bgr' if bgr else 'rgb'))
+        frame_functions.append(frame_function)
+        counters.append(counter)
+    return pred, PredFrames(*frame_functions), counters
+
+
+class PredFrames(object):
+    '''
+    get_pred_frames(frames, bgr)：按bgr选择BGR或者RGB输入对应的tf.function
+    '''
+    def __init__(self, bgr, rgb):
+        self.bgr = bgr
+        self.rgb = rgb
+
+    def __call__(self, frames, bgr=True):
+        return self.bgr(frames) if bgr else self.rgb(frames)
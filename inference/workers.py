@@ -0,0 +1,104 @@
+import functools
+import multiprocessing
+import os
+
+from .batch import batched
+from .threads import cpu_count, set_thread_budget
+
+
+# 子进程中的预测类以及参数，由_init_worker设置
+_worker = {}
+
+
+def thread_budget(num_workers, num_cores=None):
+    '''
+    每个进程的算子内线程数，使所有进程的线程总数等于核数
+    '''
+    num_cores = num_cores or cpu_count()
+    return max(1, num_cores // num_workers)
+
+
+def _init_worker(load_model, load_args, threads, batch_size, pin_cores, counter, ready):
+    with counter.get_lock():
+        worker_id = counter.value
+        counter.value += 1
+    if pin_cores and hasattr(os, 'sched_setaffinity'):
+        # 每个进程绑定到不相交的threads个核上，避免进程之间争抢
+        cores = sorted(os.sched_getaffinity(0))
+        start = (worker_id * threads) % len(cores)
+        os.sched_setaffinity(0, cores[start:start + threads] or cores)
+    set_thread_budget(threads, 1)
+    try:
+        model = load_model(*load_args)
+    except Exception as e:
+        # 通知主进程，否则主进程会一直等待
+        ready.put((worker_id, RuntimeError('worker {} failed to load the model: {!r}'.format(worker_id, e))))
+        raise
+    _worker.update(model=model, batch_size=batch_size, worker_id=worker_id)
+    ready.put((worker_id, list(model.class_names)))
+
+
+def _detect_chunk(chunk, save_dir=None):
+    '''
+    在子进程中对一组图像推理，save_dir不为空时在子进程中绘制并保存，绘制不占用主进程的GIL
+    返回值：[(index, path, image_size, Detections)]
+    '''
+    from PIL import Image
+    model = _worker['model']
+    images = [Image.open(path) for _, path in chunk]
+    results = model.detect_batch(images, batch_size=_worker['batch_size'])
+    outputs = []
+    for (index, path), image, detections in zip(chunk, images, results):
+        if save_dir is not None:
+            model.draw(image.convert('RGB'), detections).save(os.path.join(save_dir, os.path.basename(path)))
+        outputs.append((index, path, image.size, detections))
+    return outputs
+
+
+class WorkerPool(object):
+    '''
+    多进程推理：num_workers个进程各自加载一份模型，每个进程的线程数固定为threads_per_worker，
+    默认使所有进程的线程总数等于核数；PIL解码、预处理以及绘制不再受单个进程的GIL限制
+    图像列表按batch_size切分后分配给空闲的进程，结果按输入顺序返回
+    load_model：模块级函数(需要能被pickle)，load_model(*load_args)返回预测类，例如inference.models.load_model
+    pin_cores：为True时每个进程绑定到不相交的核上
+    子进程使用spawn启动，tensorflow不支持fork之后继续使用
+    '''
+    def __init__(self, load_model, load_args, num_workers, batch_size=8, threads_per_worker=None, pin_cores=False):
+        assert num_workers >= 1, 'num_workers must be greater than or equal to 1.'
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.threads_per_worker = threads_per_worker or thread_budget(num_workers)
+        context = multiprocessing.get_context('spawn')
+        counter = context.Value('i', 0)
+        ready = context.Queue()
+        self.pool = context.Pool(num_workers, initializer=_init_worker,
+                                 initargs=(load_model, tuple(load_args), self.threads_per_worker, batch_size, pin_cores, counter, ready))
+        # 等待所有进程加载完模型，加载时间不计入推理耗时
+        self.class_names = None
+        for _ in range(num_workers):
+            _, result = ready.get()
+            if isinstance(result, Exception):
+                self.pool.terminate()
+                raise result
+            self.class_names = result
+
+    def imap(self, paths, save_dir=None):
+        '''
+        按输入顺序逐张返回(path, image_size, Detections)
+        '''
+        chunks = batched(list(enumerate(paths)), self.batch_size)
+        for outputs in self.pool.imap(functools.partial(_detect_chunk, save_dir=save_dir), chunks):
+            for _, path, image_size, detections in outputs:
+                yield path, image_size, detections
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
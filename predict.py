@@ -1,11 +1,22 @@
+import time
+t_start = time.time()
 import os
-from cfg import *
+import sys
 from PIL import Image
 from glob import glob
 import argparse
-import time
 import cv2
 import numpy as np
+from inference import batched, Throughput
+from inference.pipeline import VideoPipeline, DROP_POLICIES, is_live_source
+from inference.streams import MultiStreamRunner, LiveFileCapture
+from inference.models import load_model
+from inference.workers import WorkerPool
+from inference.startup import StartupReport
+
+# 启动耗时：导入以及各阶段(构建网络、加载权重或缓存、预热等)
+startup = StartupReport()
+startup.add('import', time.time() - t_start)
 
 '''
 Usage:
@@ -24,182 +35,144 @@ def parse_args():
     parser.add_argument('--save', action='store_true', help='save result image.')
     parser.add_argument('--model', help='model', required=True)
     parser.add_argument('--save_dir', default='./result', help='save_dir')
-    parser.add_argument('--source', help='source: image, dir, video or camera')
+    parser.add_argument('--source', nargs='+', help='source: image, dir, video or camera; several videos, cameras or rtsp streams share one model')
+    parser.add_argument('--batch_size', type=int, default=1, help='number of images (or video frames) per forward pass')
+    parser.add_argument('--queue_size', type=int, default=8, help='video: capacity of the queues between pipeline stages')
+    parser.add_argument('--drop_policy', default='auto', choices=('auto',) + DROP_POLICIES, help='video: what to do when the frame queue is full, auto drops the oldest frame for cameras and rtsp streams')
+    parser.add_argument('--max_latency', type=float, default=50, help='multi-stream: max milliseconds to wait while filling a batch')
+    parser.add_argument('--report_interval', type=float, default=10, help='multi-stream: seconds between per-stream stats reports')
+    parser.add_argument('--reconnect', type=float, default=None, help='multi-stream: seconds to wait before reopening a broken live stream')
+    parser.add_argument('--simulate_live', action='store_true', help='multi-stream: play video files in real time and loop them, like rtsp streams')
+    parser.add_argument('--workers', type=int, default=1, help='dir: number of inference processes, each with its own model')
+    parser.add_argument('--threads_per_worker', type=int, default=None, help='dir: intra-op threads per process, default cores // workers')
     args = parser.parse_args()
+    # 多进程文件夹推理在子进程中绘制以及保存，无法显示结果
+    if args.workers > 1 and args.show and args.source and os.path.isdir(args.source[0]):
+        parser.error('--show is not supported with --workers > 1 on a folder, use --workers 1 or --save')
     return args
 
-def video_inference(src, model, save):
+def video_inference(src, model, args):
+    '''
+    流水线视频推理：读取、推理、后处理以及写出在不同线程中并行，结束后打印各阶段的耗时以及端到端延迟
+    '''
     capture = cv2.VideoCapture(src)
-    fps = 0.0
     # 定义编解码器并创建VideoWriter对象
     fourcc = cv2.VideoWriter_fourcc(*'XVID')
     size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-    out = cv2.VideoWriter('./output.mp4', fourcc, 20.0, size)
-    while True:
-        try:
-            t1 = time.time()
-            if capture.isOpened():
-                ref, frame = capture.read()
-                # 获取视频的时间戳
-                millseconds = capture.get(cv2.CAP_PROP_POS_MSEC)
-                if frame is not None and ref:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    frame = Image.fromarray(np.uint8(frame))
-                    frame = np.array(model.detect(frame))
-                    frame = cv2.cvtColor(frame,cv2.COLOR_RGB2BGR)
+    out = cv2.VideoWriter('./output.mp4', fourcc, 20.0, size) if args.save else None
+    drop_policy = args.drop_policy
+    if drop_policy == 'auto':
+        # 摄像头以及rtsp等实时流只处理最新的帧，视频文件不丢帧
+        drop_policy = 'drop_oldest' if is_live_source(src) else 'block'
+    pipeline = VideoPipeline(model, batch_size=args.batch_size, queue_size=args.queue_size, drop_policy=drop_policy)
+    try:
+        stats = pipeline.run(capture, writer=out, show=args.show)
+    finally:
+        capture.release()
+        if out is not None:
+            out.release()
+        cv2.destroyAllWindows()
+    print(stats)
+
 
-                    fps  = ( fps + (1./(time.time()-t1)) ) / 2
-                    print("fps= %.2f"%(fps))
-                    frame = cv2.putText(frame, "fps= %.2f"%(fps), (0, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                    if save:
-                        out.write(frame)
-                    cv2.imshow("video",frame)
-                    if cv2.waitKey(1) == ord('q'):
-                        break
-            else:
-                break
-        except Exception as e:
-            print(e)
-            break
+def multistream_inference(sources, model, args):
+    '''
+    多路视频推理：所有路共享一个模型，各路的帧组成动态batch，定期打印每一路的帧率、队列深度以及丢帧数
+    '''
+    if args.simulate_live:
+        sources = [source if is_live_source(source) else LiveFileCapture(source) for source in sources]
+    writers = {}
 
-    capture.release()
-    out.release()
-    cv2.destroyAllWindows()
+    def on_result(stream_id, index, frame, detections):
+        if args.save:
+            if stream_id not in writers:
+                if not os.path.exists(args.save_dir):
+                    os.makedirs(args.save_dir)
+                save_path = os.path.join(args.save_dir, 'stream_{}.mp4'.format(stream_id))
+                writers[stream_id] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'XVID'), 20.0, (frame.shape[1], frame.shape[0]))
+            writers[stream_id].write(frame)
+
+    runner = MultiStreamRunner(model, sources, max_batch_size=args.batch_size, max_latency=args.max_latency / 1000.,
+                               queue_size=args.queue_size, drop_policy=args.drop_policy, reconnect=args.reconnect,
+                               draw=args.save or args.show, on_result=on_result)
+    try:
+        stats = runner.run(show=args.show, report_interval=args.report_interval)
+    finally:
+        for writer in writers.values():
+            writer.release()
+        cv2.destroyAllWindows()
+    print(stats)
 
 
+def stream_inference(sources, model, args):
+    if len(sources) > 1:
+        multistream_inference(sources, model, args)
+    else:
+        video_inference(sources[0], model, args)
+
 
 def dir_inference(imag_dir, model, args):
     path_pattern = f'{imag_dir}/*'
-    img_number = len(path_pattern)
-    result = 0
-    for path in glob(path_pattern):
-        # 判断是否为文件夹
-        if os.path.isdir(path):
+    # 判断是否为文件夹
+    paths = [path for path in glob(path_pattern) if not os.path.isdir(path)]
+    throughput = Throughput()
+    for batch_paths in batched(paths, args.batch_size):
+        images = [Image.open(path) for path in batch_paths]
+        throughput.start()
+        results = model.detect_batch(images, batch_size=args.batch_size)
+        throughput.stop(len(images))
+        if not (args.show or args.save):
             continue
-        image = Image.open(path)
-        start_time = time.time()
-        img = model.detect(image)
-        end_time = time.time()
-        result += (end_time-start_time)
-        if args.show:
-            img.show()
-        if args.save:
-            if not os.path.exists(args.save_dir):
-                os.makedirs(args.save_dir)
-            save_path = os.path.join(args.save_dir, os.path.basename(path))
-            img.save(save_path)
-    fps = 1/(result/img_number)
-    print(f'finish，fps is {fps}')
+        for path, image, detections in zip(batch_paths, images, results):
+            img = model.draw(image.convert('RGB'), detections)
+            if args.show:
+                img.show()
+            if args.save:
+                if not os.path.exists(args.save_dir):
+                    os.makedirs(args.save_dir)
+                save_path = os.path.join(args.save_dir, os.path.basename(path))
+                img.save(save_path)
+    print(f'finish，{throughput}')
+
+def dir_inference_workers(imag_dir, args):
+    '''
+    多进程文件夹推理：图像按batch_size切分后分配给args.workers个进程，各进程中推理、绘制以及保存，结果按顺序合并
+    '''
+    paths = [path for path in glob(f'{imag_dir}/*') if not os.path.isdir(path)]
+    save_dir = None
+    if args.save:
+        save_dir = args.save_dir
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+    throughput = Throughput()
+    with WorkerPool(load_model, (args.yolo, args.model), args.workers, batch_size=args.batch_size,
+                    threads_per_worker=args.threads_per_worker) as pool:
+        throughput.start()
+        num_images = sum(1 for _ in pool.imap(paths, save_dir=save_dir))
+        throughput.stop(num_images)
+    print(f'finish，{args.workers} workers x {pool.threads_per_worker} threads，{throughput}')
 
 if __name__=='__main__':
     args = parse_args()
-    source = args.source
-    webcam = source.isnumeric() or source.lower().endswith(('.mp4', '.mp3', '.avi')) or source.lower().startswith(('rtsp://', 'rtmp://'))
-    if args.yolo.upper() == 'YOLOX':
-        from yolox import Inference_YOLOXModel
-        yolo = Inference_YOLOXModel(YOLOXConfig, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-    elif  args.yolo.upper() == 'YOLOV4':
-        from yolov4 import Inference_YOLOV4Model
-        yolo = Inference_YOLOV4Model(YOLOV4Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-    elif args.yolo.upper() == 'YOLOV4-TINY':
-        from yolov4 import Inference_YOLOV4Model
-        yolo = Inference_YOLOV4Model(YOLOV4Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-    elif args.yolo.upper() == 'YOLOV5':
-        from yolov5 import Inference_YOLOV5Model
-        yolo = Inference_YOLOV5Model(YOLOV5Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-    elif args.yolo.upper() == 'YOLOV5-V61':
-        from yolov5v61 import Inference_YOLOV5Model
-        yolo = Inference_YOLOV5Model(YOLOV5Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-
-    elif args.yolo.upper() == 'YOLOV7':
-        from yolov7 import Inference_YOLOV7Model
-        yolo = Inference_YOLOV7Model(YOLOV7Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
-    elif args.yolo.upper() == 'YOLOV7-TINY':
-        from yolov7 import Inference_YOLOV7Model
-        yolo = Inference_YOLOV7Model(YOLOV7Config, args.model)
-        if webcam:
-            video_inference(source, yolo, args.save)
-        else:
-            if os.path.isdir(source):
-                dir_inference(args.source, yolo, args)
-            else:
-                image = Image.open(source)
-                img = yolo.detect(image)
-                img.show()
-                if args.save:
-                    save_path = os.path.join(args.save_dir, 'tmp.jpg')
-                    img.save(save_path)
+    source = args.source[0]
+    if args.workers > 1 and os.path.isdir(source):
+        # 模型只在子进程中加载
+        dir_inference_workers(source, args)
+        sys.exit(0)
+    webcam = len(args.source) > 1 or source.isnumeric() or source.lower().endswith(('.mp4', '.mp3', '.avi')) or source.lower().startswith(('rtsp://', 'rtmp://'))
+    # 按算法加载预测类，只导入对应的模块；onnx模型不导入tensorflow
+    yolo = load_model(args.yolo, args.model)
+    startup.extend(yolo.startup)
+    print(startup)
+    if webcam:
+        stream_inference(args.source, yolo, args)
     else:
-        pass
\ No newline at end of file
+        if os.path.isdir(source):
+            dir_inference(source, yolo, args)
+        else:
+            image = Image.open(source)
+            img = yolo.detect(image)
+            img.show()
+            if args.save:
+                save_path = os.path.join(args.save_dir, 'tmp.jpg')
+                img.save(save_path)
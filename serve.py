@@ -0,0 +1,54 @@
+import argparse
+from inference.models import load_model
+from inference.server import MicroBatcher, make_http_server, make_grpc_server
+
+'''
+常驻的推理服务，模型只加载一次，并发请求合并为micro-batch推理
+
+Usage:
+    python serve.py --yolo YOLOV5 --model ./model/voc_yolov5.h5 --port 8000 --max_batch_size 8 --max_latency 10
+    python serve.py --yolo YOLOX --model ./model/voc_yolox.onnx --unix_socket /tmp/yolo.sock --grpc_port 50051
+    curl --data-binary @./samples/test.jpg http://127.0.0.1:8000/predict
+    python tools/loadgen.py --url http://127.0.0.1:8000 --image ./samples/test.jpg --concurrency 16
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='YOLO inference server')
+    parser.add_argument(
+        '--yolo',
+        help='YOLOV4, YOLOV4-TINY, YOLOV5 or YOLOX',
+        choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5','YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'],
+        default='YOLOV5',
+        type=str)
+    parser.add_argument('--model', help='model', required=True)
+    parser.add_argument('--host', default='0.0.0.0', help='HTTP: listen address')
+    parser.add_argument('--port', type=int, default=8000, help='HTTP: listen port')
+    parser.add_argument('--unix_socket', default=None, help='HTTP: listen on this unix socket instead of TCP')
+    parser.add_argument('--grpc_port', type=int, default=None, help='also serve over gRPC on this port (needs grpcio)')
+    parser.add_argument('--max_batch_size', type=int, default=8, help='max images per forward pass')
+    parser.add_argument('--max_latency', type=float, default=10, help='max milliseconds the first request of a batch waits for others')
+    parser.add_argument('--queue_size', type=int, default=256, help='max pending requests, more are rejected with 503')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    yolo = load_model(args.yolo, args.model)
+    batcher = MicroBatcher(yolo, max_batch_size=args.max_batch_size, max_latency=args.max_latency / 1000., queue_size=args.queue_size)
+    grpc_server = None
+    if args.grpc_port is not None:
+        grpc_server = make_grpc_server(batcher, '{}:{}'.format(args.host, args.grpc_port), class_names=yolo.class_names)
+        grpc_server.start()
+        print('gRPC serving on {}:{}'.format(args.host, args.grpc_port))
+    server = make_http_server(batcher, args.host, args.port, unix_socket=args.unix_socket, class_names=yolo.class_names)
+    print('HTTP serving on {}'.format(args.unix_socket if args.unix_socket is not None else '{}:{}'.format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if grpc_server is not None:
+            grpc_server.stop(0)
+        batcher.close()
+        print(batcher.stats.as_dict())
@@ -0,0 +1,110 @@
+import argparse
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+
+# 每个样本的数据增强耗时(ms)：get_random_data(随机增强以及只等比例缩放)、Mosaic以及MixUp，不包括分配目标，例如：
+# python tools/benchmark_augmentation.py --yolo YOLOV5 --annotation ./VOC2007/train.txt --input_size 640 --num_samples 200
+# --save_dir时每种增强保存几张画出真实框的图像，用于对比增强前后的视觉效果以及真实框是否对齐
+ANCHORS = {
+    'YOLOV5': './yolov5/data/yolov5_anchors.txt',
+    'YOLOV5-V61': './yolov5/data/yolov5_anchors.txt',
+    'YOLOV7': './yolov7/data/yolo_anchors.txt',
+}
+ANCHOR_MASK = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
+
+
+def load_anchors(path):
+    with open(path) as f:
+        return np.array([float(x) for x in f.readline().split(',')]).reshape(-1, 2)
+
+
+def augmentations(opt, lines, cache=None):
+    '''
+    返回{名称: 输入一行标注以及随机的4行标注，返回(图像, 真实框)的函数}
+    '''
+    input_shape = (opt.input_size, opt.input_size)
+    if opt.yolo == 'YOLOV4':
+        from yolov4.lib.utils import get_random_data, get_random_data_with_Mosaic
+        return {
+            'random': lambda line, lines: get_random_data(line, input_shape, cache=cache),
+            'letterbox': lambda line, lines: get_random_data(line, input_shape, random=False, cache=cache),
+            'mosaic': lambda line, lines: get_random_data_with_Mosaic(lines, input_shape, cache=cache),
+        }
+    if opt.yolo == 'YOLOX':
+        from yolox.lib.dataloader import YoloDatasets
+        dataset = YoloDatasets(lines, input_shape, 1, opt.num_classes, 0, 100, mosaic=True, train=True, cache=cache)
+    else:
+        YoloDatasets = {
+            'YOLOV5': lambda: __import__('yolov5.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+            'YOLOV5-V61': lambda: __import__('yolov5v61.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+            'YOLOV7': lambda: __import__('yolov7.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+        }[opt.yolo]()
+        dataset = YoloDatasets(lines, input_shape, load_anchors(ANCHORS[opt.yolo]), 1, opt.num_classes, ANCHOR_MASK, 0, 100,
+                               mosaic=True, mixup=True, mosaic_prob=1, mixup_prob=1, train=True, cache=cache)
+    ops = {
+        'random': lambda line, lines: dataset.get_random_data(line, input_shape),
+        'letterbox': lambda line, lines: dataset.get_random_data(line, input_shape, random=False),
+        'mosaic': lambda line, lines: dataset.get_random_data_with_Mosaic(lines, input_shape),
+    }
+    if hasattr(dataset, 'get_random_data_with_MixUp'):
+        def mixup(line, lines):
+            image, box = dataset.get_random_data_with_Mosaic(lines, input_shape)
+            image_2, box_2 = dataset.get_random_data(line, input_shape)
+            return dataset.get_random_data_with_MixUp(image, box, image_2, box_2)
+        ops['mosaic+mixup'] = mixup
+    return ops
+
+
+def draw(image, box):
+    '''
+    0~1或者0~255的RGB图像画出真实框，返回BGR的uint8
+    '''
+    image = np.asarray(image, np.float32)
+    if image.max() <= 1:
+        image = image * 255
+    image = cv2.cvtColor(np.clip(image, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR)
+    for x1, y1, x2, y2, _ in np.asarray(box)[np.asarray(box)[:, 2] > 0].astype(int):
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+    return image
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7'])
+    parser.add_argument('--annotation', required=True, help='annotation file, one "path x1,y1,x2,y2,class ..." per line')
+    parser.add_argument('--num_classes', type=int, default=20)
+    parser.add_argument('--input_size', type=int, default=640)
+    parser.add_argument('--num_samples', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache_dir', default=None, help='read the images from an image cache in this directory')
+    parser.add_argument('--cache_max_side', type=int, default=1024)
+    parser.add_argument('--save_dir', default=None, help='save a few augmented images with their boxes drawn')
+    parser.add_argument('--num_save', type=int, default=4)
+    opt = parser.parse_args()
+
+    lines = [line for line in open(opt.annotation, encoding='utf-8').read().splitlines() if line.strip()]
+    cache = None
+    if opt.cache_dir:
+        from components.image_cache import ImageCache
+        cache = ImageCache(lines, opt.cache_dir, opt.cache_max_side)
+    if opt.save_dir:
+        os.makedirs(opt.save_dir, exist_ok=True)
+    print('{:<16s} {:>12s} {:>14s}'.format('augmentation', 'ms/sample', 'samples/sec'))
+    for name, op in augmentations(opt, lines, cache).items():
+        random.seed(opt.seed)
+        np.random.seed(opt.seed)
+        picks = [(lines[i % len(lines)], random.sample(lines, min(4, len(lines))) * (4 // min(4, len(lines))))
+                 for i in range(opt.num_samples)]
+        op(*picks[0])
+        elapsed = 0
+        for i, (line, four) in enumerate(picks):
+            t0 = time.time()
+            image, box = op(line, four)
+            elapsed += time.time() - t0
+            if opt.save_dir and i < opt.num_save:
+                cv2.imwrite(os.path.join(opt.save_dir, '{}_{}.png'.format(name.replace('+', '_'), i)), draw(image, box))
+        print('{:<16s} {:12.2f} {:14.1f}'.format(name, elapsed / opt.num_samples * 1000, opt.num_samples / elapsed))
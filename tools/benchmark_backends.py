@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import numpy as np
+
+from cfg import YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig
+from inference.backends import backend_type
+from inference.models import load_model
+
+# 同一份权重的不同格式(.h5、SavedModel、.onnx、.tflite)逐个加载，对比加载时间、forward以及predict_frames的耗时；
+# onnx模型另外对比onnxruntime的会话设置：默认设置、并行执行以及io_binding
+# 例如：python tools/benchmark_backends.py --yolo YOLOV5 --models ./model/voc.h5 ./model/voc_inference ./model/voc.onnx
+
+ONNX_VARIANTS = [
+    ('ort default', {}),
+    ('ort no graph opt', dict(graph_optimization='disable')),
+    ('ort parallel', dict(execution_mode='parallel')),
+    ('ort io_binding', dict(io_binding=True)),
+]
+
+
+def timeit(func, repeat):
+    func()
+    times = []
+    for _ in range(repeat):
+        t1 = time.time()
+        func()
+        times.append(time.time() - t1)
+    return float(np.median(times)) * 1000
+
+
+def benchmark(yolo_type, model_path, onnx_options, batch_sizes, frame_size, repeat):
+    for config in (YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig):
+        config.onnx_options = onnx_options
+        config.warmup_batch_sizes = []
+        config.warmup_frame_shapes = []
+    t1 = time.time()
+    yolo = load_model(yolo_type, model_path)
+    result = {'load': time.time() - t1}
+    h, w = input_hw(yolo)
+    dtype = np.uint8 if getattr(yolo, 'onnx_preprocess', None) is not None else np.float32
+    rng = np.random.RandomState(0)
+    for batch_size in batch_sizes:
+        image_data = (rng.rand(batch_size, h, w, 3) * 255).astype(dtype)
+        input_image_shapes = np.tile(np.array([[frame_size[1], frame_size[0]]], np.float32), (batch_size, 1))
+        result['forward {}'.format(batch_size)] = timeit(lambda: yolo.forward(image_data, input_image_shapes), repeat)
+    frames = np.zeros([batch_sizes[-1], frame_size[1], frame_size[0], 3], np.uint8)
+    result['predict_frames {}'.format(batch_sizes[-1])] = timeit(lambda: yolo.predict_frames(frames), repeat)
+    return result
+
+
+def input_hw(yolo):
+    if hasattr(yolo, 'input_shape'):
+        return tuple(yolo.input_shape)
+    return yolo.input_size[1], yolo.input_size[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--models', nargs='+', required=True, help='the same weights as .h5, SavedModel, .onnx or .tflite')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--frame_size', type=int, nargs=2, default=[1280, 720], help='w h of the video frames')
+    parser.add_argument('--repeat', type=int, default=20)
+    opt = parser.parse_args()
+
+    # .h5、SavedModel以及.tflite使用cfg中的设置
+    default_options = YOLOV5Config.onnx_options
+    runs = []
+    for model_path in opt.models:
+        if backend_type(model_path) == 'onnx':
+            runs += [(model_path, name, options) for name, options in ONNX_VARIANTS]
+        else:
+            runs.append((model_path, backend_type(model_path), default_options))
+    results = [(model_path, name, benchmark(opt.yolo, model_path, options, opt.batch_sizes, opt.frame_size, opt.repeat))
+               for model_path, name, options in runs]
+    keys = list(results[0][2])
+    print('{:<18s} {:>8s}'.format('backend', 'load s') + ''.join(' {:>17s}'.format(key + ' ms') for key in keys[1:]) + '  model')
+    for model_path, name, result in results:
+        print('{:<18s} {:8.2f}'.format(name, result['load']) + ''.join(' {:17.1f}'.format(result[key]) for key in keys[1:]) + '  ' + model_path)
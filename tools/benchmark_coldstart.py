@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+# 冷启动以及第一帧延迟：每种配置在新的python进程中运行，依次统计导入、加载模型、预热、第一帧以及之后各帧的耗时，
+# 以及每个tf.function的trace次数；对比不预热、加载时预热、第一次保存推理缓存以及直接加载推理缓存
+
+
+def child(opt):
+    t0 = time.time()
+    import numpy as np
+    from cfg import YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig
+    from inference.models import load_model
+    t_import = time.time() - t0
+    configs = [YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig]
+    for config in configs:
+        config.warmup_batch_sizes = [1] if opt.warmup else []
+        config.warmup_frame_shapes = [(1, opt.frame_size[1], opt.frame_size[0])] if opt.warmup else []
+        config.model_cache = bool(opt.cache)
+    yolo = load_model(opt.yolo, opt.model)
+    frame = np.zeros([opt.frame_size[1], opt.frame_size[0], 3], np.uint8)
+    frame_times = []
+    for _ in range(opt.frames):
+        t1 = time.time()
+        yolo.predict_frame(frame)
+        frame_times.append(time.time() - t1)
+    print(json.dumps({
+        'import': t_import,
+        'load': yolo.load_time,
+        'warmup': sum(t for _, t in yolo.warmup_times),
+        'first_frame': frame_times[0],
+        'next_frames': float(np.median(frame_times[1:])) if len(frame_times) > 1 else 0.,
+        'time_to_first_result': time.time() - t0 - sum(frame_times[1:]),
+        'traces': {counter.name: counter.count for counter in getattr(yolo, 'trace_counters', [])},
+        'startup': yolo.startup.phases,
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--frame_size', type=int, nargs=2, default=[1280, 720], help='w h of the video frames')
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=None, help='internal: run one configuration in this process')
+    parser.add_argument('--cache', type=int, default=0, help='internal: use the inference cache')
+    opt = parser.parse_args()
+
+    if opt.warmup is not None:
+        child(opt)
+        sys.exit(0)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    # .h5的推理缓存：先删除旧的缓存，第一次运行时保存，第二次运行时直接加载
+    from inference.model_cache import cache_path
+    configurations = [('no warm-up', 0, 0), ('warm-up', 1, 0)]
+    if opt.model.lower().endswith('.h5'):
+        shutil.rmtree(cache_path(opt.model), ignore_errors=True)
+        configurations += [('save cache', 1, 1), ('load cache', 1, 1)]
+    print('{:<12s} {:>8s} {:>8s} {:>8s} {:>12s} {:>12s} {:>14s}  {}'.format(
+        'run', 'import s', 'load s', 'warmup s', 'first frame', 'next frames', 'first result s', 'traces'))
+    phases = []
+    for name, warmup, cache in configurations:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--yolo', opt.yolo, '--model', opt.model,
+                                 '--frame_size', str(opt.frame_size[0]), str(opt.frame_size[1]), '--frames', str(opt.frames),
+                                 '--warmup', str(warmup), '--cache', str(cache)], env=env, cwd=root, stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        print('{:<12s} {:8.2f} {:8.2f} {:8.2f} {:9.1f} ms {:9.1f} ms {:14.2f}  {}'.format(
+            name, result['import'], result['load'], result['warmup'], result['first_frame'] * 1000,
+            result['next_frames'] * 1000, result['time_to_first_result'], result['traces']))
+        phases.append((name, result['startup']))
+    print()
+    for name, startup in phases:
+        print('{:<12s} {}'.format(name, ', '.join('{} {:.2f}s'.format(phase, seconds) for phase, seconds in startup)))
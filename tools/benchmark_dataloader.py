@@ -0,0 +1,94 @@
+import argparse
+import time
+
+import numpy as np
+
+# 训练数据输入管线的吞吐量：原来的加载方式(YOLOV4的data_generator，其余算法的YoloDatasets)与tf.data管线
+# (components/data_pipeline.py，不同的并行数)读取相同数量的batch，统计images/sec以及第一个batch的耗时，例如：
+# python tools/benchmark_dataloader.py --yolo YOLOV5 --annotation ./VOC2007/train.txt --num_classes 20 --batch_size 16 \
+#     --num_batches 50 --workers 0 1 4
+# --cache_dir时另外统计使用图像缓存(components/image_cache.py，第一次运行时建立)的原来的加载方式以及tf.data管线
+ANCHORS = {
+    'YOLOV4': './yolov4/data/yolo_anchors.txt',
+    'YOLOV5': './yolov5/data/yolov5_anchors.txt',
+    'YOLOV5-V61': './yolov5/data/yolov5_anchors.txt',
+    'YOLOV7': './yolov7/data/yolo_anchors.txt',
+}
+ANCHOR_MASK = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
+
+
+def load_anchors(path):
+    with open(path) as f:
+        return np.array([float(x) for x in f.readline().split(',')]).reshape(-1, 2)
+
+
+def loader(opt, lines, cache=None):
+    '''
+    返回(原来的加载方式：每次返回一个batch的迭代器, 用于tf.data的dataset)
+    '''
+    input_shape = (opt.input_size, opt.input_size)
+    if opt.yolo == 'YOLOV4':
+        from yolov4.lib.dataloader import YoloSamples, data_generator
+        anchors = load_anchors(ANCHORS[opt.yolo])
+        generator = data_generator(list(lines), opt.batch_size, input_shape, anchors, opt.num_classes, mosaic=opt.mosaic, random=True, eager=False, cache=cache)
+        return generator, YoloSamples(lines, opt.batch_size, input_shape, anchors, opt.num_classes, mosaic=opt.mosaic, random=True, cache=cache)
+    if opt.yolo == 'YOLOX':
+        from yolox.lib.dataloader import YoloDatasets
+        dataset = YoloDatasets(lines, input_shape, opt.batch_size, opt.num_classes, 0, 100, mosaic=opt.mosaic, train=True, cache=cache)
+    else:
+        YoloDatasets = {
+            'YOLOV5': lambda: __import__('yolov5.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+            'YOLOV5-V61': lambda: __import__('yolov5v61.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+            'YOLOV7': lambda: __import__('yolov7.lib.dataloader', fromlist=['YoloDatasets']).YoloDatasets,
+        }[opt.yolo]()
+        dataset = YoloDatasets(lines, input_shape, load_anchors(ANCHORS[opt.yolo]), opt.batch_size, opt.num_classes, ANCHOR_MASK, 0, 100,
+                               mosaic=opt.mosaic, mixup=opt.mosaic, mosaic_prob=0.5, mixup_prob=0.5, train=True, cache=cache)
+    return (dataset[i % len(dataset)] for i in range(10 ** 9)), dataset
+
+
+def throughput(batches, num_batches, batch_size):
+    t0 = time.time()
+    first = None
+    for i, _ in enumerate(batches):
+        if first is None:
+            first = time.time() - t0
+        if i + 1 >= num_batches:
+            break
+    return num_batches * batch_size / (time.time() - t0), first
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7'])
+    parser.add_argument('--annotation', required=True, help='annotation file, one "path x1,y1,x2,y2,class ..." per line')
+    parser.add_argument('--num_classes', type=int, default=20)
+    parser.add_argument('--input_size', type=int, default=640)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_batches', type=int, default=50)
+    parser.add_argument('--mosaic', type=int, default=1)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0], help='tf.data parallel calls to compare, 0 for AUTOTUNE')
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache_dir', default=None, help='also measure the loaders reading from an image cache in this directory')
+    parser.add_argument('--cache_max_side', type=int, default=1024)
+    opt = parser.parse_args()
+
+    lines = [line for line in open(opt.annotation, encoding='utf-8').read().splitlines() if line.strip()]
+    epochs = -(-opt.num_batches // max(1, len(lines) // opt.batch_size))
+    from components.data_pipeline import build_dataset
+    caches = [None]
+    if opt.cache_dir:
+        from components.image_cache import ImageCache
+        caches.append(ImageCache(lines, opt.cache_dir, opt.cache_max_side))
+    print('{:<28s} {:>12s} {:>14s} {:>8s}'.format('loader', 'images/sec', 'first batch s', 'speedup'))
+    baseline = None
+    for cache in caches:
+        suffix = ' +cache' if cache is not None else ''
+        generator, dataset = loader(opt, lines, cache)
+        speed, first = throughput(generator, opt.num_batches, opt.batch_size)
+        baseline = baseline or speed
+        print('{:<28s} {:12.1f} {:14.2f} {:7.2f}x'.format('generator' + suffix, speed, first, speed / baseline))
+        for workers in opt.workers:
+            data = build_dataset(dataset, opt.batch_size, 0, epochs, shuffle=True, seed=opt.seed, shards=opt.shards, workers=workers or None)
+            speed, first = throughput(data, opt.num_batches, opt.batch_size)
+            print('{:<28s} {:12.1f} {:14.2f} {:7.2f}x'.format('tf.data workers={}'.format(workers or 'auto') + suffix, speed, first, speed / baseline))
@@ -0,0 +1,73 @@
+import argparse
+import time
+
+import numpy as np
+
+from inference.nms import multiclass_nms
+from inference.priors import get_anchor_priors, prior_cache_info
+from yolov5.lib.tools import DecodeBox, DecodeBox_numpy, sigmoid, yolo_correct_boxes_numpy
+from yolox.lib.utils_box import DecodeBox as DecodeBox_yolox
+from yolox.lib.utils_box import DecodeBox_numpy as DecodeBox_numpy_yolox
+
+# 对比先筛选候选框再解码与全部解码的耗时，640x640输入、80类；tf为先按confidence筛选，再按pre_nms_topk限制数量
+
+'''
+先对全部先验框解码坐标再按置信度筛选，作为参考实现
+'''
+def decode_all_numpy(outputs, anchors, num_classes, image_shape, input_shape, anchor_mask, max_boxes, confidence, nms_iou):
+    feats = sigmoid(np.concatenate([np.reshape(output, [-1, num_classes + 5]) for output in outputs], axis=0))
+    priors = get_anchor_priors([np.shape(output)[1:3] for output in outputs], anchors, anchor_mask)
+    box_xy = (feats[:, :2] * 2 - 0.5 + priors[:, 0:2]) / priors[:, 2:4]
+    box_wh = (feats[:, 2:4] * 2) ** 2 * priors[:, 4:6] / np.array(input_shape[::-1], np.float32)
+    boxes = yolo_correct_boxes_numpy(box_xy, box_wh, input_shape, image_shape, True)
+    box_scores = feats[:, 4:5] * feats[:, 5:]
+    return multiclass_nms(np.reshape(boxes, [-1, 4]), box_scores, confidence, nms_iou, max_boxes)
+
+
+def timeit(func, repeat):
+    func()
+    t1 = time.time()
+    for _ in range(repeat):
+        func()
+    return (time.time() - t1) / repeat * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--confidence', type=float, default=0.3)
+    parser.add_argument('--pre_nms_topk', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=10)
+    opt = parser.parse_args()
+
+    num_classes = 80
+    input_shape = [640, 640]
+    image_shape = np.array([[720, 1280]], np.float32)
+    anchor_mask = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
+    anchors = np.array([[10, 13], [16, 30], [33, 23], [30, 61], [62, 45], [59, 119], [116, 90], [156, 198], [373, 326]], np.float32)
+    rng = np.random.RandomState(0)
+    # 大部分先验框的objectness较低，与真实模型的输出分布接近
+    outputs = [(rng.randn(1, s, s, 3 * (5 + num_classes)) * 1.5 - 4).astype(np.float32) for s in (20, 40, 80)]
+    yolox_outputs = [(rng.randn(1, s, s, 5 + num_classes) * 1.5 - 4).astype(np.float32) for s in (80, 40, 20)]
+    kwargs = dict(anchor_mask=anchor_mask, max_boxes=100, confidence=opt.confidence, nms_iou=0.5)
+
+    print('yolov5 numpy decode all     : {:8.2f} ms'.format(timeit(
+        lambda: decode_all_numpy(outputs, anchors, num_classes, image_shape, input_shape, **kwargs), opt.repeat)))
+    print('yolov5 numpy filter + decode: {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox_numpy(outputs, anchors, num_classes, image_shape, input_shape, pre_nms_topk=opt.pre_nms_topk, **kwargs), opt.repeat)))
+    print('yolov5 tf filter + decode   : {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox(outputs, anchors, num_classes, image_shape, input_shape, **kwargs), opt.repeat)))
+    print('yolov5 tf filter + top-k    : {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox(outputs, anchors, num_classes, image_shape, input_shape, pre_nms_topk=opt.pre_nms_topk, **kwargs), opt.repeat)))
+
+    class_names = list(range(num_classes))
+    print('yolox  numpy filter + decode: {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox_numpy_yolox(yolox_outputs, image_shape, input_shape, class_names, confidence=opt.confidence,
+                                      nms_iou=0.5, pre_nms_topk=opt.pre_nms_topk), opt.repeat)))
+    print('yolox  tf filter + decode   : {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox_yolox(yolox_outputs + [image_shape], num_classes, input_shape, confidence=opt.confidence, nms_iou=0.5), opt.repeat)))
+    print('yolox  tf filter + top-k    : {:8.2f} ms'.format(timeit(
+        lambda: DecodeBox_yolox(yolox_outputs + [image_shape], num_classes, input_shape, confidence=opt.confidence, nms_iou=0.5,
+                                pre_nms_topk=opt.pre_nms_topk), opt.repeat)))
+    # 网格只在第一次遇到该输入尺寸时构建
+    hits, misses, size = prior_cache_info()
+    print('prior cache: {} hits, {} builds, {} entries'.format(hits, misses, size))
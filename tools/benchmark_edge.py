@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# 边缘设备(只有CPU)上TFLite与keras(.h5)的对比：每个模型、线程数以及是否使用XNNPACK在新的python进程中运行，
+# 统计启动时间(导入以及加载模型，包括预热)、第一张图像的耗时、常驻内存(RSS，运行之后以及峰值)以及同一组图像的FPS，
+# FPS与第一行(一般为keras模型)对比，例如：
+# python tools/benchmark_edge.py --yolo YOLOV5 --models ./model/voc_yolov5.h5 ./model/voc_yolov5.tflite ./model/voc_yolov5_e2e.tflite \
+#     --images ./VOC2007/JPEGImages --num_images 50 --threads 1 4
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def rss_mb():
+    '''
+    当前以及峰值常驻内存(MB)：linux读取/proc/self/status，其余系统只能得到峰值
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(status['VmRSS'].split()[0]) / 1024, int(status['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+        return peak, peak
+
+
+def image_paths(images, num_images):
+    # 图像目录或者每行一个图像路径的文件
+    if os.path.isdir(images):
+        paths = [os.path.join(images, name) for name in sorted(os.listdir(images)) if name.lower().endswith(IMAGE_SUFFIXES)]
+    else:
+        paths = [line.split()[0] for line in open(images).read().strip().splitlines()]
+    return paths[:num_images]
+
+
+def child(opt):
+    t0 = time.time()
+    if opt.thread:
+        from inference.threads import set_thread_budget
+        set_thread_budget(opt.thread)
+    from cfg import YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig
+    from inference.models import load_model
+    for config in [YOLOV4Config, YOLOV5Config, YOLOV7Config, YOLOXConfig]:
+        config.model_cache = bool(opt.cache)
+        config.tflite_options = dict(config.tflite_options, xnnpack=bool(opt.xnnpack))
+    yolo = load_model(opt.yolo, opt.model)
+    startup = time.time() - t0
+    from PIL import Image
+    images = [Image.open(path).convert('RGB') for path in image_paths(opt.images, opt.num_images)]
+    t1 = time.time()
+    yolo.predict(images[0])
+    first = time.time() - t1
+    detections = 0
+    t2 = time.time()
+    for image in images:
+        detections += len(yolo.predict(image).scores)
+    fps = len(images) / (time.time() - t2)
+    rss, peak = rss_mb()
+    print(json.dumps({
+        'backend': type(yolo.backend).__name__,
+        'startup': startup,
+        'first': first,
+        'fps': fps,
+        'rss': rss,
+        'peak': peak,
+        'detections': detections / len(images),
+    }))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--models', nargs='+', required=True, help='keras model (.h5) first, then the .tflite models')
+    parser.add_argument('--images', required=True, help='image folder or a file with one image path per line')
+    parser.add_argument('--num_images', type=int, default=50)
+    parser.add_argument('--threads', type=int, nargs='+', default=[0], help='thread budgets to compare, 0 for the default')
+    parser.add_argument('--no_xnnpack_runs', action='store_true', help='do not also run the .tflite models without XNNPACK')
+    parser.add_argument('--cache', type=int, default=0, help='use the inference cache for .h5 models')
+    parser.add_argument('--thread', type=int, default=None, help='internal: run one configuration in this process')
+    parser.add_argument('--model', default=None, help='internal')
+    parser.add_argument('--xnnpack', type=int, default=1, help='internal')
+    opt = parser.parse_args()
+
+    if opt.model is not None:
+        child(opt)
+        sys.exit(0)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    print('{:<40s} {:>7s} {:>7s} {:>9s} {:>12s} {:>8s} {:>8s} {:>9s} {:>9s} {:>8s}'.format(
+        'model', 'threads', 'xnnpack', 'startup s', 'first image', 'FPS', 'vs first', 'RSS MB', 'peak MB', 'dets/img'))
+    baseline = None
+    for model_path in opt.models:
+        tflite = model_path.lower().endswith('.tflite')
+        for thread in opt.threads:
+            for xnnpack in ([1, 0] if tflite and not opt.no_xnnpack_runs else [1]):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--yolo', opt.yolo, '--models', model_path,
+                                         '--model', model_path, '--images', os.path.abspath(opt.images), '--num_images', str(opt.num_images),
+                                         '--thread', str(thread), '--xnnpack', str(xnnpack), '--cache', str(opt.cache)],
+                                        env=env, cwd=root, stdout=subprocess.PIPE, check=True).stdout
+                result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+                baseline = baseline or result['fps']
+                print('{:<40s} {:>7s} {:>7s} {:9.2f} {:9.1f} ms {:8.2f} {:7.2f}x {:9.1f} {:9.1f} {:8.1f}'.format(
+                    os.path.basename(os.path.normpath(model_path))[-40:], str(thread or 'default'),
+                    ('on' if xnnpack else 'off') if tflite else '-', result['startup'], result['first'] * 1000, result['fps'],
+                    result['fps'] / baseline, result['rss'], result['peak'], result['detections']))
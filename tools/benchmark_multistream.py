@@ -0,0 +1,69 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+
+from inference.streams import LiveFileCapture, MultiStreamRunner
+from yolov5.predict_yolov5 import YOLOV5
+
+# 多路视频共享一个模型：对比逐帧推理(max_batch_size=1)与跨路动态batch的各路帧率、丢帧数以及延迟
+# 未指定--sources时生成尺寸不同的合成视频，并以LiveFileCapture按实时流的节奏循环播放，模拟rtsp摄像头
+
+'''
+生成num_frames帧的合成视频，画面中有移动的色块
+'''
+def make_clip(path, size, num_frames=100, fps=25, seed=0):
+    rng = np.random.RandomState(seed)
+    w, h = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (w, h))
+    background = (rng.rand(h, w, 3) * 80).astype('uint8')
+    for i in range(num_frames):
+        frame = background.copy()
+        x = int((i * 7) % max(w - w // 4, 1))
+        cv2.rectangle(frame, (x, h // 3), (x + w // 4, h // 3 + h // 3), (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', required=True, help='yolov5 weights (.h5) or onnx')
+    parser.add_argument('--classes_path', default='yolov5/data/voc_classes.txt')
+    parser.add_argument('--anchors_path', default='yolov5/data/yolov5_anchors.txt')
+    parser.add_argument('--input_size', type=int, default=640)
+    parser.add_argument('--phi', default='s')
+    parser.add_argument('--sources', nargs='+', default=None, help='video files, cameras or rtsp streams; synthetic clips when omitted')
+    parser.add_argument('--streams', type=int, default=4, help='number of synthetic streams')
+    parser.add_argument('--fps', type=float, default=25, help='frame rate of the simulated live streams')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--max_latency', type=float, default=50, help='milliseconds')
+    parser.add_argument('--queue_size', type=int, default=2, help='per-stream frame queue; small queues keep live latency low')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    opt = parser.parse_args()
+
+    yolo = YOLOV5(model_path=opt.model, classes_path=opt.classes_path, anchors_path=opt.anchors_path,
+                  anchors_mask=[[6, 7, 8], [3, 4, 5], [0, 1, 2]], input_shape=[opt.input_size, opt.input_size],
+                  phi=opt.phi, confidence=0.5, nms_iou=0.3, max_boxes=100, letterbox_image=True)
+    paths = opt.sources
+    if paths is None:
+        sizes = [(640, 360), (1280, 720), (704, 576), (640, 480)]
+        os.makedirs('./logs/multistream', exist_ok=True)
+        paths = [make_clip('./logs/multistream/stream_{}.avi'.format(i), sizes[i % len(sizes)], fps=int(opt.fps), seed=i)
+                 for i in range(opt.streams)]
+    # 预热，避免首次推理的图构建计入统计
+    yolo.predict_frames([cv2.VideoCapture(path).read()[1] for path in paths])
+
+    for batch_size in opt.batch_sizes:
+        sources = [path if opt.sources is not None else LiveFileCapture(path, fps=opt.fps) for path in paths]
+        runner = MultiStreamRunner(yolo, sources, max_batch_size=batch_size, max_latency=opt.max_latency / 1000.,
+                                   queue_size=opt.queue_size, drop_policy='auto', draw=False)
+        stats = runner.run(duration=opt.duration)
+        total_fps = sum(stream.fps for stream in stats.streams)
+        print('max_batch_size {}, total {:.2f} fps'.format(batch_size, total_fps))
+        print(stats)
+        print()
+        for source in sources:
+            if isinstance(source, LiveFileCapture):
+                source.release()
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import numpy as np
+
+from inference.nms import nms, multiclass_nms
+
+# 对比inference.nms与原先yolox中逐个弹出下标的非极大值抑制的结果以及耗时
+
+'''
+原先yolox/lib/utils_box.py中的non_max_suppression，作为参考实现
+'''
+def reference_nms(boxes, scores, threshold):
+    ys1, xs1, ys2, xs2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (ys2 - ys1) * (xs2 - xs1)
+    scores_indexes = scores.argsort().tolist()
+    boxes_keep_index = []
+    while len(scores_indexes):
+        index = scores_indexes.pop()
+        boxes_keep_index.append(index)
+        if not len(scores_indexes):
+            break
+        others = boxes[scores_indexes]
+        inter = np.maximum(np.minimum(boxes[index, 2], others[:, 2]) - np.maximum(boxes[index, 0], others[:, 0]), 0) * \
+                np.maximum(np.minimum(boxes[index, 3], others[:, 3]) - np.maximum(boxes[index, 1], others[:, 1]), 0)
+        ious = inter / (areas[index] + areas[scores_indexes] - inter)
+        filtered_indexes = set((ious > threshold).nonzero()[0])
+        scores_indexes = [v for (i, v) in enumerate(scores_indexes) if i not in filtered_indexes]
+    return np.array(boxes_keep_index)
+
+
+def random_boxes(num_boxes, seed=0):
+    rng = np.random.RandomState(seed)
+    yx = rng.uniform(0, 640, (num_boxes, 2))
+    hw = rng.uniform(8, 160, (num_boxes, 2))
+    boxes = np.concatenate([yx, yx + hw], axis=-1).astype('float32')
+    scores = rng.uniform(0, 1, num_boxes).astype('float32')
+    return boxes, scores
+
+
+def timeit(func, repeat):
+    t1 = time.time()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.time() - t1) / repeat * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iou', type=float, default=0.5, help='nms iou threshold')
+    parser.add_argument('--max_boxes', type=int, default=100, help='max boxes per class')
+    parser.add_argument('--reference_limit', type=int, default=10000, help='skip the reference nms above this many boxes')
+    parser.add_argument('--repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    for num_boxes in [1000, 10000, 50000]:
+        boxes, scores = random_boxes(num_boxes)
+        # 不限制数量时与参考实现的结果完全一致
+        keep, _ = nms(boxes, scores, opt.iou)
+        if num_boxes <= opt.reference_limit:
+            expected, reference_ms = timeit(lambda: reference_nms(boxes, scores, opt.iou), 1)
+            assert np.array_equal(keep, expected), 'nms result mismatch at {} boxes'.format(num_boxes)
+            reference = '{:9.2f} ms'.format(reference_ms)
+        else:
+            reference = '  skipped'
+        _, full_ms = timeit(lambda: nms(boxes, scores, opt.iou), opt.repeat)
+        _, capped_ms = timeit(lambda: nms(boxes, scores, opt.iou, opt.max_boxes), opt.repeat)
+        _, diou_ms = timeit(lambda: nms(boxes, scores, opt.iou, opt.max_boxes, method='diou'), opt.repeat)
+        _, soft_ms = timeit(lambda: nms(boxes, scores, opt.iou, opt.max_boxes, method='soft', score_threshold=0.05), opt.repeat)
+        print('{:6d} boxes | reference {} | nms {:8.2f} ms | nms(max_boxes={}) {:7.2f} ms | diou {:7.2f} ms | soft {:7.2f} ms'.format(
+            num_boxes, reference, full_ms, opt.max_boxes, capped_ms, diou_ms, soft_ms))
+
+    # 80类、8400个候选框(yolox 640输入)的multiclass_nms
+    rng = np.random.RandomState(1)
+    boxes, _ = random_boxes(8400)
+    box_scores = (rng.uniform(0, 1, (8400, 80)) ** 8).astype('float32')
+    (out_boxes, out_scores, out_classes), ms = timeit(lambda: multiclass_nms(boxes, box_scores, 0.5, opt.iou, opt.max_boxes), opt.repeat)
+    print('multiclass_nms 8400x80: {} boxes in {:.2f} ms'.format(len(out_scores), ms))
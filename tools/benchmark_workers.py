@@ -0,0 +1,69 @@
+import argparse
+import os
+import time
+from glob import glob
+
+import numpy as np
+from PIL import Image
+
+from inference.models import load_model
+from inference.threads import cpu_count
+from inference.workers import WorkerPool
+
+# 多进程推理的扩展性：1/2/4/8个进程(每个进程核数/进程数个线程)的images/sec以及相对单进程的加速比
+# 模型加载时间单独统计，不计入吞吐
+
+
+'''
+生成num_images张合成图像，尺寸与常见的数据集相近
+'''
+def make_images(image_dir, num_images=64, size=(810, 1080)):
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.RandomState(0)
+    for i in range(num_images):
+        image = Image.fromarray((rng.rand(size[0] // 8, size[1] // 8, 3) * 255).astype('uint8')).resize((size[1], size[0]), Image.BICUBIC)
+        image.save(os.path.join(image_dir, '{:04d}.jpg'.format(i)))
+    return sorted(glob(os.path.join(image_dir, '*.jpg')))
+
+
+def benchmark(load_model, load_args, paths, workers_list, batch_size=8, pin_cores=False, save_dir=None):
+    results = []
+    for num_workers in workers_list:
+        t1 = time.time()
+        with WorkerPool(load_model, load_args, num_workers, batch_size=batch_size, pin_cores=pin_cores) as pool:
+            load_time = time.time() - t1
+            # 预热：每个进程的第一个batch包含计算图的构建
+            list(pool.imap(paths[:batch_size * num_workers]))
+            t2 = time.time()
+            num_images = sum(1 for _ in pool.imap(paths, save_dir=save_dir))
+            elapsed = time.time() - t2
+            results.append((num_workers, pool.threads_per_worker, load_time, num_images / elapsed))
+    base = results[0][3]
+    print('{} cores'.format(cpu_count()))
+    print('{:>8s} {:>8s} {:>8s} {:>11s} {:>8s}'.format('workers', 'threads', 'load s', 'images/sec', 'speedup'))
+    for num_workers, threads, load_time, images_per_sec in results:
+        print('{:8d} {:8d} {:8.2f} {:11.2f} {:8.2f}'.format(num_workers, threads, load_time, images_per_sec, images_per_sec / base))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--model', required=True)
+    parser.add_argument('--image_dir', default=None, help='images to run on; synthetic images when omitted')
+    parser.add_argument('--num_images', type=int, default=64, help='number of synthetic images')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--pin_cores', action='store_true', help='bind each process to its own cores')
+    parser.add_argument('--save', action='store_true', help='also draw and save the results in the workers')
+    opt = parser.parse_args()
+
+    if opt.image_dir is None:
+        paths = make_images('./logs/benchmark_workers/images', opt.num_images)
+    else:
+        paths = sorted(path for path in glob(os.path.join(opt.image_dir, '*')) if not os.path.isdir(path))
+    save_dir = None
+    if opt.save:
+        save_dir = './logs/benchmark_workers/results'
+        os.makedirs(save_dir, exist_ok=True)
+    benchmark(load_model, (opt.yolo, opt.model), paths, opt.workers, opt.batch_size, opt.pin_cores, save_dir)
@@ -0,0 +1,143 @@
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+from glob import glob
+
+import cv2
+import numpy as np
+
+# 推理服务的本地压测：concurrency个客户端线程各自循环发送请求(闭环)，统计吞吐以及客户端延迟的p50/p95/p99
+# --url：http://host:port、unix:///path/to/socket或者grpc://host:port
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def make_client(url):
+    '''
+    返回send(data)，发送编码后的图像并返回(是否成功, 检测框数量)；每个线程使用各自的连接
+    '''
+    if url.startswith('grpc://'):
+        import grpc
+        from inference.server import GRPC_PREDICT
+        channel = grpc.insecure_channel(url[len('grpc://'):])
+        predict = channel.unary_unary(GRPC_PREDICT)
+
+        def send(data):
+            try:
+                body = json.loads(predict(data))
+            except grpc.RpcError:
+                return False, 0
+            return True, len(body['detections'])
+        return send
+    if url.startswith('unix://'):
+        conn = UnixHTTPConnection(url[len('unix://'):])
+    else:
+        host = url.split('://', 1)[-1].rstrip('/')
+        conn = http.client.HTTPConnection(host, timeout=60)
+
+    def send(data):
+        conn.request('POST', '/predict', body=data, headers={'Content-Type': 'application/octet-stream'})
+        response = conn.getresponse()
+        body = json.loads(response.read())
+        return response.status == 200, len(body.get('detections', []))
+    return send
+
+
+def get_server_stats(url):
+    if url.startswith('grpc://'):
+        return None
+    conn = UnixHTTPConnection(url[len('unix://'):]) if url.startswith('unix://') else \
+        http.client.HTTPConnection(url.split('://', 1)[-1].rstrip('/'), timeout=60)
+    conn.request('GET', '/stats')
+    return json.loads(conn.getresponse().read())
+
+
+def load_images(pattern, size):
+    if pattern is None:
+        # 没有指定图像时生成一张平滑的合成图像
+        rng = np.random.RandomState(0)
+        w, h = size
+        image = cv2.resize((rng.rand(8, 8, 3) * 255).astype('uint8'), (w, h), interpolation=cv2.INTER_CUBIC)
+        return [cv2.imencode('.jpg', image)[1].tobytes()]
+    paths = sorted(glob(pattern))
+    assert len(paths) > 0, 'no image matches {}'.format(pattern)
+    return [open(path, 'rb').read() for path in paths]
+
+
+def run(url, images, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(worker_id):
+        send = make_client(url)
+        i = worker_id
+        local = []
+        local_errors = 0
+        while time.time() < deadline:
+            t1 = time.time()
+            try:
+                ok, _ = send(images[i % len(images)])
+            except Exception:
+                ok = False
+            if ok:
+                local.append(time.time() - t1)
+            else:
+                local_errors += 1
+            i += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    t1 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - t1
+    latencies = np.array(latencies) * 1000
+    result = {'concurrency': concurrency, 'requests': len(latencies), 'errors': errors[0], 'images_per_sec': len(latencies) / elapsed}
+    for p in (50, 95, 99):
+        result['latency_p{}_ms'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) > 0 else 0.
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='http://host:port, unix:///path or grpc://host:port')
+    parser.add_argument('--image', default=None, help='image path or glob pattern; a synthetic image when omitted')
+    parser.add_argument('--image_size', type=int, nargs=2, default=[1280, 720], help='w h of the synthetic image')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='client threads, one run per value')
+    parser.add_argument('--duration', type=float, default=20, help='seconds per run')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of warm-up before the first run')
+    opt = parser.parse_args()
+
+    images = load_images(opt.image, opt.image_size)
+    if opt.warmup > 0:
+        run(opt.url, images, max(opt.concurrency), opt.warmup)
+    print('{:>11s} {:>9s} {:>7s} {:>11s} {:>9s} {:>9s} {:>9s} {:>10s}'.format(
+        'concurrency', 'requests', 'errors', 'images/sec', 'p50 ms', 'p95 ms', 'p99 ms', 'batch size'))
+    for concurrency in opt.concurrency:
+        before = get_server_stats(opt.url)
+        result = run(opt.url, images, concurrency, opt.duration)
+        after = get_server_stats(opt.url)
+        batch_size = float('nan')
+        if before is not None and after['batches'] > before['batches']:
+            batch_size = (after['requests'] - before['requests']) / (after['batches'] - before['batches'])
+        print('{:11d} {:9d} {:7d} {:11.2f} {:9.2f} {:9.2f} {:9.2f} {:10.2f}'.format(
+            concurrency, result['requests'], result['errors'], result['images_per_sec'],
+            result['latency_p50_ms'], result['latency_p95_ms'], result['latency_p99_ms'], batch_size))
@@ -0,0 +1,70 @@
+import argparse
+import os
+
+from quantization_report import evaluate_map, latency, model_size
+
+# 剪枝前后的计算量、精度与速度：每个.h5加载后(fuse_model折叠BN并删除通道剪枝之后恒为0的通道)用
+# yolov7/lib/tools.py的net_flops统计固定输入尺寸下的GFLOPs，同时统计参数量、卷积权重中0的比例、mAP以及单张图像的CPU延迟，
+# 与第一个模型(一般为剪枝前的权重)对比；ground truth需要先用evaluate/get_gt_txt.py生成，例如：
+# python tools/pruning_report.py --yolo YOLOV5 --models ./model/voc.h5 ./yolov5/logs/voc_pruned.h5 \
+#     --testset ./VOC2007/ImageSets/Main/test.txt --image_path ./VOC2007/JPEGImages/ --gt_folder ./result/gt_folder
+
+
+def model_flops(model, input_size):
+    '''
+    net_flops按每一层第一次调用时的输入输出尺寸计算，先把模型复制到固定尺寸的输入上
+    Lambda以及不支持get_config的层直接复用
+    '''
+    import tensorflow as tf
+    from yolov7.lib.tools import net_flops
+
+    def clone_function(layer):
+        if type(layer).__name__ == 'Lambda':
+            return layer
+        try:
+            return layer.__class__.from_config(layer.get_config())
+        except (NotImplementedError, TypeError, ValueError):
+            return layer
+    model = tf.keras.models.clone_model(model, input_tensors=tf.keras.Input((input_size, input_size, 3)), clone_function=clone_function)
+    return net_flops(model, print_result=False) / 1e9
+
+
+def weight_zeros(model):
+    kernels = [w for w in model.get_weights() if w.ndim >= 2]
+    return sum(int((w == 0).sum()) for w in kernels) / max(sum(w.size for w in kernels), 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOV5-V61', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--models', nargs='+', required=True, help='weights before pruning first, then the pruned weights (.h5)')
+    parser.add_argument('--input_size', type=int, default=640, help='input size used for the FLOPs')
+    parser.add_argument('--testset', required=True)
+    parser.add_argument('--image_path', required=True)
+    parser.add_argument('--gt_folder', required=True, help='output of evaluate/get_gt_txt.py')
+    parser.add_argument('--pr_root', default='./result/pruning')
+    parser.add_argument('--minoverlap', type=float, default=0.5)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=50, help='number of test images used for the latency')
+    opt = parser.parse_args()
+
+    from cfg.base import Config
+    from inference.models import load_model
+    # 不使用推理缓存，每次从.h5构建网络、折叠BN并删除通道
+    Config.model_cache = False
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    results = []
+    for model_path in opt.models:
+        yolo = load_model(opt.yolo, model_path)
+        results.append((model_path, model_size(model_path) / 2 ** 20, model_flops(yolo.model, opt.input_size),
+                        yolo.model.count_params() / 1e6, weight_zeros(yolo.model),
+                        evaluate_map(opt, model_path, root, env), latency(opt, model_path, yolo)))
+    base_flops, base_map, base_latency = results[0][2], results[0][5], results[0][6]
+    print('{:<40s} {:>9s} {:>8s} {:>9s} {:>9s} {:>8s} {:>8s} {:>11s} {:>8s}'.format(
+        'model', 'size MB', 'GFLOPs', 'params M', 'zeros %', 'mAP %', 'delta', 'latency ms', 'speedup'))
+    for model_path, size, flops, params, zeros, mAP, ms in results:
+        print('{:<40s} {:9.1f} {:8.2f} {:9.2f} {:9.1f} {:8.2f} {:+8.2f} {:11.1f} {:7.2f}x'.format(
+            os.path.basename(os.path.normpath(model_path)), size, flops, params, zeros * 100, mAP, mAP - base_map, ms, base_latency / ms))
+    print('FLOPs reduction: {}'.format(', '.join('{:.2f}x'.format(base_flops / r[2]) for r in results[1:]) or '-'))
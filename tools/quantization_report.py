@@ -0,0 +1,74 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# 量化模型的精度与速度：每个模型先用evaluate/get_dr_txt.py生成检测结果，再用evaluate/get_map.py计算mAP，
+# 然后在本进程中加载模型统计单张图像的CPU延迟，与第一个模型(一般为fp32)对比
+# ground truth需要先用evaluate/get_gt_txt.py生成，例如：
+# python tools/quantization_report.py --yolo YOLOV5 --models ./model/voc.onnx ./model/voc_int8.onnx ./model/voc_int8.tflite \
+#     --testset ./VOC2007/ImageSets/Main/test.txt --image_path ./VOC2007/JPEGImages/ --gt_folder ./result/gt_folder
+
+
+def model_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path)
+
+
+def evaluate_map(opt, model_path, root, env):
+    name = os.path.basename(os.path.normpath(model_path))
+    pr_folder = os.path.abspath(os.path.join(opt.pr_root, name))
+    subprocess.run([sys.executable, os.path.join(root, 'evaluate', 'get_dr_txt.py'), '--model', opt.yolo, '--model_path', model_path,
+                    '--testset', opt.testset, '--pr_folder', pr_folder, '--image_path', opt.image_path,
+                    '--batch_size', str(opt.batch_size)], env=env, cwd=root, check=True)
+    output = subprocess.run([sys.executable, os.path.join(root, 'evaluate', 'get_map.py'), '-na', '-np', '-q',
+                             '--GT_PATH', os.path.abspath(opt.gt_folder), '--DR_PATH', pr_folder,
+                             '--IMG_PATH', os.path.abspath(opt.image_path), '--MINOVERLAP', str(opt.minoverlap)],
+                            env=env, cwd=root, stdout=subprocess.PIPE, check=True).stdout.decode('utf-8')
+    return float(re.findall(r'mAP = ([\d.]+)%', output)[-1])
+
+
+def latency(opt, model_path, yolo=None):
+    if yolo is None:
+        from inference.models import load_model
+        yolo = load_model(opt.yolo, model_path)
+    image_ids = open(opt.testset).read().strip().split()[:opt.repeat]
+    from PIL import Image
+    images = [Image.open(os.path.join(opt.image_path, image_id + '.jpg')) for image_id in image_ids]
+    yolo.predict(images[0])
+    times = []
+    for image in images:
+        t1 = time.time()
+        yolo.predict(image)
+        times.append(time.time() - t1)
+    return float(np.median(times)) * 1000
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--yolo', default='YOLOV5', choices=['YOLOV4', 'YOLOV4-TINY', 'YOLOV5', 'YOLOX', 'YOLOV7', 'YOLOV7-TINY'])
+    parser.add_argument('--models', nargs='+', required=True, help='fp32 model first, then the quantized models (.onnx, .tflite)')
+    parser.add_argument('--testset', required=True)
+    parser.add_argument('--image_path', required=True)
+    parser.add_argument('--gt_folder', required=True, help='output of evaluate/get_gt_txt.py')
+    parser.add_argument('--pr_root', default='./result/quantization')
+    parser.add_argument('--minoverlap', type=float, default=0.5)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=50, help='number of test images used for the latency')
+    opt = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    results = []
+    for model_path in opt.models:
+        results.append((model_path, model_size(model_path) / 2 ** 20, evaluate_map(opt, model_path, root, env), latency(opt, model_path)))
+    base_map, base_latency = results[0][2], results[0][3]
+    print('{:<40s} {:>9s} {:>8s} {:>8s} {:>11s} {:>8s}'.format('model', 'size MB', 'mAP %', 'delta', 'latency ms', 'speedup'))
+    for model_path, size, mAP, ms in results:
+        print('{:<40s} {:9.1f} {:8.2f} {:+8.2f} {:11.1f} {:7.2f}x'.format(
+            os.path.basename(os.path.normpath(model_path)), size, mAP, mAP - base_map, ms, base_latency / ms))
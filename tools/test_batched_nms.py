@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import backend as K
+
+from inference.batched_nms import TFLITE_NMS_CANDIDATES, batched_nms, batched_nms_tflite, unpad_detections
+
+# 测试batched_nms与原先逐类别非极大值抑制的一致性以及耗时，以及TFLite实现(batched_nms_tflite)在检测框很多的图像上与batched_nms一致
+
+'''
+原先DecodeBox/yolo_eval中的逐类别非极大值抑制，作为参考实现
+'''
+def reference_nms(boxes, box_scores, num_classes, max_boxes, score_threshold, iou_threshold):
+    mask = box_scores > score_threshold
+    max_boxes_tensor = K.constant(max_boxes, dtype='int32')
+    boxes_out = []
+    scores_out = []
+    classes_out = []
+    for c in range(num_classes):
+        class_boxes = tf.boolean_mask(boxes, mask[:, c])
+        class_box_scores = tf.boolean_mask(box_scores[:, c], mask[:, c])
+        nms_index = tf.image.non_max_suppression(class_boxes, class_box_scores, max_boxes_tensor, iou_threshold=iou_threshold)
+        boxes_out.append(K.gather(class_boxes, nms_index))
+        scores_out.append(K.gather(class_box_scores, nms_index))
+        classes_out.append(K.ones_like(K.gather(class_box_scores, nms_index), 'int32') * c)
+    return K.concatenate(boxes_out, axis=0), K.concatenate(scores_out, axis=0), K.concatenate(classes_out, axis=0)
+
+
+def random_inputs(batch_size, num_boxes, num_classes, seed=0):
+    rng = np.random.RandomState(seed)
+    yx = rng.uniform(0, 600, (batch_size, num_boxes, 2))
+    hw = rng.uniform(10, 200, (batch_size, num_boxes, 2))
+    boxes = np.concatenate([yx, yx + hw], axis=-1).astype('float32')
+    box_scores = (rng.uniform(0, 1, (batch_size, num_boxes, num_classes)) ** 4).astype('float32')
+    return boxes, box_scores
+
+
+def as_sorted(boxes, scores, classes):
+    result = np.concatenate([np.asarray(classes, 'float32')[:, None], np.asarray(scores)[:, None], np.asarray(boxes)], axis=-1)
+    return result[np.lexsort(result.T[::-1])]
+
+
+batch_size, num_boxes, num_classes = 4, 10647, 20
+max_boxes, score_threshold, iou_threshold = 100, 0.3, 0.5
+boxes, box_scores = random_inputs(batch_size, num_boxes, num_classes)
+
+nmsed = batched_nms(boxes, box_scores, max_boxes, score_threshold, iou_threshold)
+for i in range(batch_size):
+    expected = as_sorted(*reference_nms(boxes[i], box_scores[i], num_classes, max_boxes, score_threshold, iou_threshold))
+    actual = as_sorted(*unpad_detections(*nmsed, index=i))
+    assert expected.shape == actual.shape, (expected.shape, actual.shape)
+    assert np.allclose(expected, actual, atol=1e-5)
+print('batched_nms matches the per-class loop on {} images'.format(batch_size))
+
+test_interval = 20
+t1 = time.time()
+for _ in range(test_interval):
+    for i in range(batch_size):
+        reference_nms(boxes[i], box_scores[i], num_classes, max_boxes, score_threshold, iou_threshold)
+t2 = time.time()
+for _ in range(test_interval):
+    batched_nms(boxes, box_scores, max_boxes, score_threshold, iou_threshold)
+t3 = time.time()
+print('per-class loop: {:.2f} ms/batch'.format((t2 - t1) / test_interval * 1000))
+print('batched_nms   : {:.2f} ms/batch'.format((t3 - t2) / test_interval * 1000))
+
+# 检测框很多的图像：每个类别通过非极大值抑制的检测框超过max_boxes(每个类别的上限生效)，
+# 高于阈值的(检测框, 类别)不超过TFLITE_NMS_CANDIDATES个
+busy_boxes, busy_scores = random_inputs(2, 1500, 3, seed=1)
+busy_scores = np.random.RandomState(1).uniform(0, 1, busy_scores.shape).astype('float32')
+busy_boxes[..., 2:] = busy_boxes[..., :2] + (busy_boxes[..., 2:] - busy_boxes[..., :2]) / 8
+assert (busy_scores > score_threshold).sum(axis=(1, 2)).max() <= TFLITE_NMS_CANDIDATES
+expected = batched_nms(busy_boxes, busy_scores, max_boxes, score_threshold, iou_threshold)
+actual = batched_nms_tflite(tf.constant(busy_boxes), tf.constant(busy_scores), max_boxes, score_threshold, iou_threshold, max_boxes * 3)
+for i in range(2):
+    e, a = as_sorted(*unpad_detections(*expected, index=i)), as_sorted(*unpad_detections(*actual, index=i))
+    assert e.shape == a.shape, (e.shape, a.shape)
+    assert np.allclose(e, a, atol=1e-5)
+    assert np.bincount(a[:, 0].astype(int)).max() == max_boxes
+print('batched_nms_tflite matches batched_nms on busy images ({} detections per image)'.format(list(np.asarray(expected[3]))))
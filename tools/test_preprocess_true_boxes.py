@@ -1,28 +1,260 @@
+import argparse
+import time
 
-from tools.tfrecord_create import main_create_tfrecord
 import numpy as np
-from yolov4.lib.dataloader import preprocess_true_boxes
-tfrecord_save_path= './validate.tfrecord'
-dataset_root = './VOC2007'
-class_path = './VOC2007/voc.names'
-dataset_type='val'
 
-# 测试preprocess_true_boxes
+# 测试preprocess_true_boxes：向量化的实现与原来逐个图像、逐个真实框循环的实现(下面的reference_*)输出的y_true必须逐位相同，
+# 覆盖YOLOV4(IOU最大的anchor)、YOLOV4-TINY(两层，anchor 3同时属于两层)、YOLOV5/YOLOV5-V61/YOLOV7(宽高比例以及相邻的两个网格)，
+# 测试数据包括补齐的0、中间无效的框、重复的框(同一个网格同一个anchor)以及中心恰好在网格边界或者网格中点的框；
+# 之后输出每个batch的耗时，例如：
+# python tools/test_preprocess_true_boxes.py --batch_size 16 --num_boxes 100 --repeat 20
+ANCHORS = [[10, 13], [16, 30], [33, 23], [30, 61], [62, 45], [59, 119], [116, 90], [156, 198], [373, 326]]
+ANCHORS_TINY = [[10, 14], [23, 27], [37, 58], [81, 82], [135, 169], [344, 319]]
+ANCHOR_MASK = [[6, 7, 8], [3, 4, 5], [0, 1, 2]]
 
-'''
-debug preprocess_true_boxes
-'''
-true_boxes = [[[263, 211, 324, 339, 8], [165, 264, 253, 372, 8], [241, 194, 295, 299, 8], [150, 141, 229, 284, 14]],
-              [[69, 172, 270, 330, 12], [150, 141, 229, 284, 14], [241, 194, 295, 299, 8], [285, 201, 327, 331, 14]]]
 
-true_boxes = np.array(true_boxes)
-print(true_boxes.shape)
-input_shape = (416, 416)
-anchors = [[10, 13], [16, 30], [33, 23], [30, 61], [62, 45], [59, 119], [116, 90], [156, 198], [373, 326]]
-num_classes = 20
+def reference_yolov4(true_boxes, input_shape, anchors, num_classes, anchor_mask=ANCHOR_MASK):
+    num_layers = len(anchors)//3
+    if anchor_mask is None:
+        anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]]
+    true_boxes = np.array(true_boxes, dtype='float32')
+    input_shape = np.array(input_shape, dtype='int32')
+    boxes_xy = (true_boxes[..., 0:2] + true_boxes[..., 2:4]) // 2
+    boxes_wh = true_boxes[..., 2:4] - true_boxes[..., 0:2]
+    true_boxes[..., 0:2] = boxes_xy/input_shape[::-1]
+    true_boxes[..., 2:4] = boxes_wh/input_shape[::-1]
+    m = true_boxes.shape[0]
+    grid_shapes = [input_shape//{0:32, 1:16, 2:8}[l] for l in range(num_layers)]
+    y_true = [np.zeros((m,grid_shapes[l][0],grid_shapes[l][1],len(anchor_mask[l]),5+num_classes),
+        dtype='float32') for l in range(num_layers)]
+    anchors = np.expand_dims(anchors, 0)
+    anchor_maxes = anchors / 2.
+    anchor_mins = -anchor_maxes
+    valid_mask = boxes_wh[..., 0]>0
+    for b in range(m):
+        wh = boxes_wh[b, valid_mask[b]]
+        if len(wh)==0: continue
+        wh = np.expand_dims(wh, -2)
+        box_maxes = wh / 2.
+        box_mins = -box_maxes
+        intersect_mins = np.maximum(box_mins, anchor_mins)
+        intersect_maxes = np.minimum(box_maxes, anchor_maxes)
+        intersect_wh = np.maximum(intersect_maxes - intersect_mins, 0.)
+        intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
+        box_area = wh[..., 0] * wh[..., 1]
+        anchor_area = anchors[..., 0] * anchors[..., 1]
+        iou = intersect_area / (box_area + anchor_area - intersect_area)
+        best_anchor = np.argmax(iou, axis=-1)
+        for t, best_detect in enumerate(best_anchor):
+            for l in range(num_layers):
+                if best_detect in anchor_mask[l]:
+                    xind = np.floor(true_boxes[b,t,0] * grid_shapes[l][1]).astype('int32')
+                    yind = np.floor(true_boxes[b,t,1] * grid_shapes[l][0]).astype('int32')
+                    k = anchor_mask[l].index(best_detect)
+                    c = true_boxes[b, t, 4].astype('int32')
+                    y_true[l][b, yind, xind, k, 0:4] = true_boxes[b, t, 0:4]
+                    y_true[l][b, yind, xind, k, 4] = 1
+                    y_true[l][b, yind, xind, k, 5+c] = 1
+    return y_true
 
-preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes)
 
+def reference_near_points(x, y, i, j):
+    sub_x = x - i
+    sub_y = y - j
+    if sub_x > 0.5 and sub_y > 0.5:
+        return [[0, 0], [1, 0], [0, 1]]
+    elif sub_x < 0.5 and sub_y > 0.5:
+        return [[0, 0], [-1, 0], [0, 1]]
+    elif sub_x < 0.5 and sub_y < 0.5:
+        return [[0, 0], [-1, 0], [0, -1]]
+    else:
+        return [[0, 0], [1, 0], [0, -1]]
 
-main_create_tfrecord(tfrecord_save_path=tfrecord_save_path, dataset_root=dataset_root, class_path=class_path, dataset_type=dataset_type)
-print('finish')
\ No newline at end of file
+
+def reference_yolov5(true_boxes, input_shape, anchors, num_classes, anchors_mask=ANCHOR_MASK, threshold=4, yolov7=False):
+    true_boxes  = np.array(true_boxes, dtype='float32')
+    input_shape = np.array(input_shape, dtype='int32')
+    num_layers  = len(anchors_mask)
+    m           = true_boxes.shape[0]
+    grid_shapes = [input_shape // {0:32, 1:16, 2:8}[l] for l in range(num_layers)]
+    y_true = [np.zeros((m, grid_shapes[l][0], grid_shapes[l][1], len(anchors_mask[l]), 2 if yolov7 else 5 + num_classes),
+                dtype='float32') for l in range(num_layers)]
+    box_best_ratios = [np.zeros((m, grid_shapes[l][0], grid_shapes[l][1], len(anchors_mask[l])),
+                dtype='float32') for l in range(num_layers)]
+    boxes_xy = (true_boxes[..., 0:2] + true_boxes[..., 2:4]) // 2
+    boxes_wh =  true_boxes[..., 2:4] - true_boxes[..., 0:2]
+    true_boxes[..., 0:2] = boxes_xy / input_shape[::-1]
+    true_boxes[..., 2:4] = boxes_wh / input_shape[::-1]
+    anchors         = np.array(anchors, np.float32)
+    valid_mask = boxes_wh[..., 0]>0
+    for b in range(m):
+        wh = boxes_wh[b, valid_mask[b]]
+        if len(wh) == 0: continue
+        ratios_of_gt_anchors = np.expand_dims(wh, 1) / np.expand_dims(anchors, 0)
+        ratios_of_anchors_gt = np.expand_dims(anchors, 0) / np.expand_dims(wh, 1)
+        ratios               = np.concatenate([ratios_of_gt_anchors, ratios_of_anchors_gt], axis = -1)
+        max_ratios           = np.max(ratios, axis = -1)
+        for t, ratio in enumerate(max_ratios):
+            over_threshold = ratio < threshold
+            over_threshold[np.argmin(ratio)] = True
+            for l in range(num_layers):
+                for k, n in enumerate(anchors_mask[l]):
+                    if not over_threshold[n]:
+                        continue
+                    i = np.floor(true_boxes[b,t,0] * grid_shapes[l][1]).astype('int32')
+                    j = np.floor(true_boxes[b,t,1] * grid_shapes[l][0]).astype('int32')
+                    offsets = reference_near_points(true_boxes[b,t,0] * grid_shapes[l][1], true_boxes[b,t,1] * grid_shapes[l][0], i, j)
+                    for offset in offsets:
+                        local_i = i + offset[0]
+                        local_j = j + offset[1]
+                        if local_i >= grid_shapes[l][1] or local_i < 0 or local_j >= grid_shapes[l][0] or local_j < 0:
+                            continue
+                        if box_best_ratios[l][b, local_j, local_i, k] != 0:
+                            if box_best_ratios[l][b, local_j, local_i, k] > ratio[n]:
+                                y_true[l][b, local_j, local_i, k, :] = 0
+                            else:
+                                continue
+                        if yolov7:
+                            y_true[l][b, local_j, local_i, k, 0] = 1
+                            y_true[l][b, local_j, local_i, k, 1] = t + 1
+                        else:
+                            c = true_boxes[b, t, 4].astype('int32')
+                            y_true[l][b, local_j, local_i, k, 0:4] = true_boxes[b, t, 0:4]
+                            y_true[l][b, local_j, local_i, k, 4] = 1
+                            y_true[l][b, local_j, local_i, k, 5+c] = 1
+                        box_best_ratios[l][b, local_j, local_i, k] = ratio[n]
+    return y_true
+
+
+def random_boxes(rng, batch_size, num_boxes, max_boxes, input_shape, num_classes):
+    '''
+    与get_random_data相同的格式：(batch_size, max_boxes, 5)，有效框在前，补齐的0在后；
+    一部分框重复、一部分中心在网格边界或者网格中点，一部分图像没有框
+    '''
+    h, w = input_shape
+    boxes = np.zeros((batch_size, max_boxes, 5))
+    for b in range(batch_size):
+        n = rng.integers(0, num_boxes + 1) if b % 4 else num_boxes
+        x1, y1 = rng.integers(0, w - 2, n), rng.integers(0, h - 2, n)
+        x2, y2 = np.minimum(x1 + rng.integers(1, w // 2, n), w - 1), np.minimum(y1 + rng.integers(1, h // 2, n), h - 1)
+        box = np.stack([x1, y1, x2, y2, rng.integers(0, num_classes, n)], -1).astype(np.float64)
+        if n > 4:
+            # 重复的框，以及中心恰好为8的倍数的框
+            box[1::5] = box[0::5][:len(box[1::5])]
+            box[2::7, 0:2] = (rng.integers(1, min(h, w) // 16 - 1, (len(box[2::7]), 1)) * 16 - 8)
+            box[2::7, 2:4] = box[2::7, 0:2] + 16
+        boxes[b, :n] = box
+    return boxes
+
+
+def compare(name, new, old):
+    assert len(new) == len(old), name
+    for l, (a, b) in enumerate(zip(new, old)):
+        assert a.dtype == b.dtype and a.shape == b.shape and a.tobytes() == b.tobytes(), \
+            '{}: layer {} differs at {} cells'.format(name, l, int(np.sum(np.any(a != b, axis=-1))))
+
+
+def sparse_builders(input_shape, num_classes):
+    '''
+    (稀疏记录, 稠密的y_true, 记录还原为稠密y_true的函数)，用于检查sparse=True的记录与稠密的y_true等价
+    '''
+    from components.sparse_targets import dense_index_targets, dense_targets
+    from yolov4.lib.dataloader import preprocess_true_boxes as yolov4
+    from yolov5.lib.dataloader import YoloDatasets as YOLOV5
+    from yolov5v61.lib.dataloader import YoloDatasets as YOLOV5V61
+    from yolov7.lib.dataloader import YoloDatasets as YOLOV7
+    anchors = np.array(ANCHORS, np.float32)
+    grid_shapes = [[input_shape[0] // s, input_shape[1] // s] for s in (32, 16, 8)]
+    datasets = {name: [cls([], input_shape, anchors, 1, num_classes, ANCHOR_MASK, 0, 1, False, False, 0, 0, False, sparse=sparse)
+                       for sparse in (True, False)]
+                for name, cls in [('YOLOV5', YOLOV5), ('YOLOV5-V61', YOLOV5V61), ('YOLOV7', YOLOV7)]}
+    dense = lambda records: [dense_targets(records, l, grid_shapes[l], len(ANCHOR_MASK[l]), num_classes).numpy() for l in range(3)]
+    functions = {
+        'YOLOV4': [lambda boxes, sparse=sparse: yolov4(boxes, input_shape, ANCHORS, num_classes, sparse=sparse) for sparse in (True, False)],
+        'YOLOV7': [lambda boxes, d=d: d.preprocess_true_boxes(boxes, input_shape, anchors, num_classes) for d in datasets['YOLOV7']]
+                  + [lambda records: [dense_index_targets(records, l, grid_shapes[l], len(ANCHOR_MASK[l])).numpy() for l in range(3)]],
+    }
+    for name in ('YOLOV5', 'YOLOV5-V61'):
+        functions[name] = [lambda boxes, d=d: d.preprocess_true_boxes(boxes, input_shape, anchors, num_classes) for d in datasets[name]]
+    for name in ('YOLOV4', 'YOLOV5', 'YOLOV5-V61'):
+        functions[name].append(dense)
+    return functions
+
+
+def builders(input_shape, num_classes):
+    from yolov4.lib.dataloader import preprocess_true_boxes as yolov4
+    from yolov5.lib.dataloader import YoloDatasets as YOLOV5
+    from yolov5v61.lib.dataloader import YoloDatasets as YOLOV5V61
+    from yolov7.lib.dataloader import YoloDatasets as YOLOV7
+    anchors = np.array(ANCHORS, np.float32)
+    datasets = {name: cls([], input_shape, anchors, 1, num_classes, ANCHOR_MASK, 0, 1, False, False, 0, 0, False)
+                for name, cls in [('YOLOV5', YOLOV5), ('YOLOV5-V61', YOLOV5V61), ('YOLOV7', YOLOV7)]}
+    functions = {
+        'YOLOV4': (lambda boxes: yolov4(boxes, input_shape, ANCHORS, num_classes),
+                   lambda boxes: reference_yolov4(boxes, input_shape, ANCHORS, num_classes)),
+        'YOLOV5': (lambda boxes: datasets['YOLOV5'].preprocess_true_boxes(boxes, input_shape, anchors, num_classes),
+                   lambda boxes: reference_yolov5(boxes, input_shape, anchors, num_classes)),
+        'YOLOV5-V61': (lambda boxes: datasets['YOLOV5-V61'].preprocess_true_boxes(boxes, input_shape, anchors, num_classes),
+                       lambda boxes: reference_yolov5(boxes, input_shape, anchors, num_classes)),
+        'YOLOV7': (lambda boxes: datasets['YOLOV7'].preprocess_true_boxes(boxes, input_shape, anchors, num_classes),
+                   lambda boxes: reference_yolov5(boxes, input_shape, anchors, num_classes, yolov7=True)),
+    }
+    try:
+        from yolov4.train_tiny import preprocess_true_boxes as yolov4_tiny
+        functions['YOLOV4-TINY'] = (lambda boxes: yolov4_tiny(boxes, input_shape, ANCHORS_TINY, num_classes),
+                                    lambda boxes: reference_yolov4(boxes, input_shape, ANCHORS_TINY, num_classes, None))
+    except ImportError as e:
+        print('Skip YOLOV4-TINY: {}'.format(e))
+    return functions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_size', type=int, default=416)
+    parser.add_argument('--num_classes', type=int, default=20)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_boxes', type=int, default=100)
+    parser.add_argument('--cases', type=int, default=50, help='number of random batches compared with the reference')
+    parser.add_argument('--repeat', type=int, default=20, help='number of batches used for the timing')
+    parser.add_argument('--seed', type=int, default=0)
+    opt = parser.parse_args()
+
+    input_shape = (opt.input_size, opt.input_size)
+    rng = np.random.default_rng(opt.seed)
+    functions = builders(input_shape, opt.num_classes)
+
+    # 原来的调试数据
+    true_boxes = np.array([[[263, 211, 324, 339, 8], [165, 264, 253, 372, 8], [241, 194, 295, 299, 8], [150, 141, 229, 284, 14]],
+                           [[69, 172, 270, 330, 12], [150, 141, 229, 284, 14], [241, 194, 295, 299, 8], [285, 201, 327, 331, 14]]])
+    batches = [true_boxes, np.zeros((2, 100, 5))]
+    batches += [random_boxes(rng, opt.batch_size, opt.num_boxes, max(opt.num_boxes, 100), input_shape, opt.num_classes) for _ in range(opt.cases)]
+    # 中间无效的框：有效框不是全部在前面
+    holes = random_boxes(rng, opt.batch_size, opt.num_boxes, max(opt.num_boxes, 100), input_shape, opt.num_classes)
+    holes[:, 3::4, 2:4] = holes[:, 3::4, 0:2]
+    batches.append(holes)
+    for name, (new, old) in functions.items():
+        for boxes in batches:
+            compare(name, new(boxes), old(boxes))
+    print('{} batches: all targets are bit-identical to the reference loops.'.format(len(batches)))
+
+    # sparse=True：记录在计算图中还原之后与稠密的y_true相同，比较一个batch传输的字节数
+    print('{:<12s} {:>14s} {:>14s} {:>8s}'.format('model', 'dense KB', 'sparse KB', 'ratio'))
+    for name, (sparse, dense, scatter) in sparse_builders(input_shape, opt.num_classes).items():
+        for boxes in batches:
+            records = sparse(boxes)
+            compare(name + ' sparse', scatter(records[0]), dense(boxes))
+        size = [sum(target.nbytes for target in function(batches[-1])) / 1024 for function in (dense, sparse)]
+        print('{:<12s} {:14.1f} {:14.1f} {:7.1f}x'.format(name, size[0], size[1], size[0] / size[1]))
+
+    timing = [random_boxes(rng, opt.batch_size, opt.num_boxes, max(opt.num_boxes, 100), input_shape, opt.num_classes) for _ in range(opt.repeat)]
+    for boxes in timing:
+        boxes[:, :opt.num_boxes] = np.where(boxes[:, :opt.num_boxes, 2:3] > 0, boxes[:, :opt.num_boxes], boxes[:1, :opt.num_boxes])
+    print('{:<12s} {:>14s} {:>14s} {:>8s}'.format('model', 'loop ms/batch', 'vector ms/batch', 'speedup'))
+    for name, (new, old) in functions.items():
+        times = []
+        for function in (old, new):
+            t0 = time.time()
+            for boxes in timing:
+                function(boxes)
+            times.append((time.time() - t0) / len(timing) * 1000)
+        print('{:<12s} {:14.2f} {:14.2f} {:7.1f}x'.format(name, times[0], times[1], times[0] / times[1]))
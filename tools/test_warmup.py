@@ -0,0 +1,43 @@
+import os
+import tempfile
+import warnings
+
+import numpy as np
+from tensorflow.keras.layers import Input
+
+from inference.tracing import RetraceWarning
+from yolov4.predict_yolov4 import YOLOV4
+
+# 测试加载时的预热：YOLOV4(三个输出)以及YOLOV4-TINY(两个输出)的.h5模型在构造函数中完成预热，预热之后检测正常，
+# 之后没有预热的函数第一次trace不发出RetraceWarning
+
+input_size = (320, 320)
+num_classes = 3
+tmp = tempfile.mkdtemp()
+classes_path = os.path.join(tmp, 'classes.txt')
+with open(classes_path, 'w') as f:
+    f.write('\n'.join('class{}'.format(i) for i in range(num_classes)))
+
+for istiny, anchor_path in [(True, './yolov4/data/yolo_anchors_tiny.txt'), (False, './yolov4/data/yolo_anchors.txt')]:
+    if istiny:
+        from yolov4.nets.yolo4_tiny import yolo_body
+        model = yolo_body(Input(shape=(None, None, 3)), 3, num_classes)
+    else:
+        from yolov4.nets.yolo4 import yolo_body
+        model = yolo_body(Input(shape=(None, None, 3)), 3, num_classes)
+    model_path = os.path.join(tmp, 'yolov4{}.h5'.format('_tiny' if istiny else ''))
+    model.save_weights(model_path)
+    yolo = YOLOV4(model_path=model_path, anchor_path=anchor_path, classes_path=classes_path, score=0.5, iou=0.3, max_boxes=100,
+                  input_size=input_size, letterbox_image=True, istiny=istiny, attention=0, anchors_mask=[[6, 7, 8], [3, 4, 5], [0, 1, 2]],
+                  warmup_batch_sizes=(1, 2), model_cache=False)
+    assert len(yolo.warmup_times) == 2, yolo.warmup_times
+    yolo.forward(np.zeros((1, input_size[1], input_size[0], 3), np.float32), np.array([[input_size[1], input_size[0]]], np.float32))
+    print('{}: warm-up {}'.format('YOLOV4-TINY' if istiny else 'YOLOV4', ', '.join('{} {:.2f}s'.format(*t) for t in yolo.warmup_times)))
+
+# 没有预热的视频帧函数第一次trace不发出RetraceWarning，预热过的函数再次trace(新的batch大小)仍然不trace
+with warnings.catch_warnings():
+    warnings.simplefilter('error', RetraceWarning)
+    frames = np.zeros((1, 240, 320, 3), np.uint8)
+    yolo.forward_frames(frames, bgr=True)
+    yolo.forward(np.zeros((3, input_size[1], input_size[0], 3), np.float32), np.tile([[input_size[1], input_size[0]]], [3, 1]).astype(np.float32))
+print('no RetraceWarning after warm-up: {}'.format(', '.join(str(counter) for counter in yolo.trace_counters)))
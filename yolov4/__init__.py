@@ -1,8 +1,17 @@
-from .lib.loss import *
-from .nets.yolo4 import *
-from .lib.utils import *
-from .lib.dataloader import *
-from .train_tiny import yolov4tiny
-from .train_yolov4 import yolov4
-from .predict_yolov4 import Inference_YOLOV4Model
-from .export_yolov4 import export_model as export_yolov4
\ No newline at end of file
+from inference.lazy import lazy_exports
+
+# 按需导入：只使用推理类(例如onnx模型)时不导入网络结构、训练代码以及tensorflow
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'yolov4tiny': ('.train_tiny', 'yolov4tiny'),
+    'yolov4': ('.train_yolov4', 'yolov4'),
+    'Inference_YOLOV4Model': ('.predict_yolov4', 'Inference_YOLOV4Model'),
+    'export_yolov4': ('.export_yolov4', 'export_model'),
+}, {
+    '.lib.loss': ['yolo_head', 'box_iou', 'yolo_loss'],
+    '.nets.yolo4': ['attention_block', 'DarknetConv2D', 'DarknetConv2D_BN_Leaky', 'make_five_convs', 'yolo_body', 'yolo_head',
+                    'yolo_correct_boxes', 'yolo_boxes', 'yolo_boxes_and_scores', 'yolo_head_priors', 'yolo_eval_batch', 'yolo_eval'],
+    '.lib.utils': ['check_suffix', 'compose', 'letterbox_image', 'rand', 'merge_bboxes', 'get_random_data_with_Mosaic', 'get_random_data',
+                   'cosine_decay_with_warmup', 'WarmUpCosineDecayScheduler', 'ModelCheckpoint'],
+    '.lib.dataloader': ['data_generator', 'YoloSamples', 'preprocess_true_boxes', 'preprocess_true_boxes_tf', 'get_classes', 'get_anchors',
+                        'transform_targets_for_output', 'transform_targets'],
+})
@@ -1,16 +1,18 @@
 from yolov4.lib.utils import get_random_data_with_Mosaic, get_random_data
+from components.sparse_targets import TARGET_COLUMNS, pack_records
 import numpy as np
 import tensorflow as tf
 from PIL import Image
 import cv2
 import math
+import random
 from tensorflow import keras
 from random import sample, shuffle
 
 
 
 
-def data_generator(annotation_lines, batch_size, input_shape, anchors, num_classes, mosaic=False, random=True, eager=True):
+def data_generator(annotation_lines, batch_size, input_shape, anchors, num_classes, mosaic=False, random=True, eager=True, sparse=False, cache=None):
     n = len(annotation_lines)
     i = 0
     flag = True
@@ -23,29 +25,58 @@ def data_generator(annotation_lines, batch_size, input_shape, anchors, num_class
                 np.random.shuffle(annotation_lines)
             if mosaic:
                 if flag and (i+4) < n:
-                    image, box = get_random_data_with_Mosaic(annotation_lines[i:i+4], input_shape)
+                    image, box = get_random_data_with_Mosaic(annotation_lines[i:i+4], input_shape, cache=cache)
                     i = (i+4) % n
                 else:
-                    image, box = get_random_data(annotation_lines[i], input_shape, random=random)
+                    image, box = get_random_data(annotation_lines[i], input_shape, random=random, cache=cache)
                     i = (i+1) % n
                 flag = bool(1-flag)
             else:
-                image, box = get_random_data(annotation_lines[i], input_shape, random=random)
+                image, box = get_random_data(annotation_lines[i], input_shape, random=random, cache=cache)
                 i = (i+1) % n
             image_data.append(image)
             box_data.append(box)
         image_data = np.array(image_data)
         box_data = np.array(box_data)
-        y_true = preprocess_true_boxes(box_data, input_shape, anchors, num_classes)
+        y_true = preprocess_true_boxes(box_data, input_shape, anchors, num_classes, sparse=sparse)
         if eager:
-            yield image_data, y_true[0], y_true[1], y_true[2]
+            yield (image_data, *y_true)
         else:
             yield [image_data, *y_true], np.zeros(batch_size)
 
+class YoloSamples(object):
+    '''
+    按序号读取单个样本，用于tf.data的输入管线(components/data_pipeline.py)，数据增强与data_generator相同：
+    mosaic时一半的样本与另外随机的3张图像拼接
+    '''
+
+    def __init__(self, annotation_lines, batch_size, input_shape, anchors, num_classes, mosaic=False, random=True, sparse=False, cache=None):
+        self.annotation_lines = annotation_lines
+        self.batch_size = batch_size
+        self.input_shape = input_shape
+        self.anchors = anchors
+        self.num_classes = num_classes
+        self.mosaic = mosaic
+        self.random = random
+        self.sparse = sparse
+        self.cache = cache
+
+    def get_sample(self, index, epoch, rng=random):
+        if self.mosaic and rng.random() < 0.5 and len(self.annotation_lines) >= 4:
+            lines = rng.sample(self.annotation_lines, 3)
+            lines.append(self.annotation_lines[index])
+            rng.shuffle(lines)
+            return get_random_data_with_Mosaic(lines, self.input_shape, cache=self.cache, rng=rng)
+        return get_random_data(self.annotation_lines[index], self.input_shape, random=self.random, cache=self.cache, rng=rng)
+
+    def get_targets(self, box_data):
+        return preprocess_true_boxes(box_data, self.input_shape, self.anchors, self.num_classes, sparse=self.sparse)
+
+
 #  详解：https://blog.csdn.net/weixin_38145317/article/details/95349201
 # https://zhuanlan.zhihu.com/p/79425557
 
-def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes, anchor_mask=[[6, 7, 8], [3, 4, 5], [0, 1, 2]]):
+def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes, anchor_mask=[[6, 7, 8], [3, 4, 5], [0, 1, 2]], sparse=False):
     # 该函数得到detectors_mask（最佳预测的anchor boxes，每一个true boxes都对应一个anchor boxes）
     # true_boxes：实际框的位置和类别,shape:(batch_size, max_box_number, 5),5表示(x_min, y_min, x_max, y_max, label)
     assert (true_boxes[..., 4]<num_classes).all()
@@ -66,47 +97,59 @@ def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes, anchor_
     # {0:32  1:16  2:8}表示特征金字塔下采样的倍数，得到不同尺度下的feature map的尺寸
     grid_shapes = [input_shape//{0:32, 1:16, 2:8}[l] for l in range(num_layers)]
     # 对不同的特征图下生成对应目标框的，如目标框有两个，对于13*13feature map，生成2*13*13*3*(5+class_num+1)
+    # sparse时返回补齐的记录(components/sparse_targets.py)，不分配稠密的y_true
     y_true = [np.zeros((m,grid_shapes[l][0],grid_shapes[l][1],len(anchor_mask[l]),5+num_classes),
-        dtype='float32') for l in range(num_layers)]
+        dtype='float32') for l in range(num_layers)] if not sparse else []
+    records = []
     anchors = np.expand_dims(anchors, 0)
     # 计算anchorbox与true box的IOU，因此需要得出anchorbox的坐标
     anchor_maxes = anchors / 2.
     anchor_mins = -anchor_maxes
     valid_mask = boxes_wh[..., 0]>0
 
-    # 对每一张图进行处理，计算每个目标与设定anchor box的最佳IOU
-    for b in range(m):
-        wh = boxes_wh[b, valid_mask[b]]
-        if len(wh)==0: continue
-        wh = np.expand_dims(wh, -2)
-        box_maxes = wh / 2.
-        box_mins = -box_maxes
-        intersect_mins = np.maximum(box_mins, anchor_mins)
-        intersect_maxes = np.minimum(box_maxes, anchor_maxes)
-        intersect_wh = np.maximum(intersect_maxes - intersect_mins, 0.)
-        intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
-
-        box_area = wh[..., 0] * wh[..., 1]
-        anchor_area = anchors[..., 0] * anchors[..., 1]
-
-        iou = intersect_area / (box_area + anchor_area - intersect_area)
-        best_anchor = np.argmax(iou, axis=-1)
-
-        for t, best_detect in enumerate(best_anchor):
-            for l in range(num_layers):
-                if best_detect in anchor_mask[l]:
-                    # 根据真实框的坐标信息来计算所属网格左上角的位置. xind, yind其实就是网格的坐标
-                    xind = np.floor(true_boxes[b,t,0] * grid_shapes[l][1]).astype('int32')
-                    yind = np.floor(true_boxes[b,t,1] * grid_shapes[l][0]).astype('int32')
-                    k = anchor_mask[l].index(best_detect)
-                    c = true_boxes[b, t, 4].astype('int32')
-                    # 填充真实框的中心位置和宽高
-                    y_true[l][b, yind, xind, k, 0:4] = true_boxes[b, t, 0:4]
-                    # 置信度
-                    y_true[l][b, yind, xind, k, 4] = 1
-                    # label以one-hot形式标记
-                    y_true[l][b, yind, xind, k, 5+c] = 1
+    # 所有图像一起计算每个目标与设定anchor box的最佳IOU，第t个有效框对应true_boxes的第t行(有效框在前，补齐的0在后)
+    order = np.argsort(~valid_mask, axis=1, kind='stable')
+    valid = np.take_along_axis(valid_mask, order, axis=1)
+    wh = np.expand_dims(np.take_along_axis(boxes_wh, order[..., None], axis=1), -2)
+    box_maxes = wh / 2.
+    box_mins = -box_maxes
+    intersect_mins = np.maximum(box_mins, anchor_mins)
+    intersect_maxes = np.minimum(box_maxes, anchor_maxes)
+    intersect_wh = np.maximum(intersect_maxes - intersect_mins, 0.)
+    intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
+
+    box_area = wh[..., 0] * wh[..., 1]
+    anchor_area = anchors[..., 0] * anchors[..., 1]
 
+    iou = intersect_area / (box_area + anchor_area - intersect_area)
+    best_anchor = np.argmax(iou, axis=-1)
+
+    for l in range(num_layers):
+        # 最佳anchor属于该层的真实框，k为anchor在该层中的序号
+        b, t = np.nonzero(valid & np.isin(best_anchor, anchor_mask[l]))
+        index = np.zeros(anchors.shape[1], dtype='int64')
+        index[anchor_mask[l]] = np.arange(len(anchor_mask[l]))
+        k = index[best_anchor[b, t]]
+        # 根据真实框的坐标信息来计算所属网格左上角的位置
+        i = np.floor(true_boxes[b, t, 0].astype(np.float64) * grid_shapes[l][1]).astype('int32')
+        j = np.floor(true_boxes[b, t, 1].astype(np.float64) * grid_shapes[l][0]).astype('int32')
+        c = true_boxes[b, t, 4].astype('int32')
+        # label以one-hot形式标记，同一个网格的同一个anchor有多个真实框时类别都保留，位置以及置信度由最后一个真实框填充
+        cell = ((b * grid_shapes[l][0] + j) * grid_shapes[l][1] + i) * len(anchor_mask[l]) + k
+        if sparse:
+            # 每个真实框一条记录，位置为该网格最后一个真实框的位置
+            _, first, inverse = np.unique(cell[::-1], return_index=True, return_inverse=True)
+            last = (len(cell) - 1 - first)[inverse[::-1]]
+            records.append((b, np.concatenate([np.stack([np.full(len(b), l), j, i, k], -1), true_boxes[b[last], t[last], 0:4], c[:, None]], -1)))
+            continue
+        y_true[l][b, j, i, k, 5+c] = 1
+        last = len(cell) - 1 - np.unique(cell[::-1], return_index=True)[1]
+        b, t, k, i, j = b[last], t[last], k[last], i[last], j[last]
+        y_true[l][b, j, i, k, 0:4] = true_boxes[b, t, 0:4]
+        y_true[l][b, j, i, k, 4] = 1
+
+    if sparse:
+        return [pack_records(records, m, TARGET_COLUMNS)]
     return y_true
 
 
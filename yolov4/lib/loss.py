@@ -1,6 +1,7 @@
 import tensorflow as tf
 from tensorflow.keras import backend as K
 
+from components.sparse_targets import dense_targets
 from yolov4.lib.ious import box_ciou
 
 
@@ -72,7 +73,7 @@ def box_iou(b1, b2):
     return iou
 
 
-def yolo_loss(args, anchors, num_classes, ignore_thresh=.5, label_smoothing=0.1, print_loss=False, normalize=True):
+def yolo_loss(args, anchors, num_classes, ignore_thresh=.5, label_smoothing=0.1, print_loss=False, normalize=True, sparse=False):
     num_layers = len(anchors)//3 
 
     #   y_true：shape分别为(m,13,13,3,85),(m,26,26,3,85),(m,52,52,3,85)。
@@ -82,6 +83,9 @@ def yolo_loss(args, anchors, num_classes, ignore_thresh=.5, label_smoothing=0.1,
 
     # 获取anchor mask
     anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]]
+    # sparse时y_true为preprocess_true_boxes(sparse=True)的记录，在计算图中按层scatter为稠密的y_true
+    if sparse:
+        y_true = [dense_targets(y_true[0], l, K.shape(yolo_outputs[l])[1:3], len(anchor_mask[l]), num_classes) for l in range(num_layers)]
 
     input_shape = K.cast(K.shape(yolo_outputs[0])[1:3] * 32, K.dtype(y_true[0]))
     loss = 0
@@ -1,8 +1,8 @@
 import os
+import random
 import warnings
 from functools import reduce
 
-import cv2
 import numpy as np
 import tensorflow as tf
 from PIL import Image
@@ -10,6 +10,9 @@ from tensorflow import keras
 from tensorflow.keras import backend as K
 from pathlib import Path
 
+from components.augment import apply_hsv, letterbox, mosaic, pad_boxes, random_affine, shift_lut
+from components.image_cache import load_annotation
+
 def check_suffix(file='yolov5s.pt', suffix=('.pt',), msg=''):
     # Check file(s) for acceptable suffixes
     if file and suffix:
@@ -108,7 +111,7 @@ def merge_bboxes(bboxes, cutx, cuty):
             merge_bbox.append(tmp_box)
     return merge_bbox
 
-def get_random_data_with_Mosaic(annotation_line, input_shape, max_boxes=100, hue=.1, sat=1.5, val=1.5):
+def get_random_data_with_Mosaic(annotation_line, input_shape, max_boxes=100, hue=.1, sat=1.5, val=1.5, cache=None, rng=random):
     '''random preprocessing for real-time data augmentation'''
     h, w = input_shape
     min_offset_x = 0.3
@@ -116,198 +119,49 @@ def get_random_data_with_Mosaic(annotation_line, input_shape, max_boxes=100, hue
     scale_low = 1-min(min_offset_x,min_offset_y)
     scale_high = scale_low+0.2
 
-    image_datas = [] 
-    box_datas = []
-    index = 0
-
     place_x = [0,0,int(w*min_offset_x),int(w*min_offset_x)]
     place_y = [0,int(h*min_offset_y),int(h*min_offset_y),0]
 
-    for line in annotation_line:
-        # 每一行进行分割
-        line_content = line.split()
-        # 打开图片
-        image = Image.open(line_content[0])
-        image = image.convert("RGB") 
-        iw, ih = image.size
-        box = np.array([np.array(list(map(int,box.split(',')))) for box in line_content[1:]])
-        
-        # 是否翻转图片
-        flip = rand()<.5
-        if flip and len(box)>0:
-            image = image.transpose(Image.FLIP_LEFT_RIGHT)
-            box[:, [0,2]] = iw - box[:, [2,0]]
-
-        # 对输入进来的图片进行缩放
-        new_ar = w/h
-        scale = rand(scale_low, scale_high)
+    # 打开图片，cache为图像缓存(components/image_cache.py)
+    samples = [load_annotation(line, cache) for line in annotation_line]
+    # 每张图像随机翻转以及缩放(长宽比与输入相同)，放在固定的位置，在自己的区域内进行色域变换
+    placements, luts = [], []
+    new_ar = w/h
+    for index in range(len(samples)):
+        flip = rng.random()<.5
+        scale = rng.random()*(scale_high-scale_low) + scale_low
         if new_ar < 1:
             nh = int(scale*h)
             nw = int(nh*new_ar)
         else:
             nw = int(scale*w)
             nh = int(nw/new_ar)
-        image = image.resize((nw,nh), Image.BICUBIC)
-
-        # 进行色域变换
-        hue = rand(-hue, hue)
-        sat = rand(1, sat) if rand()<.5 else 1/rand(1, sat)
-        val = rand(1, val) if rand()<.5 else 1/rand(1, val)
-        x = cv2.cvtColor(np.array(image,np.float32)/255, cv2.COLOR_RGB2HSV)
-        x[..., 0] += hue*360
-        x[..., 0][x[..., 0]>1] -= 1
-        x[..., 0][x[..., 0]<0] += 1
-        x[..., 1] *= sat
-        x[..., 2] *= val
-        x[x[:,:, 0]>360, 0] = 360
-        x[:, :, 1:][x[:, :, 1:]>1] = 1
-        x[x<0] = 0
-        image = cv2.cvtColor(x, cv2.COLOR_HSV2RGB) # numpy array, 0 to 1
-
-        image = Image.fromarray((image*255).astype(np.uint8))
-        # 将图片进行放置，分别对应四张分割图片的位置
-        dx = place_x[index]
-        dy = place_y[index]
-        new_image = Image.new('RGB', (w,h), (128,128,128))
-        new_image.paste(image, (dx, dy))
-        image_data = np.array(new_image)/255
-
-        index = index + 1
-        box_data = []
-        # 对box进行重新处理
-        if len(box)>0:
-            np.random.shuffle(box)
-            box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-            box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-            box[:, 0:2][box[:, 0:2]<0] = 0
-            box[:, 2][box[:, 2]>w] = w
-            box[:, 3][box[:, 3]>h] = h
-            box_w = box[:, 2] - box[:, 0]
-            box_h = box[:, 3] - box[:, 1]
-            box = box[np.logical_and(box_w>1, box_h>1)]
-            box_data = np.zeros((len(box),5))
-            box_data[:len(box)] = box
-        
-        image_datas.append(image_data)
-        box_datas.append(box_data)
+        placements.append((nw, nh, place_x[index], place_y[index], flip))
+        luts.append(shift_lut(rng, hue, sat, val))
 
     # 将图片分割，放在一起
-    cutx = np.random.randint(int(w*min_offset_x), int(w*(1 - min_offset_x)))
-    cuty = np.random.randint(int(h*min_offset_y), int(h*(1 - min_offset_y)))
-
-    new_image = np.zeros([h,w,3])
-    new_image[:cuty, :cutx, :] = image_datas[0][:cuty, :cutx, :]
-    new_image[cuty:, :cutx, :] = image_datas[1][cuty:, :cutx, :]
-    new_image[cuty:, cutx:, :] = image_datas[2][cuty:, cutx:, :]
-    new_image[:cuty, cutx:, :] = image_datas[3][:cuty, cutx:, :]
+    cutx = rng.randrange(int(w*min_offset_x), int(w*(1 - min_offset_x)))
+    cuty = rng.randrange(int(h*min_offset_y), int(h*(1 - min_offset_y)))
+    new_image, box_datas = mosaic(samples, input_shape, (cutx, cuty), placements, rng, luts)
 
     # 对框进行进一步的处理
     new_boxes = merge_bboxes(box_datas, cutx, cuty)
-
-    # 将box进行调整
-    box_data = np.zeros((max_boxes,5))
-    if len(new_boxes)>0:
-        if len(new_boxes)>max_boxes: new_boxes = new_boxes[:max_boxes]
-        box_data[:len(new_boxes)] = new_boxes
-    return new_image, box_data
+    box_data = pad_boxes(np.array(new_boxes).reshape(-1, 5), max_boxes)
+    return np.multiply(new_image, 1/255, dtype=np.float32), box_data
 
 
-def get_random_data(annotation_line, input_shape, max_boxes=100, jitter=.3, hue=.1, sat=1.5, val=1.5, random=True):
+def get_random_data(annotation_line, input_shape, max_boxes=100, jitter=.3, hue=.1, sat=1.5, val=1.5, random=True, cache=None, rng=random):
     '''random preprocessing for real-time data augmentation'''
-    line = annotation_line.split()
-    image = Image.open(line[0])
-    iw, ih = image.size
-    h, w = input_shape
-    box = np.array([np.array(list(map(int,box.split(',')))) for box in line[1:]])
+    image, box = load_annotation(annotation_line, cache)
 
     if not random:
-        # resize image
-        scale = min(w/iw, h/ih)
-        nw = int(iw*scale)
-        nh = int(ih*scale)
-        dx = (w-nw)//2
-        dy = (h-nh)//2
-
-        image = image.resize((nw,nh), Image.BICUBIC)
-        new_image = Image.new('RGB', (w,h), (128,128,128))
-        new_image.paste(image, (dx, dy))
-        image_data = np.array(new_image, np.float32)/255
-
-        # correct boxes
-        box_data = np.zeros((max_boxes,5))
-        if len(box)>0:
-            np.random.shuffle(box)
-            box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-            box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-            box[:, 0:2][box[:, 0:2]<0] = 0
-            box[:, 2][box[:, 2]>w] = w
-            box[:, 3][box[:, 3]>h] = h
-            box_w = box[:, 2] - box[:, 0]
-            box_h = box[:, 3] - box[:, 1]
-            box = box[np.logical_and(box_w>1, box_h>1)] # discard invalid box
-            if len(box)>max_boxes: box = box[:max_boxes]
-            box_data[:len(box)] = box
-
-        return image_data, box_data
-        
-    # 对图像进行缩放并且进行长和宽的扭曲
-    new_ar = w/h * rand(1-jitter,1+jitter)/rand(1-jitter,1+jitter)
-    scale = rand(.25, 2)
-    if new_ar < 1:
-        nh = int(scale*h)
-        nw = int(nh*new_ar)
-    else:
-        nw = int(scale*w)
-        nh = int(nw/new_ar)
-    image = image.resize((nw,nh), Image.BICUBIC)
+        image_data, box_data = letterbox(image, box, input_shape, max_boxes, rng)
+        return np.multiply(image_data, 1/255, dtype=np.float32), box_data
 
-    # 将图像多余的部分加上灰条
-    dx = int(rand(0, w-nw))
-    dy = int(rand(0, h-nh))
-    new_image = Image.new('RGB', (w,h), (128,128,128))
-    new_image.paste(image, (dx, dy))
-    image = new_image
-
-    # 翻转图像
-    flip = rand()<.5
-    if flip: image = image.transpose(Image.FLIP_LEFT_RIGHT)
-
-    # 色域扭曲
-    hue = rand(-hue, hue)
-    sat = rand(1, sat) if rand()<.5 else 1/rand(1, sat)
-    val = rand(1, val) if rand()<.5 else 1/rand(1, val)
-    x = cv2.cvtColor(np.array(image,np.float32)/255, cv2.COLOR_RGB2HSV)
-    x[..., 0] += hue*360
-    x[..., 0][x[..., 0]>1] -= 1
-    x[..., 0][x[..., 0]<0] += 1
-    x[..., 1] *= sat
-    x[..., 2] *= val
-    x[x[:,:, 0]>360, 0] = 360
-    x[:, :, 1:][x[:, :, 1:]>1] = 1
-    x[x<0] = 0
-    image_data = cv2.cvtColor(x, cv2.COLOR_HSV2RGB) # numpy array, 0 to 1
-
-    # 将box进行调整
-    box_data = np.zeros((max_boxes,5))
-    if len(box)>0:
-        np.random.shuffle(box)
-        # 对box的左上角x坐标以及右下角x坐标进行调整，nw表示新的resize原图的width，iw表示原图的width，nm/iw表示它的尺度
-        box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-        box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-        if flip: box[:, [0,2]] = w - box[:, [2,0]]
-        # 对box进行修正
-        box[:, 0:2][box[:, 0:2]<0] = 0
-        box[:, 2][box[:, 2]>w] = w
-        box[:, 3][box[:, 3]>h] = h
-        box_w = box[:, 2] - box[:, 0]
-        box_h = box[:, 3] - box[:, 1]
-        # discard invalid box
-        box = box[np.logical_and(box_w>1, box_h>1)] 
-        if len(box)>max_boxes: 
-            box = box[:max_boxes]
-        box_data[:len(box)] = box
-    
-    return image_data, box_data
+    # 缩放、长和宽的扭曲(以输入的长宽比为基准)、平移以及翻转在一次仿射变换中完成，再进行色域扭曲
+    image_data, box_data = random_affine(image, box, input_shape, max_boxes, rng, jitter, keep_aspect=False)
+    apply_hsv(image_data, shift_lut(rng, hue, sat, val))
+    return np.multiply(image_data, 1/255, dtype=np.float32), box_data
 
 
 def cosine_decay_with_warmup(global_step,
@@ -0,0 +1,75 @@
+import numpy as np
+from inference.nms import multiclass_nms, select_candidates
+from inference.priors import get_anchor_priors
+
+
+def sigmoid(x):
+    return np.exp(-np.logaddexp(0, -x))
+
+def yolo_boxes_numpy(box_xy, box_wh, input_shape, image_shape, letterbox_image):
+    box_yx = box_xy[..., ::-1]
+    box_hw = box_wh[..., ::-1]
+    input_shape = np.array(input_shape, box_yx.dtype)
+    image_shape = np.reshape(np.array(image_shape, box_yx.dtype), [-1, 2])
+
+    if letterbox_image:
+        new_shape = np.round(image_shape * np.min(input_shape/image_shape, axis=-1, keepdims=True))
+        offset = (input_shape - new_shape) / 2. / input_shape
+        scale = input_shape / new_shape
+
+        box_yx = (box_yx - offset) * scale
+        box_hw *= scale
+
+    box_mins = box_yx - (box_hw / 2.)
+    box_maxes = box_yx + (box_hw / 2.)
+    boxes = np.concatenate([
+        box_mins[..., 0:1],  # y_min
+        box_mins[..., 1:2],  # x_min
+        box_maxes[..., 0:1],  # y_max
+        box_maxes[..., 1:2]  # x_max
+    ], axis=-1)
+
+    boxes *= np.concatenate([image_shape, image_shape], axis=-1)
+    return boxes
+
+
+# 推理
+def yolo_eval_numpy(yolo_outputs,
+              anchors,
+              num_classes,
+              image_shape,
+              anchor_mask,
+              max_boxes=20,
+              score_threshold=.6,
+              iou_threshold=.5,
+              letterbox_image=True,
+              nms_method='nms',
+              pre_nms_topk=None):
+    '''
+    NumPy解码以及非极大值抑制，用于onnx推理的单张图像，不依赖tensorflow
+    先按置信度筛选候选框(最多pre_nms_topk个)，只对候选框解码坐标
+    nms_method：'nms'、'diou'或'soft'，详见inference.nms
+    '''
+    num_layers = len(yolo_outputs)
+    if num_layers == 2:
+        # yolov4-tiny只有两个特征层
+        anchor_mask = [[3,4,5], [1,2,3]]
+
+    input_shape = np.array(np.shape(yolo_outputs[0])[1:3]) * 32
+    feats = np.concatenate([np.reshape(np.array(output, np.float32), [-1, num_classes + 5]) for output in yolo_outputs], axis=0)
+    priors = get_anchor_priors([np.shape(output)[1:3] for output in yolo_outputs], anchors, anchor_mask[:num_layers])
+
+    # 类别概率不超过1，objectness低于score_threshold的检测框不可能成为候选框
+    box_confidence = sigmoid(feats[:, 4])
+    index = np.flatnonzero(box_confidence >= score_threshold)
+    box_scores = box_confidence[index, None] * sigmoid(feats[index, 5:])
+    candidates = select_candidates(box_scores, score_threshold, pre_nms_topk)
+    index, box_scores = index[candidates], box_scores[candidates]
+
+    # b_x = sigmoid(t_x)+C_x, b_y = sigmoid(t_y)+C_y, b_w = p_w*e^{t_x}，同理b_y
+    feats, priors = feats[index], priors[index]
+    box_xy = (sigmoid(feats[:, :2]) + priors[:, 0:2]) / priors[:, 2:4]
+    box_wh = np.exp(feats[:, 2:4]) * priors[:, 4:6] / input_shape[::-1].astype(np.float32)
+    boxes = yolo_boxes_numpy(box_xy, box_wh, input_shape, image_shape, letterbox_image)
+
+    return multiclass_nms(boxes, box_scores, score_threshold, iou_threshold, max_boxes, method=nms_method)
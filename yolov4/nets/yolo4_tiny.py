@@ -6,9 +6,11 @@ from tensorflow.keras.initializers import RandomNormal
 from tensorflow.keras.layers import (BatchNormalization, Concatenate, Conv2D,
                                      LeakyReLU, UpSampling2D)
 from tensorflow.keras.models import Model
+from inference.batched_nms import batched_nms, unpad_detections, select_topk
+from inference.priors import get_anchor_priors, static_grid_shapes
 from yolov4.lib.utils import compose
 
-from Attention.attention import cbam_block, eca_block, se_block
+from components.attention import cbam_block, eca_block, se_block
 from yolov4.nets.CSPdarknet53_tiny import darknet_body
 
 attention_block = [se_block, cbam_block, eca_block]
@@ -90,9 +92,10 @@ def yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape):
     box_hw = box_wh[..., ::-1]
     
     input_shape = K.cast(input_shape, K.dtype(box_yx))
-    image_shape = K.cast(image_shape, K.dtype(box_yx))
+    # (batch_size, 2) -> (batch_size, 1, ..., 2)，每张图像使用各自的尺寸
+    image_shape = K.reshape(K.cast(image_shape, K.dtype(box_yx)), [-1] + [1] * (K.ndim(box_yx) - 2) + [2])
 
-    new_shape = K.round(image_shape * K.min(input_shape/image_shape))
+    new_shape = K.round(image_shape * K.min(input_shape/image_shape, axis=-1, keepdims=True))
     offset = (input_shape - new_shape) / 2. / input_shape
     scale = input_shape / new_shape
 
@@ -112,9 +115,7 @@ def yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape):
     return boxes
 
 
-# 获取分类框以及得分
-def yolo_boxes_and_scores(feats, anchors, num_classes, input_shape, image_shape, letterbox_image):
-    box_xy, box_wh, box_confidence, box_class_probs = yolo_head(feats, anchors, num_classes, input_shape)
+def yolo_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image):
     if letterbox_image:
         boxes = yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape)
     else:
@@ -124,21 +125,49 @@ def yolo_boxes_and_scores(feats, anchors, num_classes, input_shape, image_shape,
         box_maxes = box_yx + (box_hw / 2.)
 
         input_shape = K.cast(input_shape, K.dtype(box_yx))
-        image_shape = K.cast(image_shape, K.dtype(box_yx))
+        image_shape = K.reshape(K.cast(image_shape, K.dtype(box_yx)), [-1] + [1] * (K.ndim(box_yx) - 2) + [2])
 
         boxes =  K.concatenate([
-            box_mins[..., 0:1] * image_shape[0],  # y_min
-            box_mins[..., 1:2] * image_shape[1],  # x_min
-            box_maxes[..., 0:1] * image_shape[0],  # y_max
-            box_maxes[..., 1:2] * image_shape[1]  # x_max
+            box_mins[..., 0:1] * image_shape[..., 0:1],  # y_min
+            box_mins[..., 1:2] * image_shape[..., 1:2],  # x_min
+            box_maxes[..., 0:1] * image_shape[..., 0:1],  # y_max
+            box_maxes[..., 1:2] * image_shape[..., 1:2]  # x_max
         ])
-    boxes = K.reshape(boxes, [-1, 4])
+    return boxes
+
+# 获取分类框以及得分
+def yolo_boxes_and_scores(feats, anchors, num_classes, input_shape, image_shape, letterbox_image):
+    box_xy, box_wh, box_confidence, box_class_probs = yolo_head(feats, anchors, num_classes, input_shape)
+    boxes = yolo_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image)
+    batch_size = K.shape(box_xy)[0]
+    boxes = K.reshape(boxes, [batch_size, -1, 4])
     box_scores = box_confidence * box_class_probs
-    box_scores = K.reshape(box_scores, [-1, num_classes])
+    box_scores = K.reshape(box_scores, [batch_size, -1, num_classes])
     return boxes, box_scores
 
+def yolo_head_priors(feats, anchors, num_classes):
+    '''
+    将一个特征层展开为(batch_size, h * w * num_anchors, 5 + num_classes)，
+    同时返回每个预测对应的先验信息(h * w * num_anchors, 6)：网格坐标、网格尺寸以及先验框宽高，
+    用于先筛选候选框再解码坐标
+    '''
+    num_anchors = len(anchors)
+    feats = tf.convert_to_tensor(feats)
+    grid_shape = K.shape(feats)[1:3]  # height, width
+    grid_y = K.tile(K.reshape(K.arange(0, stop=grid_shape[0]), [-1, 1, 1, 1]),
+                    [1, grid_shape[1], num_anchors, 1])
+    grid_x = K.tile(K.reshape(K.arange(0, stop=grid_shape[1]), [1, -1, 1, 1]),
+                    [grid_shape[0], 1, num_anchors, 1])
+    grid = K.reshape(K.cast(K.concatenate([grid_x, grid_y]), K.dtype(feats)), [-1, 2])
+    anchors_tensor = K.reshape(K.constant(anchors), [1, 1, num_anchors, 2])
+    anchors_tensor = K.reshape(K.tile(anchors_tensor, [grid_shape[0], grid_shape[1], 1, 1]), [-1, 2])
+    grid_size = K.ones_like(grid) * K.cast(grid_shape[::-1], K.dtype(feats))
+
+    feats = K.reshape(feats, [K.shape(feats)[0], -1, num_classes + 5])
+    return feats, K.concatenate([grid, grid_size, anchors_tensor])
+
 # 推理
-def yolo_eval(yolo_outputs,
+def yolo_eval_batch(yolo_outputs,
               anchors,
               num_classes,
               image_shape,
@@ -146,50 +175,67 @@ def yolo_eval(yolo_outputs,
               max_boxes=20,
               score_threshold=.6,
               iou_threshold=.5,
-              eager = False,
-              letterbox_image=True):
-    if eager:
-        image_shape = K.reshape(yolo_outputs[-1],[-1])
-        num_layers = len(yolo_outputs)-1
-    else:
-        num_layers = len(yolo_outputs)
+              letterbox_image=True,
+              max_total_size=None,
+              pre_nms_topk=None):
+    '''
+    批量解码以及非极大值抑制
+    image_shape：(batch_size, 2)，每张原图的(h, w)
+    pre_nms_topk：先计算置信度，只对不低于score_threshold的候选框(最多pre_nms_topk个)解码坐标，为None时不限制数量
+    返回值：padding后的boxes、scores、classes以及每张图像的有效检测框数量，详见batched_nms
+    '''
+    num_layers = len(yolo_outputs)
 
     anchor_mask = [[6,7,8], [3,4,5], [0,1,2]] if num_layers==3 else [[3,4,5], [1,2,3]]
     
     input_shape = K.shape(yolo_outputs[0])[1:3] * 32
-    boxes = []
-    box_scores = []
-
-    for l in range(num_layers):
-        _boxes, _box_scores = yolo_boxes_and_scores(yolo_outputs[l], anchors[anchor_mask[l]], num_classes, input_shape,
-                                                    image_shape, letterbox_image)
-        boxes.append(_boxes)
-        box_scores.append(_box_scores)
-    boxes = K.concatenate(boxes, axis=0)
-    box_scores = K.concatenate(box_scores, axis=0)
-
-    mask = box_scores >= score_threshold
-    max_boxes_tensor = K.constant(max_boxes, dtype='int32')
-    boxes_ = []
-    scores_ = []
-    classes_ = []
-    for c in range(num_classes):
-        class_boxes = tf.boolean_mask(boxes, mask[:, c])
-        class_box_scores = tf.boolean_mask(box_scores[:, c], mask[:, c])
-
-        # 非极大值抑制
-        nms_index = tf.image.non_max_suppression(
-            class_boxes, class_box_scores, max_boxes_tensor, iou_threshold=iou_threshold)
-
-        # 获取目标框的位置、置信度以及分类
-        class_boxes = K.gather(class_boxes, nms_index)
-        class_box_scores = K.gather(class_box_scores, nms_index)
-        classes = K.ones_like(class_box_scores, 'int32') * c
-        boxes_.append(class_boxes)
-        scores_.append(class_box_scores)
-        classes_.append(classes)
-    boxes_ = K.concatenate(boxes_, axis=0)
-    scores_ = K.concatenate(scores_, axis=0)
-    classes_ = K.concatenate(classes_, axis=0)
+    grid_shapes = static_grid_shapes(yolo_outputs)
+    if grid_shapes is not None:
+        # 特征层尺寸已知时使用缓存的先验信息，不再重复构建网格
+        feats = K.concatenate([K.reshape(output, [K.shape(output)[0], -1, num_classes + 5]) for output in yolo_outputs], axis=1)
+        priors = K.constant(get_anchor_priors(grid_shapes, anchors, anchor_mask[:num_layers]))
+    else:
+        feats = []
+        priors = []
+        for l in range(num_layers):
+            _feats, _priors = yolo_head_priors(yolo_outputs[l], anchors[anchor_mask[l]], num_classes)
+            feats.append(_feats)
+            priors.append(_priors)
+        feats = K.concatenate(feats, axis=1)
+        priors = K.concatenate(priors, axis=0)
+
+    box_scores = K.sigmoid(feats[..., 4:5]) * K.sigmoid(feats[..., 5:])
+    # 先按score_threshold筛选候选框，只对候选框解码坐标
+    index, box_scores = select_topk(box_scores, score_threshold, pre_nms_topk)
+    feats = tf.gather(feats[..., :4], index, batch_dims=1)
+    priors = tf.gather(priors, index)
+    box_xy = (K.sigmoid(feats[..., :2]) + priors[..., 0:2]) / priors[..., 2:4]
+    box_wh = K.exp(feats[..., 2:4]) * priors[..., 4:6] / K.cast(input_shape[::-1], K.dtype(feats))
+    boxes = yolo_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image)
+
+    # 非极大值抑制，所有类别一次完成
+    return batched_nms(boxes, box_scores, max_boxes, score_threshold, iou_threshold, max_total_size)
+
+def yolo_eval(yolo_outputs,
+              anchors,
+              num_classes,
+              image_shape,
+              anchor_mask,
+              max_boxes=20,
+              score_threshold=.6,
+              iou_threshold=.5,
+              eager = False,
+              letterbox_image=True,
+              pre_nms_topk=None):
+    if eager:
+        image_shape = K.reshape(yolo_outputs[-1],[-1, 2])
+        yolo_outputs = yolo_outputs[:-1]
+
+    nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections = yolo_eval_batch(
+        yolo_outputs, anchors, num_classes, image_shape, anchor_mask,
+        max_boxes=max_boxes, score_threshold=score_threshold, iou_threshold=iou_threshold, letterbox_image=letterbox_image,
+        pre_nms_topk=pre_nms_topk)
+    # 获取目标框的位置、置信度以及分类
+    boxes_, scores_, classes_ = unpad_detections(nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections)
 
     return boxes_, scores_, classes_
@@ -1,17 +1,22 @@
 import colorsys
 import os
 import time
-from .lib.utils import letterbox_image, check_suffix
+from .lib.utils_box import yolo_eval_numpy
+from inference import batched, Detections, draw_detections, draw_detections_cv2
+from inference.utils import resize_image
+from inference.preprocess import letterbox_numpy, stack_frames
+from inference.end2end import unpad_end2end
+from inference.backends import backend_type, load_backend, GraphBackend
+from inference.tracing import warmup
+from inference.model_cache import cache_path, cache_key, is_fresh, is_cache
+from inference.startup import StartupReport
 import numpy as np
-import tensorflow as tf
-from PIL import Image, ImageDraw, ImageFont
-from tensorflow.keras.layers import Input, Lambda
-from tensorflow.keras.models import Model
-from pathlib import Path
+from PIL import Image
 
 
 class YOLOV4(object):
     def __init__(self, **kwargs) -> None:
+        t_load = time.time()
         self._params={
             "model_path" : kwargs['model_path'],
             "anchor_path" : kwargs['anchor_path'],
@@ -24,10 +29,18 @@ class YOLOV4(object):
             "istiny" : kwargs["istiny"],
             "attention" : kwargs["attention"],
             "anchors_mask":kwargs['anchors_mask'],
+            "pre_nms_topk" : kwargs.get('pre_nms_topk'),
+            "warmup_batch_sizes" : kwargs.get('warmup_batch_sizes'),
+            "warmup_frame_shapes" : kwargs.get('warmup_frame_shapes'),
+            "model_cache" : kwargs.get('model_cache', False),
+            "onnx_options" : kwargs.get('onnx_options'),
+            "tflite_options" : kwargs.get('tflite_options'),
+            "fuse" : kwargs.get('fuse', True),
             "result":'./result',
             "pr_folder_name":'tmp'
         }
         self.__dict__.update(self._params)
+        self.startup = StartupReport()
         self._class_names = self.get_classes()
         self._anchors = self.get_anchors()
         # 初始化颜色
@@ -43,6 +56,24 @@ class YOLOV4(object):
         np.random.seed(None)
         # 初始化模型
         self.get_model()
+        # tensorflow模型使用固定的input_signature，batch大小以及原图尺寸变化时不再重新trace
+        self.trace_counters = []
+        if self.backend_type in ('h5', 'saved_model'):
+            if not self.cached:
+                from inference.tracing_graph import build_pred_functions
+                self.get_pred, self.get_pred_frames, self.trace_counters = build_pred_functions(self._get_pred, self._get_pred_frames, (self.input_size[1], self.input_size[0]))
+                if self.backend_type == 'h5' and self.model_cache:
+                    from inference.model_cache_graph import save_pred_functions
+                    with self.startup.phase('save cache'):
+                        if save_pred_functions(cache_path(self.model_path), self.model, self.get_pred, self.get_pred_frames, self.get_cache_key()):
+                            print('inference cache saved to {}'.format(cache_path(self.model_path)))
+            self.backend = GraphBackend(self.backend_type, self.model, self.get_pred, self.get_pred_frames)
+        self.load_time = time.time() - t_load
+        # 加载时预热，第一帧不再包含trace以及首次运行的开销
+        self.warmup_times = []
+        if self.warmup_batch_sizes or self.warmup_frame_shapes:
+            with self.startup.phase('warmup'):
+                self.warmup_times = warmup(self, self.warmup_batch_sizes or (), self.warmup_frame_shapes or ())
     
     # 获得所有分类
     def get_classes(self):
@@ -51,6 +82,10 @@ class YOLOV4(object):
             class_names = f.readlines()
         class_names = [c.strip() for c in class_names]
         return class_names
+
+    @property
+    def class_names(self):
+        return self._class_names
     
     def get_anchors(self):
         anchors_path = os.path.expanduser(self.anchor_path)
@@ -63,30 +98,63 @@ class YOLOV4(object):
 
          # 加载不同类型的模型
         weights = str(self.model_path[0] if isinstance(self.model_path, list) else self.model_path)
-        suffix, suffixes = Path(weights).suffix.lower(), ['.h5', '.onnx', '']
-        # check weights have acceptable suffix
-        check_suffix(weights, suffixes)
-        # backbend booleans
-        self.h5, self.onnx, self.saved_model = (suffix == x for x in suffixes)
-
-        if self.h5:
+        # 按后缀选择后端：h5、onnx、tflite或者saved_model
+        self.backend_type = backend_type(weights)
+        # 推理缓存：.h5第一次加载后保存为SavedModel，之后直接加载计算图，不再构建网络以及trace
+        self.cached = False
+        if self.backend_type == 'h5':
             model_path = os.path.expanduser(self.model_path)
             assert model_path.endswith('.h5'), 'Keras model or weights must be a .h5 file.'
-            num_anchors = len(self._anchors)
-            num_classes = len(self._class_names)
-            if not self.istiny:
-                from .nets.yolo4 import yolo_body
-                self.model = yolo_body(Input(shape=(None,None,3)), num_anchors//3, num_classes, phi=self.attention)
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if self.model_cache and is_fresh(cache_path(model_path), self.get_cache_key()):
+                self.load_cache(cache_path(model_path))
             else:
-                from .nets.yolo4_tiny import yolo_body
-                self.model = yolo_body(Input(shape=(None,None,3)), num_anchors//2, num_classes, phi=self.attention)
-            self.model.load_weights(self.model_path)
+                from tensorflow.keras.layers import Input
+                num_anchors = len(self._anchors)
+                num_classes = len(self._class_names)
+                with self.startup.phase('build model'):
+                    if not self.istiny:
+                        from .nets.yolo4 import yolo_body
+                        self.model = yolo_body(Input(shape=(None,None,3)), num_anchors//3, num_classes, phi=self.attention)
+                    else:
+                        from .nets.yolo4_tiny import yolo_body
+                        self.model = yolo_body(Input(shape=(None,None,3)), num_anchors//2, num_classes, phi=self.attention)
+                with self.startup.phase('load weights'):
+                    self.model.load_weights(self.model_path)
+                if self.fuse:
+                    # 推理时把BN折叠到卷积中并合并RepConv，与原模型的输出不一致时保持原模型
+                    from inference.fuse_graph import fuse_model
+                    with self.startup.phase('fuse'):
+                        self.model = fuse_model(self.model, (self.input_size[1], self.input_size[0]))
             print('{} model, anchors, and classes loaded.'.format(model_path))
-        if self.onnx:
-            import onnxruntime
-            self.model = onnxruntime.InferenceSession(weights, None)
-        if self.saved_model:
-            self.model = tf.keras.models.load_model(weights)
+        self.onnx_preprocess = None
+        self.end2end = False
+        if self.backend_type in ('onnx', 'tflite'):
+            with self.startup.phase('load ' + self.backend_type):
+                self.backend = load_backend(weights, self.onnx_options, self.tflite_options)
+            # 导出时使用--preprocess的onnx模型输入为uint8，缩放方式以模型为准
+            self.onnx_preprocess = self.backend.preprocess
+            # 导出时使用--end2end的onnx模型内含解码以及非极大值抑制，阈值以模型为准
+            self.end2end = self.backend.end2end
+            if self.onnx_preprocess is not None:
+                self.letterbox_image = self.onnx_preprocess['letterbox_image']
+        if self.backend_type == 'saved_model':
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if is_cache(weights):
+                self.load_cache(weights)
+            else:
+                import tensorflow as tf
+                with self.startup.phase('load model'):
+                    self.model = tf.keras.models.load_model(weights)
+                if self.fuse:
+                    # 推理时把BN折叠到卷积中并合并RepConv，与原模型的输出不一致时保持原模型
+                    from inference.fuse_graph import fuse_model
+                    with self.startup.phase('fuse'):
+                        self.model = fuse_model(self.model, (self.input_size[1], self.input_size[0]))
 
 
         # self.input_image_shape = Input([2,],batch_size=1)
@@ -101,35 +169,90 @@ class YOLOV4(object):
     #     out_boxes, out_scores, out_classes = self.model([image_data, input_image_shape], training=False)
     #     return out_boxes, out_scores, out_classes
 
-    @tf.function
-    def get_pred(self, image_data):
-        yolo_head_P5, yolo_head_P4, yolo_head_P3 = self.model([image_data], training=False)
-        return [yolo_head_P5, yolo_head_P4, yolo_head_P3]
+    def get_cache_key(self):
+        import tensorflow as tf
+        return cache_key(self.model_path, model='yolov4', istiny=self.istiny, attention=self.attention, num_classes=len(self._class_names),
+                         anchors_mask=self.anchors_mask, input_size=self.input_size, letterbox_image=self.letterbox_image, fuse=self.fuse, tensorflow=tf.__version__)
+
+    def load_cache(self, path):
+        from inference.model_cache_graph import load_pred_functions
+        with self.startup.phase('load cache'):
+            self.model, self.get_pred, self.get_pred_frames = load_pred_functions(path)
+        self.cached = True
+
+    def _get_pred(self, image_data):
+        # YOLOV4为P5、P4、P3三个输出，YOLOV4-TINY为P5、P4两个输出
+        return list(self.model([image_data], training=False))
     
-    def detect(self, image,istrack=False):
+    def preprocess(self, image):
         '''
-        参数说明：
-        image：待检测的图像
-        imageid：在计算map的时候需要用到
-        istrack：是否目标跟踪返回数据的标志
+        图像预处理，返回RGB图像、归一化后的网络输入(不含batch维度)以及原图尺寸(h, w)
         '''
         image = image.convert('RGB')
         if self.letterbox_image:
-            boxed_image = letterbox_image(image, (self.input_size[0],self.input_size[1]))
+            boxed_image = resize_image(image, (self.input_size[0],self.input_size[1]), True)
         else:
             boxed_image = image.resize((self.input_size[0],self.input_size[1]), Image.BICUBIC)
-        image_data = np.array(boxed_image, dtype='float32')
-        image_data /= 255.
-        image_data = np.expand_dims(image_data, 0)  # Add batch dimension.
-        input_image_shape = np.expand_dims(np.array([image.size[1], image.size[0]], dtype='float32'), 0)
-        # out_boxes, out_scores, out_classes = self.get_pred(image_data, input_image_shape) 
+        if self.onnx_preprocess is not None:
+            # onnx模型内含归一化，只传输uint8数据；图像已缩放到输入尺寸，模型中的缩放不再改变图像
+            image_data = np.array(boxed_image, dtype='uint8')
+            if self.onnx_preprocess['bgr']:
+                image_data = np.ascontiguousarray(image_data[..., ::-1])
+        else:
+            image_data = np.array(boxed_image, dtype='float32')
+            image_data /= 255.
+        input_image_shape = np.array([image.size[1], image.size[0]], dtype='float32')
+        return image, image_data, input_image_shape
 
-        if self.h5 or self.saved_model:
-            outputs = self.get_pred(image_data)
-        if self.onnx:
-            output_names = [output.name for output in self.model.get_outputs()]
-            outputs = self.model.run(output_names, {self.model.get_inputs()[0].name: image_data})
-        
+    def forward(self, image_data, input_image_shapes=None):
+        '''
+        image_data：(batch_size, h, w, 3)，一次前向推理得到每个yolo head的输出(YOLOV4-TINY为两个)
+        input_image_shapes：(batch_size, 2)，每张原图的(h, w)，只有end2end模型需要
+        '''
+        return self.backend.run(image_data, input_image_shapes)
+
+    def _get_pred_frames(self, frames, bgr):
+        from inference.preprocess_graph import letterbox_graph
+        image_data = letterbox_graph(frames, (self.input_size[1], self.input_size[0]), self.letterbox_image, bgr=bgr)
+        return self._get_pred(image_data)
+
+    def forward_frames(self, frames, bgr=True):
+        '''
+        frames：(batch_size, H, W, 3)的uint8图像，可以直接使用cv2.VideoCapture读取的帧；
+                尺寸不同的帧(例如来自多路摄像头)以列表传入，详见stack_frames
+        tensorflow模型以及内含预处理的onnx模型在计算图中完成缩放、填充以及归一化，只传输uint8数据，
+        其余onnx模型以及tflite模型使用cv2预处理
+        '''
+        frames, input_image_shapes = stack_frames(frames, (self.input_size[1], self.input_size[0]), self.letterbox_image)
+        if self.backend.tensorflow:
+            return self.backend.run_frames(frames, bgr)
+        if self.onnx_preprocess is not None:
+            if self.onnx_preprocess['bgr'] != bgr:
+                frames = np.ascontiguousarray(frames[..., ::-1])
+            return self.forward(frames, input_image_shapes)
+        image_data = np.stack([letterbox_numpy(frame, (self.input_size[1], self.input_size[0]), self.letterbox_image, bgr=bgr)
+                               for frame in frames], axis=0)
+        return self.forward(image_data, input_image_shapes)
+
+    def decode(self, outputs, input_image_shape):
+        '''
+        对单张图像的网络输出进行解码以及非极大值抑制
+        '''
+        if self.end2end:
+            return unpad_end2end(*outputs)
+        if not self.backend.tensorflow:
+            return yolo_eval_numpy(
+                yolo_outputs=outputs,
+                anchors=self._anchors,
+                num_classes = len(self._class_names),
+                image_shape = input_image_shape,
+                anchor_mask = self.anchors_mask,
+                score_threshold = self.score,
+                iou_threshold = self.iou,
+                max_boxes = self.max_boxes,
+                letterbox_image = self.letterbox_image,
+                pre_nms_topk = self.pre_nms_topk
+            )
         # 判断是否是tiny
         if self.istiny:
             from .nets.yolo4_tiny import yolo_eval
@@ -144,8 +267,115 @@ class YOLOV4(object):
             score_threshold = self.score,
             iou_threshold = self.iou,
             max_boxes = self.max_boxes,
-            letterbox_image = self.letterbox_image
+            letterbox_image = self.letterbox_image,
+            pre_nms_topk = self.pre_nms_topk
         )
+        return out_boxes, out_scores, out_classes
+
+    def decode_batch(self, outputs, input_image_shapes):
+        '''
+        对整个batch的网络输出进行解码以及非极大值抑制，input_image_shapes：(batch_size, 2)
+        返回值：每张图像的(out_boxes, out_scores, out_classes)
+        '''
+        if self.end2end:
+            return [unpad_end2end(*outputs, index=i) for i in range(len(input_image_shapes))]
+        if not self.backend.tensorflow:
+            # onnx以及tflite使用NumPy逐张图像解码
+            return [self.decode([output[i:i+1] for output in outputs], input_image_shapes[i:i+1])
+                    for i in range(len(input_image_shapes))]
+        if self.istiny:
+            from .nets.yolo4_tiny import yolo_eval_batch
+        else:
+            from .nets.yolo4 import yolo_eval_batch
+        from inference.batched_nms import unpad_detections
+        nmsed_outputs = yolo_eval_batch(
+            yolo_outputs=outputs,
+            anchors=self._anchors,
+            num_classes = len(self._class_names),
+            image_shape = input_image_shapes,
+            anchor_mask = self.anchors_mask,
+            score_threshold = self.score,
+            iou_threshold = self.iou,
+            max_boxes = self.max_boxes,
+            letterbox_image = self.letterbox_image,
+            pre_nms_topk = self.pre_nms_topk
+        )
+        return [unpad_detections(*nmsed_outputs, index=i) for i in range(len(input_image_shapes))]
+
+    def predict(self, image):
+        '''
+        只进行推理以及后处理，不绘制、不打印，返回Detections(boxes为x1, y1, x2, y2)
+        '''
+        image, image_data, input_image_shape = self.preprocess(image)
+        input_image_shape = np.expand_dims(input_image_shape, 0)
+        outputs = self.forward(np.expand_dims(image_data, 0), input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
+        return Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size)
+
+    def predict_frames(self, frames, bgr=True):
+        '''
+        对uint8的HWC图像推理，不经过PIL，返回每张图像对应的Detections，frames的说明见forward_frames
+        '''
+        image_hws = [frame.shape[:2] for frame in frames]
+        input_image_shapes = np.array(image_hws, dtype='float32')
+        decoded = self.decode_batch(self.forward_frames(frames, bgr), input_image_shapes)
+        return [Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                for (h, w), (out_boxes, out_scores, out_classes) in zip(image_hws, decoded)]
+
+    def predict_frame(self, frame, bgr=True):
+        return self.predict_frames(frame[None], bgr)[0]
+
+    def detect_batch(self, images, batch_size=8):
+        '''
+        参数说明：
+        images：待检测的图像序列(PIL.Image)，可以是生成器
+        batch_size：每次前向推理的图像数量
+        返回值：每张图像对应的Detections
+        '''
+        results = []
+        for batch in batched(images, batch_size):
+            batch_sizes = []
+            batch_data = []
+            batch_shapes = []
+            for image in batch:
+                image, image_data, input_image_shape = self.preprocess(image)
+                batch_sizes.append(image.size)
+                batch_data.append(image_data)
+                batch_shapes.append(input_image_shape)
+            batch_shapes = np.stack(batch_shapes, axis=0)
+            outputs = self.forward(np.stack(batch_data, axis=0), batch_shapes)
+            decoded = self.decode_batch(outputs, batch_shapes)
+            for i, (out_boxes, out_scores, out_classes) in enumerate(decoded):
+                results.append(Detections.from_tlbr(out_boxes, out_scores, out_classes, batch_sizes[i]))
+        return results
+
+    def draw(self, image, detections):
+        '''
+        在图像上绘制检测结果，字体按字号缓存
+        '''
+        return draw_detections(image, detections, self._class_names, self.colors, font_path='model_data/simhei.ttf',
+            font_scale=6e-2, padding=5)
+
+    def draw_frame(self, frame, detections, bgr=True):
+        '''
+        使用cv2在uint8图像上绘制检测结果(原地修改)，用于视频流
+        '''
+        return draw_detections_cv2(frame, detections, self.class_names, self.colors, bgr=bgr)
+
+    def detect(self, image,istrack=False):
+        '''
+        参数说明：
+        image：待检测的图像
+        imageid：在计算map的时候需要用到
+        istrack：是否目标跟踪返回数据的标志
+        '''
+        image, image_data, input_image_shape = self.preprocess(image)
+        image_data = np.expand_dims(image_data, 0)  # Add batch dimension.
+        input_image_shape = np.expand_dims(input_image_shape, 0)
+        # out_boxes, out_scores, out_classes = self.get_pred(image_data, input_image_shape) 
+
+        outputs = self.forward(image_data, input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
 
         print('Found {} boxes for {}'.format(len(out_boxes), 'img'))
         if istrack:
@@ -172,49 +402,12 @@ class YOLOV4(object):
                 boxes.append(box_tmp)
             return boxes, out_scores, out_classes
         else:
-            font = ImageFont.truetype(font='model_data/simhei.ttf', size=np.floor(3e-2 * image.size[1]*2 + 0.5).astype('int32'))
-            thickness = max((image.size[0] + image.size[1]) // 300, 1)
-        
-            for i, c in list(enumerate(out_classes)):
-                predicted_class = self._class_names[c]
-                box = out_boxes[i]
-                score = out_scores[i]
-
-                top, left, bottom, right = box
-                top = top - 5
-                left = left - 5
-                bottom = bottom + 5
-                right = right + 5
-                top = max(0, np.floor(top + 0.5).astype('int32'))
-                left = max(0, np.floor(left + 0.5).astype('int32'))
-                bottom = min(image.size[1], np.floor(bottom + 0.5).astype('int32'))
-                right = min(image.size[0], np.floor(right + 0.5).astype('int32'))
-
-                # 画框框
-                label = '{} {:.2f}'.format(predicted_class, score)
-                # label = '{}'.format(predicted_class)
-                draw = ImageDraw.Draw(image)
-                label_size = draw.textsize(label, font)
-                label = label.encode('utf-8')
-                print(label, top, left, bottom, right)
-            
-                if top - label_size[1] >= 0:
-                    text_origin = np.array([left, top - label_size[1]])
-                else:
-                    text_origin = np.array([left, top + 1])
-
-                for i in range(thickness):
-                    draw.rectangle([left + i, top + i, right - i, bottom - i],outline=self.colors[c])
-                draw.rectangle([tuple(text_origin), tuple(text_origin + label_size)],fill=self.colors[c])
-                draw.text(text_origin, str(label,'UTF-8'), fill=(0, 0, 0), font=font)
-                del draw
-
-            return image
+            return self.draw(image, Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size))
         
     def getdrtxt(self, image,pr_folder_name, image_id):
         image = image.convert('RGB')
         if self.letterbox_image:
-            boxed_image = letterbox_image(image, (self.input_size[0],self.input_size[1]))
+            boxed_image = resize_image(image, (self.input_size[0],self.input_size[1]), True)
         else:
             boxed_image = image.resize((self.input_size[0],self.input_size[1]), Image.BICUBIC)
         image_data = np.array(boxed_image, dtype='float32')
@@ -264,8 +457,14 @@ def Inference_YOLOV4Model(YOLOV4Config, model_path):
         anchor_path = YOLOV4Config.anchors_path,
         classes_path = YOLOV4Config.classes_path,
         score = YOLOV4Config.score,
-        anchors_mask = YOLOV4Config.ANCHOR_MASK
-        
+        anchors_mask = YOLOV4Config.ANCHOR_MASK,
+        pre_nms_topk = YOLOV4Config.pre_nms_topk,
+        warmup_batch_sizes = YOLOV4Config.warmup_batch_sizes,
+        warmup_frame_shapes = YOLOV4Config.warmup_frame_shapes,
+        model_cache = YOLOV4Config.model_cache,
+        onnx_options = YOLOV4Config.onnx_options,
+        tflite_options = YOLOV4Config.tflite_options,
+        fuse = YOLOV4Config.fuse
     )
     return yolov4
     
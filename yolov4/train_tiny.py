@@ -9,10 +9,12 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tqdm import tqdm
 
-from . import (yolo_loss, yolo_body,ModelCheckpoint,
-                         WarmUpCosineDecayScheduler, get_random_data,
+from . import (ModelCheckpoint, WarmUpCosineDecayScheduler, get_random_data,
                          get_random_data_with_Mosaic)
-from cfg import YOLOV4Config
+from .nets.yolo4_tiny import yolo_body
+from .lib.loss_tiny import yolo_loss
+from components.distillation import distillation
+from components.image_cache import image_cache
 
 
 # 设置GPU自增长
@@ -35,36 +37,43 @@ def get_anchors(anchors_path):
     anchors = [float(x) for x in anchors.split(',')]
     return np.array(anchors).reshape(-1, 2)
 
-def data_generator(annotation_lines, batch_size, input_shape, anchors, num_classes, mosaic=False, random=True, eager=True):
+def data_generator(annotation_lines, batch_size, input_shape, anchors, num_classes, mosaic=False, random=True, eager=True, teacher_cache=None, cache=None):
+    '''
+    teacher_cache：知识蒸馏的TeacherCache，不为None时在输入之后加入每张图像缓存的teacher蒸馏目标
+    cache：图像缓存(components/image_cache.py)
+    '''
     n = len(annotation_lines)
     i = 0
     flag = True
     while True:
         image_data = []
         box_data = []
+        batch_lines = []
         for b in range(batch_size):
             if i==0:
                 np.random.shuffle(annotation_lines)
+            batch_lines.append(annotation_lines[i])
             if mosaic:
                 if flag and (i+4) < n:
-                    image, box = get_random_data_with_Mosaic(annotation_lines[i:i+4], input_shape)
+                    image, box = get_random_data_with_Mosaic(annotation_lines[i:i+4], input_shape, cache=cache)
                     i = (i+4) % n
                 else:
-                    image, box = get_random_data(annotation_lines[i], input_shape, random=random)
+                    image, box = get_random_data(annotation_lines[i], input_shape, random=random, cache=cache)
                     i = (i+1) % n
                 flag = bool(1-flag)
             else:
-                image, box = get_random_data(annotation_lines[i], input_shape, random=random)
+                image, box = get_random_data(annotation_lines[i], input_shape, random=random, cache=cache)
                 i = (i+1) % n
             image_data.append(image)
             box_data.append(box)
         image_data = np.array(image_data)
         box_data = np.array(box_data)
         y_true = preprocess_true_boxes(box_data, input_shape, anchors, num_classes)
+        teacher_targets = teacher_cache.get(batch_lines) if teacher_cache is not None else []
         if eager:
-            yield image_data, y_true[0], y_true[1]
+            yield (image_data, y_true[0], y_true[1], *teacher_targets)
         else:
-            yield [image_data, *y_true], np.zeros(batch_size)
+            yield [image_data, *y_true, *teacher_targets], np.zeros(batch_size)
 
 def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes):
     assert (true_boxes[..., 4]<num_classes).all(), 'class id must be less than num_classes'
@@ -88,46 +97,61 @@ def preprocess_true_boxes(true_boxes, input_shape, anchors, num_classes):
     anchor_mins = -anchor_maxes
     valid_mask = boxes_wh[..., 0]>0
 
-    for b in range(m):
-        # 对每一张图进行处理
-        wh = boxes_wh[b, valid_mask[b]]
-        if len(wh)==0: continue
-        wh = np.expand_dims(wh, -2)
-        box_maxes = wh / 2.
-        box_mins = -box_maxes
-        intersect_mins = np.maximum(box_mins, anchor_mins)
-        intersect_maxes = np.minimum(box_maxes, anchor_maxes)
-        intersect_wh = np.maximum(intersect_maxes - intersect_mins, 0.)
-        intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
-
-        box_area = wh[..., 0] * wh[..., 1]
-        anchor_area = anchors[..., 0] * anchors[..., 1]
-
-        iou = intersect_area / (box_area + anchor_area - intersect_area)
-        best_anchor = np.argmax(iou, axis=-1)
-
-        for t, n in enumerate(best_anchor):
-            for l in range(num_layers):
-                if n in anchor_mask[l]:
-                    i = np.floor(true_boxes[b,t,0] * grid_shapes[l][1]).astype('int32')
-                    j = np.floor(true_boxes[b,t,1] * grid_shapes[l][0]).astype('int32')
-                    k = anchor_mask[l].index(n)
-                    c = true_boxes[b, t, 4].astype('int32')
-                    y_true[l][b, j, i, k, 0:4] = true_boxes[b, t, 0:4]
-                    y_true[l][b, j, i, k, 4] = 1
-                    y_true[l][b, j, i, k, 5+c] = 1
+    # 所有图像一起计算每个目标与设定anchor box的最佳IOU，第t个有效框对应true_boxes的第t行(有效框在前，补齐的0在后)
+    order = np.argsort(~valid_mask, axis=1, kind='stable')
+    valid = np.take_along_axis(valid_mask, order, axis=1)
+    wh = np.expand_dims(np.take_along_axis(boxes_wh, order[..., None], axis=1), -2)
+    box_maxes = wh / 2.
+    box_mins = -box_maxes
+    intersect_mins = np.maximum(box_mins, anchor_mins)
+    intersect_maxes = np.minimum(box_maxes, anchor_maxes)
+    intersect_wh = np.maximum(intersect_maxes - intersect_mins, 0.)
+    intersect_area = intersect_wh[..., 0] * intersect_wh[..., 1]
+
+    box_area = wh[..., 0] * wh[..., 1]
+    anchor_area = anchors[..., 0] * anchors[..., 1]
+
+    iou = intersect_area / (box_area + anchor_area - intersect_area)
+    best_anchor = np.argmax(iou, axis=-1)
+
+    for l in range(num_layers):
+        # 最佳anchor属于该层的真实框，k为anchor在该层中的序号
+        b, t = np.nonzero(valid & np.isin(best_anchor, anchor_mask[l]))
+        index = np.zeros(anchors.shape[1], dtype='int64')
+        index[anchor_mask[l]] = np.arange(len(anchor_mask[l]))
+        k = index[best_anchor[b, t]]
+        # 根据真实框的坐标信息来计算所属网格左上角的位置
+        i = np.floor(true_boxes[b, t, 0].astype(np.float64) * grid_shapes[l][1]).astype('int32')
+        j = np.floor(true_boxes[b, t, 1].astype(np.float64) * grid_shapes[l][0]).astype('int32')
+        c = true_boxes[b, t, 4].astype('int32')
+        # label以one-hot形式标记，同一个网格的同一个anchor有多个真实框时类别都保留，位置以及置信度由最后一个真实框填充
+        y_true[l][b, j, i, k, 5+c] = 1
+        cell = ((b * grid_shapes[l][0] + j) * grid_shapes[l][1] + i) * len(anchor_mask[l]) + k
+        last = len(cell) - 1 - np.unique(cell[::-1], return_index=True)[1]
+        b, t, k, i, j = b[last], t[last], k[last], i[last], j[last]
+        y_true[l][b, j, i, k, 0:4] = true_boxes[b, t, 0:4]
+        y_true[l][b, j, i, k, 4] = 1
 
     return y_true
 
 # 防止bug
-def get_train_step_fn():
+def get_train_step_fn(anchors, num_classes, label_smoothing, distiller=None):
     @tf.function
-    def train_step(imgs, yolo_loss, targets, net, optimizer, regularization, normalize):
+    def train_step(imgs, yolo_loss, targets, net, optimizer, regularization, normalize, teacher_targets=None):
         with tf.GradientTape() as tape:
             # 计算loss
-            P5_output, P4_output = net(imgs, training=True)
+            if distiller is None:
+                P5_output, P4_output = net(imgs, training=True)
+            else:
+                # 蒸馏时同时输出检测头特征，没有缓存时在线运行teacher
+                outputs = distiller.student(imgs, training=True)
+                P5_output, P4_output = outputs[:2]
             args = [P5_output, P4_output] + targets
-            loss_value = yolo_loss(args,YOLOV4Config.anchors,YOLOV4Config.num_classes,label_smoothing=YOLOV4Config.label_smoothing,normalize=normalize)
+            loss_value = yolo_loss(args,anchors,num_classes,label_smoothing=label_smoothing,normalize=normalize)
+            if distiller is not None:
+                if teacher_targets is None:
+                    teacher_targets = distiller.teacher_targets(imgs)
+                loss_value = loss_value + distiller.loss(outputs[:2], outputs[2:], teacher_targets)
             if regularization:
                 # 加入正则化损失
                 loss_value = tf.reduce_sum(net.losses) + loss_value
@@ -137,7 +161,7 @@ def get_train_step_fn():
     return train_step
 
 def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val, gen, genval, Epoch, anchors, 
-                        num_classes, label_smoothing, regularization=False, train_step=None):
+                        num_classes, label_smoothing, regularization=False, train_step=None, normalize=True, log_dir='logs/'):
     loss = 0
     val_loss = 0
     print('Start Train')
@@ -145,10 +169,12 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
         for iteration, batch in enumerate(gen):
             if iteration>=epoch_size:
                 break
-            images, target0, target1 = batch[0], batch[1], batch[2], batch[3]
+            images, target0, target1 = batch[0], batch[1], batch[2]
             targets = [target0, target1]
             targets = [tf.convert_to_tensor(target) for target in targets]
-            loss_value = train_step(images, yolo_loss, targets, net, optimizer, regularization, YOLOV4Config.normalize)
+            # 缓存的teacher蒸馏目标
+            teacher_targets = list(batch[3:]) or None
+            loss_value = train_step(images, yolo_loss, targets, net, optimizer, regularization, normalize, teacher_targets)
             loss = loss + loss_value
 
             pbar.set_postfix(**{'total_loss': float(loss) / (iteration + 1), 
@@ -165,9 +191,10 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
             targets = [target0, target1]
             targets = [tf.convert_to_tensor(target) for target in targets]
 
-            P5_output, P4_output = net(images)
+            # 蒸馏时net(distiller.student)另外输出检测头特征，只取两个检测头
+            P5_output, P4_output = net(images)[:2]
             args = [P5_output, P4_output] + targets
-            loss_value = yolo_loss(args,anchors,num_classes,label_smoothing=label_smoothing, normalize=YOLOV4Config.normalize)
+            loss_value = yolo_loss(args,anchors,num_classes,label_smoothing=label_smoothing, normalize=normalize)
             if regularization:
                 # 加入正则化损失
                 loss_value = tf.reduce_sum(net.losses) + loss_value
@@ -179,38 +206,38 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
     print('Finish Validation')
     print('Epoch:'+ str(epoch+1) + '/' + str(Epoch))
     print('Total Loss: %.4f || Val Loss: %.4f ' % (loss/(epoch_size+1),val_loss/(epoch_size_val+1)))
-    net.save_weights('logs/Epoch%d-Total_Loss%.4f-Val_Loss%.4f.h5'%((epoch+1),loss/(epoch_size+1),val_loss/(epoch_size_val+1)))
+    net.save_weights(log_dir + 'Epoch%d-Total_Loss%.4f-Val_Loss%.4f.h5'%((epoch+1),loss/(epoch_size+1),val_loss/(epoch_size_val+1)))
 
 gpus = tf.config.experimental.list_physical_devices(device_type='GPU')
 for gpu in gpus:
     tf.config.experimental.set_memory_growth(gpu, True)
 
-def yolov4tiny():
-    train_txt = YOLOV4Config.train_txt
-    log_dir = YOLOV4Config.logdir
-    classes_path = YOLOV4Config.classes_path
-    anchors_path = YOLOV4Config.anchors_tiny_path
-    weights_path = YOLOV4Config.pretrain_weight_tiny
-    save_model_name = YOLOV4Config.save_model_name
-    input_shape = (YOLOV4Config.imagesize,YOLOV4Config.imagesize)
-    eager = YOLOV4Config.eager
-    normalize = YOLOV4Config.normalize
+def yolov4tiny(config):
+    train_txt = config.train_txt
+    log_dir = config.logdir
+    classes_path = config.classes_path
+    anchors_path = config.anchors_tiny_path
+    weights_path = config.pretrain_weight_tiny
+    save_model_name = config.save_weight_tiny
+    input_shape = (config.imagesize,config.imagesize)
+    eager = config.eager
+    normalize = config.normalize
 
     class_names = get_classes(classes_path)
     anchors     = get_anchors(anchors_path)
     num_classes = len(class_names)
     num_anchors = len(anchors)
 
-    mosaic = YOLOV4Config.mosaic
-    Cosine_scheduler = YOLOV4Config.Cosine_scheduler
-    label_smoothing = YOLOV4Config.label_smoothing
+    mosaic = config.mosaic
+    Cosine_scheduler = config.Cosine_scheduler
+    label_smoothing = config.label_smoothing
 
-    regularization = YOLOV4Config.regularization
+    regularization = config.regularization
 
     image_input = Input(shape=(None, None, 3))
     h, w = input_shape
     print('Create YOLOv4-Tiny model with {} anchors and {} classes.'.format(num_anchors, num_classes))
-    model_body = yolo_body(image_input, num_anchors//2, num_classes, YOLOV4Config.ATTENTION)
+    model_body = yolo_body(image_input, num_anchors//2, num_classes, config.ATTENTION)
     
     print('Load weights {}.'.format(weights_path))
     model_body.load_weights(weights_path, by_name=True, skip_mismatch=True)
@@ -231,16 +258,27 @@ def yolov4tiny():
     np.random.seed(None)
     num_val = int(len(lines)*val_split)
     num_train = len(lines) - num_val
+    # 图像缓存：config.image_cache_dir不为空时训练集以及验证集的图像只解码一次
+    cache = image_cache(config, lines)
+
+    # 知识蒸馏：teacher的蒸馏目标缓存到磁盘时训练图像不做随机数据增强
+    distiller, teacher_cache = distillation(config, model_body, num_classes, lines,
+                                            lambda line: get_random_data(line, input_shape, random=False, cache=cache)[0], input_shape)
+    if distiller is not None:
+        model = distiller.attach(model, model_body, cached=teacher_cache is not None)
+    net = model_body if distiller is None else distiller.student
+    train_random = teacher_cache is None
+    mosaic = mosaic and train_random
     
-    freeze_layers = YOLOV4Config.freeze_layers_tiny
+    freeze_layers = config.freeze_layers_tiny
     for i in range(freeze_layers): model_body.layers[i].trainable = False
     print('Freeze the first {} layers of total {} layers.'.format(freeze_layers, len(model_body.layers)))
 
     if True:
-        Init_epoch = YOLOV4Config.Init_epoch
-        Freeze_epoch = YOLOV4Config.Freeze_epoch
-        batch_size  = YOLOV4Config.batch_size
-        learning_rate_freeze  = YOLOV4Config.learning_rate_freeze
+        Init_epoch = config.Init_epoch
+        Freeze_epoch = config.Freeze_epoch
+        batch_size  = config.batch_size
+        learning_rate_freeze  = config.learning_rate_freeze
         
         epoch_size      = num_train // batch_size
         epoch_size_val  = num_val // batch_size
@@ -250,9 +288,10 @@ def yolov4tiny():
 
         if eager:
             gen     = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[:num_train], batch_size = batch_size,
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True), (tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=train_random, teacher_cache=teacher_cache, cache=cache),
+                (tf.float32,) * (3 + len(teacher_cache.arrays) if teacher_cache else 3))
             gen_val = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[num_train:], batch_size = batch_size, 
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False), (tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False, cache=cache), (tf.float32, tf.float32, tf.float32))
 
             gen     = gen.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
             gen_val = gen_val.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
@@ -281,12 +320,13 @@ def yolov4tiny():
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         if eager:
             for epoch in range(Init_epoch,Freeze_epoch):
-                fit_one_epoch(model_body, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
-                            Freeze_epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn())
+                fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
+                            Freeze_epoch, anchors, num_classes, label_smoothing, regularization,
+                            get_train_step_fn(anchors, num_classes, label_smoothing, distiller), normalize, log_dir)
         else:
-            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False),
+            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=train_random, eager=False, teacher_cache=teacher_cache, cache=cache),
                     steps_per_epoch=epoch_size,
-                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False),
+                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False, teacher_cache=teacher_cache, cache=cache),
                     validation_steps=epoch_size_val,
                     epochs=Freeze_epoch,
                     initial_epoch=Init_epoch,
@@ -295,10 +335,10 @@ def yolov4tiny():
     for i in range(freeze_layers): model_body.layers[i].trainable = True
 
     if True:
-        Freeze_epoch = YOLOV4Config.Freeze_epoch
-        Epoch = YOLOV4Config.epoch
-        batch_size = YOLOV4Config.batch_size
-        learning_rate_unfreeze  = YOLOV4Config.learning_rate_unfreeze
+        Freeze_epoch = config.Freeze_epoch
+        Epoch = config.epoch
+        batch_size = config.batch_size
+        learning_rate_unfreeze  = config.learning_rate_unfreeze
 
         epoch_size      = num_train // batch_size
         epoch_size_val  = num_val // batch_size
@@ -308,9 +348,10 @@ def yolov4tiny():
 
         if eager:
             gen     = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[:num_train], batch_size = batch_size,
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True), (tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=train_random, teacher_cache=teacher_cache, cache=cache),
+                (tf.float32,) * (3 + len(teacher_cache.arrays) if teacher_cache else 3))
             gen_val = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[num_train:], batch_size = batch_size, 
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False), (tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False, cache=cache), (tf.float32, tf.float32, tf.float32))
 
             gen     = gen.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
             gen_val = gen_val.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
@@ -339,15 +380,16 @@ def yolov4tiny():
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         if eager:
             for epoch in range(Freeze_epoch,Epoch):
-                fit_one_epoch(model_body, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
-                            Epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn())
+                fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
+                            Epoch, anchors, num_classes, label_smoothing, regularization,
+                            get_train_step_fn(anchors, num_classes, label_smoothing, distiller), normalize, log_dir)
         else:
-            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False),
+            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=train_random, eager=False, teacher_cache=teacher_cache, cache=cache),
                     steps_per_epoch=epoch_size,
-                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False),
+                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False, teacher_cache=teacher_cache, cache=cache),
                     validation_steps=epoch_size_val,
                     epochs=Epoch,
                     initial_epoch=Freeze_epoch,
                     callbacks=[logging, checkpoint, reduce_lr, early_stopping])
     
-    model.save('./model/voc_tiny', save_format='tf')
\ No newline at end of file
+    model.save('./model/voc_tiny', save_format='tf')
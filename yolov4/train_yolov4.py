@@ -10,10 +10,22 @@ from tensorflow.keras.optimizers import Adam
 from tqdm import tqdm
 
 
-from yolov4 import yolo_body, yolo_loss, ModelCheckpoint, WarmUpCosineDecayScheduler, data_generator, get_classes, get_anchors
+from yolov4 import yolo_body, yolo_loss, ModelCheckpoint, WarmUpCosineDecayScheduler, data_generator, YoloSamples, get_classes, get_anchors
 from tools.tfrecord_create import load_tfrecord_dataset, transform_dataset
+from components.pruning import prune_magnitude, pruning_callbacks, pruning_steps, strip_and_save
+from components.data_pipeline import data_pipeline
+from components.sparse_targets import TARGET_COLUMNS
+from components.image_cache import image_cache
 from tqdm import tqdm
 
+def tf_data_loaders(config, lines, num_train, batch_size, input_shape, anchors, num_classes, mosaic, initial_epoch, epochs, eager, cache=None):
+    '''
+    config.data_pipeline为tf.data时的训练集以及验证集(components/data_pipeline.py)，代替data_generator
+    '''
+    train = YoloSamples(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, sparse=config.sparse_targets, cache=cache)
+    val = YoloSamples(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, sparse=config.sparse_targets, cache=cache)
+    return data_pipeline(train, config, epochs, initial_epoch, eager=eager), data_pipeline(val, config, 1, shuffle=False, eager=eager)
+
 # 防止bug
 def get_train_step_fn():
     @tf.function
@@ -32,7 +44,7 @@ def get_train_step_fn():
     return train_step
 
 def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val, gen, genval, Epoch, anchors, 
-                        num_classes, label_smoothing, regularization=False, train_step=None):
+                        num_classes, label_smoothing, regularization=False, train_step=None, callbacks=()):
     loss = 0
     val_loss = 0
     print('Start Train')
@@ -40,10 +52,14 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
         for iteration, batch in enumerate(gen):
             if iteration>=epoch_size:
                 break
-            images, target0, target1, target2 = batch[0], batch[1], batch[2], batch[3]
-            targets = [target0, target1, target2]
+            images, targets = batch[0], list(batch[1:])
             targets = [tf.convert_to_tensor(target) for target in targets]
+            # 剪枝的callback：更新剪枝的step以及mask
+            for callback in callbacks:
+                callback.on_train_batch_begin(iteration)
             loss_value = train_step(images, yolo_loss, targets, net, optimizer, regularization, normalize)
+            for callback in callbacks:
+                callback.on_train_batch_end(iteration)
             loss = loss + loss_value
 
             pbar.set_postfix(**{'total_loss': float(loss) / (iteration + 1), 
@@ -56,8 +72,7 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
             if iteration>=epoch_size_val:
                 break
             # 计算验证集loss
-            images, target0, target1, target2 = batch[0], batch[1], batch[2], batch[3]
-            targets = [target0, target1, target2]
+            images, targets = batch[0], list(batch[1:])
             targets = [tf.convert_to_tensor(target) for target in targets]
 
             P5_output, P4_output, P3_output = net(images)
@@ -73,6 +88,8 @@ def fit_one_epoch(net, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,
             pbar.update(1)
 
     logs = {'loss': loss.numpy()/(epoch_size+1), 'val_loss': val_loss.numpy()/(epoch_size_val+1)}
+    for callback in callbacks:
+        callback.on_epoch_end(epoch, logs)
     print('Finish Validation')
     print('Epoch:'+ str(epoch+1) + '/' + str(Epoch))
     print('Total Loss: %.4f || Val Loss: %.4f ' % (loss/(epoch_size+1),val_loss/(epoch_size_val+1)))
@@ -93,7 +110,9 @@ def yolov4(config):
     input_shape = (config.imagesize,config.imagesize)
     anchor_mask = config.ANCHOR_MASK
     eager = config.eager
+    tf_data = config.data_pipeline == 'tf.data'
     normalize = config.normalize
+    sparse = config.sparse_targets
 
     class_names = get_classes(classes_path)
     anchors     = get_anchors(anchors_path)
@@ -106,19 +125,40 @@ def yolov4(config):
 
     regularization = config.regularization
 
+    val_split = 0.1
+    with open(train_txt) as f:
+        lines = f.readlines()
+    np.random.seed(10101)
+    np.random.shuffle(lines)
+    np.random.seed(None)
+    num_val = int(len(lines)*val_split)
+    num_train = len(lines) - num_val
+    # 图像缓存：config.image_cache_dir不为空时训练集以及验证集的图像只解码一次
+    cache = image_cache(config, lines)
+
     image_input = Input(shape=(None, None, 3))
     h, w = input_shape
     model_body = yolo_body(image_input, num_anchors//3, num_classes, config.ATTENTION)
     print('加载权重')
     model_body.load_weights(weights_path, by_name=True, skip_mismatch=True)
-    
-
-    # 将模型的输出作为loss
-    y_true = [Input(shape=(h//{0:32, 1:16, 2:8}[l], w//{0:32, 1:16, 2:8}[l], \
-        num_anchors//3, num_classes+5)) for l in range(3)]
+    if config.pruning == 'magnitude':
+        # 非结构化剪枝：用tfmot包装卷积，训练时按计划把绝对值最小的权重置0
+        model_body = prune_magnitude(model_body, config.pruning_sparsity,
+                                     *pruning_steps(config, num_train // config.batch_size),
+                                     frequency=config.pruning_frequency)
+
+    # 将模型的输出作为loss，sparse时y_true为一个(None, TARGET_COLUMNS)的记录输入
+    if sparse:
+        y_true = [Input(shape=(None, TARGET_COLUMNS))]
+    else:
+        y_true = [Input(shape=(h//{0:32, 1:16, 2:8}[l], w//{0:32, 1:16, 2:8}[l], \
+            num_anchors//3, num_classes+5)) for l in range(3)]
     loss_input = [*model_body.output, *y_true]
     model_loss = Lambda(yolo_loss, output_shape=(1,), name='yolo_loss',
-        arguments={'anchors': anchors, 'num_classes': num_classes, 'ignore_thresh': 0.5, 'label_smoothing': label_smoothing})(loss_input)
+        arguments={'anchors': anchors, 'num_classes': num_classes, 'ignore_thresh': 0.5, 'label_smoothing': label_smoothing,
+                   'sparse': sparse})(loss_input)
+    # eager训练时使用的loss
+    eager_loss = partial(yolo_loss, sparse=sparse)
 
     model = Model([model_body.input, *y_true], model_loss)
 
@@ -126,16 +166,13 @@ def yolov4(config):
     logging = TensorBoard(log_dir=log_dir)
     checkpoint = ModelCheckpoint(log_dir+save_weight, save_weights_only=True, save_best_only=True, period=1)
     early_stopping = EarlyStopping(min_delta=0, patience=10, verbose=1)
+    # 剪枝的callback，冻结以及解冻训练使用相同的实例
+    pruning = pruning_callbacks(model_body, config, num_train // config.batch_size)
+    if eager:
+        for callback in pruning:
+            callback.set_model(model_body)
+            callback.on_train_begin()
 
-    val_split = 0.1
-    with open(train_txt) as f:
-        lines = f.readlines()
-    np.random.seed(10101)
-    np.random.shuffle(lines)
-    np.random.seed(None)
-    num_val = int(len(lines)*val_split)
-    num_train = len(lines) - num_val
-    
     freeze_layers = config.freeze_layers
     for i in range(freeze_layers): model_body.layers[i].trainable = False
     print('Freeze the first {} layers of total {} layers.'.format(freeze_layers, len(model_body.layers)))
@@ -185,9 +222,9 @@ def yolov4(config):
 
         if eager:
             gen = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[:num_train], batch_size = batch_size,
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True), (tf.float32, tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True, sparse=sparse, cache=cache), (tf.float32,) * (1 + len(y_true)))
             gen_val = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[num_train:], batch_size = batch_size, 
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False), (tf.float32, tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False, sparse=sparse, cache=cache), (tf.float32,) * (1 + len(y_true)))
 
             gen = gen.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
             gen_val = gen_val.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
@@ -216,16 +253,25 @@ def yolov4(config):
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         if eager:
             for epoch in range(Init_epoch,Freeze_epoch):
-                fit_one_epoch(model_body, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
-                            Freeze_epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn())
+                if tf_data:
+                    gen, gen_val = tf_data_loaders(config, lines, num_train, batch_size, input_shape, anchors, num_classes, mosaic,
+                                                   epoch, epoch + 1, eager=True, cache=cache)
+                fit_one_epoch(model_body, eager_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
+                            Freeze_epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn(), pruning)
         else:
-            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False),
+            if tf_data:
+                gen, gen_val = tf_data_loaders(config, lines, num_train, batch_size, input_shape, anchors, num_classes, mosaic,
+                                               Init_epoch, Freeze_epoch, eager=False, cache=cache)
+            else:
+                gen = data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False, sparse=sparse, cache=cache)
+                gen_val = data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False, sparse=sparse, cache=cache)
+            model.fit(gen,
                     steps_per_epoch=epoch_size,
-                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False),
+                    validation_data=gen_val,
                     validation_steps=epoch_size_val,
                     epochs=Freeze_epoch,
                     initial_epoch=Init_epoch,
-                    callbacks=[logging, checkpoint, reduce_lr, early_stopping])
+                    callbacks=[logging, checkpoint, reduce_lr, early_stopping] + pruning)
 
     for i in range(freeze_layers): model_body.layers[i].trainable = True
 
@@ -244,9 +290,9 @@ def yolov4(config):
 
         if eager:
             gen     = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[:num_train], batch_size = batch_size,
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True), (tf.float32, tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=mosaic, random=True, sparse=sparse, cache=cache), (tf.float32,) * (1 + len(y_true)))
             gen_val = tf.data.Dataset.from_generator(partial(data_generator, annotation_lines = lines[num_train:], batch_size = batch_size, 
-                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False), (tf.float32, tf.float32, tf.float32, tf.float32))
+                input_shape = input_shape, anchors = anchors, num_classes = num_classes, mosaic=False, random=False, sparse=sparse, cache=cache), (tf.float32,) * (1 + len(y_true)))
 
             gen     = gen.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
             gen_val = gen_val.shuffle(buffer_size=batch_size).prefetch(buffer_size=batch_size)
@@ -275,20 +321,26 @@ def yolov4(config):
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         if eager:
             for epoch in range(Freeze_epoch,Epoch):
-                fit_one_epoch(model_body, yolo_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
-                            Epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn())
+                if tf_data:
+                    gen, gen_val = tf_data_loaders(config, lines, num_train, batch_size, input_shape, anchors, num_classes, mosaic,
+                                                   epoch, epoch + 1, eager=True, cache=cache)
+                fit_one_epoch(model_body, eager_loss, optimizer, epoch, epoch_size, epoch_size_val,gen, gen_val, 
+                            Epoch, anchors, num_classes, label_smoothing, regularization, get_train_step_fn(), pruning)
         else:
-            model.fit(data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False),
+            if tf_data:
+                gen, gen_val = tf_data_loaders(config, lines, num_train, batch_size, input_shape, anchors, num_classes, mosaic,
+                                               Freeze_epoch, Epoch, eager=False, cache=cache)
+            else:
+                gen = data_generator(lines[:num_train], batch_size, input_shape, anchors, num_classes, mosaic=mosaic, random=True, eager=False, sparse=sparse, cache=cache)
+                gen_val = data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False, sparse=sparse, cache=cache)
+            model.fit(gen,
                     steps_per_epoch=epoch_size,
-                    validation_data=data_generator(lines[num_train:], batch_size, input_shape, anchors, num_classes, mosaic=False, random=False, eager=False),
+                    validation_data=gen_val,
                     validation_steps=epoch_size_val,
                     epochs=Epoch,
                     initial_epoch=Freeze_epoch,
-                    callbacks=[logging, checkpoint, reduce_lr, early_stopping])
-    
-    
-
-        
-
-
+                    callbacks=[logging, checkpoint, reduce_lr, early_stopping] + pruning)
 
+    if config.pruning:
+        # 去掉剪枝的包装，保存剪枝后的权重
+        strip_and_save(model_body, config, pruning)
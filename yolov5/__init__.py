@@ -1,7 +1,14 @@
-from .nets.yolov5 import *
-from .lib.loss import *
-from .lib.utils import *
-from .lib.dataloader import *
-from .train_yolov5 import yolov5
-from .predict_yolov5 import Inference_YOLOV5Model
-from .export_yolov5 import export_model as export_yolov5
\ No newline at end of file
+from inference.lazy import lazy_exports
+
+# 按需导入：只使用推理类(例如onnx模型)时不导入网络结构、训练代码以及tensorflow
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'yolov5': ('.train_yolov5', 'yolov5'),
+    'Inference_YOLOV5Model': ('.predict_yolov5', 'Inference_YOLOV5Model'),
+    'export_yolov5': ('.export_yolov5', 'export_model'),
+}, {
+    '.nets.yolov5': ['yolo_body', 'get_train_model'],
+    '.lib.loss': ['box_ciou', 'box_iou', 'yolo_loss', 'get_lr_scheduler'],
+    '.lib.utils': ['get_classes', 'get_anchors', 'compose', 'cvtColor', 'preprocess_input', 'letterbox_image', 'rand', 'merge_bboxes',
+                   'get_random_data_with_Mosaic', 'get_random_data', 'cosine_decay_with_warmup', 'WarmUpCosineDecayScheduler', 'ModelCheckpoint'],
+    '.lib.dataloader': ['YoloDatasets'],
+})
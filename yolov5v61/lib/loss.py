@@ -2,6 +2,7 @@ import math
 from functools import partial
 import tensorflow as tf
 from tensorflow.keras import backend as K
+from components.sparse_targets import dense_targets
 from .tools import get_anchors_and_decode
 
 
@@ -89,11 +90,15 @@ def yolo_loss(
     label_smoothing = 0.01, 
     box_ratio       = 0.05, 
     obj_ratio       = 1, 
-    cls_ratio       = 0.5
+    cls_ratio       = 0.5,
+    sparse          = False
 ):
     num_layers = len(anchors_mask)
     y_true          = args[num_layers:]
     yolo_outputs    = args[:num_layers]
+    # sparse时y_true为YoloDatasets(sparse=True)的记录，在计算图中按层scatter为稠密的y_true
+    if sparse:
+        y_true = [dense_targets(y_true[0], l, tf.shape(yolo_outputs[l])[1:3], len(anchors_mask[l]), num_classes) for l in range(num_layers)]
 
     input_shape = K.cast(input_shape, K.dtype(y_true[0]))
 
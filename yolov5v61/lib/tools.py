@@ -1,23 +1,20 @@
 import tensorflow as tf
 from tensorflow.keras import backend as K
-from pathlib import Path
-
-def check_suffix(file='yolov5s.pt', suffix=('.pt',), msg=''):
-    # Check file(s) for acceptable suffixes
-    if file and suffix:
-        if isinstance(suffix, str):
-            suffix = [suffix]
-        for f in file if isinstance(file, (list, tuple)) else [file]:
-            assert Path(f).suffix.lower() in suffix, f"{msg}{f} acceptable suffix is {suffix}"
+import numpy as np
+from inference.batched_nms import batched_nms, unpad_detections, select_topk
+from inference.priors import get_anchor_priors, static_grid_shapes
+from inference.utils import check_suffix
+from .tools_numpy import sigmoid, yolo_correct_boxes_numpy, DecodeBox_numpy
 
 def yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image):
     box_yx = box_xy[..., ::-1]
     box_hw = box_wh[..., ::-1]
     input_shape = K.cast(input_shape, K.dtype(box_yx))
-    image_shape = K.cast(image_shape, K.dtype(box_yx))
+    # (batch_size, 2) -> (batch_size, 1, 2)，每张图像使用各自的尺寸
+    image_shape = K.reshape(K.cast(image_shape, K.dtype(box_yx)), [-1, 1, 2])
 
     if letterbox_image:
-        new_shape = K.round(image_shape * K.min(input_shape/image_shape))
+        new_shape = K.round(image_shape * K.min(input_shape/image_shape, axis=-1, keepdims=True))
         offset  = (input_shape - new_shape)/2./input_shape
         scale   = input_shape/new_shape
 
@@ -50,7 +47,26 @@ def get_anchors_and_decode(feats, anchors, num_classes, input_shape, calc_loss=F
     return box_xy, box_wh, box_confidence, box_class_probs
 
 # 后处理
-def DecodeBox(outputs,
+def get_decode_priors(feats, anchors, num_classes):
+    '''
+    将一个特征层展开为(batch_size, h * w * num_anchors, 5 + num_classes)，
+    同时返回每个预测对应的先验信息(h * w * num_anchors, 6)：网格坐标、网格尺寸以及先验框宽高，
+    用于先筛选候选框再解码坐标
+    '''
+    feats = tf.convert_to_tensor(feats)
+    num_anchors = len(anchors)
+    grid_shape = K.shape(feats)[1:3]
+    grid_x  = K.tile(K.reshape(K.arange(0, stop=grid_shape[1]), [1, -1, 1, 1]), [grid_shape[0], 1, num_anchors, 1])
+    grid_y  = K.tile(K.reshape(K.arange(0, stop=grid_shape[0]), [-1, 1, 1, 1]), [1, grid_shape[1], num_anchors, 1])
+    grid    = K.reshape(K.cast(K.concatenate([grid_x, grid_y]), feats.dtype), [-1, 2])
+    anchors_tensor = K.reshape(K.constant(anchors), [1, 1, num_anchors, 2])
+    anchors_tensor = K.reshape(K.tile(anchors_tensor, [grid_shape[0], grid_shape[1], 1, 1]), [-1, 2])
+    grid_size = K.ones_like(grid) * K.cast(grid_shape[::-1], feats.dtype)
+
+    feats = K.reshape(feats, [K.shape(feats)[0], -1, num_classes + 5])
+    return feats, K.concatenate([grid, grid_size, anchors_tensor])
+
+def DecodeBox_batch(outputs,
             anchors,
             num_classes,
             image_shape,
@@ -59,49 +75,60 @@ def DecodeBox(outputs,
             max_boxes = 100,
             confidence = 0.5,
             nms_iou = 0.3,
-            letterbox_image = True):
-    
-    # image_shape = K.reshape(outputs[-1],[-1])
-
-    box_xy = []
-    box_wh = []
-    box_confidence  = []
-    box_class_probs = []
-    for i in range(len(anchor_mask)):
-        sub_box_xy, sub_box_wh, sub_box_confidence, sub_box_class_probs = \
-            get_anchors_and_decode(outputs[i], anchors[anchor_mask[i]], num_classes, input_shape)
-        box_xy.append(K.reshape(sub_box_xy, [-1, 2]))
-        box_wh.append(K.reshape(sub_box_wh, [-1, 2]))
-        box_confidence.append(K.reshape(sub_box_confidence, [-1, 1]))
-        box_class_probs.append(K.reshape(sub_box_class_probs, [-1, num_classes]))
-    box_xy          = K.concatenate(box_xy, axis = 0)
-    box_wh          = K.concatenate(box_wh, axis = 0)
-    box_confidence  = K.concatenate(box_confidence, axis = 0)
-    box_class_probs = K.concatenate(box_class_probs, axis = 0)
-    
-    boxes       = yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image)
+            letterbox_image = True,
+            max_total_size = None,
+            pre_nms_topk = None):
+    '''
+    批量解码以及非极大值抑制
+    image_shape：(batch_size, 2)，每张原图的(h, w)
+    pre_nms_topk：先计算置信度，只对不低于confidence的候选框(最多pre_nms_topk个)解码坐标，为None时不限制数量
+    返回值：padding后的boxes、scores、classes以及每张图像的有效检测框数量，详见batched_nms
+    '''
+    grid_shapes = static_grid_shapes(outputs)
+    if grid_shapes is not None:
+        # 特征层尺寸已知时使用缓存的先验信息，不再重复构建网格
+        feats = K.concatenate([K.reshape(output, [K.shape(output)[0], -1, num_classes + 5]) for output in outputs], axis = 1)
+        priors = K.constant(get_anchor_priors(grid_shapes, anchors, anchor_mask))
+    else:
+        feats = []
+        priors = []
+        for i in range(len(anchor_mask)):
+            sub_feats, sub_priors = get_decode_priors(outputs[i], anchors[anchor_mask[i]], num_classes)
+            feats.append(sub_feats)
+            priors.append(sub_priors)
+        feats = K.concatenate(feats, axis = 1)
+        priors = K.concatenate(priors, axis = 0)
 
-    box_scores  = box_confidence * box_class_probs
-    mask             = box_scores >= confidence
-    max_boxes_tensor = K.constant(max_boxes, dtype='int32')
-    boxes_out   = []
-    scores_out  = []
-    classes_out = []
-    for c in range(num_classes):
-        class_boxes      = tf.boolean_mask(boxes, mask[:, c])
-        class_box_scores = tf.boolean_mask(box_scores[:, c], mask[:, c])
+    box_scores  = K.sigmoid(feats[..., 4:5]) * K.sigmoid(feats[..., 5:])
+    # 先按confidence筛选候选框，只对候选框解码坐标
+    index, box_scores = select_topk(box_scores, confidence, pre_nms_topk)
+    feats = tf.gather(feats[..., :4], index, batch_dims=1)
+    priors = tf.gather(priors, index)
+    box_xy = (K.sigmoid(feats[..., :2]) * 2 - 0.5 + priors[..., 0:2]) / priors[..., 2:4]
+    box_wh = (K.sigmoid(feats[..., 2:4]) * 2) ** 2 * priors[..., 4:6] / K.cast(input_shape[::-1], feats.dtype)
+    boxes = yolo_correct_boxes(box_xy, box_wh, input_shape, image_shape, letterbox_image)
 
-        nms_index = tf.image.non_max_suppression(class_boxes, class_box_scores, max_boxes_tensor, iou_threshold=nms_iou)
+    # 所有类别一次完成非极大值抑制
+    return batched_nms(boxes, box_scores, max_boxes, confidence, nms_iou, max_total_size)
 
-        class_boxes         = K.gather(class_boxes, nms_index)
-        class_box_scores    = K.gather(class_box_scores, nms_index)
-        classes             = K.ones_like(class_box_scores, 'int32') * c
+def DecodeBox(outputs,
+            anchors,
+            num_classes,
+            image_shape,
+            input_shape,
+            anchor_mask = [[6, 7, 8], [3, 4, 5], [0, 1, 2]],
+            max_boxes = 100,
+            confidence = 0.5,
+            nms_iou = 0.3,
+            letterbox_image = True,
+            pre_nms_topk = None):
+    
+    # image_shape = K.reshape(outputs[-1],[-1])
 
-        boxes_out.append(class_boxes)
-        scores_out.append(class_box_scores)
-        classes_out.append(classes)
-    boxes_out = K.concatenate(boxes_out, axis=0)
-    scores_out = K.concatenate(scores_out, axis=0)
-    classes_out = K.concatenate(classes_out, axis=0)
+    nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections = DecodeBox_batch(
+        outputs, anchors, num_classes, image_shape, input_shape,
+        anchor_mask=anchor_mask, max_boxes=max_boxes, confidence=confidence, nms_iou=nms_iou, letterbox_image=letterbox_image,
+        pre_nms_topk=pre_nms_topk)
+    boxes_out, scores_out, classes_out = unpad_detections(nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections)
 
-    return boxes_out, scores_out, classes_out
\ No newline at end of file
+    return boxes_out, scores_out, classes_out
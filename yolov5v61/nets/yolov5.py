@@ -1,6 +1,7 @@
 from tensorflow.keras.layers import Concatenate, Input, Lambda, UpSampling2D, ZeroPadding2D
 from tensorflow.keras.models import Model
 from .CSPdarknet import C3, DarknetConv2D, DarknetConv2D_BN_SiLU, darknet_body
+from components.sparse_targets import TARGET_COLUMNS
 from ..lib.loss import yolo_loss
 
 def yolo_body(input_shape, anchors_mask, num_classes, phi, weight_decay=5e-4):
@@ -39,9 +40,13 @@ def yolo_body(input_shape, anchors_mask, num_classes, phi, weight_decay=5e-4):
     out0 = DarknetConv2D(len(anchors_mask[0]) * (5 + num_classes), (1, 1), strides = (1, 1), weight_decay=weight_decay, name = 'yolo_head_P5')(P5_out)
     return Model(inputs, [out0, out1, out2])
 
-def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing):
-    y_true = [Input(shape = (input_shape[0] // {0:32, 1:16, 2:8}[l], input_shape[1] // {0:32, 1:16, 2:8}[l], \
-                                len(anchors_mask[l]), num_classes + 5)) for l in range(len(anchors_mask))]
+def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing, sparse=False):
+    # sparse时y_true为一个(None, TARGET_COLUMNS)的记录输入(components/sparse_targets.py)
+    if sparse:
+        y_true = [Input(shape = [None, TARGET_COLUMNS])]
+    else:
+        y_true = [Input(shape = (input_shape[0] // {0:32, 1:16, 2:8}[l], input_shape[1] // {0:32, 1:16, 2:8}[l], \
+                                    len(anchors_mask[l]), num_classes + 5)) for l in range(len(anchors_mask))]
     model_loss  = Lambda(
         yolo_loss, 
         output_shape    = (1, ), 
@@ -55,7 +60,8 @@ def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask,
             'balance'           : [0.4, 1.0, 4],
             'box_ratio'         : 0.05,
             'obj_ratio'         : 1 * (input_shape[0] * input_shape[1]) / (640 ** 2), 
-            'cls_ratio'         : 0.5 * (num_classes / 80)
+            'cls_ratio'         : 0.5 * (num_classes / 80),
+            'sparse'            : sparse
         }
     )([*model_body.output, *y_true])
     model       = Model([model_body.input, *y_true], model_loss)
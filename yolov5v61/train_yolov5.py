@@ -5,6 +5,8 @@ from tensorflow.keras.callbacks import EarlyStopping, LearningRateScheduler, Ten
 from tensorflow.keras.optimizers import SGD, Adam
 import tensorflow as tf
 from functools import partial
+from components.data_pipeline import data_pipeline
+from components.image_cache import image_cache
 from . import get_train_model, yolo_body, get_lr_scheduler, ModelCheckpoint, YoloDatasets, get_anchors, get_classes
 
 
@@ -61,7 +63,7 @@ def yolov5(config):
     if pre_train_model != '':
         print('Load weights {}.'.format(pre_train_model))
         model_body.load_weights(pre_train_model, by_name=True, skip_mismatch=True)
-    model =  get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing)
+    model =  get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing, config.sparse_targets)
 
     # 获取数据集
     with open(train_annotation_path, encoding='utf-8') as f:
@@ -70,6 +72,8 @@ def yolov5(config):
         val_lines = f.readlines()
     num_train = len(train_lines)
     num_val = len(val_lines)
+    # 图像缓存：config.image_cache_dir不为空时训练集以及验证集的图像只解码一次
+    cache = image_cache(config, train_lines + val_lines)
 
     wanted_step = 5e4 if optimizer_type == "sgd" else 1.5e4
     total_step  = num_train // batch_size * epoch
@@ -83,9 +87,9 @@ def yolov5(config):
     
     # 数据集加载
     train_dataloader = YoloDatasets(train_lines, input_shape, anchors, batch_size, num_classes, anchor_mask, 0, epoch, \
-                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio)
+                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio, sparse=config.sparse_targets, cache=cache)
     val_dataloader = YoloDatasets(val_lines, input_shape, anchors, batch_size, num_classes, anchor_mask, 0, epoch, \
-                                        mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0)
+                                        mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0, sparse=config.sparse_targets, cache=cache)
 
                                         
     # 设置超参数
@@ -124,9 +128,9 @@ def yolov5(config):
 
         print('Freeze Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         model.fit(
-            x = train_dataloader,
+            x = data_pipeline(train_dataloader, config, Freeze_Epoch),
             steps_per_epoch = epoch_step,
-            validation_data = val_dataloader,
+            validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
             validation_steps = epoch_step_val,
             epochs = Freeze_Epoch,
             callbacks = callbacks
@@ -143,9 +147,9 @@ def yolov5(config):
     lr_scheduler_func = get_lr_scheduler(learning_rate_decay_type, Init_lr_fit, Min_lr_fit, epoch)
 
     train_dataloader = YoloDatasets(train_lines, input_shape, anchors, batch_size, num_classes, anchor_mask, 0, epoch, \
-                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio)
+                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio, sparse=config.sparse_targets, cache=cache)
     val_dataloader = YoloDatasets(val_lines, input_shape, anchors, batch_size, num_classes, anchor_mask, 0, epoch, \
-                                            mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0)
+                                            mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0, sparse=config.sparse_targets, cache=cache)
     optimizer = {
             'adam'  : Adam(lr = learning_rate, beta_1 = momentum),
             'sgd'   : SGD(lr = learning_rate, momentum = momentum, nesterov=True)
@@ -155,9 +159,9 @@ def yolov5(config):
 
     print('Freeze Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
     model.fit(
-        x = train_dataloader,
+        x = data_pipeline(train_dataloader, config, UnFreeze_Epoch),
         steps_per_epoch = epoch_step,
-        validation_data = val_dataloader,
+        validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
         validation_steps = epoch_step_val,
         epochs = UnFreeze_Epoch,
         callbacks = callbacks
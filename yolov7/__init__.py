@@ -1,5 +1,13 @@
-from .nets import *
-from .lib import *
-from .train_yolov7 import yolov7
-from .predict_yolov7 import Inference_YOLOV7Model
-from .export_yolov7 import export_model as export_yolov7
\ No newline at end of file
+from inference.lazy import lazy_exports
+
+# 按需导入：只使用推理类(例如onnx模型)时不导入网络结构、训练代码以及tensorflow
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'yolov7': ('.train_yolov7', 'yolov7'),
+    'Inference_YOLOV7Model': ('.predict_yolov7', 'Inference_YOLOV7Model'),
+    'export_yolov7': ('.export_yolov7', 'export_model'),
+}, {
+    '.nets': ['SPPCSPC', 'RepConv', 'yolo_body', 'get_train_model', 'box_ciou', 'box_iou', 'yolo_loss', 'get_assignments',
+              'dynamic_k_matching', 'get_lr_scheduler', 'yoloBodyTiny'],
+    '.lib': ['YoloDatasets', 'check_suffix', 'compose', 'cvtColor', 'resize_image', 'get_classes', 'get_anchors', 'preprocess_input',
+             'show_config', 'net_flops'],
+})
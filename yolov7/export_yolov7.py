@@ -2,18 +2,54 @@ from cfg import YOLOV7Config
 import os
 import tensorflow as tf
 import tf2onnx
+import onnx
 import numpy as np
+from inference.preprocess import preprocess_metadata
+from inference.preprocess_graph import build_preprocess_model
+from inference.end2end import end2end_max_total_size, end2end_metadata
+from inference.end2end_graph import build_end2end_model
+from inference.quantize_graph import export_quantized
+from .lib.decodebox import DecodeBox_batch
 from .predict_yolov7 import Inference_YOLOV7Model
 
 
-def export_model(weights, saved_pb, saved_pb_dir, opset, onnx_save_path):
+def export_model(weights, saved_pb, saved_pb_dir, opset, onnx_save_path, preprocess=False, bgr=False, end2end=False,
+                 tflite_save_path=None, quantize=None, onnx_int8_path=None, calib_txt=None, calib_num=100, fuse=True,
+                 max_total_size=None):
     model_path = os.path.expanduser(weights)
     assert model_path.endswith('.h5'), 'Tensorflow model or weights must be a .h5 file.'
-    yolo_model = Inference_YOLOV7Model(YOLOV7Config, weights).model
+    # 导出需要keras模型，不使用推理缓存
+    YOLOV7Config.model_cache = False
+    # 导出折叠BN以及合并RepConv之后的模型
+    YOLOV7Config.fuse = fuse
+    yolo = Inference_YOLOV7Model(YOLOV7Config, weights)
+    yolo_model = yolo.model
     yolo_model.compile()
     if saved_pb:
         assert len(saved_pb_dir) > 0, 'save_name cannot be none or empty.'
         yolo_model.save(saved_pb_dir, save_format='tf')
+    if end2end:
+        # 解码以及批量非极大值抑制导出到模型中，每个类别最多max_boxes个、每张图像最多max_total_size个检测框(默认与非end2end相同)
+        max_total_size = end2end_max_total_size(yolo.max_boxes, yolo.num_classes, max_total_size)
+        def decode_batch(outputs, image_shape):
+            return DecodeBox_batch(outputs, yolo.anchors, yolo.num_classes, yolo.input_shape, image_shape, yolo.anchors_mask,
+                                   max_boxes=yolo.max_boxes, confidence=yolo.confidence, nms_iou=yolo.nms_iou,
+                                   letterbox_image=yolo.letterbox_image, max_total_size=max_total_size, pre_nms_topk=yolo.pre_nms_topk)
+        yolo_model = build_end2end_model(yolo_model, decode_batch, YOLOV7Config.input_shape, preprocess=preprocess, letterbox_image=True, bgr=bgr)
+    elif preprocess:
+        # onnx模型输入为uint8图像，缩放、填充以及归一化在模型中完成
+        yolo_model = build_preprocess_model(yolo_model, YOLOV7Config.input_shape, letterbox_image=True, bgr=bgr)
     model_proto, _ = tf2onnx.convert.from_keras(yolo_model, opset=opset, output_path=onnx_save_path)
+    metadata = {}
+    if preprocess:
+        metadata.update(preprocess_metadata(letterbox_image=True, bgr=bgr))
+    if end2end:
+        metadata.update(end2end_metadata(yolo.confidence, yolo.nms_iou, yolo.max_boxes, max_total_size))
+    if len(metadata) > 0:
+        onnx.helper.set_model_props(model_proto, metadata)
+        onnx.save(model_proto, onnx_save_path)
     output_names = [n.name for n in model_proto.graph.output]
-    print(f'Model output names: ',output_names)
\ No newline at end of file
+    print(f'Model output names: ',output_names)
+    # 量化的TFLite以及int8 onnx；--end2end时TFLite同样内含解码以及非极大值抑制
+    export_quantized(yolo, yolo.model, YOLOV7Config.input_shape, onnx_save_path, tflite_save_path, quantize, onnx_int8_path, calib_txt, calib_num,
+                     decode_batch=decode_batch if end2end else None)
@@ -1,2 +1,7 @@
-from .dataloader import *
-from .tools import *
\ No newline at end of file
+from inference.lazy import lazy_exports
+
+# 按需导入：推理只需要tools以及decodebox_numpy，不导入dataloader(tensorflow)
+__getattr__, __dir__ = lazy_exports(__name__, submodules={
+    '.dataloader': ['YoloDatasets'],
+    '.tools': ['check_suffix', 'compose', 'cvtColor', 'resize_image', 'get_classes', 'get_anchors', 'preprocess_input', 'show_config', 'net_flops'],
+})
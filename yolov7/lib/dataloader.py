@@ -1,18 +1,21 @@
 import math
+import random
 import copy
 from random import sample, shuffle
 
-import cv2
 import numpy as np
-from PIL import Image
 from tensorflow import keras
 
-from .tools import cvtColor, preprocess_input
+from components.augment import apply_hsv, gain_lut, letterbox, mixup, pad_boxes, random_affine, random_mosaic
+from components.image_cache import load_annotation
+from components.sparse_targets import INDEX_COLUMNS, pack_records
+
+from .tools import preprocess_input
 
 
 class YoloDatasets(keras.utils.Sequence):
     def __init__(self, annotation_lines, input_shape, anchors, batch_size, num_classes, anchors_mask, epoch_now, epoch_length, \
-                        mosaic, mixup, mosaic_prob, mixup_prob, train, special_aug_ratio = 0.7):
+                        mosaic, mixup, mosaic_prob, mixup_prob, train, special_aug_ratio = 0.7, sparse = False, cache = None):
         self.annotation_lines   = annotation_lines
         self.length             = len(self.annotation_lines)
         
@@ -29,6 +32,9 @@ class YoloDatasets(keras.utils.Sequence):
         self.mixup_prob         = mixup_prob
         self.train              = train
         self.special_aug_ratio  = special_aug_ratio
+        self.sparse             = sparse
+        # 图像缓存(components/image_cache.py)，为None时从磁盘读取图像
+        self.cache              = cache
 
         self.threshold          = 4
 
@@ -39,32 +45,39 @@ class YoloDatasets(keras.utils.Sequence):
         image_data  = []
         box_data    = []
         for i in range(index * self.batch_size, (index + 1) * self.batch_size):  
-            i = i % self.length
-            if self.mosaic and self.rand() < self.mosaic_prob and self.epoch_now < self.epoch_length * self.special_aug_ratio:
-                lines = sample(self.annotation_lines, 3)
-                lines.append(self.annotation_lines[i])
-                shuffle(lines)
-                image, box = self.get_random_data_with_Mosaic(lines, self.input_shape)
-                    
-                if self.mixup and self.rand() < self.mixup_prob:
-                    lines           = sample(self.annotation_lines, 1)
-                    image_2, box_2  = self.get_random_data(lines[0], self.input_shape, random = self.train)
-                    image, box      = self.get_random_data_with_MixUp(image, box, image_2, box_2)
-            else:
-                image, box  = self.get_random_data(self.annotation_lines[i], self.input_shape, random = self.train)
-                
-            image_data.append(preprocess_input(np.array(image, np.float32)))
+            image, box = self.get_sample(i % self.length, self.epoch_now)
+            image_data.append(image)
             box_data.append(box)
 
-        labels              = copy.deepcopy(np.array(box_data))
-        labels[..., 2:4]    = labels[..., 2:4] - labels[..., 0:2]
-        labels[..., 0:2]    = labels[..., 0:2] + labels[..., 2:4] / 2 
-        
         image_data  = np.array(image_data)
         box_data    = np.array(box_data)
-        y_true      = self.preprocess_true_boxes(box_data, self.input_shape, self.anchors, self.num_classes)
-        
-        return [image_data, *y_true, labels], np.zeros(self.batch_size)
+        return [image_data, *self.get_targets(box_data)], np.zeros(self.batch_size)
+
+    def get_sample(self, index, epoch, rng=random):
+        '''
+        第index个样本：数据增强以及预处理之后的图像和补齐的真实框(max_boxes, 5)，
+        epoch决定是否使用mosaic，rng为mosaic、mixup的概率以及拼接图像的随机数生成器
+        '''
+        if self.mosaic and rng.random() < self.mosaic_prob and epoch < self.epoch_length * self.special_aug_ratio:
+            lines = rng.sample(self.annotation_lines, 3)
+            lines.append(self.annotation_lines[index])
+            rng.shuffle(lines)
+            image, box = self.get_random_data_with_Mosaic(lines, self.input_shape, rng = rng)
+                
+            if self.mixup and rng.random() < self.mixup_prob:
+                lines           = rng.sample(self.annotation_lines, 1)
+                image_2, box_2  = self.get_random_data(lines[0], self.input_shape, random = self.train, rng = rng)
+                image, box      = self.get_random_data_with_MixUp(image, box, image_2, box_2)
+        else:
+            image, box  = self.get_random_data(self.annotation_lines[index], self.input_shape, random = self.train, rng = rng)
+        return preprocess_input(np.array(image, np.float32)), box
+
+    def get_targets(self, box_data):
+        labels              = copy.deepcopy(box_data)
+        labels[..., 2:4]    = labels[..., 2:4] - labels[..., 0:2]
+        labels[..., 0:2]    = labels[..., 0:2] + labels[..., 2:4] / 2 
+        y_true              = self.preprocess_true_boxes(box_data, self.input_shape, self.anchors, self.num_classes)
+        return [*y_true, labels]
 
     def generate(self):
         i = 0
@@ -107,87 +120,15 @@ class YoloDatasets(keras.utils.Sequence):
     def rand(self, a=0, b=1):
         return np.random.rand()*(b-a) + a
 
-    def get_random_data(self, annotation_line, input_shape, max_boxes=500, jitter=.3, hue=.1, sat=0.7, val=0.4, random=True):
-        line = annotation_line.split()
-        image   = Image.open(line[0])
-        image   = cvtColor(image)
-        iw, ih  = image.size
-        h, w    = input_shape
-        box = np.array([np.array(list(map(int,box.split(',')))) for box in line[1:]])
-
+    def get_random_data(self, annotation_line, input_shape, max_boxes=500, jitter=.3, hue=.1, sat=0.7, val=0.4, random=True, rng=random):
+        '''
+        rng为随机数生成器(random.Random或者random模块)，random为False时只等比例缩放(验证集)
+        '''
+        image, box = load_annotation(annotation_line, self.cache)
         if not random:
-            scale = min(w/iw, h/ih)
-            nw = int(iw*scale)
-            nh = int(ih*scale)
-            dx = (w-nw)//2
-            dy = (h-nh)//2
-
-            image = image.resize((nw,nh), Image.BICUBIC)
-            new_image   = Image.new('RGB', (w,h), (128,128,128))
-            new_image.paste(image, (dx, dy))
-            image_data  = np.array(new_image, np.float32)
-            box_data = np.zeros((max_boxes,5))
-            if len(box)>0:
-                np.random.shuffle(box)
-                box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-                box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-                box[:, 0:2][box[:, 0:2]<0]  = 0
-                box[:, 2][box[:, 2]>w]      = w
-                box[:, 3][box[:, 3]>h]      = h
-                box_w   = box[:, 2] - box[:, 0]
-                box_h   = box[:, 3] - box[:, 1]
-                box     = box[np.logical_and(box_w>1, box_h>1)]
-                if len(box)>max_boxes: box = box[:max_boxes]
-                box_data[:len(box)] = box
-
-            return image_data, box_data
-                
-        new_ar = iw/ih * self.rand(1-jitter,1+jitter) / self.rand(1-jitter,1+jitter)
-        scale = self.rand(.25, 2)
-        if new_ar < 1:
-            nh = int(scale*h)
-            nw = int(nh*new_ar)
-        else:
-            nw = int(scale*w)
-            nh = int(nw/new_ar)
-        image = image.resize((nw,nh), Image.BICUBIC)
-
-        dx = int(self.rand(0, w-nw))
-        dy = int(self.rand(0, h-nh))
-        new_image = Image.new('RGB', (w,h), (128,128,128))
-        new_image.paste(image, (dx, dy))
-        image = new_image
-
-        flip = self.rand()<.5
-        if flip: image = image.transpose(Image.FLIP_LEFT_RIGHT)
-
-        image_data = np.array(image, np.uint8)
-        r = np.random.uniform(-1, 1, 3) * [hue, sat, val] + 1
-        hue, sat, val   = cv2.split(cv2.cvtColor(image_data, cv2.COLOR_RGB2HSV))
-        dtype = image_data.dtype
-        x = np.arange(0, 256, dtype=r.dtype)
-        lut_hue = ((x * r[0]) % 180).astype(dtype)
-        lut_sat = np.clip(x * r[1], 0, 255).astype(dtype)
-        lut_val = np.clip(x * r[2], 0, 255).astype(dtype)
-
-        image_data = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
-        image_data = cv2.cvtColor(image_data, cv2.COLOR_HSV2RGB)
-
-        box_data = np.zeros((max_boxes,5))
-        if len(box)>0:
-            np.random.shuffle(box)
-            box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-            box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-            if flip: box[:, [0,2]] = w - box[:, [2,0]]
-            box[:, 0:2][box[:, 0:2]<0] = 0
-            box[:, 2][box[:, 2]>w] = w
-            box[:, 3][box[:, 3]>h] = h
-            box_w = box[:, 2] - box[:, 0]
-            box_h = box[:, 3] - box[:, 1]
-            box = box[np.logical_and(box_w>1, box_h>1)] # discard invalid box
-            if len(box)>max_boxes: box = box[:max_boxes]
-            box_data[:len(box)] = box
-        
+            return letterbox(image, box, input_shape, max_boxes, rng)
+        image_data, box_data = random_affine(image, box, input_shape, max_boxes, rng, jitter)
+        apply_hsv(image_data, gain_lut(rng, hue, sat, val))
         return image_data, box_data
 
     def merge_bboxes(self, bboxes, cutx, cuty):
@@ -236,179 +177,90 @@ class YoloDatasets(keras.utils.Sequence):
                 merge_bbox.append(tmp_box)
         return merge_bbox
 
-    def get_random_data_with_Mosaic(self, annotation_line, input_shape, max_boxes=500, jitter=0.3, hue=.1, sat=0.7, val=0.4):
-        h, w = input_shape
-        min_offset_x = self.rand(0.3, 0.7)
-        min_offset_y = self.rand(0.3, 0.7)
-
-        image_datas = [] 
-        box_datas   = []
-        index       = 0
-        for line in annotation_line:
-            line_content = line.split()
-            image = Image.open(line_content[0])
-            image = cvtColor(image)
-            iw, ih = image.size
-            box = np.array([np.array(list(map(int,box.split(',')))) for box in line_content[1:]])
-            
-            flip = self.rand()<.5
-            if flip and len(box)>0:
-                image = image.transpose(Image.FLIP_LEFT_RIGHT)
-                box[:, [0,2]] = iw - box[:, [2,0]]
-
-            new_ar = iw/ih * self.rand(1-jitter,1+jitter) / self.rand(1-jitter,1+jitter)
-            scale = self.rand(.4, 1)
-            if new_ar < 1:
-                nh = int(scale*h)
-                nw = int(nh*new_ar)
-            else:
-                nw = int(scale*w)
-                nh = int(nw/new_ar)
-            image = image.resize((nw, nh), Image.BICUBIC)
-
-            if index == 0:
-                dx = int(w*min_offset_x) - nw
-                dy = int(h*min_offset_y) - nh
-            elif index == 1:
-                dx = int(w*min_offset_x) - nw
-                dy = int(h*min_offset_y)
-            elif index == 2:
-                dx = int(w*min_offset_x)
-                dy = int(h*min_offset_y)
-            elif index == 3:
-                dx = int(w*min_offset_x)
-                dy = int(h*min_offset_y) - nh
-            
-            new_image = Image.new('RGB', (w,h), (128,128,128))
-            new_image.paste(image, (dx, dy))
-            image_data = np.array(new_image)
-
-            index = index + 1
-            box_data = []
-            if len(box)>0:
-                np.random.shuffle(box)
-                box[:, [0,2]] = box[:, [0,2]]*nw/iw + dx
-                box[:, [1,3]] = box[:, [1,3]]*nh/ih + dy
-                box[:, 0:2][box[:, 0:2]<0] = 0
-                box[:, 2][box[:, 2]>w] = w
-                box[:, 3][box[:, 3]>h] = h
-                box_w = box[:, 2] - box[:, 0]
-                box_h = box[:, 3] - box[:, 1]
-                box = box[np.logical_and(box_w>1, box_h>1)]
-                box_data = np.zeros((len(box),5))
-                box_data[:len(box)] = box
-            
-            image_datas.append(image_data)
-            box_datas.append(box_data)
-
-        cutx = int(w * min_offset_x)
-        cuty = int(h * min_offset_y)
-
-        new_image = np.zeros([h, w, 3])
-        new_image[:cuty, :cutx, :] = image_datas[0][:cuty, :cutx, :]
-        new_image[cuty:, :cutx, :] = image_datas[1][cuty:, :cutx, :]
-        new_image[cuty:, cutx:, :] = image_datas[2][cuty:, cutx:, :]
-        new_image[:cuty, cutx:, :] = image_datas[3][:cuty, cutx:, :]
-
-        new_image = np.array(new_image, np.uint8)
-        r = np.random.uniform(-1, 1, 3) * [hue, sat, val] + 1
-
-        hue, sat, val   = cv2.split(cv2.cvtColor(new_image, cv2.COLOR_RGB2HSV))
-        dtype = new_image.dtype
-        x = np.arange(0, 256, dtype=r.dtype)
-        lut_hue = ((x * r[0]) % 180).astype(dtype)
-        lut_sat = np.clip(x * r[1], 0, 255).astype(dtype)
-        lut_val = np.clip(x * r[2], 0, 255).astype(dtype)
-
-        new_image = cv2.merge((cv2.LUT(hue, lut_hue), cv2.LUT(sat, lut_sat), cv2.LUT(val, lut_val)))
-        new_image = cv2.cvtColor(new_image, cv2.COLOR_HSV2RGB)
+    def get_random_data_with_Mosaic(self, annotation_line, input_shape, max_boxes=500, jitter=0.3, hue=.1, sat=0.7, val=0.4, rng=random):
+        samples = [load_annotation(line, self.cache) for line in annotation_line]
+        new_image, box_datas, (cutx, cuty) = random_mosaic(samples, input_shape, rng, jitter)
+        apply_hsv(new_image, gain_lut(rng, hue, sat, val))
         new_boxes = self.merge_bboxes(box_datas, cutx, cuty)
-        box_data = np.zeros((max_boxes, 5))
-        if len(new_boxes)>0:
-            if len(new_boxes)>max_boxes: new_boxes = new_boxes[:max_boxes]
-            box_data[:len(new_boxes)] = new_boxes
-        return new_image, box_data
+        return new_image, pad_boxes(np.array(new_boxes).reshape(-1, 5), max_boxes)
 
     def get_random_data_with_MixUp(self, image_1, box_1, image_2, box_2, max_boxes=500):
-        new_image = np.array(image_1, np.float32) * 0.5 + np.array(image_2, np.float32) * 0.5
-        
-        box_1_wh    = box_1[:, 2:4] - box_1[:, 0:2]
-        box_1_valid = box_1_wh[:, 0] > 0
-        
-        box_2_wh    = box_2[:, 2:4] - box_2[:, 0:2]
-        box_2_valid = box_2_wh[:, 0] > 0
-        
-        new_boxes = np.concatenate([box_1[box_1_valid, :], box_2[box_2_valid, :]], axis=0)
-        box_data = np.zeros((max_boxes, 5))
-        if len(new_boxes)>0:
-            if len(new_boxes)>max_boxes: new_boxes = new_boxes[:max_boxes]
-            box_data[:len(new_boxes)] = new_boxes
-        return new_image, box_data
+        return mixup(image_1, box_1, image_2, box_2, max_boxes)
 
     def get_near_points(self, x, y, i, j):
+        '''
+        每个中心点(x, y)所在网格(i, j)以及距离最近的两个相邻网格的偏移，输入为数组，返回(n, 3, 2)
+        '''
         sub_x = x - i
         sub_y = y - j
-        if sub_x > 0.5 and sub_y > 0.5:
-            return [[0, 0], [1, 0], [0, 1]]
-        elif sub_x < 0.5 and sub_y > 0.5:
-            return [[0, 0], [-1, 0], [0, 1]]
-        elif sub_x < 0.5 and sub_y < 0.5:
-            return [[0, 0], [-1, 0], [0, -1]]
-        else:
-            return [[0, 0], [1, 0], [0, -1]]
+        right_down  = (sub_x > 0.5) & (sub_y > 0.5)
+        left_down   = ~right_down & (sub_x < 0.5) & (sub_y > 0.5)
+        left_up     = ~right_down & ~left_down & (sub_x < 0.5) & (sub_y < 0.5)
+        dx = np.where(left_down | left_up, -1, 1)
+        dy = np.where(right_down | left_down, 1, -1)
+        zeros = np.zeros_like(dx)
+        return np.stack([np.stack([zeros, zeros], -1), np.stack([dx, zeros], -1), np.stack([zeros, dy], -1)], 1)
 
     def preprocess_true_boxes(self, true_boxes, input_shape, anchors, num_classes):
         assert (true_boxes[..., 4]<num_classes).all(), 'class id must be less than num_classes'
+
         true_boxes  = np.array(true_boxes, dtype='float32')
         input_shape = np.array(input_shape, dtype='int32')
         num_layers  = len(self.anchors_mask)
         m           = true_boxes.shape[0]
         grid_shapes = [input_shape // {0:32, 1:16, 2:8}[l] for l in range(num_layers)]
+        # sparse时只生成记录，不分配稠密的y_true
         y_true = [np.zeros((m, grid_shapes[l][0], grid_shapes[l][1], len(self.anchors_mask[l]), 2),
-                    dtype='float32') for l in range(num_layers)]
-        box_best_ratios = [np.zeros((m, grid_shapes[l][0], grid_shapes[l][1], len(self.anchors_mask[l])),
-                    dtype='float32') for l in range(num_layers)]
+                    dtype='float32') for l in range(num_layers)] if not self.sparse else []
+        records = []
+
         boxes_xy = (true_boxes[..., 0:2] + true_boxes[..., 2:4]) // 2
         boxes_wh =  true_boxes[..., 2:4] - true_boxes[..., 0:2]
         true_boxes[..., 0:2] = boxes_xy / input_shape[::-1]
         true_boxes[..., 2:4] = boxes_wh / input_shape[::-1]
         anchors         = np.array(anchors, np.float32)
-
         valid_mask = boxes_wh[..., 0]>0
 
-        for b in range(m):
-            wh = boxes_wh[b, valid_mask[b]]
-
-            if len(wh) == 0: 
+        # 第t个有效框的宽高与anchor的比例对应true_boxes的第t行(有效框在前，补齐的0在后)
+        order       = np.argsort(~valid_mask, axis=1, kind='stable')
+        wh          = np.take_along_axis(boxes_wh, order[..., None], axis=1)
+        valid       = np.take_along_axis(valid_mask, order, axis=1)
+        with np.errstate(divide='ignore'):
+            ratios_of_gt_anchors = np.expand_dims(wh, 2) / anchors
+            ratios_of_anchors_gt = anchors / np.expand_dims(wh, 2)
+        ratios               = np.concatenate([ratios_of_gt_anchors, ratios_of_anchors_gt], axis = -1)
+        max_ratios           = np.max(ratios, axis = -1)
+        over_threshold       = max_ratios < self.threshold
+        np.put_along_axis(over_threshold, np.argmin(max_ratios, axis=-1)[..., None], True, axis=-1)
+        over_threshold       &= valid[..., None]
+
+        for l in range(num_layers):
+            h, w = grid_shapes[l]
+            # 所有(图像, 真实框, anchor)的组合，每个组合对应中心所在网格以及最近的两个相邻网格
+            b, t, k = np.nonzero(over_threshold[..., self.anchors_mask[l]])
+            ratio   = max_ratios[b, t, np.array(self.anchors_mask[l])[k]]
+            x       = true_boxes[b, t, 0].astype(np.float64) * w
+            y       = true_boxes[b, t, 1].astype(np.float64) * h
+            i       = np.floor(x).astype('int32')
+            j       = np.floor(y).astype('int32')
+            offsets = self.get_near_points(x, y, i, j)
+            local_i = (i[:, None] + offsets[..., 0]).ravel()
+            local_j = (j[:, None] + offsets[..., 1]).ravel()
+            b, t, k, ratio = [np.repeat(a, 3) for a in (b, t, k, ratio)]
+            inside  = (local_i >= 0) & (local_i < w) & (local_j >= 0) & (local_j < h)
+            b, t, k, ratio, local_i, local_j = [a[inside] for a in (b, t, k, ratio, local_i, local_j)]
+
+            # 同一个网格的同一个anchor只保留比例最小的真实框，比例相同时保留靠前的真实框
+            cell    = ((b * h + local_j) * w + local_i) * len(self.anchors_mask[l]) + k
+            first   = np.lexsort((t, ratio, cell))
+            keep    = first[np.r_[True, cell[first][1:] != cell[first][:-1]]] if len(first) else first
+            b, t, k, local_i, local_j = [a[keep] for a in (b, t, k, local_i, local_j)]
+            if self.sparse:
+                records.append((b, np.stack([np.full(len(b), l), local_j, local_i, k, t + 1], -1)))
                 continue
-            ratios_of_gt_anchors = np.expand_dims(wh, 1) / np.expand_dims(anchors, 0)
-            ratios_of_anchors_gt = np.expand_dims(anchors, 0) / np.expand_dims(wh, 1)
-            ratios               = np.concatenate([ratios_of_gt_anchors, ratios_of_anchors_gt], axis = -1)
-            max_ratios           = np.max(ratios, axis = -1)
-            
-            for t, ratio in enumerate(max_ratios):
-                over_threshold = ratio < self.threshold
-                over_threshold[np.argmin(ratio)] = True
-                for l in range(num_layers):
-                    for k, n in enumerate(self.anchors_mask[l]):
-                        if not over_threshold[n]:
-                            continue
-                        i = np.floor(true_boxes[b,t,0] * grid_shapes[l][1]).astype('int32')
-                        j = np.floor(true_boxes[b,t,1] * grid_shapes[l][0]).astype('int32')
-                        offsets = self.get_near_points(true_boxes[b,t,0] * grid_shapes[l][1], true_boxes[b,t,1] * grid_shapes[l][0], i, j)
-                        for offset in offsets:
-                            local_i = i + offset[0]
-                            local_j = j + offset[1]
-
-                            if local_i >= grid_shapes[l][1] or local_i < 0 or local_j >= grid_shapes[l][0] or local_j < 0:
-                                continue
+            y_true[l][b, local_j, local_i, k, 0] = 1
+            y_true[l][b, local_j, local_i, k, 1] = t + 1
 
-                            if box_best_ratios[l][b, local_j, local_i, k] != 0:
-                                if box_best_ratios[l][b, local_j, local_i, k] > ratio[n]:
-                                    y_true[l][b, local_j, local_i, k, :] = 0
-                                else:
-                                    continue
-                            y_true[l][b, local_j, local_i, k, 0] = 1
-                            y_true[l][b, local_j, local_i, k, 1] = t + 1
-                            box_best_ratios[l][b, local_j, local_i, k] = ratio[n]
+        if self.sparse:
+            return [pack_records(records, m, INDEX_COLUMNS)]
         return y_true
\ No newline at end of file
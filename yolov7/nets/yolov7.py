@@ -1,9 +1,10 @@
-import numpy as np
 from tensorflow.keras.layers import (Add, BatchNormalization, Concatenate, Conv2D, Input,
                                     Lambda, MaxPooling2D, UpSampling2D)
 from tensorflow.keras.models import Model
 
 from .backbone import DarknetConv2D, DarknetConv2D_BN_SiLU, Multi_Concat_Block, SiLU, Transition_Block,darknet_body
+from components.sparse_targets import INDEX_COLUMNS
+
 from .loss import yolo_loss
 
 
@@ -23,59 +24,6 @@ def SPPCSPC(x, c2, n=1, shortcut=False, g=1, e=0.5, k=(5, 9, 13), weight_decay=5
     
     return out
 
-def fusion_rep_vgg(fuse_layers, trained_model, infer_model):
-    for layer_name, use_bias, use_bn in fuse_layers:
-
-        conv_kxk_weights = trained_model.get_layer(layer_name + '.rbr_dense.0').get_weights()[0]
-        conv_1x1_weights = trained_model.get_layer(layer_name + '.rbr_1x1.0').get_weights()[0]
-
-        if use_bias:
-            conv_kxk_bias = trained_model.get_layer(layer_name + '.rbr_dense.0').get_weights()[1]
-            conv_1x1_bias = trained_model.get_layer(layer_name + '.rbr_1x1.0').get_weights()[1]
-        else:
-            conv_kxk_bias = np.zeros((conv_kxk_weights.shape[-1],))
-            conv_1x1_bias = np.zeros((conv_1x1_weights.shape[-1],))
-
-        if use_bn:
-            gammas_kxk, betas_kxk, means_kxk, var_kxk = trained_model.get_layer(layer_name + '.rbr_dense.1').get_weights()
-            gammas_1x1, betas_1x1, means_1x1, var_1x1 = trained_model.get_layer(layer_name + '.rbr_1x1.1').get_weights()
-
-        else:
-            gammas_1x1, betas_1x1, means_1x1, var_1x1 = [np.ones((conv_1x1_weights.shape[-1],)),
-                                                         np.zeros((conv_1x1_weights.shape[-1],)),
-                                                         np.zeros((conv_1x1_weights.shape[-1],)),
-                                                         np.ones((conv_1x1_weights.shape[-1],))]
-            gammas_kxk, betas_kxk, means_kxk, var_kxk = [np.ones((conv_kxk_weights.shape[-1],)),
-                                                         np.zeros((conv_kxk_weights.shape[-1],)),
-                                                         np.zeros((conv_kxk_weights.shape[-1],)),
-                                                         np.ones((conv_kxk_weights.shape[-1],))]
-        gammas_res, betas_res, means_res, var_res = [np.ones((conv_1x1_weights.shape[-1],)),
-                                                     np.zeros((conv_1x1_weights.shape[-1],)),
-                                                     np.zeros((conv_1x1_weights.shape[-1],)),
-                                                     np.ones((conv_1x1_weights.shape[-1],))]
-
-        # _fuse_bn_tensor(self.rbr_dense)
-        w_kxk = (gammas_kxk / np.sqrt(np.add(var_kxk, 1e-3))) * conv_kxk_weights
-        b_kxk = (((conv_kxk_bias - means_kxk) * gammas_kxk) / np.sqrt(np.add(var_kxk, 1e-3))) + betas_kxk
-        
-        # _fuse_bn_tensor(self.rbr_dense)
-        kernel_size = w_kxk.shape[0]
-        in_channels = w_kxk.shape[2]
-        w_1x1 = np.zeros_like(w_kxk)
-        w_1x1[kernel_size // 2, kernel_size // 2, :, :] = (gammas_1x1 / np.sqrt(np.add(var_1x1, 1e-3))) * conv_1x1_weights
-        b_1x1 = (((conv_1x1_bias - means_1x1) * gammas_1x1) / np.sqrt(np.add(var_1x1, 1e-3))) + betas_1x1
-
-        w_res = np.zeros_like(w_kxk)
-        for i in range(in_channels):
-            w_res[kernel_size // 2, kernel_size // 2, i % in_channels, i] = 1
-        w_res = ((gammas_res / np.sqrt(np.add(var_res, 1e-3))) * w_res)
-        b_res = (((0 - means_res) * gammas_res) / np.sqrt(np.add(var_res, 1e-3))) + betas_res
-
-        weight = [w_res, w_1x1, w_kxk]
-        bias = [b_res, b_1x1, b_kxk]
-        
-        infer_model.get_layer(layer_name).set_weights([np.array(weight).sum(axis=0), np.array(bias).sum(axis=0)])
-
 def RepConv(x, c2, mode="train", weight_decay=5e-4, name=""):
     if mode == "predict":
         out = DarknetConv2D(c2, (3, 3), name = name, use_bias=True, weight_decay=weight_decay, padding='same')(x)
@@ -138,9 +86,13 @@ def yolo_body(input_shape, anchors_mask, num_classes, phi, weight_decay=5e-4, mo
     out0 = DarknetConv2D(len(anchors_mask[0]) * (5 + num_classes), (1, 1), weight_decay=weight_decay, strides = (1, 1), name = 'yolo_head_P5')(P5)
     return Model(inputs, [out0, out1, out2])
 
-def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing):
-    y_true = [Input(shape = (input_shape[0] // {0:32, 1:16, 2:8}[l], input_shape[1] // {0:32, 1:16, 2:8}[l], \
-                                len(anchors_mask[l]), 2)) for l in range(len(anchors_mask))] + [Input(shape = [None, 5])]
+def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing, sparse=False):
+    # sparse时y_true为一个(None, INDEX_COLUMNS)的记录输入(components/sparse_targets.py)
+    if sparse:
+        y_true = [Input(shape = [None, INDEX_COLUMNS]), Input(shape = [None, 5])]
+    else:
+        y_true = [Input(shape = (input_shape[0] // {0:32, 1:16, 2:8}[l], input_shape[1] // {0:32, 1:16, 2:8}[l], \
+                                    len(anchors_mask[l]), 2)) for l in range(len(anchors_mask))] + [Input(shape = [None, 5])]
     model_loss  = Lambda(
         yolo_loss, 
         output_shape    = (1, ), 
@@ -154,7 +106,8 @@ def get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask,
             'balance'           : [0.4, 1.0, 4],
             'box_ratio'         : 0.05,
             'obj_ratio'         : 1 * (input_shape[0] * input_shape[1]) / (640 ** 2), 
-            'cls_ratio'         : 0.5 * (num_classes / 80)
+            'cls_ratio'         : 0.5 * (num_classes / 80),
+            'sparse'            : sparse
         }
     )([*model_body.output, *y_true])
     model       = Model([model_body.input, *y_true], model_loss)
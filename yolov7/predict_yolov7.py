@@ -2,29 +2,25 @@ import time
 
 import cv2
 import numpy as np
-import tensorflow as tf
 from PIL import Image
 
 import colorsys
 import os
-import time
-import gc
-
-import numpy as np
-import tensorflow as tf
-from PIL import ImageDraw, ImageFont
-from tensorflow.keras.layers import Input, Lambda
-from tensorflow.keras.models import Model
-
-from .nets import yolo_body, fusion_rep_vgg
-from .lib.tools import cvtColor, get_anchors, get_classes, preprocess_input,resize_image, check_suffix
-from .lib.decodebox import DecodeBox
-from pathlib import Path
 
+from .lib.tools import cvtColor, get_anchors, get_classes, preprocess_input,resize_image
+from .lib.decodebox_numpy import DecodeBox_numpy
+from inference import batched, Detections, draw_detections, draw_detections_cv2
+from inference.preprocess import letterbox_numpy, stack_frames
+from inference.end2end import unpad_end2end
+from inference.backends import backend_type, load_backend, GraphBackend
+from inference.tracing import warmup
+from inference.model_cache import cache_path, cache_key, is_fresh, is_cache
+from inference.startup import StartupReport
 
 
 class YOLO(object):
     def __init__(self, **kwargs):
+        t_load = time.time()
         self._params = {
             "model_path" : kwargs['model_path'], 
             "classes_path" : kwargs['class_path'], 
@@ -36,9 +32,17 @@ class YOLO(object):
             "nms_iou" : kwargs['nms_iou'],
             "max_boxes" : kwargs['max_boxes'], 
             "letterbox_image" : kwargs['letterbox_image'],
-            "tiny":kwargs['tiny']
+            "tiny":kwargs['tiny'],
+            "pre_nms_topk" : kwargs.get('pre_nms_topk'),
+            "warmup_batch_sizes" : kwargs.get('warmup_batch_sizes'),
+            "warmup_frame_shapes" : kwargs.get('warmup_frame_shapes'),
+            "model_cache" : kwargs.get('model_cache', False),
+            "onnx_options" : kwargs.get('onnx_options'),
+            "tflite_options" : kwargs.get('tflite_options'),
+            "fuse" : kwargs.get('fuse', True)
         }
         self.__dict__.update(self._params)
+        self.startup = StartupReport()
             
         self.class_names, self.num_classes = get_classes(self.classes_path)
         self.anchors, self.num_anchors     = get_anchors(self.anchors_path)
@@ -46,41 +50,69 @@ class YOLO(object):
         self.colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
         self.colors = list(map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)), self.colors))
         self.init_model()
+        # tensorflow模型使用固定的input_signature，batch大小以及原图尺寸变化时不再重新trace
+        self.trace_counters = []
+        if self.backend_type in ('h5', 'saved_model'):
+            if not self.cached:
+                from inference.tracing_graph import build_pred_functions
+                self.get_pred, self.get_pred_frames, self.trace_counters = build_pred_functions(self._get_pred, self._get_pred_frames, self.input_shape)
+                if self.backend_type == 'h5' and self.model_cache:
+                    from inference.model_cache_graph import save_pred_functions
+                    with self.startup.phase('save cache'):
+                        if save_pred_functions(cache_path(self.model_path), self.model, self.get_pred, self.get_pred_frames, self.get_cache_key()):
+                            print('inference cache saved to {}'.format(cache_path(self.model_path)))
+            self.backend = GraphBackend(self.backend_type, self.model, self.get_pred, self.get_pred_frames)
+        self.load_time = time.time() - t_load
+        # 加载时预热，第一帧不再包含trace以及首次运行的开销
+        self.warmup_times = []
+        if self.warmup_batch_sizes or self.warmup_frame_shapes:
+            with self.startup.phase('warmup'):
+                self.warmup_times = warmup(self, self.warmup_batch_sizes or (), self.warmup_frame_shapes or ())
 
     def init_model(self):
          # 加载不同类型的模型
         weights = str(self.model_path[0] if isinstance(self.model_path, list) else self.model_path)
-        suffix, suffixes = Path(weights).suffix.lower(), ['.h5', '.onnx', '']
-        # check weights have acceptable suffix
-        check_suffix(weights, suffixes)
-        # backbend booleans
-        self.h5, self.onnx, self.saved_model = (suffix == x for x in suffixes)
-
-        if self.h5:
+        # 按后缀选择后端：h5、onnx、tflite或者saved_model
+        self.backend_type = backend_type(weights)
+        # 推理缓存：.h5第一次加载(以及RepConv融合)后保存为SavedModel，之后直接加载计算图，不再构建网络以及trace
+        self.cached = False
+        if self.backend_type == 'h5':
             model_path = os.path.expanduser(self.model_path)
             assert model_path.endswith('.h5'), 'Keras model or weights must be a .h5 file.'
-            self.model = yolo_body([None, None, 3], self.anchors_mask, self.num_classes, self.phi)
-            self.model.load_weights(self.model_path, by_name=True)
-        
-            if self.phi == "l":
-                fuse_layers = [
-                    ["rep_conv_1", False, True],
-                    ["rep_conv_2", False, True],
-                    ["rep_conv_3", False, True],
-                ]
-                self.model_fuse = yolo_body([None, None, 3], self.anchors_mask, self.num_classes, self.phi, mode="predict")
-                self.model_fuse.load_weights(self.model_path, by_name=True)
-
-                fusion_rep_vgg(fuse_layers, self.model, self.model_fuse)
-                del self.model
-                gc.collect()
-                self.model = self.model_fuse
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if self.model_cache and is_fresh(cache_path(model_path), self.get_cache_key()):
+                self.load_cache(cache_path(model_path))
+            else:
+                self.build_model()
             print('{} model, anchors, and classes loaded.'.format(model_path))
-        if self.onnx:
-            import onnxruntime
-            self.model = onnxruntime.InferenceSession(weights, None)
-        if self.saved_model:
-            self.model = tf.keras.models.load_model(weights)
+        self.onnx_preprocess = None
+        self.end2end = False
+        if self.backend_type in ('onnx', 'tflite'):
+            with self.startup.phase('load ' + self.backend_type):
+                self.backend = load_backend(weights, self.onnx_options, self.tflite_options)
+            # 导出时使用--preprocess的onnx模型输入为uint8，缩放方式以模型为准
+            self.onnx_preprocess = self.backend.preprocess
+            # 导出时使用--end2end的onnx模型内含解码以及非极大值抑制，阈值以模型为准
+            self.end2end = self.backend.end2end
+            if self.onnx_preprocess is not None:
+                self.letterbox_image = self.onnx_preprocess['letterbox_image']
+        if self.backend_type == 'saved_model':
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if is_cache(weights):
+                self.load_cache(weights)
+            else:
+                import tensorflow as tf
+                with self.startup.phase('load model'):
+                    self.model = tf.keras.models.load_model(weights)
+                if self.fuse:
+                    # 推理时把BN折叠到卷积中并合并RepConv，与原模型的输出不一致时保持原模型
+                    from inference.fuse_graph import fuse_model
+                    with self.startup.phase('fuse'):
+                        self.model = fuse_model(self.model, self.input_shape)
             
 
         
@@ -105,8 +137,30 @@ class YOLO(object):
 
 
 
-    @tf.function
-    def get_pred(self, image_data):
+    def build_model(self):
+        with self.startup.phase('build model'):
+            from .nets import yolo_body
+            self.model = yolo_body([None, None, 3], self.anchors_mask, self.num_classes, self.phi)
+        with self.startup.phase('load weights'):
+            self.model.load_weights(self.model_path, by_name=True)
+        if self.fuse:
+            # 推理时把BN折叠到卷积中并合并RepConv(rep_conv_1~3的3x3以及1x1分支)，与原模型的输出不一致时保持原模型
+            from inference.fuse_graph import fuse_model
+            with self.startup.phase('fuse'):
+                self.model = fuse_model(self.model, self.input_shape)
+
+    def get_cache_key(self):
+        import tensorflow as tf
+        return cache_key(self.model_path, model='yolov7', phi=self.phi, num_classes=self.num_classes, anchors_mask=self.anchors_mask,
+                         input_shape=self.input_shape, letterbox_image=self.letterbox_image, fuse=self.fuse, tensorflow=tf.__version__)
+
+    def load_cache(self, path):
+        from inference.model_cache_graph import load_pred_functions
+        with self.startup.phase('load cache'):
+            self.model, self.get_pred, self.get_pred_frames = load_pred_functions(path)
+        self.cached = True
+
+    def _get_pred(self, image_data):
         yolo_head_P5, yolo_head_P4, yolo_head_P3 = self.model([image_data], training=False)
         return [yolo_head_P5, yolo_head_P4, yolo_head_P3]
 
@@ -115,18 +169,73 @@ class YOLO(object):
     #     out_boxes, out_scores, out_classes = self.model([image_data, input_image_shape], training=False)
     #     return out_boxes, out_scores, out_classes
 
-    def detect(self, image, crop = False, istrack=False):
+    def preprocess(self, image):
+        '''
+        图像预处理，返回RGB图像、归一化后的网络输入(不含batch维度)以及原图尺寸(h, w)
+        '''
         image = cvtColor(image)
         image_data  = resize_image(image, (self.input_shape[1], self.input_shape[0]), self.letterbox_image)
-        image_data  = np.expand_dims(preprocess_input(np.array(image_data, dtype='float32')), 0)
-        input_image_shape = np.expand_dims(np.array([image.size[1], image.size[0]], dtype='float32'), 0)
-        
-        if self.h5 or self.saved_model:
-            outputs = self.get_pred(image_data)
-        if self.onnx:
-            output_names = [output.name for output in self.model.get_outputs()]
-            outputs = self.model.run(output_names, {self.model.get_inputs()[0].name: image_data})
-        
+        if self.onnx_preprocess is not None:
+            # onnx模型内含归一化，只传输uint8数据；图像已缩放到输入尺寸，模型中的缩放不再改变图像
+            image_data = np.array(image_data, dtype='uint8')
+            if self.onnx_preprocess['bgr']:
+                image_data = np.ascontiguousarray(image_data[..., ::-1])
+        else:
+            image_data  = preprocess_input(np.array(image_data, dtype='float32'))
+        input_image_shape = np.array([image.size[1], image.size[0]], dtype='float32')
+        return image, image_data, input_image_shape
+
+    def forward(self, image_data, input_image_shapes=None):
+        '''
+        image_data：(batch_size, h, w, 3)，一次前向推理得到三个yolo head的输出
+        input_image_shapes：(batch_size, 2)，每张原图的(h, w)，只有end2end模型需要
+        '''
+        return self.backend.run(image_data, input_image_shapes)
+
+    def _get_pred_frames(self, frames, bgr):
+        from inference.preprocess_graph import letterbox_graph
+        image_data = letterbox_graph(frames, self.input_shape, self.letterbox_image, bgr=bgr)
+        return self._get_pred(image_data)
+
+    def forward_frames(self, frames, bgr=True):
+        '''
+        frames：(batch_size, H, W, 3)的uint8图像，可以直接使用cv2.VideoCapture读取的帧；
+                尺寸不同的帧(例如来自多路摄像头)以列表传入，详见stack_frames
+        tensorflow模型以及内含预处理的onnx模型在计算图中完成缩放、填充以及归一化，只传输uint8数据，
+        其余onnx模型以及tflite模型使用cv2预处理
+        '''
+        frames, input_image_shapes = stack_frames(frames, self.input_shape, self.letterbox_image)
+        if self.backend.tensorflow:
+            return self.backend.run_frames(frames, bgr)
+        if self.onnx_preprocess is not None:
+            if self.onnx_preprocess['bgr'] != bgr:
+                frames = np.ascontiguousarray(frames[..., ::-1])
+            return self.forward(frames, input_image_shapes)
+        image_data = np.stack([letterbox_numpy(frame, self.input_shape, self.letterbox_image, bgr=bgr)
+                               for frame in frames], axis=0)
+        return self.forward(image_data, input_image_shapes)
+
+    def decode(self, outputs, input_image_shape):
+        '''
+        对单张图像的网络输出进行解码以及非极大值抑制
+        '''
+        if self.end2end:
+            return unpad_end2end(*outputs)
+        if not self.backend.tensorflow:
+            return DecodeBox_numpy(
+                outputs=outputs,
+                anchors=self.anchors,
+                num_classes = self.num_classes,
+                image_shape = input_image_shape,
+                input_shape = self.input_shape,
+                anchor_mask = self.anchors_mask,
+                confidence = self.confidence,
+                nms_iou = self.nms_iou,
+                max_boxes = self.max_boxes,
+                letterbox_image = self.letterbox_image,
+                pre_nms_topk = self.pre_nms_topk
+            )
+        from .lib.decodebox import DecodeBox
         out_boxes, out_scores, out_classes = DecodeBox(
             outputs=outputs,
             anchors=self.anchors,
@@ -137,8 +246,106 @@ class YOLO(object):
             confidence = self.confidence,
             nms_iou = self.nms_iou,
             max_boxes = self.max_boxes,
-            letterbox_image = self.letterbox_image
+            letterbox_image = self.letterbox_image,
+            pre_nms_topk = self.pre_nms_topk
+        )
+        return out_boxes, out_scores, out_classes
+
+    def decode_batch(self, outputs, input_image_shapes):
+        '''
+        对整个batch的网络输出进行解码以及非极大值抑制，input_image_shapes：(batch_size, 2)
+        返回值：每张图像的(out_boxes, out_scores, out_classes)
+        '''
+        if self.end2end:
+            return [unpad_end2end(*outputs, index=i) for i in range(len(input_image_shapes))]
+        if not self.backend.tensorflow:
+            # onnx以及tflite使用NumPy逐张图像解码
+            return [self.decode([output[i:i+1] for output in outputs], input_image_shapes[i:i+1])
+                    for i in range(len(input_image_shapes))]
+        from .lib.decodebox import DecodeBox_batch
+        from inference.batched_nms import unpad_detections
+        nmsed_outputs = DecodeBox_batch(
+            outputs=outputs,
+            anchors=self.anchors,
+            num_classes = self.num_classes,
+            image_shape = input_image_shapes,
+            input_shape = self.input_shape,
+            anchor_mask = self.anchors_mask,
+            confidence = self.confidence,
+            nms_iou = self.nms_iou,
+            max_boxes = self.max_boxes,
+            letterbox_image = self.letterbox_image,
+            pre_nms_topk = self.pre_nms_topk
         )
+        return [unpad_detections(*nmsed_outputs, index=i) for i in range(len(input_image_shapes))]
+
+    def predict(self, image):
+        '''
+        只进行推理以及后处理，不绘制、不打印，返回Detections(boxes为x1, y1, x2, y2)
+        '''
+        image, image_data, input_image_shape = self.preprocess(image)
+        input_image_shape = np.expand_dims(input_image_shape, 0)
+        outputs = self.forward(np.expand_dims(image_data, 0), input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
+        return Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size)
+
+    def predict_frames(self, frames, bgr=True):
+        '''
+        对uint8的HWC图像推理，不经过PIL，返回每张图像对应的Detections，frames的说明见forward_frames
+        '''
+        image_hws = [frame.shape[:2] for frame in frames]
+        input_image_shapes = np.array(image_hws, dtype='float32')
+        decoded = self.decode_batch(self.forward_frames(frames, bgr), input_image_shapes)
+        return [Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                for (h, w), (out_boxes, out_scores, out_classes) in zip(image_hws, decoded)]
+
+    def predict_frame(self, frame, bgr=True):
+        return self.predict_frames(frame[None], bgr)[0]
+
+    def detect_batch(self, images, batch_size=8):
+        '''
+        参数说明：
+        images：待检测的图像序列(PIL.Image)，可以是生成器
+        batch_size：每次前向推理的图像数量
+        返回值：每张图像对应的Detections
+        '''
+        results = []
+        for batch in batched(images, batch_size):
+            batch_sizes = []
+            batch_data = []
+            batch_shapes = []
+            for image in batch:
+                image, image_data, input_image_shape = self.preprocess(image)
+                batch_sizes.append(image.size)
+                batch_data.append(image_data)
+                batch_shapes.append(input_image_shape)
+            batch_shapes = np.stack(batch_shapes, axis=0)
+            outputs = self.forward(np.stack(batch_data, axis=0), batch_shapes)
+            decoded = self.decode_batch(outputs, batch_shapes)
+            for i, (out_boxes, out_scores, out_classes) in enumerate(decoded):
+                results.append(Detections.from_tlbr(out_boxes, out_scores, out_classes, batch_sizes[i]))
+        return results
+
+    def draw(self, image, detections):
+        '''
+        在图像上绘制检测结果，字体按字号缓存
+        '''
+        return draw_detections(image, detections, self.class_names, self.colors, font_path='model_data/simhei.ttf',
+            thickness=int(max((image.size[0] + image.size[1]) // np.mean(self.input_shape), 1)))
+
+    def draw_frame(self, frame, detections, bgr=True):
+        '''
+        使用cv2在uint8图像上绘制检测结果(原地修改)，用于视频流
+        '''
+        return draw_detections_cv2(frame, detections, self.class_names, self.colors, bgr=bgr)
+
+    def detect(self, image, crop = False, istrack=False):
+        image, image_data, input_image_shape = self.preprocess(image)
+        image_data  = np.expand_dims(image_data, 0)
+        input_image_shape = np.expand_dims(input_image_shape, 0)
+        
+        outputs = self.forward(image_data, input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
         # out_boxes, out_scores, out_classes = self.get_pred(image_data, input_image_shape)
         print('Found {} boxes for {}'.format(len(out_boxes), 'img'))
 
@@ -181,37 +388,7 @@ class YOLO(object):
                 boxes.append(box_tmp)
             return boxes, out_scores, out_classes
         else:
-            font = ImageFont.truetype(font='model_data/simhei.ttf', size=np.floor(3e-2 * image.size[1] + 0.5).astype('int32'))
-            thickness   = int(max((image.size[0] + image.size[1]) // np.mean(self.input_shape), 1))
-            for i, c in list(enumerate(out_classes)):   
-                predicted_class = self.class_names[int(c)]
-                box = out_boxes[i]
-                score = out_scores[i]
-                top, left, bottom, right = box
-
-                top = max(0, np.floor(top).astype('int32'))
-                left = max(0, np.floor(left).astype('int32'))
-                bottom = min(image.size[1], np.floor(bottom).astype('int32'))
-                right = min(image.size[0], np.floor(right).astype('int32'))
-
-                label = '{} {:.2f}'.format(predicted_class, score)
-                draw = ImageDraw.Draw(image)
-                label_size = draw.textsize(label, font)
-                label = label.encode('utf-8')
-                print(label, top, left, bottom, right)
-            
-                if top - label_size[1] >= 0:
-                    text_origin = np.array([left, top - label_size[1]])
-                else:
-                    text_origin = np.array([left, top + 1])
-
-                for i in range(thickness):
-                    draw.rectangle([left + i, top + i, right - i, bottom - i], outline=self.colors[c])
-                draw.rectangle([tuple(text_origin), tuple(text_origin + label_size)], fill=self.colors[c])
-                draw.text(text_origin, str(label,'UTF-8'), fill=(0, 0, 0), font=font)
-                del draw
-
-            return image
+            return self.draw(image, Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size))
 
     def getdrtxt(self,image, pr_folder_name, image_id):
         image = cvtColor(image)
@@ -288,6 +465,13 @@ def Inference_YOLOV7Model(config, model_path):
         max_boxes=config.max_boxes,
         letterbox_image = True,
         phi=config.phi,
-        tiny = config.tiny
+        tiny = config.tiny,
+        pre_nms_topk = config.pre_nms_topk,
+        warmup_batch_sizes = config.warmup_batch_sizes,
+        warmup_frame_shapes = config.warmup_frame_shapes,
+        model_cache = config.model_cache,
+        onnx_options = config.onnx_options,
+        tflite_options = config.tflite_options,
+        fuse = config.fuse
     )
     return yolo
@@ -2,6 +2,7 @@ import datetime
 import os
 from functools import partial
 
+import numpy as np
 import tensorflow as tf
 import tensorflow.keras.backend as K
 from tensorflow.keras.callbacks import (EarlyStopping, LearningRateScheduler,
@@ -12,9 +13,12 @@ from .nets.yolov7 import get_train_model, yolo_body
 from .nets.loss import get_lr_scheduler
 from .lib.callbacks import ModelCheckpoint
 from .lib.dataloader import YoloDatasets
-from .lib.tools import get_anchors, get_classes, show_config
+from .lib.tools import get_anchors, get_classes, preprocess_input, show_config
 from tqdm import tqdm
 from .nets.loss import yolo_loss
+from components.distillation import TeacherCacheSequence, distillation
+from components.data_pipeline import data_pipeline
+from components.image_cache import image_cache
 
 def get_train_step_fn(input_shape, anchors, anchors_mask, num_classes, label_smoothing, strategy):
     @tf.function
@@ -171,7 +175,7 @@ def yolov7(config):
         print('Load weights {}.'.format(model_path))
         model_body.load_weights(model_path, by_name=True, skip_mismatch=True)
     if not eager:
-        model = get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing)
+        model = get_train_model(model_body, input_shape, num_classes, anchors, anchors_mask, label_smoothing, config.sparse_targets)
             
     with open(train_annotation_path, encoding='utf-8') as f:
         train_lines = f.readlines()
@@ -179,6 +183,8 @@ def yolov7(config):
         val_lines   = f.readlines()
     num_train   = len(train_lines)
     num_val     = len(val_lines)
+    # 图像缓存：config.image_cache_dir不为空时训练集以及验证集的图像只解码一次
+    cache       = image_cache(config, train_lines + val_lines)
 
     show_config(
         classes_path = classes_path, anchors_path = anchors_path, anchors_mask = anchors_mask, model_path = model_path, input_shape = input_shape, \
@@ -220,10 +226,23 @@ def yolov7(config):
     if epoch_step == 0 or epoch_step_val == 0:
         raise ValueError('数据集过小，无法进行训练，请扩充数据集。')
 
-    train_dataloader = YoloDatasets(train_lines, input_shape, anchors, batch_size, num_classes, anchors_mask, Init_Epoch, UnFreeze_Epoch, \
-                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio)
     val_dataloader = YoloDatasets(val_lines, input_shape, anchors, batch_size, num_classes, anchors_mask, Init_Epoch, UnFreeze_Epoch, \
-                                            mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0)
+                                            mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0, sparse=config.sparse_targets, cache=cache)
+
+    # 知识蒸馏：teacher的蒸馏目标缓存到磁盘时训练图像不做随机数据增强(mosaic、mixup)
+    distiller, teacher_cache = distillation(config, model_body, num_classes, train_lines + val_lines,
+                                            lambda line: preprocess_input(np.array(val_dataloader.get_random_data(line, input_shape, random=False)[0], np.float32)),
+                                            input_shape)
+    if distiller is not None:
+        model = distiller.attach(model, model_body, cached=teacher_cache is not None)
+    if teacher_cache is None:
+        train_dataloader = YoloDatasets(train_lines, input_shape, anchors, batch_size, num_classes, anchors_mask, Init_Epoch, UnFreeze_Epoch, \
+                                            mosaic=mosaic, mixup=mixup, mosaic_prob=mosaic_prob, mixup_prob=mixup_prob, train=True, special_aug_ratio=special_aug_ratio, sparse=config.sparse_targets, cache=cache)
+    else:
+        train_dataloader = YoloDatasets(train_lines, input_shape, anchors, batch_size, num_classes, anchors_mask, Init_Epoch, UnFreeze_Epoch, \
+                                            mosaic=False, mixup=False, mosaic_prob=0, mixup_prob=0, train=False, special_aug_ratio=0, sparse=config.sparse_targets, cache=cache)
+        train_dataloader = TeacherCacheSequence(train_dataloader, teacher_cache)
+        val_dataloader = TeacherCacheSequence(val_dataloader, teacher_cache)
 
     optimizer = {
             'adam'  : Adam(lr = Init_lr, beta_1 = momentum),
@@ -246,9 +265,9 @@ def yolov7(config):
     if start_epoch < end_epoch:
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         model.fit(
-            x = train_dataloader,
+            x = data_pipeline(train_dataloader, config, end_epoch, start_epoch),
             steps_per_epoch = epoch_step,
-            validation_data = val_dataloader,
+            validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
             validation_steps = epoch_step_val,
             epochs = end_epoch,
             initial_epoch = start_epoch,
@@ -277,14 +296,14 @@ def yolov7(config):
         if epoch_step == 0 or epoch_step_val == 0:
             raise ValueError("数据集过小，无法继续进行训练，请扩充数据集。")
 
-        train_dataloader.batch_size    = Unfreeze_batch_size
-        val_dataloader.batch_size      = Unfreeze_batch_size
+        for dataloader in (train_dataloader, val_dataloader):
+            getattr(dataloader, 'dataset', dataloader).batch_size = Unfreeze_batch_size
 
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         model.fit(
-            x = train_dataloader,
+            x = data_pipeline(train_dataloader, config, end_epoch, start_epoch),
             steps_per_epoch = epoch_step,
-            validation_data = val_dataloader,
+            validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
             validation_steps = epoch_step_val,
             epochs = end_epoch,
             initial_epoch = start_epoch,
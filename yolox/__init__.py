@@ -1,7 +1,13 @@
-from .nets.yolox import *
-from .lib.loss_yolox import *
-from .lib.callbacks import *
-from .lib.dataloader import *
-from .train_yolox import yolox
-from .predict_yolox import Inference_YOLOXModel
-from .export_yolox import export_model as export_yolox
\ No newline at end of file
+from inference.lazy import lazy_exports
+
+# 按需导入：只使用推理类(例如onnx模型)时不导入网络结构、训练代码以及tensorflow
+__getattr__, __dir__ = lazy_exports(__name__, {
+    'yolox': ('.train_yolox', 'yolox'),
+    'Inference_YOLOXModel': ('.predict_yolox', 'Inference_YOLOXModel'),
+    'export_yolox': ('.export_yolox', 'export_model'),
+}, {
+    '.nets.yolox': ['yolo_body', 'get_yolox_model'],
+    '.lib.loss_yolox': ['get_yolo_loss', 'get_losses', 'get_assignments', 'get_in_boxes_info', 'bboxes_iou', 'dynamic_k_matching', 'get_lr_scheduler'],
+    '.lib.callbacks': ['ExponentDecayScheduler', 'WarmUpCosineDecayScheduler', 'ModelCheckpoint'],
+    '.lib.dataloader': ['cvtColor', 'YoloDatasets', 'get_classes'],
+})
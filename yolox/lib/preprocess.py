@@ -0,0 +1,11 @@
+import numpy as np
+
+# 归一化使用的均值以及标准差(RGB)
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+def preprocess_input(image):
+    image /= 255.0
+    image -= np.array(MEAN)
+    image /= np.array(STD)
+    return image
@@ -0,0 +1,64 @@
+import numpy as np
+from inference.nms import multiclass_nms, select_candidates
+from inference.priors import get_stride_priors
+
+
+def sigmoid(x):  
+    return np.exp(-np.logaddexp(0, -x))
+
+def yolo_correct_boxes_numpy(box_xy, box_wh, image_shape, input_shape, letterbox_image=True):
+    box_yx = box_xy[..., ::-1]
+    box_hw = box_wh[..., ::-1]
+    input_shape = np.array(input_shape, np.float64)
+    image_shape = np.array(image_shape, np.float64)
+
+    if letterbox_image:
+        new_shape = np.round(image_shape * np.min(input_shape/image_shape))
+        offset  = (input_shape - new_shape)/2./input_shape
+        scale   = input_shape/new_shape
+
+        box_yx  = (box_yx - offset) * scale
+        box_hw *= scale
+
+    box_mins    = box_yx - (box_hw / 2.)
+    box_maxes   = box_yx + (box_hw / 2.)
+    boxes  = np.concatenate([box_mins[..., 0:1], box_mins[..., 1:2], box_maxes[..., 0:1], box_maxes[..., 1:2]], axis=-1)
+    boxes *= np.concatenate([image_shape, image_shape], axis=1)
+    return boxes
+
+def DecodeBox_numpy(outputs,image_shape, input_shape, class_names,confidence=0.5, max_boxes=100, letterbox_image = True, nms_iou=0.3, nms_method='nms', pre_nms_topk=None):
+    '''
+    NumPy解码以及非极大值抑制，用于单张图像，不依赖tensorflow
+    先按置信度筛选候选框(最多pre_nms_topk个)，只对候选框解码坐标
+    nms_method：'nms'、'diou'或'soft'，详见inference.nms
+    '''
+    num_classes = len(class_names)
+    priors = get_stride_priors([np.shape(x)[1:3] for x in outputs], input_shape)
+    '''
+    outputs before:
+    batch_size, 80, 80, 4+1+num_classes
+    batch_size, 40, 40, 4+1+num_classes
+    batch_size, 20, 20, 4+1+num_classes
+
+    outputs after:
+    8400, 4+1+num_classes
+    '''
+    outputs = np.concatenate([np.reshape(np.array(x, np.float32), [-1, 5 + num_classes]) for x in outputs], axis = 0)
+
+    # 类别概率不超过1，objectness低于confidence的检测框不可能成为候选框
+    box_confidence = sigmoid(outputs[:, 4])
+    index = np.flatnonzero(box_confidence >= confidence)
+    box_scores = box_confidence[index, None] * sigmoid(outputs[index, 5:])
+    candidates = select_candidates(box_scores, confidence, pre_nms_topk)
+    index, box_scores = index[candidates], box_scores[candidates]
+
+    outputs, priors = outputs[index], priors[index]
+    box_xy = (outputs[:, :2] + priors[:, 0:2]) * priors[:, 2:3] / np.array(input_shape[::-1], np.float32)
+    box_wh = np.exp(outputs[:, 2:4]) * priors[:, 2:3] / np.array(input_shape[::-1], np.float32)
+    boxes = yolo_correct_boxes_numpy(box_xy, box_wh, image_shape, input_shape, letterbox_image)
+
+    # 所有类别的检测框一起做非极大值抑制，输出预先分配
+    boxes_out, scores_out, classes_out = multiclass_nms(
+        np.reshape(boxes, [-1, 4]), box_scores, confidence, nms_iou, max_boxes, method=nms_method)
+
+    return boxes_out, scores_out, classes_out
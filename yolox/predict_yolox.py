@@ -1,21 +1,24 @@
-import colorsys
 import os
+import time
 import numpy as np
-import tensorflow as tf
-from PIL import ImageDraw, ImageFont,Image
-from tensorflow.keras.layers import Input, Lambda
-from tensorflow.keras.models import Model
-from .nets.yolox import yolo_body
-from .lib.dataloader import cvtColor, get_classes, preprocess_input
-from .lib.utils_box import DecodeBox, DecodeBox_numpy
+from PIL import Image
+from .lib.preprocess import preprocess_input, MEAN, STD
+from .lib.utils_box_numpy import DecodeBox_numpy
 import gc
 from glob import glob
-from .lib.utils import check_suffix
-from pathlib import Path
+from inference import batched, Detections, draw_detections, draw_detections_cv2, get_colors
+from inference.utils import cvtColor, get_classes
+from inference.preprocess import letterbox_numpy, stack_frames
+from inference.end2end import unpad_end2end
+from inference.backends import backend_type, load_backend, GraphBackend
+from inference.tracing import warmup
+from inference.model_cache import cache_path, cache_key, is_fresh, is_cache
+from inference.startup import StartupReport
 
 
 class YOLOX(object):
     def __init__(self, **kwargs) -> None:
+        t_load = time.time()
         self._arguments = {
             'class_path':kwargs['class_path'], 
             'input_shape':kwargs['input_shape'], 
@@ -25,11 +28,39 @@ class YOLOX(object):
             'letterbox_image':kwargs['letterbox_image'],
             'model_path':kwargs['model_path'],
             'phi':kwargs['phi'],
-            'onnx':kwargs['onnx']
+            'onnx':kwargs['onnx'],
+            'pre_nms_topk':kwargs.get('pre_nms_topk'),
+            'warmup_batch_sizes':kwargs.get('warmup_batch_sizes'),
+            'warmup_frame_shapes':kwargs.get('warmup_frame_shapes'),
+            'model_cache':kwargs.get('model_cache', False),
+            'onnx_options':kwargs.get('onnx_options'),
+            'tflite_options':kwargs.get('tflite_options'),
+            'fuse':kwargs.get('fuse', True)
         }
         self.__dict__.update(self._arguments)
-        self.class_names = get_classes(self.class_path)
+        self.startup = StartupReport()
+        self.class_names, _ = get_classes(self.class_path)
+        # 设置颜色
+        self.colors = get_colors(len(self.class_names))
         self.model = self.build_model()
+        # tensorflow模型使用固定的input_signature，batch大小以及原图尺寸变化时不再重新trace
+        self.trace_counters = []
+        if self.backend_type in ('h5', 'saved_model'):
+            if not self.cached:
+                from inference.tracing_graph import build_pred_functions
+                self.prediction, self.get_pred_frames, self.trace_counters = build_pred_functions(self._prediction, self._get_pred_frames, self.input_shape)
+                if self.backend_type == 'h5' and self.model_cache:
+                    from inference.model_cache_graph import save_pred_functions
+                    with self.startup.phase('save cache'):
+                        if save_pred_functions(cache_path(self.model_path), self.model, self.prediction, self.get_pred_frames, self.get_cache_key()):
+                            print('inference cache saved to {}'.format(cache_path(self.model_path)))
+            self.backend = GraphBackend(self.backend_type, self.model, self.prediction, self.get_pred_frames)
+        self.load_time = time.time() - t_load
+        # 加载时预热，第一帧不再包含trace以及首次运行的开销
+        self.warmup_times = []
+        if self.warmup_batch_sizes or self.warmup_frame_shapes:
+            with self.startup.phase('warmup'):
+                self.warmup_times = warmup(self, self.warmup_batch_sizes or (), self.warmup_frame_shapes or ())
 
     def resize_image(self, image):
         size = self.input_shape
@@ -51,16 +82,32 @@ class YOLOX(object):
     def build_model(self, export_model = False):
         # 加载不同类型的模型
         weights = str(self.model_path[0] if isinstance(self.model_path, list) else self.model_path)
-        suffix, suffixes = Path(weights).suffix.lower(), ['.h5', '.onnx', '']
-        # check weights have acceptable suffix
-        check_suffix(weights, suffixes)
-        # backbend booleans
-        self.h5, self.onnx, self.saved_model = (suffix == x for x in suffixes)
-        if self.h5:
+        # 按后缀选择后端：h5、onnx、tflite或者saved_model
+        self.backend_type = backend_type(weights)
+        self.onnx_preprocess = None
+        self.end2end = False
+        # 推理缓存：.h5第一次加载后保存为SavedModel，之后直接加载计算图，不再构建网络以及trace
+        self.cached = False
+        if self.backend_type == 'h5':
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if self.model_cache and not export_model and is_fresh(cache_path(weights), self.get_cache_key()):
+                print('model weight success load.')
+                return self.load_cache(cache_path(weights))
+            import tensorflow as tf
             num_classes = len(self.class_names) 
-            yolo_model = yolo_body([None, None, 3], num_classes=num_classes, phi=self.phi)
-            yolo_model.load_weights(weights)
+            with self.startup.phase('build model'):
+                from .nets.yolox import yolo_body
+                yolo_model = yolo_body([None, None, 3], num_classes=num_classes, phi=self.phi)
+            with self.startup.phase('load weights'):
+                yolo_model.load_weights(weights)
             print('model weight success load.')
+            if self.fuse:
+                # 推理时把BN折叠到卷积中并合并RepConv，与原模型的输出不一致时保持原模型
+                from inference.fuse_graph import fuse_model
+                with self.startup.phase('fuse'):
+                    yolo_model = fuse_model(yolo_model, self.input_shape)
             if self.onnx:
                 return yolo_model
             if export_model:
@@ -86,12 +133,30 @@ class YOLOX(object):
             # model = Model([yolo_model.input, input_image_shape], outputs)
             # gc.collect()
             return yolo_model
-        if self.onnx:
-            import onnxruntime
-            model = onnxruntime.InferenceSession(weights, None)
-            return model
-        if self.saved_model:
-            model = tf.keras.models.load_model(weights)
+        if self.backend_type in ('onnx', 'tflite'):
+            with self.startup.phase('load ' + self.backend_type):
+                self.backend = load_backend(weights, self.onnx_options, self.tflite_options)
+            # 导出时使用--preprocess的onnx模型输入为uint8，缩放方式以模型为准
+            self.onnx_preprocess = self.backend.preprocess
+            # 导出时使用--end2end的onnx模型内含解码以及非极大值抑制，阈值以模型为准
+            self.end2end = self.backend.end2end
+            if self.onnx_preprocess is not None:
+                self.letterbox_image = self.onnx_preprocess['letterbox_image']
+            return self.backend
+        if self.backend_type == 'saved_model':
+            with self.startup.phase('import tensorflow'):
+                # 单独统计导入tensorflow的耗时
+                import tensorflow
+            if is_cache(weights):
+                return self.load_cache(weights)
+            import tensorflow as tf
+            with self.startup.phase('load model'):
+                model = tf.keras.models.load_model(weights)
+            if self.fuse:
+                # 推理时把BN折叠到卷积中并合并RepConv，与原模型的输出不一致时保持原模型
+                from inference.fuse_graph import fuse_model
+                with self.startup.phase('fuse'):
+                    model = fuse_model(model, self.input_shape)
             return model
     
     # @tf.function
@@ -99,34 +164,171 @@ class YOLOX(object):
     #     out_boxes, out_scores, out_classes = model([image_data, input_image_shape], training=False)
     #     return out_boxes, out_scores, out_classes
 
-    @tf.function
-    def prediction(self, model, image_data):
-        concatenate_13, concatenate_14, concatenate_15 = model([image_data], training=False)
+    def get_cache_key(self):
+        import tensorflow as tf
+        return cache_key(self.model_path, model='yolox', phi=self.phi, num_classes=len(self.class_names),
+                         input_shape=self.input_shape, letterbox_image=self.letterbox_image, fuse=self.fuse, tensorflow=tf.__version__)
+
+    def load_cache(self, path):
+        from inference.model_cache_graph import load_pred_functions
+        with self.startup.phase('load cache'):
+            model, self.prediction, self.get_pred_frames = load_pred_functions(path)
+        self.cached = True
+        return model
+
+    def _prediction(self, image_data):
+        concatenate_13, concatenate_14, concatenate_15 = self.model([image_data], training=False)
         outputs = [concatenate_13, concatenate_14, concatenate_15]
         return outputs
 
-    def detect(self, image, crop=False, istrack=False):
-        num_classes = len(self.class_names)
-        # 设置颜色
-        hsv_tuples = [(x / num_classes, 1., 1.) for x in range(num_classes)]
-        colors = list(map(lambda x: colorsys.hsv_to_rgb(*x), hsv_tuples))
-        colors = list(map(lambda x: (int(x[0] * 255), int(x[1] * 255), int(x[2] * 255)), colors))
-        # 构建模型
+    def preprocess(self, image):
+        '''
+        图像预处理，返回RGB图像、归一化后的网络输入(不含batch维度)以及原图尺寸(h, w)
+        '''
         image = cvtColor(image)
         image_data = self.resize_image(image)
-        image_data = np.expand_dims(preprocess_input(np.array(image_data, dtype='float32')), 0)
-        input_image_shape = np.expand_dims(np.array([image.size[1], image.size[0]], dtype='float32'), 0)
+        if self.onnx_preprocess is not None:
+            # onnx模型内含归一化，只传输uint8数据；图像已缩放到输入尺寸，模型中的缩放不再改变图像
+            image_data = np.array(image_data, dtype='uint8')
+            if self.onnx_preprocess['bgr']:
+                image_data = np.ascontiguousarray(image_data[..., ::-1])
+        else:
+            image_data = preprocess_input(np.array(image_data, dtype='float32'))
+        input_image_shape = np.array([image.size[1], image.size[0]], dtype='float32')
+        return image, image_data, input_image_shape
+
+    def forward(self, image_data, input_image_shapes=None):
+        '''
+        image_data：(batch_size, h, w, 3)，一次前向推理得到三个head的输出
+        input_image_shapes：(batch_size, 2)，每张原图的(h, w)，只有end2end模型需要
+        '''
+        return self.backend.run(image_data, input_image_shapes)
+
+    def _get_pred_frames(self, frames, bgr):
+        from inference.preprocess_graph import letterbox_graph
+        image_data = letterbox_graph(frames, self.input_shape, self.letterbox_image, bgr=bgr, mean=MEAN, std=STD)
+        return self._prediction(image_data)
+
+    def forward_frames(self, frames, bgr=True):
+        '''
+        frames：(batch_size, H, W, 3)的uint8图像，可以直接使用cv2.VideoCapture读取的帧；
+                尺寸不同的帧(例如来自多路摄像头)以列表传入，详见stack_frames
+        tensorflow模型以及内含预处理的onnx模型在计算图中完成缩放、填充以及归一化，只传输uint8数据，
+        其余onnx模型以及tflite模型使用cv2预处理
+        '''
+        frames, input_image_shapes = stack_frames(frames, self.input_shape, self.letterbox_image)
+        if self.backend.tensorflow:
+            return self.backend.run_frames(frames, bgr)
+        if self.onnx_preprocess is not None:
+            if self.onnx_preprocess['bgr'] != bgr:
+                frames = np.ascontiguousarray(frames[..., ::-1])
+            return self.forward(frames, input_image_shapes)
+        image_data = np.stack([letterbox_numpy(frame, self.input_shape, self.letterbox_image, bgr=bgr, mean=MEAN, std=STD)
+                               for frame in frames], axis=0)
+        return self.forward(image_data, input_image_shapes)
+
+    def decode(self, outputs, input_image_shape):
+        '''
+        对单张图像的网络输出进行解码以及非极大值抑制
+        '''
+        if self.end2end:
+            return unpad_end2end(*outputs)
+        return DecodeBox_numpy(outputs, input_image_shape, self.input_shape, self.class_names,
+                               confidence=self.confidence, max_boxes=self.max_boxes,
+                               letterbox_image=self.letterbox_image, nms_iou=self.nms_iou,
+                               pre_nms_topk=self.pre_nms_topk)
+
+    def decode_batch(self, outputs, input_image_shapes):
+        '''
+        对整个batch的网络输出逐张图像解码以及非极大值抑制，input_image_shapes：(batch_size, 2)
+        返回值：每张图像的(out_boxes, out_scores, out_classes)
+        '''
+        outputs = [np.array(output) for output in outputs]
+        return [self.decode([output[i:i+1] for output in outputs], input_image_shapes[i:i+1])
+                for i in range(len(input_image_shapes))]
+
+    def predict(self, image):
+        '''
+        只进行推理以及后处理，不绘制、不打印，返回Detections(boxes为x1, y1, x2, y2)
+        '''
+        image, image_data, input_image_shape = self.preprocess(image)
+        input_image_shape = np.expand_dims(input_image_shape, 0)
+        outputs = self.forward(np.expand_dims(image_data, 0), input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
+        return Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size)
+
+    def predict_frames(self, frames, bgr=True):
+        '''
+        对uint8的HWC图像推理，不经过PIL，返回每张图像对应的Detections，frames的说明见forward_frames
+        '''
+        image_hws = [frame.shape[:2] for frame in frames]
+        input_image_shapes = np.array(image_hws, dtype='float32')
+        decoded = self.decode_batch(self.forward_frames(frames, bgr), input_image_shapes)
+        return [Detections.from_tlbr(out_boxes, out_scores, out_classes, (w, h))
+                for (h, w), (out_boxes, out_scores, out_classes) in zip(image_hws, decoded)]
+
+    def predict_frame(self, frame, bgr=True):
+        return self.predict_frames(frame[None], bgr)[0]
+
+    def detect_batch(self, images, batch_size=8):
+        '''
+        参数说明：
+        images：待检测的图像序列(PIL.Image)，可以是生成器
+        batch_size：每次前向推理的图像数量
+        返回值：每张图像对应的Detections
+        '''
+        results = []
+        for batch in batched(images, batch_size):
+            batch_sizes = []
+            batch_data = []
+            batch_shapes = []
+            for image in batch:
+                image, image_data, input_image_shape = self.preprocess(image)
+                batch_sizes.append(image.size)
+                batch_data.append(image_data)
+                batch_shapes.append(input_image_shape)
+            batch_shapes = np.stack(batch_shapes, axis=0)
+            outputs = self.forward(np.stack(batch_data, axis=0), batch_shapes)
+            outputs = [np.array(output) for output in outputs]
+            for i, input_image_shape in enumerate(batch_shapes):
+                out_boxes, out_scores, out_classes = self.decode(
+                    [output[i:i+1] for output in outputs], np.expand_dims(input_image_shape, 0))
+                results.append(Detections.from_tlbr(out_boxes, out_scores, out_classes, batch_sizes[i]))
+        return results
+
+    def draw(self, image, detections, crop=False):
+        '''
+        在图像上绘制检测结果，字体按字号缓存
+        '''
+        if crop:
+            for i, (left, top, right, bottom) in enumerate(detections.boxes):
+                top = max(0, np.floor(top).astype('int32'))
+                left = max(0, np.floor(left).astype('int32'))
+                bottom = min(image.size[1], np.floor(bottom).astype('int32'))
+                right = min(image.size[0], np.floor(right).astype('int32'))
+                dir_save_path = "img_crop"
+                if not os.path.exists(dir_save_path):
+                    os.makedirs(dir_save_path)
+                crop_image = image.crop([left, top, right, bottom])
+                crop_image.save(os.path.join(dir_save_path, "crop_" + str(i) + ".png"), quality=95, subsampling=0)
+                print("save crop_" + str(i) + ".png to " + dir_save_path)
+        return draw_detections(image, detections, self.class_names, self.colors, font_path='data/simhei.ttf',
+            thickness=int(max((image.size[0] + image.size[1]) // np.mean(self.input_shape), 1)))
+
+    def draw_frame(self, frame, detections, bgr=True):
+        '''
+        使用cv2在uint8图像上绘制检测结果(原地修改)，用于视频流
+        '''
+        return draw_detections_cv2(frame, detections, self.class_names, self.colors, bgr=bgr)
+
+    def detect(self, image, crop=False, istrack=False):
+        image, image_data, input_image_shape = self.preprocess(image)
+        image_data = np.expand_dims(image_data, 0)
+        input_image_shape = np.expand_dims(input_image_shape, 0)
         
         # 推理以及后处理
-        if self.h5 or self.saved_model:
-            # out_boxes, out_scores, out_classes  = self.prediction(self.model, image_data, input_image_shape) 
-            outputs = self.prediction(self.model, image_data) 
-            
-        if self.onnx:
-            output_names = [output.name for output in self.model.get_outputs()]
-            outputs = self.model.run(output_names, {self.model.get_inputs()[0].name: image_data})
-        
-        out_boxes, out_scores, out_classes = DecodeBox_numpy(outputs, input_image_shape, self.input_shape, self.class_names, self.confidence)
+        outputs = self.forward(image_data, input_image_shape)
+        out_boxes, out_scores, out_classes = self.decode(outputs, input_image_shape)
         print('Found {} boxes for {}'.format(len(out_boxes), 'img'))
 
         if istrack:
@@ -154,48 +356,7 @@ class YOLOX(object):
             return boxes, out_scores, out_classes
 
         else:
-            font = ImageFont.truetype(font='data/simhei.ttf', size=np.floor(3e-2 * image.size[1] + 0.5).astype('int32'))
-            thickness = int(max((image.size[0] + image.size[1]) // np.mean(self.input_shape), 1))
-            if crop:
-                for i, c in list(enumerate(out_boxes)):
-                    top, left, bottom, right = out_boxes[i]
-                    top = max(0, np.floor(top).astype('int32'))
-                    left = max(0, np.floor(left).astype('int32'))
-                    bottom = min(image.size[1], np.floor(bottom).astype('int32'))
-                    right = min(image.size[0], np.floor(right).astype('int32'))
-                    dir_save_path = "img_crop"
-                    if not os.path.exists(dir_save_path):
-                        os.makedirs(dir_save_path)
-                    crop_image = image.crop([left, top, right, bottom])
-                    crop_image.save(os.path.join(dir_save_path, "crop_" + str(i) + ".png"), quality=95, subsampling=0)
-                    print("save crop_" + str(i) + ".png to " + dir_save_path)
-            for i, c in list(enumerate(out_classes)):
-                predicted_class = self.class_names[int(c)]
-                box = out_boxes[i]
-                score = out_scores[i]
-                top, left, bottom, right = box
-
-                top = max(0, np.floor(top).astype('int32'))
-                left = max(0, np.floor(left).astype('int32'))
-                bottom = min(image.size[1], np.floor(bottom).astype('int32'))
-                right = min(image.size[0], np.floor(right).astype('int32'))
-                label = '{} {:.2f}'.format(predicted_class, score)
-                draw = ImageDraw.Draw(image)
-                label_size = draw.textsize(label, font)
-                label = label.encode('utf-8')
-                print(label, top, left, bottom, right)
-            
-                if top - label_size[1] >= 0:
-                    text_origin = np.array([left, top - label_size[1]])
-                else:
-                    text_origin = np.array([left, top + 1])
-
-                for i in range(thickness):
-                    draw.rectangle([left + i, top + i, right - i, bottom - i], outline=colors[c])
-                draw.rectangle([tuple(text_origin), tuple(text_origin + label_size)], fill=colors[c])
-                draw.text(text_origin, str(label,'UTF-8'), fill=(0, 0, 0), font=font)
-                del draw
-            return image
+            return self.draw(image, Detections.from_tlbr(out_boxes, out_scores, out_classes, image.size), crop=crop)
     def getdrtxt(self,image, pr_folder_name, image_id):
         image = cvtColor(image)
         image_data = self.resize_image(image)
@@ -236,6 +397,13 @@ def Inference_YOLOXModel(YOLOXConfig, model_path, onnx = False):
         letterbox_image = True,
         model_path = model_path,
         phi=YOLOXConfig.phi,
-        onnx = onnx
+        onnx = onnx,
+        pre_nms_topk = YOLOXConfig.pre_nms_topk,
+        warmup_batch_sizes = YOLOXConfig.warmup_batch_sizes,
+        warmup_frame_shapes = YOLOXConfig.warmup_frame_shapes,
+        model_cache = YOLOXConfig.model_cache,
+        onnx_options = YOLOXConfig.onnx_options,
+        tflite_options = YOLOXConfig.tflite_options,
+        fuse = YOLOXConfig.fuse
     )
     return yolox
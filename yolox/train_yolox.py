@@ -4,6 +4,9 @@ import tensorflow.keras.backend as K
 from tensorflow.keras.callbacks import EarlyStopping, LearningRateScheduler, TensorBoard
 from tensorflow.keras.optimizers import SGD, Adam
 from yolox import yolo_body, get_yolox_model,get_lr_scheduler, ModelCheckpoint, YoloDatasets, get_classes
+from components.pruning import prune_magnitude, pruning_callbacks, pruning_steps, strip_and_save
+from components.data_pipeline import data_pipeline
+from components.image_cache import image_cache
 from tqdm import tqdm
 
 
@@ -111,12 +114,18 @@ def yolox(config):
     num_classes = len(class_names)
 
     # 创建模型
-    model = yolo_body([None, None, 3], num_classes = num_classes, phi = phi, weight_decay=weight_decay)
+    model_body = yolo_body([None, None, 3], num_classes = num_classes, phi = phi, weight_decay=weight_decay)
     # 加载预训练权重
-    model.load_weights(pretrain_model_path, by_name=True, skip_mismatch=True)
+    model_body.load_weights(pretrain_model_path, by_name=True, skip_mismatch=True)
     print('success load pretrain model.')
+    if config.pruning == 'magnitude':
+        # 非结构化剪枝：用tfmot包装卷积，训练时按计划把绝对值最小的权重置0
+        with open(train_txt, encoding='utf-8') as f:
+            num_train = len(f.readlines())
+        model_body = prune_magnitude(model_body, config.pruning_sparsity, *pruning_steps(config, num_train // Freeze_batch_size),
+                                     frequency=config.pruning_frequency)
 
-    model = get_yolox_model(model, input_shape, num_classes)
+    model = get_yolox_model(model_body, input_shape, num_classes)
     
 
     if Freeze_train:
@@ -138,10 +147,12 @@ def yolox(config):
             val_line = f.readlines()
         num_train = len(train_line)
         num_val = len(val_line)
+        # 图像缓存：config.image_cache_dir不为空时训练集以及验证集的图像只解码一次
+        cache = image_cache(config, train_line + val_line)
         epoch_step = num_train // batch_size
         epoch_step_val = num_val // batch_size
-        train_dataloader = YoloDatasets(train_line, input_shape, batch_size, num_classes, Init_Epoch, UnFreeze_Epoch, mosaic = mosaic, train = True)
-        val_dataloader = YoloDatasets(val_line, input_shape, batch_size, num_classes, Init_Epoch, UnFreeze_Epoch, mosaic = False, train = False)
+        train_dataloader = YoloDatasets(train_line, input_shape, batch_size, num_classes, Init_Epoch, UnFreeze_Epoch, mosaic = mosaic, train = True, cache = cache)
+        val_dataloader = YoloDatasets(val_line, input_shape, batch_size, num_classes, Init_Epoch, UnFreeze_Epoch, mosaic = False, train = False, cache = cache)
 
         optimizer = {
             'adam':Adam(learning_rate=learning_rate, beta_1=momentum),
@@ -157,14 +168,16 @@ def yolox(config):
         early_stopping  = EarlyStopping(monitor='val_loss', min_delta = 0, patience = 10, verbose = 1)
         checkpoint = ModelCheckpoint(weight_name, monitor = 'val_loss', save_weights_only = True, save_best_only = False)
         lr_schedule = LearningRateScheduler(lr_scheduler_func, verbose = 1)
-        callbacks = [logging, lr_schedule, checkpoint, early_stopping]
+        # 剪枝的callback，冻结以及解冻训练使用相同的实例
+        pruning = pruning_callbacks(model_body, config, epoch_step)
+        callbacks = [logging, lr_schedule, checkpoint, early_stopping] + pruning
 
         # 训练模型
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         model.fit_generator(
-                    generator = train_dataloader,
+                    generator = data_pipeline(train_dataloader, config, Freeze_Epoch),
                     steps_per_epoch = epoch_step,
-                    validation_data = val_dataloader,
+                    validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
                     validation_steps = epoch_step_val,
                     epochs = Freeze_Epoch,
                     # initial_epoch = Init_Epoch,
@@ -180,7 +193,7 @@ def yolox(config):
         Min_lr_fit  = max(batch_size / nbs * min_learning_rate, 3e-6)
         lr_scheduler_func = get_lr_scheduler(lr_decay_type, Init_lr_fit, Min_lr_fit, UnFreeze_Epoch)
         lr_scheduler = LearningRateScheduler(lr_scheduler_func, verbose = 1)
-        callbacks = [logging, checkpoint, lr_scheduler, early_stopping]
+        callbacks = [logging, checkpoint, lr_scheduler, early_stopping] + pruning
 
         epoch_step = num_train // batch_size
         epoch_step_val  = num_val // batch_size
@@ -189,14 +202,18 @@ def yolox(config):
 
         print('Train on {} samples, val on {} samples, with batch size {}.'.format(num_train, num_val, batch_size))
         model.fit_generator(
-                    generator = train_dataloader,
+                    generator = data_pipeline(train_dataloader, config, UnFreeze_Epoch),
                     steps_per_epoch = epoch_step,
-                    validation_data = val_dataloader,
+                    validation_data = data_pipeline(val_dataloader, config, 1, shuffle=False),
                     validation_steps = epoch_step_val,
                     epochs = UnFreeze_Epoch,
                     # initial_epoch = Freeze_Epoch,
                     callbacks = callbacks)
         
+        if config.pruning:
+            # 去掉剪枝的包装，保存剪枝后的权重
+            strip_and_save(model_body, config, pruning)
+
         # 以Tensorflow格式保存模型
         # model.save('./model/VOC2007_yolox', save_format='tf2')
 